@@ -17,6 +17,67 @@ fi
 
 NAPCAT_AUTH_HEADER="Authorization: Bearer $NAPCAT_ACCESS_TOKEN"
 
+# ---- 链路追踪（详见 getmsgserv/pipeline_trace.py）----
+# OQQ_TRACE_ID 由 tag 派生并通过环境变量传给子进程；各阶段结束时写一行 trace_span。
+# 写库失败一律忽略，不影响主流程。
+trace_now() {
+    date +%s.%3N
+}
+# 继承的 trace_id 不属于该 tag（例如刷新时由旧投稿派生出新 tag）则新建
+trace_init() {
+    local tag=$1
+    if [[ "${OQQ_TRACE_ID:-}" != "$tag-"* ]]; then
+        export OQQ_TRACE_ID="$tag-$(date +%s%3N)"
+    fi
+}
+# 审核/发送阶段沿用该 tag 最近一次的 trace_id，使其接在投稿时间线之后
+trace_resume() {
+    local tag=$1 last
+    last=$(timeout 5s sqlite3 ./cache/OQQWall.db "SELECT trace_id FROM trace_span WHERE tag = '${tag//\'/\'\'}' ORDER BY start_ts DESC LIMIT 1;" 2>/dev/null || true)
+    if [[ -n "$last" ]]; then
+        export OQQ_TRACE_ID="$last"
+    else
+        trace_init "$tag"
+    fi
+}
+trace_file_bytes() {
+    stat -c%s "$1" 2>/dev/null || echo ""
+}
+# 用法：trace_span <tag> <stage> <start_ts> [exit_code] [bytes] [note]
+trace_span() {
+    local tag=$1 stage=$2 start=$3 rc=${4:-0} nbytes=${5:-} note=${6:-}
+    local end
+    end=$(trace_now)
+    trace_init "$tag"
+    [[ "$start" =~ ^[0-9]+(\.[0-9]+)?$ ]] || start=$end
+    [[ "$rc" =~ ^-?[0-9]+$ ]] || rc=0
+    [[ "$nbytes" =~ ^[0-9]+$ ]] || nbytes=NULL
+    timeout 5s sqlite3 ./cache/OQQWall.db "INSERT INTO trace_span (trace_id, tag, stage, pid, start_ts, end_ts, duration, exit_code, bytes, note)
+        VALUES ('${OQQ_TRACE_ID//\'/\'\'}', '${tag//\'/\'\'}', '${stage//\'/\'\'}', $BASHPID, $start, $end, $end - $start, $rc, $nbytes, '${note//\'/\'\'}');" >/dev/null 2>&1 || true
+    return 0
+}
+
+# ---- 媒体存储（详见 getmsgserv/media_store.py）----
+# tag 发送/删除/拒绝后释放其对 blob 的引用；失败忽略
+media_release() {
+    python3 ./getmsgserv/media_store.py release "$@" >/dev/null 2>&1 || true
+}
+media_gc() {
+    python3 ./getmsgserv/media_store.py gc >/dev/null 2>&1 || true
+}
+
+# ---- 缓存清理 ----
+# 按各模块自己的保留期清理派生缓存与索引；失败忽略
+cache_prune() {
+    python3 ./getmsgserv/HTMLwork/qr_cache.py prune >/dev/null 2>&1 || true
+    python3 ./getmsgserv/HTMLwork/render_cache.py prune >/dev/null 2>&1 || true
+    python3 ./getmsgserv/outbound_encoder.py prune >/dev/null 2>&1 || true
+    python3 ./getmsgserv/pipeline.py prune >/dev/null 2>&1 || true
+    python3 ./getmsgserv/qr_scan.py prune >/dev/null 2>&1 || true
+    python3 ./getmsgserv/history_index.py prune >/dev/null 2>&1 || true
+    python3 ./getmsgserv/pipeline_trace.py prune >/dev/null 2>&1 || true
+}
+
 sendmsggroup() {
     msg=$1
     encoded_msg=$(perl -MURI::Escape -e 'print uri_escape($ARGV[0]);' "$msg")
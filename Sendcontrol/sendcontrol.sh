@@ -261,6 +261,10 @@ cleanup_cache_dirs() {
             echo "已删除缓存目录: $dir"
         fi
     done
+    # 已发送的 tag 不再引用媒体存储中的 blob（见 getmsgserv/media_store.py）
+    if declare -F media_release >/dev/null; then
+        media_release "${tags[@]}"
+    fi
 }
 
 # =============================================================================
@@ -619,6 +623,8 @@ manage_posts() {
     fi
     
     # 发送到每个QQ号
+    local trace_start
+    trace_start=$(date +%s.%3N)
     for qqid in "${goingtosendid[@]}"; do
         echo "Sending Qzone use id: $qqid (total images: $total)"
         
@@ -635,6 +641,14 @@ manage_posts() {
         done
     done
     
+    # 链路追踪：每个 tag 记一条 qzone_send，接在该投稿已有的时间线之后
+    if declare -F trace_span >/dev/null; then
+        local t
+        for t in "${tags[@]}"; do
+            ( trace_resume "$t"; trace_span "$t" qzone_send "$trace_start" "$send_failed" "" "${#goingtosendid[@]} accounts, $total images" ) || true
+        done
+    fi
+
     # 按发送结果反馈
     if [[ $send_failed -eq 0 ]]; then
         # 仅在所有发布均成功时通知“投稿已发送”
@@ -6,6 +6,13 @@ log(){ if [[ "$DEBUG" == "1" ]]; then echo "[DEBUG] $*" >&2; fi }
 [[ "$DEBUG" == "1" ]] && set -x
 
 tag="$1"
+
+# 优先使用 Python 渲染器（一次读库、预编译模板，输出与下方 jq 实现一致）；
+# 失败或 OQQWALL_HTML_LEGACY=1 时走下方原实现
+if [[ "${OQQWALL_HTML_LEGACY:-0}" != "1" ]] && python3 getmsgserv/HTMLwork/render_post.py "$tag"; then
+    exit 0
+fi
+
 qr_dir="$(pwd)/cache/qrcode/${tag}"
 mkdir -p "$qr_dir"
 
@@ -129,6 +136,9 @@ fi
 # === Avatar image (respect privacy) ===
 if [[ "$needpriv" == "true" ]]; then
     avatar_img="file://$(pwd)/getmsgserv/HTMLwork/source/Anonymous_avatar.png"
+elif [[ -f "$(pwd)/cache/avatars/${userid}.jpg" ]]; then
+    # 本地头像缓存（getmsgserv/avatar_cache.py）
+    avatar_img="file://$(pwd)/cache/avatars/${userid}.jpg"
 else
     avatar_img="https://qlogo2.store.qq.com/qzone/${userid}/${userid}/640"
 fi
@@ -198,7 +208,9 @@ message_html=$(echo "$json_data" | jq -r \
       "<img src=\"" + .data.url + "\" alt=\"Image\">"
 
     elif .type == "video" then
-      "<video controls autoplay muted><source src=\"" +
+      "<video controls autoplay muted" +
+      (if (.data.poster // "") != "" then " poster=\"" + .data.poster + "\"" else "" end) +
+      "><source src=\"" +
       ((.data.url // .data.file // "") | tostring) +
       "\" type=\"video/mp4\">Your browser does not support the video tag.</video>"
 
@@ -811,6 +823,7 @@ html_content=$(cat <<EOF
             inset: 0;
             pointer-events: none;
             z-index: 999;
+            mix-blend-mode: multiply;
             -webkit-print-color-adjust: exact;
             print-color-adjust: exact;
         }
@@ -825,11 +838,10 @@ html_content=$(cat <<EOF
             text-shadow: 0 0 1px rgba(255, 255, 255, 0.25), 0 0 1px rgba(255, 255, 255, 0.25);
             transform: rotate(-24deg);
             line-height: 1;
-            mix-blend-mode: multiply;
         }
 
         @media print {
-            .wm-item {
+            .wm-overlay {
                 mix-blend-mode: normal;
             }
         }
@@ -900,14 +912,12 @@ html_content=$(cat <<EOF
             function addWatermark(opts) {
                 const container = document.querySelector('.container');
 
-                // 创建覆盖层
+                // 创建覆盖层：整层只有这一个节点，每个水印都是它的一层背景图
                 let overlay = container.querySelector('.wm-overlay');
                 if (!overlay) {
                     overlay = document.createElement('div');
                     overlay.className = 'wm-overlay';
                     container.appendChild(overlay);
-                } else {
-                    overlay.innerHTML = ''; // 重新渲染时清空
                 }
 
                 // 严格使用容器的可视尺寸，避免对文档布局产生任何影响
@@ -927,7 +937,6 @@ html_content=$(cat <<EOF
                 probe.className = 'wm-item';
                 probe.textContent = text;
                 probe.style.fontSize = fontSize + 'px';
-                probe.style.opacity = opacity.toString();
                 probe.style.transform = ${rotate};
                 probe.style.visibility = 'hidden';
                 probe.style.left = '-9999px';
@@ -936,18 +945,14 @@ html_content=$(cat <<EOF
                 const rect = probe.getBoundingClientRect();
                 const stampW = rect.width;
                 const stampH = rect.height;
+                const fontFamily = getComputedStyle(probe).fontFamily;
                 overlay.removeChild(probe);
 
+                const stamp = watermarkStamp(text, fontFamily, fontSize, angle, opacity, stampW, stampH);
+
                 // 计算网格：仅在容器内布点，保证任何抖动后也不会越界
                 const padX = Math.ceil(stampW * 0.5);
                 const padY = Math.ceil(stampH * 0.5);
-                const startX = padX;
-                const endX = Math.max(padX, W - padX);
-                const startY = padY;
-                const endY = Math.max(padY, H - padY);
-
-                // 列/行数量
-                // …前面保持不变：测出 stampW, stampH，计算 padX/padY …
 
                 // 只在可用宽度内估算列数
                 const cols = Math.max(1, Math.floor((W - 2*padX) / tile) + 1);
@@ -964,15 +969,9 @@ html_content=$(cat <<EOF
                 const centerVertical = false; // 想竖向也居中改成 true
                 const baseCY0 = centerVertical ? (H/2 - ((rows - 1) * tile) / 2) : (padY + stampH/2);
 
+                const positions = [];
                 for (let r = 0; r < rows; r++) {
                   for (let c = 0; c < cols; c++) {
-                    const span = document.createElement('span');
-                    span.className = 'wm-item';
-                    span.textContent = text;
-                    span.style.fontSize = fontSize + 'px';
-                    span.style.opacity  = opacity.toString();
-                    span.style.transform = ${rotate};
-
                     // 交错排布（可选，让视觉更满）
                     const stagger = (r % 2) ? tile / 2 : 0;
 
@@ -992,12 +991,44 @@ html_content=$(cat <<EOF
                     x = Math.max(0, Math.min(W - stampW, x));
                     y = Math.max(0, Math.min(H - stampH, y));
 
-                    span.style.left = x + 'px';
-                    span.style.top  = y + 'px';
-                    overlay.appendChild(span);
+                    positions.push(x + 'px ' + y + 'px');
                   }
                 }
 
+                // 同一张图块重复作背景层，浏览器只解码一次
+                overlay.style.backgroundImage = positions.map(function () { return stamp; }).join(', ');
+                overlay.style.backgroundPosition = positions.join(', ');
+                overlay.style.backgroundSize = stampW + 'px ' + stampH + 'px';
+                overlay.style.backgroundRepeat = 'no-repeat';
+            }
+
+            // 单个水印图块（SVG，矢量打印不失真），按 (文字, 字体, 字号, 角度, 透明度) 缓存
+            function watermarkStamp(text, fontFamily, fontSize, angle, opacity, w, h) {
+                const cache = watermarkStamp.cache || (watermarkStamp.cache = {});
+                const key = [text, fontFamily, fontSize, angle, opacity, w, h].join('|');
+                if (cache[key]) {
+                    return cache[key];
+                }
+                const esc = function (s) {
+                    return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+                        .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+                };
+                // 与 .wm-item 相同：黑字、500 字重、两层 1px 白色文字阴影、整体透明度、绕中心旋转
+                const svg = '<svg xmlns="http://www.w3.org/2000/svg" width="' + w + '" height="' + h + '">'
+                    + '<filter id="s" x="-10%" y="-10%" width="120%" height="120%">'
+                    + '<feGaussianBlur in="SourceAlpha" stdDeviation="0.5" result="b"/>'
+                    + '<feFlood flood-color="#fff" flood-opacity="0.25"/>'
+                    + '<feComposite in2="b" operator="in" result="g"/>'
+                    + '<feMerge><feMergeNode in="g"/><feMergeNode in="g"/><feMergeNode in="SourceGraphic"/></feMerge>'
+                    + '</filter>'
+                    + '<g opacity="' + opacity + '">'
+                    + '<text x="' + (w / 2) + '" y="' + (h / 2) + '" text-anchor="middle" dominant-baseline="central"'
+                    + ' transform="rotate(' + (-angle) + ' ' + (w / 2) + ' ' + (h / 2) + ')"'
+                    + ' font-family="' + esc(fontFamily) + '" font-size="' + fontSize + '" font-weight="500"'
+                    + ' fill="#000" filter="url(#s)">' + esc(text) + '</text>'
+                    + '</g></svg>';
+                cache[key] = 'url("data:image/svg+xml;charset=utf-8,' + encodeURIComponent(svg) + '")';
+                return cache[key];
             }
         };
     </script>
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""卡片二维码：进程内生成 + 按 URL 哈希的持久缓存。
+
+- 二维码按 ``sha256(url)`` 存在 ``cache/qr_cache/<前两位>/<sha256>.png``，同一 URL 只编码一次；
+- 编码在渲染进程内完成（python-qrcode，边距 0，与 ``qrencode -m 0`` 相同）；
+  未安装 qrcode 包时退回调用 qrencode 命令生成缓存文件；
+- 渲染器需要的 ``cache/qrcode/<tag>/qr_<message_id>.png`` 是指向缓存文件的硬链接（跨文件系统时复制），
+  HTML 输出契约不变；
+- 命中时刷新缓存文件的 mtime，``prune`` 清理长期未使用的条目（main.sh 每 6 小时经 cache_prune 调用）。
+
+命令行：
+    python3 getmsgserv/HTMLwork/qr_cache.py make <url> <目标文件>
+    python3 getmsgserv/HTMLwork/qr_cache.py prune [--days 30]
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+CACHE_DIR = './cache/qr_cache'
+MAX_AGE_DAYS = 30
+
+
+def encode_png(url: str) -> bytes:
+    """把 URL 编码成二维码 PNG（与 qrencode 默认一致：L 级纠错、每模块 3px，无静区）。"""
+    try:
+        import qrcode
+    except ImportError:
+        return subprocess.run(['qrencode', url, '-t', 'PNG', '-o', '-', '-m', '0'],
+                              check=True, capture_output=True).stdout
+    qr = qrcode.QRCode(box_size=3, border=0, error_correction=qrcode.constants.ERROR_CORRECTION_L)
+    qr.add_data(url)
+    qr.make(fit=True)
+    out = io.BytesIO()
+    qr.make_image().save(out)
+    return out.getvalue()
+
+
+class QRCache:
+    def __init__(self, root: str = CACHE_DIR, encoder=encode_png):
+        self.root = root
+        self.encoder = encoder
+        self.stats = {'hits': 0, 'encoded': 0}
+
+    def path_for(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], f'{digest}.png')
+
+    def get(self, url: str) -> str:
+        """返回 URL 对应的缓存 PNG 路径，不存在时编码并原子写入。"""
+        path = self.path_for(url)
+        if os.path.isfile(path):
+            self.stats['hits'] += 1
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        data = self.encoder(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.stats['encoded'] += 1
+        return path
+
+    def make(self, url: str, dest: str):
+        """在 dest 放置 URL 的二维码（硬链接到缓存，跨文件系统时复制）。"""
+        src = self.get(url)
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        tmp = f'{dest}.{os.getpid()}.lnk'
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+    def prune(self, max_age_days: float = MAX_AGE_DAYS) -> int:
+        """删除超过 max_age_days 未被使用的缓存条目，返回删除数。"""
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+_default: Optional[QRCache] = None
+
+
+def make_qr(url: str, dest: str, root: Optional[str] = None):
+    """渲染器使用的默认入口（进程内共享同一个缓存实例）。"""
+    global _default
+    cache_dir = os.path.join(root, 'cache', 'qr_cache') if root else CACHE_DIR
+    if _default is None or _default.root != cache_dir:
+        _default = QRCache(cache_dir)
+    _default.make(url, dest)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='卡片二维码缓存')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('make', help='生成（或取缓存）二维码到目标文件')
+    p.add_argument('url')
+    p.add_argument('dest')
+    p = sub.add_parser('prune', help='清理长期未使用的缓存')
+    p.add_argument('--days', type=float, default=MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    cache = QRCache(args.cache_dir)
+    if args.action == 'make':
+        cache.make(args.url, args.dest)
+        return 0
+    print(cache.prune(args.days))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""渲染结果缓存：按投稿内容哈希复用 HTML 与页面图片。
+
+重渲染、调出（preprocess.sh <tag> randeronly）、web_review 的 /detail_html 预览以及失败重试时，
+内容没变就直接复用上次的页面：
+
+- 缓存键是以下输入的 sha256：tag、AfterLM（含 needpriv）、发件人 id 与昵称、
+  账户组配置（该组条目与全局水印）、引用的本地媒体与头像文件（大小 + mtime）、
+  分段设置（``render_slice_max_aspect`` / ``render_slice_max_kb``），
+  以及模板版本（TEMPLATE_VERSION + 模板和渲染器源码的哈希）；
+- 只缓存渲染服务按消息边界分段截图（tiles）的结果；回退路径（PDF + 栅格化）的页面不入缓存，
+  否则服务恢复后仍会命中旧的切分方式；
+- 条目 ``cache/render_cache/<前两位>/<key>/`` 存 post.html 与页面图片 NN.jpeg；
+- 命中时把页面硬链接进 ``cache/prepost/<tag>/<tag>-NN.jpeg``，不再启动浏览器；
+- 模板、渲染器或账户组配置一改，键随之改变，旧条目不再命中，由 ``prune`` 按最后使用时间清理
+  （main.sh 每 6 小时经 cache_prune 调用）。
+
+prepost 中的页面与缓存条目是同一文件的硬链接，后续处理只能替换文件，不能原地改写。
+
+命令行：
+    python3 getmsgserv/HTMLwork/render_cache.py key <tag>
+    python3 getmsgserv/HTMLwork/render_cache.py restore <key> <tag> <目标目录>
+    python3 getmsgserv/HTMLwork/render_cache.py store <key> <页面目录> <html> --prefix <tag>-
+    python3 getmsgserv/HTMLwork/render_cache.py prune [--days 14]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from typing import Iterator, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+import render_post  # noqa: E402
+import render_service  # noqa: E402
+
+CACHE_DIR = './cache/render_cache'
+MAX_AGE_DAYS = 14
+# 影响页面但不在下列源码里的改动（如 Chrome 参数、栅格化 dpi）需要手动递增
+TEMPLATE_VERSION = 1
+VERSIONED_FILES = (
+    os.path.join(HERE, 'source', 'post_template.html'),
+    os.path.join(HERE, 'render_post.py'),
+    os.path.join(HERE, 'render_service.py'),
+)
+# oqqwall.config 中影响页面切分的配置
+RENDER_CONFIG_KEYS = ('render_slice_max_aspect', 'render_slice_max_kb')
+PAGE_RE = re.compile(r'^(\d+)\.jpeg$')
+
+_template_version: Optional[str] = None
+
+
+def template_version() -> str:
+    global _template_version
+    if _template_version is None:
+        h = hashlib.sha256(str(TEMPLATE_VERSION).encode())
+        for path in VERSIONED_FILES:
+            try:
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+            except OSError:
+                h.update(b'missing')
+        _template_version = h.hexdigest()[:16]
+    return _template_version
+
+
+def _file_urls(node) -> Iterator[str]:
+    if isinstance(node, dict):
+        for value in node.values():
+            yield from _file_urls(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _file_urls(value)
+    elif isinstance(node, str) and node.startswith('file://'):
+        yield node[7:]
+
+
+def _stamp(path: str) -> str:
+    try:
+        st = os.stat(path)
+        return f'{st.st_size}:{st.st_mtime_ns}'
+    except OSError:
+        return 'missing'
+
+
+def compute_key(tag, root: Optional[str] = None) -> Optional[str]:
+    """计算 tag 当前渲染输入的缓存键；没有 AfterLM 时返回 None。"""
+    root = os.path.abspath(root or os.getcwd())
+    row = render_post.load_post(tag, os.path.join(root, 'cache', 'OQQWall.db'))
+    if not row or not row[3]:
+        return None
+    senderid, nickname, group, after_lm_raw = row
+    try:
+        after_lm = json.loads(after_lm_raw)
+    except ValueError:
+        return None
+    group_config = render_post.load_group_config(root)
+
+    h = hashlib.sha256()
+
+    def feed(value):
+        h.update(json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        h.update(b'\0')
+
+    feed(str(tag))
+    feed(template_version())
+    feed([senderid, nickname, group])
+    feed(after_lm)
+    feed([group_config.get(group) if isinstance(group_config, dict) else None,
+          render_post.watermark_text(group_config, group)])
+    feed(sorted((p, _stamp(p)) for p in set(_file_urls(after_lm))))
+    feed(_stamp(render_post.avatar_cache.avatar_path(senderid, os.path.join(root, 'cache', 'avatars'))))
+    service_config = render_service.read_config(os.path.join(root, 'oqqwall.config'))
+    feed([service_config.get(k, '') for k in RENDER_CONFIG_KEYS])
+    return h.hexdigest()
+
+
+class RenderCache:
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def pages(self, key: str) -> List[str]:
+        entry = self.entry_dir(key)
+        try:
+            names = os.listdir(entry)
+        except OSError:
+            return []
+        return sorted((n for n in names if PAGE_RE.match(n)), key=lambda n: int(PAGE_RE.match(n).group(1)))
+
+    def html(self, key: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.entry_dir(key), 'post.html'), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def touch(self, key: str):
+        try:
+            os.utime(self.entry_dir(key))
+        except OSError:
+            pass
+
+    def restore(self, key: str, prefix: str, dest: str) -> int:
+        """命中时清空 dest 并硬链接页面进去，返回页数；未命中返回 0（dest 不动）。"""
+        pages = self.pages(key)
+        if not pages:
+            return 0
+        entry = self.entry_dir(key)
+        shutil.rmtree(dest, ignore_errors=True)
+        os.makedirs(dest, exist_ok=True)
+        for name in pages:
+            src = os.path.join(entry, name)
+            target = os.path.join(dest, f'{prefix}{name}')
+            try:
+                os.link(src, target)
+            except OSError:
+                shutil.copyfile(src, target)
+        self.touch(key)
+        return len(pages)
+
+    def store(self, key: str, folder: str, html_path: Optional[str], prefix: str) -> int:
+        """把 folder 中的 <prefix>NN.jpeg 页面与 HTML 存为 key 的条目（原子替换），返回页数。"""
+        page_re = re.compile(rf'^{re.escape(prefix)}(\d+)\.jpeg$')
+        try:
+            names = sorted(n for n in os.listdir(folder) if page_re.match(n))
+        except OSError:
+            return 0
+        if not names:
+            return 0
+        entry = self.entry_dir(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=f'.{key[:8]}.')
+        try:
+            for name in names:
+                src = os.path.join(folder, name)
+                target = os.path.join(tmp, f'{page_re.match(name).group(1)}.jpeg')
+                try:
+                    os.link(src, target)
+                except OSError:
+                    shutil.copyfile(src, target)
+            if html_path and os.path.isfile(html_path):
+                shutil.copyfile(html_path, os.path.join(tmp, 'post.html'))
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'created': int(time.time()), 'pages': len(names),
+                           'template_version': template_version()}, f)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return 0
+        return len(names)
+
+    def prune(self, max_age_days: float = MAX_AGE_DAYS) -> int:
+        """删除超过 max_age_days 未被使用的条目，返回删除数。"""
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        try:
+            shards = os.listdir(self.root)
+        except OSError:
+            return 0
+        for shard in shards:
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                entry = os.path.join(shard_dir, name)
+                try:
+                    if os.path.getmtime(entry) < cutoff:
+                        shutil.rmtree(entry)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def cached_html(tag, root: Optional[str] = None) -> Optional[str]:
+    """tag 当前内容已渲染过时返回缓存的 HTML（供 web_review 预览）。"""
+    root = os.path.abspath(root or os.getcwd())
+    key = compute_key(tag, root)
+    if not key:
+        return None
+    return RenderCache(os.path.join(root, 'cache', 'render_cache')).html(key)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='渲染结果缓存')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('key', help='输出 tag 当前输入的缓存键')
+    p.add_argument('tag')
+    p = sub.add_parser('restore', help='命中时把页面硬链接到目标目录（未命中退出码 1）')
+    p.add_argument('key')
+    p.add_argument('tag')
+    p.add_argument('dest')
+    p = sub.add_parser('store', help='保存页面与 HTML')
+    p.add_argument('key')
+    p.add_argument('folder')
+    p.add_argument('html')
+    p.add_argument('--prefix', default='')
+    p = sub.add_parser('prune', help='清理长期未使用的条目')
+    p.add_argument('--days', type=float, default=MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    cache = RenderCache(args.cache_dir)
+    if args.action == 'key':
+        key = compute_key(args.tag)
+        if not key:
+            return 1
+        print(key)
+        return 0
+    if args.action == 'restore':
+        pages = cache.restore(args.key, f'{args.tag}-', args.dest)
+        print(pages)
+        return 0 if pages else 1
+    if args.action == 'store':
+        print(cache.store(args.key, args.folder, args.html, args.prefix))
+        return 0
+    print(cache.prune(args.days))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""投稿 HTML 渲染器，由 gotohtml.sh 调用，在一个进程里生成整页 HTML：
+
+- 每个 tag 只读一次数据库（senderid, nickname, ACgroup, AfterLM 一条 SELECT）；
+- 页面模板 ``source/post_template.html`` 用 ``string.Template`` 预编译一次；
+- 消息渲染、卡片跳转 URL、水印文字的规则与 gotohtml.sh 的 jq 程序逐项对应，
+  输出逐字节一致（包括 jq 1.6 的 @html / @uri 转义与数字格式）。
+
+输出：HTML 写到 stdout，二维码 PNG 写到 cache/qrcode/<tag>/qr_<message_id>.png
+（由 qr_cache.py 在进程内生成并按 URL 缓存）。
+头像使用 avatar_cache.py 的本地缓存（file:// URL）。
+视频的后台转码失败时改用保留下来的原文件（video_transcode.failed_source）。
+本脚本失败时 gotohtml.sh 回退到 jq 实现（OQQWALL_HTML_LEGACY=1 可强制使用 jq 实现）。
+
+命令行：
+    python3 getmsgserv/HTMLwork/render_post.py <tag> > post.html
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+from string import Template
+from typing import Callable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+sys.path.append(os.path.dirname(HERE))
+sys.path.append(os.path.join(os.path.dirname(HERE), 'LM_work'))
+import avatar_cache  # noqa: E402
+import qr_cache  # noqa: E402
+import video_transcode  # noqa: E402
+
+TEMPLATE_PATH = os.path.join(HERE, 'source', 'post_template.html')
+ROTATE_JS = '`rotate(-${angle}deg)` '
+
+# 文件扩展名 -> 图标（getmsgserv/HTMLwork/source/<icon>.png）
+FILE_ICONS = [
+    (r'^(doc|docx|odt)$', 'doc'),
+    (r'^(apk|ipa)$', 'apk'),
+    (r'^(dmg|iso)$', 'dmg'),
+    (r'^(ppt|pptx|key)$', 'ppt'),
+    (r'^(xls|xlsx|numbers)$', 'xls'),
+    (r'^(pages)$', 'pages'),
+    (r'^(ai|ps|sketch)$', 'ps'),
+    (r'^(ttf|otf|woff2?|font)$', 'font'),
+    (r'^(png|jpg|jpeg|gif|bmp|webp)$', 'image'),
+    (r'^(mp3|wav|flac|aac|ogg)$', 'audio'),
+    (r'^(mp4|mkv|mov|avi|webm)$', 'video'),
+    (r'^(zip|7z)$', 'zip'),
+    (r'^(rar)$', 'rar'),
+    (r'^(pkg)$', 'pkg'),
+    (r'^(pdf)$', 'pdf'),
+    (r'^(exe|msi)$', 'exe'),
+    (r'^(sh|py|c|cpp|js|ts|go|rs|java|rb|php|lua|code)$', 'code'),
+    (r'^(txt|md|note)$', 'txt'),
+]
+# Oniguruma 的 ^ $ 是行锚点
+_FILE_ICONS = [(re.compile(pattern, re.MULTILINE), icon) for pattern, icon in FILE_ICONS]
+_UIN_IN_URL = re.compile(r'uin=(?P<uin>[0-9]+)')
+_UIN = re.compile(r'(?P<uin>[0-9]{5,})')
+_HTML_ESCAPES = str.maketrans({'<': '&lt;', '>': '&gt;', '&': '&amp;', "'": '&apos;', '"': '&quot;'})
+_ASCII_LOWER = str.maketrans({chr(c): chr(c + 32) for c in range(ord('A'), ord('Z') + 1)})
+
+# jq 中 `empty`（不产生输出）的占位：卡片跳转 URL 为 empty 时整张卡片不渲染
+EMPTY = object()
+
+_template: Optional[Template] = None
+
+
+def load_template() -> Template:
+    global _template
+    if _template is None:
+        with open(TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+            _template = Template(f.read())
+    return _template
+
+
+# ---- jq 语义 ----------------------------------------------------------------
+def _truthy(value) -> bool:
+    return value is not None and value is not False
+
+
+def _alt(*values):
+    """jq 的 ``a // b``：第一个非 null/false 的值，都不是时取最后一个。"""
+    for value in values[:-1]:
+        if _truthy(value):
+            return value
+    return values[-1]
+
+
+def _get(obj, *keys):
+    for key in keys:
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def _number(value) -> str:
+    if isinstance(value, int) and abs(value) < 10 ** 17:
+        return str(value)
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e17:
+        return str(int(value))
+    return repr(value)
+
+
+def _tostring(value) -> str:
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return _number(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _s(value) -> str:
+    """字符串拼接里的值：jq 中 ``"..." + null`` 等于原字符串。"""
+    return '' if value is None else _tostring(value)
+
+
+def _video_src(url: str) -> str:
+    """后台转码失败时 ``-h264.mp4`` 不会出现，改用保留下来的原文件。"""
+    if url.startswith('file://') and not os.path.exists(url[len('file://'):]):
+        src = video_transcode.failed_source(url[len('file://'):])
+        if src:
+            return 'file://' + src
+    return url
+
+
+def _html(value) -> str:
+    return _tostring(value).translate(_HTML_ESCAPES)
+
+
+def _uri(value) -> str:
+    return quote(_tostring(value), safe="!*'()")
+
+
+def _tojson(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False).replace('\x7f', '\\u007f')
+
+
+def _search(pattern, value) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    m = pattern.search(value)
+    return m.group('uin') if m else None
+
+
+# ---- 卡片 -------------------------------------------------------------------
+def parse_card(data):
+    """规范化并解析 JSON 卡片（&#44; -> ,，\\/ -> /）；失败返回 None。"""
+    if not isinstance(data, str):
+        return None
+    try:
+        return json.loads(data.replace('&#44;', ',').replace('\\/', '/'))
+    except ValueError:
+        return None
+
+
+def card_url(card):
+    """卡片跳转 URL（用于二维码）；返回 EMPTY 表示 jq 里的 empty。"""
+    view = _get(card, 'view')
+    contact = _get(card, 'meta', 'contact')
+    if view == 'contact' and _truthy(contact):
+        uin = _search(_UIN_IN_URL, _get(contact, 'jumpUrl')) or _search(_UIN, _get(contact, 'contact'))
+        return f'https://mp.qzone.qq.com/u/{uin}' if uin else EMPTY
+    miniapp = _get(card, 'meta', 'miniapp')
+    if view == 'miniapp' and _truthy(miniapp):
+        return _alt(_get(miniapp, 'jumpUrl'), _get(miniapp, 'doc_url'))
+    news = _get(card, 'meta', 'news')
+    if view == 'news' and _truthy(news):
+        return _get(news, 'jumpUrl')
+    first = _first_meta_value(_alt(_get(card, 'meta'), {}))
+    if first is not None and not isinstance(first, dict):
+        return EMPTY
+    url = _get(first, 'jumpUrl')
+    return url if _truthy(url) else EMPTY
+
+
+def _first_meta_value(meta):
+    if isinstance(meta, dict):
+        return next(iter(meta.values()), None)
+    if isinstance(meta, list):
+        return meta[0] if meta else None
+    return None
+
+
+def _qr_img(qr_dir: str, mid) -> str:
+    return f'<img class="qr-code" src="file://{qr_dir}/qr_{_tostring(mid)}.png" alt="QR">'
+
+
+def _tag_row(obj) -> str:
+    if not (_truthy(obj.get('tag')) or _truthy(obj.get('tagIcon'))):
+        return ''
+    html = '<div class="card-tag-row">'
+    if _truthy(obj.get('tagIcon')):
+        html += f'<img class="card-tag-icon" src="{_s(obj["tagIcon"])}" alt="">'
+    if _truthy(obj.get('tag')):
+        html += f'<span class="card-tag">{_html(obj["tag"])}</span>'
+    return html + '</div>'
+
+
+def render_card(card, mid, qr_dir: str):
+    if card is None:
+        return ''
+    url = card_url(card)
+    if url is EMPTY:
+        return EMPTY
+    qr = _qr_img(qr_dir, mid) if _truthy(url) else ''
+    view = card.get('view')
+    meta = card.get('meta')
+
+    if view == 'contact' and _truthy(_get(meta, 'contact')):
+        c = meta['contact']
+        return (
+            f'<a class="card card-contact" href="{_s(_alt(c.get("jumpUrl"), "#"))}" '
+            'target="_blank" rel="noopener noreferrer">'
+            f'<div class="card-media"><img src="{_s(_alt(c.get("avatar"), ""))}" alt="avatar"></div>'
+            '<div class="card-body">'
+            f'<div class="card-title">{_html(_alt(c.get("nickname"), "联系人"))}</div>'
+            + (f'<div class="card-desc">{_html(c["contact"])}</div>' if _truthy(c.get('contact')) else '')
+            + (f'<span class="card-tag">{_html(c["tag"])}</span>' if _truthy(c.get('tag')) else '')
+            + '</div>' + qr + '</a>'
+        )
+
+    if view == 'miniapp' and _truthy(_get(meta, 'miniapp')):
+        m = meta['miniapp']
+        brand = ''
+        if _truthy(m.get('source')) or _truthy(m.get('sourcelogo')):
+            brand = (
+                '<div class="brand-inline">'
+                + (f'<img class="brand-icon" src="{_s(m["sourcelogo"])}" alt="">' if _truthy(m.get('sourcelogo')) else '')
+                + (f'<span class="brand-text">{_html(m["source"])}</span>' if _truthy(m.get('source')) else '')
+                + '</div>'
+            )
+        return (
+            f'<a class="card card-vertical card-miniapp" href="{_s(_alt(m.get("jumpUrl"), m.get("doc_url"), "#"))}" '
+            'target="_blank" rel="noopener noreferrer">'
+            '<div class="card-header"><div class="card-header-left">'
+            + brand
+            + f'<div class="card-title">{_html(_alt(m.get("title"), "小程序卡片"))}</div>'
+            + '</div>' + qr + '</div>'
+            + (f'<div class="card-preview"><img src="{_s(m["preview"])}" alt="preview"></div>'
+               if _truthy(m.get('preview')) else '')
+            + _tag_row(m)
+            + '</a>'
+        )
+
+    if view == 'news' and _truthy(_get(meta, 'news')):
+        n = meta['news']
+        return (
+            f'<a class="card card-news" href="{_s(_alt(n.get("jumpUrl"), "#"))}" '
+            'target="_blank" rel="noopener noreferrer">'
+            '<div class="card-header">'
+            + (f'<img class="thumb" src="{_s(n["preview"])}" alt="thumb">' if _truthy(n.get('preview')) else '')
+            + f'<div class="card-header-right"><div class="card-title">{_html(_alt(n.get("title"), "分享"))}</div></div>'
+            + qr + '</div>'
+            '<div class="card-bottom"><div class="card-bottom-left">'
+            + (f'<div class="card-desc">{_html(n["desc"])}</div>' if _truthy(n.get('desc')) else '')
+            + _tag_row(n)
+            + '</div></div></a>'
+        )
+
+    g = _alt(_first_meta_value(_alt(meta, {})), {})
+    if not isinstance(g, dict):
+        g = {}
+    title = _alt(g.get('title'), card.get('prompt'), _alt(view, '卡片'))
+    return (
+        '<div class="card card-vertical">'
+        + (f'<div class="card-preview"><img src="{_s(g["preview"])}" alt="preview"></div>'
+           if _truthy(g.get('preview')) else '')
+        + f'<div class="card-body"><div class="card-title">{_html(title)}</div>'
+        + (f'<div class="card-desc">{_html(g["desc"])}</div>' if _truthy(g.get('desc')) else '')
+        + (f'<div class="qr-wrap">{qr}</div>' if qr else '')
+        + '</div></div>'
+    )
+
+
+# ---- 消息 -------------------------------------------------------------------
+def file_icon(name) -> str:
+    if not isinstance(name, str) or not name:
+        return 'unknown'
+    ext = name.split('.')[-1].translate(_ASCII_LOWER)
+    for pattern, icon in _FILE_ICONS:
+        if pattern.search(ext):
+            return icon
+    return 'unknown'
+
+
+def _file_size(size) -> str:
+    n = size if isinstance(size, (int, float)) else float(size)
+    if n > 1048576:
+        return _number(n / 1048576) + ' MB'
+    if n > 1024:
+        return _number(n / 1024) + ' KB'
+    return _tostring(size) + ' B'
+
+
+class PostRenderer:
+    def __init__(self, root: str, qr_dir: str):
+        self.icon_dir = f'file://{root}/getmsgserv/HTMLwork/source'
+        self.poke_icon = f'file://{root}/getmsgserv/LM_work/source/poke.png'
+        self.qr_dir = qr_dir
+
+    def segment(self, seg, mid):
+        """渲染一个消息段；返回 EMPTY 表示该段不输出（对应 jq 的 empty）。"""
+        kind = _get(seg, 'type')
+        data = _get(seg, 'data') or {}
+        if kind == 'text':
+            return '<div class="bubble">' + _s(data.get('text')).replace('\n', '<br>') + '</div>'
+        if kind == 'image':
+            return f'<img src="{_s(data.get("url"))}" alt="Image">'
+        if kind == 'video':
+            poster = _alt(data.get('poster'), '')
+            return (
+                '<video controls autoplay muted'
+                + (f' poster="{_s(poster)}"' if poster != '' else '')
+                + f'><source src="{_video_src(_tostring(_alt(data.get("url"), data.get("file"), "")))}" type="video/mp4">'
+                'Your browser does not support the video tag.</video>'
+            )
+        if kind == 'poke':
+            return f'<img class="poke-icon" src="{self.poke_icon}" alt="Poke">'
+        if kind == 'file':
+            name = data.get('file')
+            size = data.get('file_size')
+            return (
+                '<div class="file-block">'
+                f'<img class="file-icon" src="{self.icon_dir}/{file_icon(_alt(name, ""))}.png" alt="File Icon">'
+                '<div class="file-info">'
+                f'<a class="file-name" href="file://{_uri(name)}" download>{_s(_alt(name, "未命名文件"))}</a>'
+                + (f'<div class="file-meta">{_file_size(size)}</div>' if _truthy(size) else '')
+                + '</div></div>'
+            )
+        if kind == 'json':
+            return render_card(parse_card(data.get('data')), mid, self.qr_dir)
+        if kind == 'forward':
+            items = _alt(data.get('messages'), data.get('content'), [])
+            html = '<div class="forward-title">合并转发聊天记录</div><div class="forward">'
+            for one in items or []:
+                kid = _alt(_get(one, 'message_id'), mid)
+                html += '<div class="forward-item">' + self.join(_get(one, 'message'), kid) + '</div>'
+            return html + '</div>'
+        return ''
+
+    def join(self, segments, mid) -> str:
+        parts = (self.segment(seg, mid) for seg in segments or [])
+        return ' '.join(p for p in parts if p is not EMPTY)
+
+    def messages(self, after_lm: dict) -> str:
+        lines = [self.join(_get(msg, 'message'), _get(msg, 'message_id'))
+                 for msg in _get(after_lm, 'messages') or []]
+        # jq 实现按行输出再经 $(...) 去掉末尾换行
+        return '\n'.join(lines).rstrip('\n')
+
+
+def qr_targets(after_lm: dict) -> List[Tuple[str, str]]:
+    """所有卡片（含嵌套转发）的 (文件名 key, 跳转 URL)，顺序与原 jq 提取一致。"""
+    def walk(item, key) -> Iterator[Tuple[str, str]]:
+        if not isinstance(item, dict):
+            return
+        if item.get('type') == 'json':
+            card = parse_card(_get(item, 'data', 'data'))
+            if card is None:
+                return
+            url = card_url(card)
+            if url is not EMPTY and _truthy(url):
+                yield _tostring(key), _tostring(url)
+        elif item.get('type') == 'forward':
+            data = item.get('data') or {}
+            for f in _alt(data.get('messages'), data.get('content'), []) or []:
+                k = _alt(_get(f, 'message_id'), key)
+                for sub in _get(f, 'message') or []:
+                    yield from walk(sub, k)
+        elif isinstance(item.get('message'), list):
+            for sub in item['message']:
+                yield from walk(sub, _alt(item.get('message_id'), key))
+
+    out: List[Tuple[str, str]] = []
+    for msg in _get(after_lm, 'messages') or []:
+        for seg in _get(msg, 'message') or []:
+            out.extend(walk(seg, _get(msg, 'message_id')))
+    return out
+
+
+def watermark_text(group_config: dict, group: str) -> str:
+    candidates = [_get(group_config, group, 'watermark_text'), _get(group_config, group, 'watermark'),
+                  _get(group_config, 'MethGroup', 'watermark')]
+    for value in candidates:
+        if isinstance(value, str) and value:
+            return value.rstrip('\n')
+    return ''
+
+
+def _cli_text(value) -> str:
+    """按 sqlite3 命令行 + $(...) 的方式取文本：NULL 为空串，去掉末尾换行。"""
+    return '' if value is None else str(value).rstrip('\n')
+
+
+def load_group_config(root: str) -> dict:
+    try:
+        with open(os.path.join(root, 'AcountGroupcfg.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_post(tag, db_path: str) -> Optional[Tuple[str, str, str, str]]:
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        return conn.execute('SELECT senderid, nickname, ACgroup, AfterLM FROM preprocess WHERE tag = ?',
+                            (str(tag),)).fetchone()
+    finally:
+        conn.close()
+
+
+def render_html(after_lm: dict, senderid: str, nickname: str, watermark: str, root: str, qr_dir: str,
+                avatar: Optional[Callable[[str], str]] = None) -> str:
+    userid = senderid
+    userid_show = userid
+    if _tostring(_get(after_lm, 'needpriv')) == 'true':
+        nickname, userid, userid_show = '匿名', '10000', ''
+        avatar_img = f'file://{root}/getmsgserv/HTMLwork/source/Anonymous_avatar.png'
+    else:
+        # 本地头像缓存（cache/avatars/），渲染时不联网等 qlogo
+        avatar_img = (avatar or (lambda uid: avatar_cache.avatar_url(uid, root)))(userid)
+    message_html = PostRenderer(root, qr_dir).messages(after_lm)
+    return load_template().substitute(
+        avatar_img=avatar_img,
+        nickname=nickname,
+        userid_show=userid_show,
+        message_html=message_html,
+        wm_js=_tojson(watermark),
+        rotate=ROTATE_JS,
+    ).rstrip('\n') + '\n'
+
+
+def render_tag(tag, root: Optional[str] = None, make_qr: Optional[Callable[[str, str], None]] = None,
+               avatar: Optional[Callable[[str], str]] = None) -> str:
+    """渲染一个 tag 的投稿 HTML（同时生成卡片二维码）。数据不存在时抛 LookupError。"""
+    root = root or os.getcwd()
+    make_qr = make_qr or (lambda url, path: qr_cache.make_qr(url, path, root))
+    row = load_post(tag, os.path.join(root, 'cache', 'OQQWall.db'))
+    after_lm_raw = _cli_text(row[3]) if row else ''
+    if not after_lm_raw:
+        raise LookupError(f'No data found for tag {tag}')
+    if os.environ.get('DEBUG') == '1':
+        with open(os.path.join(root, 'cache', f'debug_{tag}_AfterLM.json'), 'w', encoding='utf-8') as f:
+            f.write(after_lm_raw + '\n')
+    after_lm = json.loads(after_lm_raw)
+    senderid, nickname, group = (_cli_text(v) for v in row[:3])
+
+    group_config = load_group_config(root)
+
+    qr_dir = os.path.join(root, 'cache', 'qrcode', str(tag))
+    os.makedirs(qr_dir, exist_ok=True)
+    for key, url in qr_targets(after_lm):
+        make_qr(url, os.path.join(qr_dir, f'qr_{key}.png'))
+
+    return render_html(after_lm, senderid, nickname, watermark_text(group_config, group), root, qr_dir, avatar)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='渲染投稿 HTML 到 stdout')
+    parser.add_argument('tag')
+    parser.add_argument('--root', default=None, help='OQQWall 根目录（默认当前目录）')
+    args = parser.parse_args(argv)
+    try:
+        html = render_tag(args.tag, args.root)
+    except LookupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except (OSError, ValueError, sqlite3.Error, subprocess.CalledProcessError) as e:
+        print(f'render_post: {e}', file=sys.stderr)
+        return 1
+    # 整页生成完才输出，失败时不会留下半页给回退实现
+    sys.stdout.write(html)
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
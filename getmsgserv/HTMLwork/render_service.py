@@ -0,0 +1,656 @@
+#!/usr/bin/env python3
+"""常驻 Chromium 渲染服务。
+
+常驻后台，维护一个小的浏览器池，供 preprocess.sh 渲染投稿页面：
+
+- 每个浏览器实例通过 DevTools 协议（CDP）驱动，每次渲染新开一个标签页，渲染完即关闭；
+- 页面 load 之后等待就绪信号（字体、全部图片加载完成，
+  以及页面可选提供的 ``window.__renderReady`` Promise），随后输出 PDF 或整页截图；
+- ``tiles`` 格式跳过 PDF：按打印样式布局后以目标分辨率分段截图，直接得到投稿所需的 JPEG；
+  分段按消息块边界切分（不切断气泡/卡片），每段高度不超过宽度的 ``render_slice_max_aspect`` 倍，
+  单张超过 ``render_slice_max_kb`` 时在靠近中部的块边界再切一次；
+- 浏览器渲染满 N 次（``render_recycle_after``）或出错后自动回收重启，避免内存缓慢上涨；
+- 通过 Unix 套接字（默认 ./render_uds.sock，环境变量 ``RENDER_UDS_PATH``）对外提供服务，
+  bash 与 Python 都可调用；服务不可用时 preprocess.sh 回退到冷启动 Chrome。
+
+协议：每个连接发送一行 JSON，返回一行 JSON。
+    {"html": "/dev/shm/OQQWall/x.html", "out": "/dev/shm/OQQWall/x.pdf", "format": "pdf"}
+    -> {"ok": true, "out": "...", "bytes": 12345, "ms": 210}
+    {"html": "...", "out": "cache/prepost/123", "format": "tiles", "prefix": "123-"}
+    -> {"ok": true, "files": [".../123-00.jpeg", ...], "bytes": 456789, "ms": 380}
+    {"cmd": "ping"} / {"cmd": "stats"}
+
+命令行：
+    python3 getmsgserv/HTMLwork/render_service.py serve [--pool-size 2] [--recycle-after 50]
+    python3 getmsgserv/HTMLwork/render_service.py render <html> <out> [--format pdf|png]
+    printf '%s\\n' '{"cmd":"ping"}' | socat - UNIX-CONNECT:./render_uds.sock
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+SOCK_PATH = os.environ.get('RENDER_UDS_PATH', './render_uds.sock')
+# 只允许写入这些目录（相对路径按服务的工作目录解析）
+OUTPUT_ROOTS = ('/dev/shm/OQQWall', './cache')
+DEFAULT_POOL_SIZE = 2
+DEFAULT_RECYCLE_AFTER = 50
+DEFAULT_TIMEOUT = 30
+# 等待空闲浏览器的上限（秒）：排队 + 渲染须在客户端超时（渲染超时 + 10 秒）内返回
+POOL_WAIT = 5
+CHROME_CANDIDATES = ('google-chrome-stable', 'chrome', 'chromium-browser', 'chromium')
+
+# 等待页面就绪：字体、图片全部加载，页面可通过 window.__renderReady（Promise）追加等待条件
+READY_JS = '''(async () => {
+  if (document.fonts && document.fonts.ready) { await document.fonts.ready; }
+  await Promise.all(Array.from(document.images)
+    .filter(img => !img.complete)
+    .map(img => new Promise(resolve => { img.addEventListener('load', resolve); img.addEventListener('error', resolve); })));
+  if (window.__renderReady) { await window.__renderReady; }
+  await new Promise(resolve => requestAnimationFrame(() => requestAnimationFrame(resolve)));
+  return true;
+})()'''
+
+# 与原命令行参数（--no-pdf-header-footer --no-margins --print-background 等）对应
+PDF_OPTIONS = {
+    'printBackground': True,
+    'displayHeaderFooter': False,
+    'landscape': False,
+    'preferCSSPageSize': True,
+    'marginTop': 0,
+    'marginBottom': 0,
+    'marginLeft': 0,
+    'marginRight': 0,
+}
+
+# tiles：按打印样式布局后直接截图，像素宽度与原 convert -density 360 一致（4in → 1440px）
+CSS_DPI = 96
+PAGE_WIDTH_IN = 4
+# 与模板 window.onload 一致：短投稿至少输出 4in 高（正方形）
+PAGE_MIN_HEIGHT_IN = 4
+# 每段最大高宽比（4in 宽 → 最高 16in），以及单张图片的字节预算（KB，0 为不限）
+SLICE_MAX_ASPECT = 4
+SLICE_MAX_KB = 2048
+TILE_DPI = 360
+TILE_QUALITY = 90
+TILE_OPTIONS = ('prefix', 'page_width_in', 'max_aspect', 'max_kb', 'dpi', 'quality', 'image_format')
+
+# 量出不可切分的消息块：返回 {total, blocks: [[top, bottom], ...]}（CSS 像素）。
+# total 按 .container 的内容高度计算（文档 scrollHeight 不会小于视口高度），不低于 minHeight；
+# 块是页头与 .content 的直接子元素；高于单段上限的块（如长合并转发）再展开到子元素。
+LAYOUT_BLOCKS_JS = '''(() => {
+  const maxHeight = %d;
+  const minHeight = %d;
+  const container = document.querySelector('.container') || document.body;
+  const rect = container.getBoundingClientRect();
+  const bottom = window.scrollY + Math.max(rect.bottom, rect.top + container.scrollHeight);
+  const total = Math.max(minHeight, Math.ceil(bottom));
+  const blocks = [];
+  const collect = (el) => {
+    const r = el.getBoundingClientRect();
+    if (r.height <= 0) { return; }
+    if (r.height > maxHeight && el.children.length) {
+      Array.from(el.children).forEach(collect);
+      return;
+    }
+    blocks.push([Math.floor(r.top + window.scrollY), Math.ceil(r.bottom + window.scrollY)]);
+  };
+  document.querySelectorAll('.container > .header, .container > .content > *').forEach(collect);
+  return {total: total, blocks: blocks};
+})()'''
+
+logger = logging.getLogger('render_service')
+
+
+class RenderError(Exception):
+    pass
+
+
+def cut_points(blocks: List[List[int]], total: int) -> List[int]:
+    """不切断任何块的候选切点：相邻块之间空隙的中点（升序）。"""
+    cuts: List[int] = []
+    reach: Optional[int] = None
+    for top, bottom in sorted((max(0, int(t)), min(total, int(b))) for t, b in blocks if b > t):
+        if reach is not None and top >= reach:
+            cuts.append((reach + top) // 2)
+        reach = bottom if reach is None else max(reach, bottom)
+    return [c for c in cuts if 0 < c < total]
+
+
+def plan_slices(blocks: List[List[int]], total: int, max_height: int) -> List[List[int]]:
+    """把 [0, total) 切成尽量少的段，每段不高于 max_height 且只在块边界处切。
+
+    单个块本身高于 max_height（展开后仍是一整张长图等）时只能在上限处硬切。
+    """
+    total = max(1, int(total))
+    max_height = max(1, int(max_height))
+    cuts = cut_points(blocks, total)
+    slices: List[List[int]] = []
+    top = 0
+    while total - top > max_height:
+        fits = [c for c in cuts if top < c <= top + max_height]
+        bottom = fits[-1] if fits else top + max_height
+        slices.append([top, bottom])
+        top = bottom
+    slices.append([top, total])
+    return slices
+
+
+def middle_cut(cuts: List[int], top: int, bottom: int) -> Optional[int]:
+    """(top, bottom) 内最靠近中点的候选切点；没有则返回 None。"""
+    inside = [c for c in cuts if top < c < bottom]
+    if not inside:
+        return None
+    middle = (top + bottom) / 2
+    return min(inside, key=lambda c: abs(c - middle))
+
+
+def find_chrome() -> Optional[str]:
+    for candidate in CHROME_CANDIDATES:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+
+def read_config(path: str = 'oqqwall.config') -> Dict[str, str]:
+    config = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for raw in f:
+                line = raw.partition('#')[0].strip()
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    config[key.strip()] = value.strip().strip('"')
+    except OSError:
+        pass
+    return config
+
+
+def to_url(html: str) -> str:
+    if html.startswith(('file://', 'http://', 'https://', 'data:')):
+        return html
+    return 'file://' + os.path.abspath(html)
+
+
+# ---- DevTools 协议 ----------------------------------------------------------
+class CDPConnection:
+    """浏览器级 websocket 连接；页面命令通过 flatten 模式的 sessionId 复用同一连接。"""
+
+    def __init__(self, ws_url: str, timeout: float = DEFAULT_TIMEOUT):
+        import websocket  # websocket-client，仅服务端需要
+        self._ws = websocket.create_connection(ws_url, timeout=timeout, suppress_origin=True)
+        self._next_id = 0
+        self._events: deque = deque()
+
+    def close(self):
+        try:
+            self._ws.close()
+        except Exception:
+            pass
+
+    def _recv(self, deadline: float) -> dict:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RenderError('DevTools 响应超时')
+        self._ws.settimeout(remaining)
+        return json.loads(self._ws.recv())
+
+    def send(self, method: str, params: Optional[dict] = None, session_id: Optional[str] = None,
+             timeout: float = DEFAULT_TIMEOUT) -> dict:
+        self._next_id += 1
+        msg_id = self._next_id
+        msg = {'id': msg_id, 'method': method, 'params': params or {}}
+        if session_id:
+            msg['sessionId'] = session_id
+        self._ws.send(json.dumps(msg))
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self._recv(deadline)
+            if data.get('id') == msg_id:
+                if 'error' in data:
+                    raise RenderError(f"{method}: {data['error'].get('message')}")
+                return data.get('result') or {}
+            if 'method' in data:
+                self._events.append(data)
+
+    def wait_event(self, method: str, session_id: Optional[str], timeout: float = DEFAULT_TIMEOUT) -> dict:
+        for event in list(self._events):
+            if event.get('method') == method and event.get('sessionId') == session_id:
+                self._events.remove(event)
+                return event
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self._recv(deadline)
+            if data.get('method') == method and data.get('sessionId') == session_id:
+                return data
+            if 'method' in data:
+                self._events.append(data)
+
+    def drop_events(self, session_id: str):
+        self._events = deque(e for e in self._events if e.get('sessionId') != session_id)
+
+
+class BrowserWorker:
+    """一个 headless Chromium 进程；渲染满 recycle_after 次后由池回收重启。"""
+
+    def __init__(self, chrome_bin: str, no_sandbox: bool = False, timeout: float = DEFAULT_TIMEOUT,
+                 tile_defaults: Optional[dict] = None):
+        self.chrome_bin = chrome_bin
+        self.no_sandbox = no_sandbox
+        self.timeout = timeout
+        # tiles 的默认参数（来自 oqqwall.config），请求中的同名参数优先
+        self.tile_defaults = dict(tile_defaults or {})
+        self.renders = 0
+        self._proc: Optional[subprocess.Popen] = None
+        self._profile: Optional[str] = None
+        self._conn: Optional[CDPConnection] = None
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None and self._conn is not None
+
+    def start(self):
+        if self.alive:
+            return
+        self.close()
+        self._profile = tempfile.mkdtemp(prefix='oqqwall-render-')
+        args = [
+            self.chrome_bin, '--headless', '--remote-debugging-port=0',
+            f'--user-data-dir={self._profile}',
+            '--no-first-run', '--no-default-browser-check', '--disable-gpu',
+            '--disable-extensions', '--hide-scrollbars', '--mute-audio',
+            '--run-all-compositor-stages-before-draw',
+            '--allow-file-access-from-files',
+        ]
+        if self.no_sandbox:
+            args.append('--no-sandbox')
+        args.append('about:blank')
+        self._proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        # Chromium 启动后把实际端口与浏览器 websocket 路径写入 DevToolsActivePort
+        port_file = os.path.join(self._profile, 'DevToolsActivePort')
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                raise RenderError(f'Chromium 启动失败 (exit={self._proc.returncode})')
+            try:
+                with open(port_file, 'r', encoding='utf-8') as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    self._conn = CDPConnection(f'ws://127.0.0.1:{lines[0]}{lines[1]}', self.timeout)
+                    self.renders = 0
+                    return
+            except OSError:
+                pass
+            time.sleep(0.05)
+        self.close()
+        raise RenderError('等待 Chromium DevTools 端口超时')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+                try:
+                    self._proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._proc.kill()
+                    self._proc.wait()
+            self._proc = None
+        if self._profile:
+            shutil.rmtree(self._profile, ignore_errors=True)
+            self._profile = None
+
+    @contextmanager
+    def _page(self, html: str, timeout: float, metrics: Optional[dict] = None, media: Optional[str] = None):
+        """新开标签页加载 html 并等待就绪，产出 (连接, sessionId)；结束后关闭标签页。"""
+        self.start()
+        conn = self._conn
+        target_id = conn.send('Target.createTarget', {'url': 'about:blank'}, timeout=timeout)['targetId']
+        session_id = None
+        try:
+            session_id = conn.send('Target.attachToTarget', {'targetId': target_id, 'flatten': True},
+                                   timeout=timeout)['sessionId']
+            conn.send('Page.enable', session_id=session_id, timeout=timeout)
+            if media:
+                conn.send('Emulation.setEmulatedMedia', {'media': media}, session_id, timeout)
+            if metrics:
+                conn.send('Emulation.setDeviceMetricsOverride', metrics, session_id, timeout)
+            result = conn.send('Page.navigate', {'url': to_url(html)}, session_id, timeout)
+            if result.get('errorText'):
+                raise RenderError(f"加载失败: {result['errorText']}")
+            conn.wait_event('Page.loadEventFired', session_id, timeout)
+            conn.send('Runtime.evaluate', {'expression': READY_JS, 'awaitPromise': True, 'returnByValue': True},
+                      session_id, timeout)
+            yield conn, session_id
+        finally:
+            try:
+                conn.send('Target.closeTarget', {'targetId': target_id}, timeout=5)
+            except Exception:
+                pass
+            if session_id:
+                conn.drop_events(session_id)
+
+    def render(self, html: str, out: str, fmt: str = 'pdf', timeout: float = DEFAULT_TIMEOUT,
+               options: Optional[dict] = None) -> dict:
+        if fmt == 'tiles':
+            return self.render_tiles(html, out, timeout, **{**self.tile_defaults, **(options or {})})
+        with self._page(html, timeout) as (conn, session_id):
+            if fmt == 'pdf':
+                data = conn.send('Page.printToPDF', PDF_OPTIONS, session_id, timeout)['data']
+            else:
+                size = conn.send('Page.getLayoutMetrics', session_id=session_id, timeout=timeout)
+                content = size.get('cssContentSize') or size.get('contentSize') or {}
+                clip = {'x': 0, 'y': 0, 'width': content.get('width', 800),
+                        'height': content.get('height', 600), 'scale': 1}
+                data = conn.send('Page.captureScreenshot',
+                                 {'format': fmt, 'clip': clip, 'captureBeyondViewport': True},
+                                 session_id, timeout)['data']
+        nbytes = _write_b64(out, data)
+        self.renders += 1
+        return {'out': out, 'bytes': nbytes}
+
+    def render_tiles(self, html: str, out_dir: str, timeout: float = DEFAULT_TIMEOUT, prefix: str = '',
+                     page_width_in: float = PAGE_WIDTH_IN, max_aspect: float = SLICE_MAX_ASPECT,
+                     max_kb: int = SLICE_MAX_KB, dpi: int = TILE_DPI, quality: int = TILE_QUALITY,
+                     image_format: str = 'jpeg') -> dict:
+        """不经过 PDF，按打印样式布局后按消息块边界分段截图（JPEG/PNG）。
+
+        视口宽度等于纸张宽度，deviceScaleFactor = dpi / 96，输出像素宽度与原先
+        ``convert -density <dpi>`` 的结果一致；每段高度不超过宽度的 max_aspect 倍，
+        超过 max_kb 的段在靠近中部的块边界再切。文件名为 ``<prefix><两位序号>.<扩展名>``，从 00 开始。
+        """
+        width = round(page_width_in * CSS_DPI)
+        max_height = max(1, round(width * float(max_aspect)))
+        max_bytes = int(max_kb or 0) * 1024
+        metrics = {'width': width, 'height': max_height, 'deviceScaleFactor': dpi / CSS_DPI, 'mobile': False}
+        ext = 'jpeg' if image_format == 'jpeg' else 'png'
+        images: List[bytes] = []
+        os.makedirs(out_dir, exist_ok=True)
+        with self._page(html, timeout, metrics=metrics, media='print') as (conn, session_id):
+            expression = LAYOUT_BLOCKS_JS % (max_height, round(PAGE_MIN_HEIGHT_IN * CSS_DPI))
+            result = conn.send('Runtime.evaluate', {'expression': expression, 'returnByValue': True},
+                               session_id, timeout)
+            layout = (result.get('result') or {}).get('value') or {}
+            total = int(layout.get('total') or max_height)
+            blocks = layout.get('blocks') or []
+            cuts = cut_points(blocks, total)
+            pending = plan_slices(blocks, total, max_height)
+            while pending:
+                top, bottom = pending.pop(0)
+                params = {'format': image_format, 'captureBeyondViewport': True, 'fromSurface': True,
+                          'clip': {'x': 0, 'y': top, 'width': width, 'height': max(1, bottom - top), 'scale': 1}}
+                if image_format == 'jpeg':
+                    params['quality'] = quality
+                data = base64.b64decode(conn.send('Page.captureScreenshot', params, session_id, timeout)['data'])
+                split = middle_cut(cuts, top, bottom) if max_bytes and len(data) > max_bytes else None
+                if split is not None:
+                    pending[:0] = [[top, split], [split, bottom]]
+                    continue
+                images.append(data)
+        files: List[str] = []
+        total_bytes = 0
+        for index, data in enumerate(images):
+            path = os.path.join(out_dir, f'{prefix}{index:02d}.{ext}')
+            total_bytes += _write_bytes(path, data)
+            files.append(path)
+        self.renders += 1
+        return {'files': files, 'bytes': total_bytes}
+
+
+def _write_b64(path: str, data: str) -> int:
+    return _write_bytes(path, base64.b64decode(data))
+
+
+def _write_bytes(path: str, payload: bytes) -> int:
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    return len(payload)
+
+
+# ---- 浏览器池 ---------------------------------------------------------------
+class BrowserPool:
+    def __init__(self, factory: Callable[[], BrowserWorker], size: int = DEFAULT_POOL_SIZE,
+                 recycle_after: int = DEFAULT_RECYCLE_AFTER):
+        self.size = max(1, int(size))
+        self.recycle_after = max(1, int(recycle_after))
+        self._workers: List[BrowserWorker] = [factory() for _ in range(self.size)]
+        self._idle: 'queue.Queue[BrowserWorker]' = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._lock = threading.Lock()
+        self.stats = {'renders': 0, 'failures': 0, 'recycled': 0, 'busy': 0}
+
+    def warm(self):
+        """预先启动全部浏览器，首个请求无需等待冷启动。"""
+        for worker in self._workers:
+            try:
+                worker.start()
+            except Exception as exc:
+                logger.warning('预热浏览器失败: %s', exc)
+
+    def render(self, html: str, out: str, fmt: str = 'pdf', timeout: float = DEFAULT_TIMEOUT,
+               options: Optional[dict] = None) -> dict:
+        try:
+            worker = self._idle.get(timeout=min(timeout, POOL_WAIT))
+        except queue.Empty:
+            raise RenderError('渲染池繁忙')
+        with self._lock:
+            self.stats['busy'] += 1
+        try:
+            result = worker.render(html, out, fmt, timeout, options)
+            with self._lock:
+                self.stats['renders'] += 1
+            return result
+        except Exception:
+            with self._lock:
+                self.stats['failures'] += 1
+            # 出错的浏览器状态不可信，直接丢弃，下次使用时重新启动
+            worker.close()
+            raise
+        finally:
+            if worker.renders >= self.recycle_after:
+                worker.close()
+                with self._lock:
+                    self.stats['recycled'] += 1
+            with self._lock:
+                self.stats['busy'] -= 1
+            self._idle.put(worker)
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()
+
+
+# ---- Unix 套接字服务 --------------------------------------------------------
+def _read_line(conn: socket.socket, limit: int = 1 << 20) -> bytes:
+    buf = b''
+    while b'\n' not in buf and len(buf) < limit:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        buf += chunk
+    return buf.split(b'\n', 1)[0]
+
+
+class RenderServer:
+    def __init__(self, pool: BrowserPool, sock_path: str = SOCK_PATH, output_roots=OUTPUT_ROOTS):
+        self.pool = pool
+        self.sock_path = sock_path
+        self.output_roots = [os.path.realpath(r) for r in output_roots]
+        self._sock: Optional[socket.socket] = None
+        self._stop = threading.Event()
+
+    def output_allowed(self, out: str) -> bool:
+        real = os.path.realpath(out)
+        return any(os.path.commonpath([real, root]) == root for root in self.output_roots)
+
+    def handle(self, request: dict) -> dict:
+        cmd = request.get('cmd')
+        if cmd == 'ping':
+            return {'ok': True}
+        if cmd == 'stats':
+            return {'ok': True, 'pool_size': self.pool.size, 'recycle_after': self.pool.recycle_after,
+                    **self.pool.stats}
+        html, out = request.get('html'), request.get('out')
+        fmt = str(request.get('format') or 'pdf').lower()
+        if not html or not out or fmt not in ('pdf', 'png', 'jpeg', 'tiles'):
+            return {'ok': False, 'error': '参数错误：需要 html、out，format 为 pdf/png/jpeg/tiles'}
+        if not self.output_allowed(str(out)):
+            logger.warning('拒绝写入 %s：不在 %s 之下', out, ', '.join(self.output_roots))
+            return {'ok': False, 'error': f'out 必须位于 {", ".join(OUTPUT_ROOTS)} 之下'}
+        options = {k: request[k] for k in TILE_OPTIONS if k in request} if fmt == 'tiles' else None
+        start = time.monotonic()
+        try:
+            result = self.pool.render(html, out, fmt, float(request.get('timeout') or DEFAULT_TIMEOUT), options)
+        except Exception as exc:
+            logger.warning('渲染失败 %s: %s', html, exc)
+            return {'ok': False, 'error': str(exc) or type(exc).__name__}
+        return {'ok': True, 'out': out, **result, 'ms': int((time.monotonic() - start) * 1000)}
+
+    def _serve_conn(self, conn: socket.socket):
+        try:
+            try:
+                request = json.loads(_read_line(conn) or b'{}')
+                response = self.handle(request if isinstance(request, dict) else {})
+            except ValueError:
+                response = {'ok': False, 'error': '无效的 JSON'}
+            conn.sendall(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def start(self):
+        if os.path.exists(self.sock_path):
+            os.unlink(self.sock_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.sock_path)
+        self._sock.listen(16)
+        self._sock.settimeout(0.5)
+
+    def serve_forever(self):
+        if self._sock is None:
+            self.start()
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.settimeout(None)
+            threading.Thread(target=self._serve_conn, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sock is not None:
+            self._sock.close()
+        try:
+            os.unlink(self.sock_path)
+        except OSError:
+            pass
+
+
+# ---- 客户端 -----------------------------------------------------------------
+def request(payload: dict, sock_path: str = SOCK_PATH, timeout: float = DEFAULT_TIMEOUT + 10) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(sock_path)
+        sock.sendall(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+        line = _read_line(sock)
+    return json.loads(line or b'{}')
+
+
+def render(html: str, out: str, fmt: str = 'pdf', sock_path: str = SOCK_PATH,
+           timeout: float = DEFAULT_TIMEOUT, **options) -> dict:
+    """fmt 为 tiles 时 out 是输出目录，options 可含 prefix/dpi/quality 等（见 TILE_OPTIONS）。"""
+    payload = {'html': html, 'out': out, 'format': fmt, 'timeout': timeout, **options}
+    return request(payload, sock_path, timeout + 10)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='常驻 Chromium 渲染服务')
+    parser.add_argument('--sock', default=SOCK_PATH)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('serve', help='启动服务')
+    p.add_argument('--pool-size', type=int)
+    p.add_argument('--recycle-after', type=int)
+    p.add_argument('--chrome', help='Chromium 可执行文件，默认自动查找')
+    p.add_argument('--no-sandbox', action='store_true', default=None)
+    p = sub.add_parser('render', help='请求渲染一次（成功退出码 0）')
+    p.add_argument('html')
+    p.add_argument('out')
+    p.add_argument('--format', default='pdf', choices=['pdf', 'png', 'jpeg', 'tiles'],
+                   help='tiles：跳过 PDF，按页直接截图到 out 目录')
+    p.add_argument('--prefix', default='', help='tiles 文件名前缀，如 "123-"')
+    p.add_argument('--dpi', type=int, default=TILE_DPI)
+    p.add_argument('--quality', type=int, default=TILE_QUALITY)
+    p.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    sub.add_parser('ping', help='检查服务是否可用')
+    sub.add_parser('stats', help='输出服务统计（JSON）')
+    args = parser.parse_args(argv)
+
+    if args.action == 'serve':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] render_service: %(message)s')
+        config = read_config()
+        chrome_bin = args.chrome or find_chrome()
+        if not chrome_bin:
+            logger.error('未找到 Chromium/Chrome 可执行文件')
+            return 1
+        no_sandbox = args.no_sandbox if args.no_sandbox is not None else \
+            config.get('force_chromium_no-sandbox', 'false').lower() == 'true'
+        tile_defaults = {'max_aspect': float(config.get('render_slice_max_aspect') or SLICE_MAX_ASPECT),
+                         'max_kb': int(config.get('render_slice_max_kb') or SLICE_MAX_KB)}
+        pool = BrowserPool(lambda: BrowserWorker(chrome_bin, no_sandbox, tile_defaults=tile_defaults),
+                           args.pool_size or int(config.get('render_pool_size') or DEFAULT_POOL_SIZE),
+                           args.recycle_after or int(config.get('render_recycle_after') or DEFAULT_RECYCLE_AFTER))
+        server = RenderServer(pool, args.sock)
+        server.start()
+        signal.signal(signal.SIGTERM, lambda *_: server.stop())
+        threading.Thread(target=pool.warm, daemon=True).start()
+        logger.info('监听 %s（浏览器 %s 个，每 %s 次渲染回收）', args.sock, pool.size, pool.recycle_after)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            pool.close()
+        return 0
+
+    try:
+        if args.action == 'render':
+            options = {'prefix': args.prefix, 'dpi': args.dpi, 'quality': args.quality} \
+                if args.format == 'tiles' else {}
+            response = render(args.html, args.out, args.format, args.sock, args.timeout, **options)
+        else:
+            response = request({'cmd': args.action}, args.sock, 5)
+    except (OSError, ValueError) as exc:
+        print(f'render_service 不可用: {exc}', file=sys.stderr)
+        return 1
+    print(json.dumps(response, ensure_ascii=False))
+    return 0 if response.get('ok') else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""合并转发（forward）展开。
+
+替代 progress-lite-json.sh 中逐个 curl /get_forward_msg + 逐个 jq 替换的实现：
+
+- 使用带连接池的 keep-alive HTTP 客户端（requests.Session）；
+- 每一层把尚未展开的 forward id 一次性并发拉取（受并发上限约束）；
+- 结果按 forward id 记忆化：进程内字典 + 磁盘缓存 cache/forward/<id>.json，
+  同一合并转发在不同 tag、重试之间不会重复请求（forward 内容按 id 不可变）；
+- 每层只在内存里做一次整树替换，输出结构与原 jq 实现一致：
+  保持 type=forward，只把 .data 替换为接口返回的 .data，并保留原 id。
+
+用法（stdin 输入 rawmsg JSON，stdout 输出展开后的 JSON）：
+    NAPCAT_ACCESS_TOKEN=... python3 getmsgserv/LM_work/forward_expand.py --api 127.0.0.1:3000
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MAX_DEPTH = 4
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 10
+CACHE_DIR = './cache/forward'
+CACHE_MAX_AGE_DAYS = 7
+
+_SAFE_ID = re.compile(r'^[0-9A-Za-z_\-]+$')
+
+
+def iter_forward_ids(node: Any, filled: Optional[Set[int]] = None) -> Iterable[str]:
+    """递归找出所有尚未展开的 forward 段的 id（字符串化）。"""
+    filled = filled if filled is not None else set()
+    stack = [node]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            data = cur.get('data')
+            if (cur.get('type') == 'forward' and isinstance(data, dict) and id(data) not in filled
+                    and data.get('id') not in (None, '', False)):
+                yield str(data['id'])
+            stack.extend(cur.values())
+        elif isinstance(cur, list):
+            stack.extend(cur)
+
+
+def fill_forwards(node: Any, payloads: Dict[str, dict], filled: Optional[Set[int]] = None) -> int:
+    """一次遍历把匹配的 forward 段 .data 替换为 payload（保留原 id），返回替换次数。
+
+    filled 记录已填入的 .data 对象，后续层不会再覆盖（否则会丢掉更深层的展开结果）。
+    """
+    filled = filled if filled is not None else set()
+    replaced = 0
+    stack = [node]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            data = cur.get('data')
+            if cur.get('type') == 'forward' and isinstance(data, dict) and id(data) not in filled:
+                payload = payloads.get(str(data.get('id')))
+                if payload is not None:
+                    old_id = data.get('id')
+                    # 深拷贝：同一 payload 可能出现在多处，且后续层还会就地改写其内部 forward
+                    new_data = copy.deepcopy(payload)
+                    new_data['id'] = old_id
+                    cur['data'] = new_data
+                    filled.add(id(new_data))
+                    replaced += 1
+                    # 新填入的内容留给下一层处理，避免自引用的转发无限展开
+                    stack.extend(v for k, v in cur.items() if k != 'data')
+                    continue
+            stack.extend(cur.values())
+        elif isinstance(cur, list):
+            stack.extend(cur)
+    return replaced
+
+
+class ForwardExpander:
+    def __init__(self, api: str, token: str = '', concurrency: int = DEFAULT_CONCURRENCY,
+                 timeout: float = DEFAULT_TIMEOUT, cache_dir: Optional[str] = CACHE_DIR,
+                 max_depth: int = MAX_DEPTH):
+        self.base_url = api if api.startswith(('http://', 'https://')) else f'http://{api}'
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.max_depth = max_depth
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+        self._memo: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.requests_made = 0
+
+    def close(self):
+        self.session.close()
+
+    # ---- 记忆化 -------------------------------------------------------------
+    def _cache_path(self, fid: str) -> Optional[str]:
+        if not self.cache_dir or not _SAFE_ID.match(fid):
+            return None
+        return os.path.join(self.cache_dir, f'{fid}.json')
+
+    def _cache_get(self, fid: str) -> Optional[dict]:
+        with self._lock:
+            if fid in self._memo:
+                return self._memo[fid]
+        path = self._cache_path(fid)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._memo[fid] = payload
+        return payload
+
+    def _cache_put(self, fid: str, payload: dict):
+        with self._lock:
+            self._memo[fid] = payload
+        path = self._cache_path(fid)
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def prune_cache(self, max_age_days: float = CACHE_MAX_AGE_DAYS):
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        cutoff = time.time() - max_age_days * 86400
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < cutoff:
+                            os.unlink(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    # ---- 拉取 ---------------------------------------------------------------
+    def fetch(self, fid: str) -> Optional[dict]:
+        cached = self._cache_get(fid)
+        if cached is not None:
+            return cached
+        with self._lock:
+            self.requests_made += 1
+        try:
+            resp = self.session.get(f'{self.base_url}/get_forward_msg',
+                                    params={'message_id': fid}, timeout=self.timeout)
+            body = resp.json()
+        except (requests.RequestException, ValueError):
+            return None
+        if not isinstance(body, dict) or body.get('status') != 'ok' or body.get('data') is None:
+            return None
+        payload = body['data']
+        if not isinstance(payload, dict):
+            return None
+        self._cache_put(fid, payload)
+        return payload
+
+    def fetch_many(self, ids: List[str]) -> Dict[str, dict]:
+        results: Dict[str, dict] = {}
+        if not ids:
+            return results
+        if len(ids) == 1 or self.concurrency == 1:
+            for fid in ids:
+                payload = self.fetch(fid)
+                if payload is not None:
+                    results[fid] = payload
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(ids))) as pool:
+            for fid, payload in zip(ids, pool.map(self.fetch, ids)):
+                if payload is not None:
+                    results[fid] = payload
+        return results
+
+    # ---- 展开 ---------------------------------------------------------------
+    def expand(self, messages: Any) -> Any:
+        """逐层展开 forward，返回展开后的（数组形式）JSON；没有任何替换时原样返回。"""
+        tree = messages if isinstance(messages, list) else [messages]
+        attempted: Set[str] = set()
+        resolved: Dict[str, dict] = {}
+        filled: Set[int] = set()
+        replaced_any = False
+        for _ in range(self.max_depth):
+            # 本次已请求过（无论成败）的 id 不再重复请求；已拿到的结果可直接填入更深层
+            pending = sorted(set(iter_forward_ids(tree, filled)) - attempted)
+            if pending:
+                attempted.update(pending)
+                resolved.update(self.fetch_many(pending))
+            if not fill_forwards(tree, resolved, filled):
+                break
+            replaced_any = True
+        return tree if replaced_any else messages
+
+
+def _read_token() -> str:
+    token = os.environ.get('NAPCAT_ACCESS_TOKEN', '')
+    if token:
+        return token
+    try:
+        with open('oqqwall.config', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('napcat_access_token='):
+                    return line.split('=', 1)[1].strip().strip('"')
+    except OSError:
+        pass
+    return ''
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='展开 rawmsg 中的合并转发（stdin -> stdout）')
+    parser.add_argument('--api', required=True, help='NapCat HTTP 地址，如 127.0.0.1:3000')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH)
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='空字符串表示不使用磁盘缓存')
+    args = parser.parse_args(argv)
+
+    raw = sys.stdin.read()
+    try:
+        messages = json.loads(raw)
+    except ValueError:
+        sys.stdout.write(raw)
+        return 0
+
+    expander = ForwardExpander(args.api, _read_token(), args.concurrency, args.timeout,
+                               args.cache_dir or None, args.max_depth)
+    try:
+        expander.prune_cache()
+        result = expander.expand(messages)
+    finally:
+        expander.close()
+    if result is messages:
+        sys.stdout.write(raw)
+    else:
+        json.dump(result, sys.stdout, ensure_ascii=False)
+        sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
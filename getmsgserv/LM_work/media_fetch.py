@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""投稿媒体（图片/视频）批量获取。
+
+替代 progress-lite-json.sh 中逐个文件 docker cp / cp / curl、每个文件一次整棵 JSON jq 改写的实现：
+
+- 容器内路径（/app...）：先通过一次 ``docker inspect`` 找到绑定挂载，宿主机可见时直接硬链接（跨文件系统则复制）；
+  不可见时把所有文件合成一次 ``docker exec <容器> tar -cf -`` 的 tar 流解包，失败再逐个 docker cp 兜底；
+- 宿主机 file:// 路径：硬链接或复制；
+- http(s)：使用带连接池的 requests.Session 并发下载；
+- 获取到的文件收录进 media_store（按内容去重，tag 路径为指向同一份数据的硬链接）；
+- 全部获取完成后，对整棵 JSON 做一次 URL 改写。
+
+文件命名、去重与编号规则与原实现一致：图片与视频各自按首次出现顺序编号，
+保存为 cache/picture/<tag>/<tag>-<n>.<ext>；视频输出为 <tag>-<n>-h264.mp4，
+由 video_transcode.py 负责（能 remux 则不转码，否则附封面 <tag>-<n>-poster.jpg 并后台转码）。
+
+用法（stdin 输入消息 JSON，stdout 输出改写后的 JSON）：
+    python3 getmsgserv/LM_work/media_fetch.py --tag 123 [--container napcat]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import video_transcode  # noqa: E402
+from media_store import STORE_DIR, MediaStore  # noqa: E402
+
+IMAGE_EXTS = ('jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp')
+CONTAINER_PREFIX = '/app'
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30
+
+
+def iter_media_nodes(node: Any, media_type: str) -> Iterator[dict]:
+    """按文档顺序（与 jq 的 `..` 一致）枚举指定类型且带 url 的段。"""
+    if isinstance(node, dict):
+        data = node.get('data')
+        if node.get('type') == media_type and isinstance(data, dict) and data.get('url'):
+            yield node
+        for value in node.values():
+            yield from iter_media_nodes(value, media_type)
+    elif isinstance(node, list):
+        for value in node:
+            yield from iter_media_nodes(value, media_type)
+
+
+def image_extension(node: dict) -> str:
+    url = node['data']['url']
+    name = node['data'].get('file') or ''
+    if not name:
+        name = os.path.basename(url[7:] if url.startswith('file://') else url.split('?', 1)[0])
+    ext = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+    return ext if ext in IMAGE_EXTS else 'png'
+
+
+def video_extension(node: dict) -> str:
+    name = node['data'].get('file') or ''
+    if '.' in name:
+        ext = name.rsplit('.', 1)[1]
+        if ext:
+            return ext
+    return 'mp4'
+
+
+class MediaFetcher:
+    def __init__(self, tag: str, folder: str, pwd: str, container: str = 'napcat',
+                 concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                 docker_bin: str = 'docker', mounts: Optional[List[Tuple[str, str]]] = None,
+                 video_cache_dir: str = video_transcode.CACHE_DIR, store_dir: Optional[str] = STORE_DIR):
+        self.tag = str(tag)
+        self.folder = folder
+        self.pwd = pwd
+        self.container = container
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.docker_bin = docker_bin
+        self._mounts = mounts
+        self.video_cache_dir = video_cache_dir
+        self.store = MediaStore(store_dir) if store_dir else None
+        self._session: Optional[requests.Session] = None
+        self._linked = set()
+        self.stats = {'linked': 0, 'copied': 0, 'docker_batch': 0, 'docker_cp': 0, 'http': 0, 'missing': 0,
+                      'stored': 0}
+
+    # ---- 基础工具 -----------------------------------------------------------
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    def _docker_available(self) -> bool:
+        return bool(shutil.which(self.docker_bin))
+
+    def mounts(self) -> List[Tuple[str, str]]:
+        """返回容器的 (Destination, Source) 绑定挂载列表，按目标路径长度降序。"""
+        if self._mounts is None:
+            self._mounts = []
+            if self._docker_available():
+                try:
+                    out = subprocess.run(
+                        [self.docker_bin, 'inspect', '--format', '{{json .Mounts}}', self.container],
+                        capture_output=True, text=True, timeout=10,
+                    )
+                    if out.returncode == 0:
+                        for m in json.loads(out.stdout or '[]') or []:
+                            if m.get('Destination') and m.get('Source'):
+                                self._mounts.append((m['Destination'].rstrip('/'), m['Source'].rstrip('/')))
+                except (OSError, ValueError, subprocess.SubprocessError):
+                    pass
+            self._mounts.sort(key=lambda x: len(x[0]), reverse=True)
+        return self._mounts
+
+    def host_path(self, container_path: str) -> Optional[str]:
+        """容器内路径在宿主机上的可读位置；不可见返回 None。"""
+        for dest, src in self.mounts():
+            if container_path == dest or container_path.startswith(dest + '/'):
+                candidate = src + container_path[len(dest):]
+                if os.path.isfile(candidate):
+                    return candidate
+        # 非 Docker 部署或同路径挂载
+        if os.path.isfile(container_path):
+            return container_path
+        return None
+
+    def _link_or_copy(self, src: str, dest: str) -> bool:
+        try:
+            os.link(src, dest)
+            self._linked.add(dest)
+            self.stats['linked'] += 1
+            return True
+        except OSError:
+            pass
+        try:
+            shutil.copyfile(src, dest)
+            self.stats['copied'] += 1
+            return True
+        except OSError:
+            return False
+
+    # ---- 容器批量复制 -------------------------------------------------------
+    def _docker_tar_batch(self, jobs: Dict[str, str]) -> Dict[str, str]:
+        """一次 tar 流取出多个容器内文件；返回成功的 {容器路径: 目标文件}。"""
+        done: Dict[str, str] = {}
+        if not jobs or not self._docker_available():
+            return done
+        wanted = {path.lstrip('/'): path for path in jobs}
+        try:
+            proc = subprocess.Popen(
+                [self.docker_bin, 'exec', self.container, 'tar', '-cf', '-', '--', *jobs],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            return done
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                for member in tar:
+                    path = wanted.get(member.name.lstrip('/'))
+                    if not path or not member.isfile():
+                        continue
+                    src = tar.extractfile(member)
+                    if src is None:
+                        continue
+                    with open(jobs[path], 'wb') as out:
+                        shutil.copyfileobj(src, out)
+                    done[path] = jobs[path]
+        except (tarfile.TarError, OSError):
+            pass
+        finally:
+            try:
+                proc.stdout.close()
+            except OSError:
+                pass
+            proc.wait()
+        self.stats['docker_batch'] += len(done)
+        return done
+
+    def _docker_cp(self, path: str, dest: str) -> bool:
+        if not self._docker_available():
+            return False
+        try:
+            subprocess.run([self.docker_bin, 'cp', f'{self.container}:{path}', dest],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        except (OSError, subprocess.SubprocessError):
+            return False
+        if os.path.isfile(dest):
+            self.stats['docker_cp'] += 1
+            return True
+        return False
+
+    # ---- HTTP ---------------------------------------------------------------
+    def _download(self, url: str, dest: str) -> bool:
+        tmp = dest + '.part'
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as resp:
+                if resp.status_code >= 400:
+                    return False
+                with open(tmp, 'wb') as out:
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        out.write(chunk)
+            os.replace(tmp, dest)
+            self.stats['http'] += 1
+            return True
+        except (requests.RequestException, OSError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+
+    # ---- 主流程 -------------------------------------------------------------
+    def acquire(self, jobs: Dict[str, str]) -> Dict[str, str]:
+        """jobs: {url: 目标文件}；返回成功获取的 {url: 目标文件}。"""
+        done: Dict[str, str] = {}
+        container_jobs: Dict[str, str] = {}
+        container_urls: Dict[str, str] = {}
+        http_jobs: List[Tuple[str, str]] = []
+
+        for url, dest in jobs.items():
+            if url.startswith('file://'):
+                src = url[7:]
+                if src.startswith(CONTAINER_PREFIX):
+                    host = self.host_path(src)
+                    if host and self._link_or_copy(host, dest):
+                        done[url] = dest
+                    else:
+                        container_jobs[src] = dest
+                        container_urls[src] = url
+                elif os.path.isfile(src) and self._link_or_copy(src, dest):
+                    done[url] = dest
+            else:
+                http_jobs.append((url, dest))
+
+        pool = None
+        futures = []
+        if http_jobs:
+            # HTTP 下载与容器复制同时进行
+            pool = ThreadPoolExecutor(max_workers=min(self.concurrency, len(http_jobs)))
+            futures = [(url, dest, pool.submit(self._download, url, dest)) for url, dest in http_jobs]
+
+        if container_jobs:
+            batch = self._docker_tar_batch(container_jobs)
+            for path, dest in container_jobs.items():
+                if path in batch or self._docker_cp(path, dest):
+                    done[container_urls[path]] = dest
+
+        if pool is not None:
+            for url, dest, fut in futures:
+                if fut.result():
+                    done[url] = dest
+            pool.shutdown()
+
+        for url, dest in done.items():
+            if dest in self._linked:
+                # 硬链接与源文件共享 inode，不改动 NapCat 侧文件权限
+                continue
+            try:
+                os.chmod(dest, 0o666)
+            except OSError:
+                pass
+        self.stats['missing'] += len(jobs) - len(done)
+        return done
+
+    def public_url(self, path: str) -> str:
+        return f"file://{self.pwd}/cache/picture/{self.tag}/{os.path.basename(path)}"
+
+    def process(self, messages: Any) -> Any:
+        os.makedirs(self.folder, exist_ok=True)
+        tree = messages if isinstance(messages, list) else [messages]
+
+        # 1) 规划：图片与视频各自按首次出现的 URL 编号
+        image_final: Dict[str, str] = {}
+        video_final: Dict[str, str] = {}
+        jobs: Dict[str, str] = {}
+        video_posters: Dict[str, str] = {}
+        videos: List[Tuple[str, str, str, str]] = []  # (url, 原始文件, h264 文件, 封面)
+
+        index = 1
+        for node in iter_media_nodes(tree, 'image'):
+            url = node['data']['url']
+            if url in image_final or url in jobs:
+                continue
+            dest = os.path.join(self.folder, f"{self.tag}-{index}.{image_extension(node)}")
+            if os.path.isfile(dest):
+                image_final[url] = dest
+            else:
+                jobs[url] = dest
+            index += 1
+        image_jobs = set(jobs)
+
+        index = 1
+        seen_videos = set()
+        for node in iter_media_nodes(tree, 'video'):
+            url = node['data']['url']
+            if url in seen_videos:
+                continue
+            seen_videos.add(url)
+            local = os.path.join(self.folder, f"{self.tag}-{index}.{video_extension(node)}")
+            h264 = os.path.join(self.folder, f"{self.tag}-{index}-h264.mp4")
+            poster = os.path.join(self.folder, f"{self.tag}-{index}-poster.jpg")
+            index += 1
+            failed = video_transcode.failed_source(h264)
+            if failed or os.path.isfile(h264) or os.path.isfile(h264 + video_transcode.PENDING_SUFFIX):
+                # 已完成、上一次运行入队的转码仍在进行，或转码失败（引用原文件）
+                video_final[url] = failed or h264
+                if os.path.isfile(poster):
+                    video_posters[url] = poster
+                continue
+            videos.append((url, local, h264, poster))
+
+        # 2) 获取：同一 URL 同时作为图片和视频出现时分别保存
+        fetched = self.acquire(jobs)
+        for url in image_jobs:
+            if url in fetched:
+                image_final[url] = fetched[url]
+        video_jobs = {url: local for url, local, _, _ in videos}
+        fetched_videos = self.acquire(video_jobs) if video_jobs else {}
+        for url, local, h264, poster in videos:
+            if url in fetched_videos:
+                video_final[url], poster_path = video_transcode.prepare_video(
+                    local, h264, poster, self.video_cache_dir)
+                if poster_path:
+                    video_posters[url] = poster_path
+
+        # 3) 收录进内容寻址存储：相同内容（重复处理、刷新、热门图片）只保留一份数据
+        if self.store is not None:
+            final = {p for p in list(image_final.values()) + list(video_final.values()) + list(video_posters.values())
+                     if os.path.isfile(p)}
+            self.stats['stored'] = len(self.store.ingest(self.tag, sorted(final)))
+
+        # 4) 一次遍历改写 URL
+        image_urls = {u: self.public_url(p) for u, p in image_final.items() if os.path.isfile(p)}
+        video_urls = {u: self.public_url(p) for u, p in video_final.items()
+                      if os.path.isfile(p) or os.path.isfile(p + video_transcode.PENDING_SUFFIX)}
+        for node in list(iter_media_nodes(tree, 'image')):
+            new = image_urls.get(node['data']['url'])
+            if new:
+                node['data']['url'] = new
+        for node in list(iter_media_nodes(tree, 'video')):
+            old = node['data']['url']
+            new = video_urls.get(old)
+            if new:
+                node['data']['url'] = new
+                if old in video_posters:
+                    node['data']['poster'] = self.public_url(video_posters[old])
+        return tree
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='批量获取投稿中的图片/视频并改写 URL（stdin -> stdout）')
+    parser.add_argument('--tag', required=True)
+    parser.add_argument('--folder', help='默认 cache/picture/<tag>')
+    parser.add_argument('--pwd', default=os.getcwd(), help='项目根目录，用于生成 file:// URL')
+    parser.add_argument('--container', default=os.environ.get('NAPCAT_CONTAINER', 'napcat'))
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--docker-bin', default='docker')
+    args = parser.parse_args(argv)
+
+    messages = json.load(sys.stdin)
+    fetcher = MediaFetcher(args.tag, args.folder or os.path.join('cache', 'picture', str(args.tag)),
+                           args.pwd, args.container, args.concurrency, args.timeout, args.docker_bin)
+    try:
+        result = fetcher.process(messages)
+    finally:
+        fetcher.close()
+    json.dump(result, sys.stdout, ensure_ascii=False)
+    sys.stdout.write('\n')
+    print(f"media_fetch: {json.dumps(fetcher.stats)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,16 @@ if [[ -z "$napcat_token" ]]; then
 fi
 napcat_auth_header="Authorization: Bearer $napcat_token"
 
+# 链路追踪：stdout 是交给 sendtoLM 的 JSON，trace_span 本身不输出任何内容
+source ./Global_toolkit.sh
+trace_collect_start=$(trace_now)
+on_exit() {
+    local rc=$?
+    rm -f "${hist_idx_file:-}"
+    trace_span "$tag" collect "$trace_collect_start" "$rc"
+}
+trap on_exit EXIT
+
 #####################################
 #           基础函数定义            #
 #####################################
@@ -64,7 +74,7 @@ process_json() {
       # HTML 转义
       def esc: gsub("&";"&amp;") | gsub("<";"&lt;") | gsub(">";"&gt;");
       
-      # 预览文本（用于 reply 展开）
+      # 预览文本（用于 reply 展开；历史索引中已预先算好，此处只处理本次投稿内的消息）
       def preview($m):
         (($m.message // [])
           | map(
@@ -107,7 +117,7 @@ process_json() {
                             text:
                               ("<div class=\"reply\" data-mid=\"" + $rid + "\">" +
                                   "<div class=\"reply-meta\">" + $tm + "</div>" +
-                                  "<div class=\"reply-body\">" + (preview($ref) | esc) + "</div>" +
+                                  "<div class=\"reply-body\">" + ((if ($ref|has("preview")) then $ref.preview else preview($ref) end) | esc) + "</div>" +
                                "</div>")
                           }
                         }
@@ -209,10 +219,22 @@ check_irregular_types() {
   <<<"$rawmsg" 2>/dev/null || echo "false"
 }
 
-# 展开合并转发：用 /get_forward_msg 的结果把 forward 段替换为若干普通段
 # 展开合并转发：拉取 /get_forward_msg，把 forward 段的 .data 替换为接口返回的 .data
 # 递归/迭代充实 forward：保持 type=forward，只替换 .data（并保留原 id）
+# 由 forward_expand.py 完成：同层并发拉取、连接复用、按 forward id 缓存（cache/forward/）
 resolve_forward_messages() {
+  local json="$1" expanded
+  if expanded="$(printf '%s' "$json" | NAPCAT_ACCESS_TOKEN="$napcat_token" \
+        python3 getmsgserv/LM_work/forward_expand.py --api "$napcat_api")" && [[ -n "$expanded" ]]; then
+    printf '%s\n' "$expanded"
+    return 0
+  fi
+  echo "forward_expand.py 执行失败，回退到逐个请求" >&2
+  resolve_forward_messages_serial "$json"
+}
+
+# 旧实现（逐个 curl + jq），仅在 forward_expand.py 不可用时使用
+resolve_forward_messages_serial() {
   local json="$1"
   local updated="$json"
   local MAX_DEPTH=4
@@ -345,6 +367,7 @@ resolve_file_urls() {
   echo "$updated_json"
 }
 
+# 以下两个函数为逐个复制的旧实现，仅在 media_fetch.py 不可用时使用
 # 下载/复制 image：对 file:// 路径，如果是容器内部 (/app 开头)，使用 docker cp；否则常规 cp 或 curl
 # 下载/复制 image：递归处理任意深度（含 forward 内）
 download_and_replace_images() {
@@ -561,6 +584,15 @@ output_final_json() {
 
 create_folder
 
+# getmsgserv/pipeline.py 的 media 阶段在 media_fetch.py 失败时调用：stdin 为消息数组，逐个复制后原样输出
+if [[ "${OQQWALL_LEGACY_MEDIA:-0}" == "1" ]]; then
+  processed_json=$(cat)
+  processed_json=$(download_and_replace_images "$processed_json")
+  processed_json=$(download_and_replace_videos "$processed_json")
+  printf '%s\n' "$processed_json"
+  exit 0
+fi
+
 query_result=$(fetch_sender_info)
 senderid=$(cut -d '|' -f 1 <<<"$query_result")
 receiver=$(cut -d '|' -f 2 <<<"$query_result")
@@ -578,75 +610,16 @@ fi
 
 rawmsg=$(resolve_forward_messages "$rawmsg")
 
-# === 仅当存在 reply 时才构建历史索引（限制在文件末尾 N 行）===
+# === 仅当存在 reply 时才查询历史索引（serv.py 入库时维护的 msg_history 表，按引用 id 查询）===
 has_reply_flag=$(has_reply "$rawmsg")
 
-history_file="getmsgserv/all/priv_post.jsonl"
-legacy_history="getmsgserv/all/priv_post.json"
-if [[ ! -f "$history_file" && -f "$legacy_history" ]]; then
-  history_file="$legacy_history"
-fi
-HIST_TAIL_LINES=20000
-
-# 临时文件：窗口数组（最后 N 行里抽到的完整顶层对象）
-hist_window_file="$(mktemp)"
-# 临时文件：索引（message_id -> 对象）
+# 临时文件：索引（message_id -> {time, preview}）
 hist_idx_file="$(mktemp)"
-trap 'rm -f "$hist_window_file" "$hist_idx_file"' EXIT
-
-if [[ "$has_reply_flag" == "true" && -f "$history_file" ]]; then
-  # 兼容 JSON Lines 与旧版数组格式，抽取末尾窗口
-  python3 - "$history_file" "$HIST_TAIL_LINES" > "$hist_window_file" <<'PY'
-import sys
-import json
-from collections import deque
-
-path = sys.argv[1]
-tail_lines = int(sys.argv[2])
-
-def first_non_whitespace(fp):
-    while True:
-        char = fp.read(1)
-        if not char:
-            return ''
-        if not char.isspace():
-            return char
-
-result = []
-try:
-    with open(path, 'r', encoding='utf-8', errors='ignore') as fp:
-        first_char = first_non_whitespace(fp)
-        fp.seek(0)
-        if first_char == '[':
-            try:
-                data = json.load(fp)
-                if isinstance(data, list):
-                    result = data[-tail_lines:]
-                else:
-                    result = []
-            except Exception:
-                result = []
-        else:
-            lines = deque(maxlen=tail_lines)
-            for line in fp:
-                lines.append(line)
-            for raw_line in lines:
-                line = raw_line.strip()
-                if not line:
-                    continue
-                try:
-                    result.append(json.loads(line))
-                except Exception:
-                    continue
-except FileNotFoundError:
-    result = []
-
-json.dump(result, sys.stdout, ensure_ascii=False)
-PY
-
-  # 基于窗口数组建索引
-  jq 'INDEX((.message_id|tostring))' "$hist_window_file" > "$hist_idx_file" 2>/dev/null \
+
+if [[ "$has_reply_flag" == "true" ]]; then
+  printf '%s' "$rawmsg" | python3 getmsgserv/history_index.py lookup --db "$db_file" > "$hist_idx_file" 2>/dev/null \
     || echo '{}' > "$hist_idx_file"
+  [[ -s "$hist_idx_file" ]] || echo '{}' > "$hist_idx_file"
 else
   echo '{}' > "$hist_idx_file"
 fi
@@ -660,6 +633,18 @@ processed_json=$(merge_adjacent_texts_recursively "$processed_json")
 
 has_irregular_types=$(check_irregular_types "$rawmsg")
 processed_json=$(resolve_file_urls "$processed_json")
-processed_json=$(download_and_replace_images "$processed_json")
-processed_json=$(download_and_replace_videos "$processed_json")
+# 由 getmsgserv/pipeline.py 调用时，媒体获取作为单独的阶段执行（可单独重试）
+if [[ "${OQQWALL_COLLECT_SKIP_MEDIA:-0}" == "1" ]]; then
+  output_final_json "$processed_json" "$has_irregular_types"
+  exit 0
+fi
+# 图片/视频批量获取（绑定挂载直读/硬链接、单次 docker tar 流、并发下载、一次性改写 URL）
+if media_json="$(printf '%s' "$processed_json" | python3 getmsgserv/LM_work/media_fetch.py \
+      --tag "$tag" --folder "$folder" --pwd "$pwd_path" --container "$container_name")" && [[ -n "$media_json" ]]; then
+  processed_json="$media_json"
+else
+  echo "media_fetch.py 执行失败，回退到逐个复制" >&2
+  processed_json=$(download_and_replace_images "$processed_json")
+  processed_json=$(download_and_replace_videos "$processed_json")
+fi
 output_final_json "$processed_json" "$has_irregular_types"
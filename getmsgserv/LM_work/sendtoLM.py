@@ -18,14 +18,26 @@ import unicodedata
 import sqlite3
 import copy
 import traceback
+import atexit
 import signal
 import ssl
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import queue
 import urllib3
 from typing import Dict, Any, List, Optional, Tuple
 from contextlib import contextmanager
 from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# 链路追踪（getmsgserv/pipeline_trace.py）；模块缺失时退化为空操作
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    from pipeline_trace import span as trace_span
+except ImportError:
+    @contextmanager
+    def trace_span(tag, stage, db_path=None):
+        yield {}
 
 # 最近一次LLM原始事件调试信息（便于在空响应时输出）
 LAST_LLM_RAW_EVENTS = ""
@@ -38,8 +50,46 @@ LAST_LLM_RAW_EVENTS = ""
 LOG_FILE_PATH = './logs/sendtoLM_debug.log'
 ENABLE_FILE_LOGGING = True  # 是否启用文件日志记录（设为False则只输出到控制台）
 
+class LazyJSON:
+    """日志参数包装：仅在日志真正输出时才执行 json.dumps，避免 INFO 级别下白白序列化整棵消息树"""
+    __slots__ = ('obj', 'limit', 'kwargs')
+
+    def __init__(self, obj, limit=None, **kwargs):
+        self.obj = obj
+        self.limit = limit
+        self.kwargs = kwargs
+
+    def __str__(self):
+        try:
+            text = json.dumps(self.obj, **self.kwargs)
+        except (TypeError, ValueError):
+            text = repr(self.obj)
+        return text[:self.limit] if self.limit is not None else text
+
+
+# 后台日志监听器：处理器的格式化与文件写入在独立线程完成
+_log_listener = None
+
+
+def _stop_log_listener():
+    """停止当前监听器并排空队列；重复调用安全（已停止的 QueueListener 再次 stop 会抛异常）"""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None:
+        listener.stop()
+
+
+# 进程退出时排空队列，保证 sys.exit 前的日志落盘
+atexit.register(_stop_log_listener)
+
 def get_logging_config():
-    """动态生成日志配置，确保日志目录存在"""
+    """
+    动态生成日志配置，确保日志目录存在。
+    调用线程只把记录放入队列（QueueHandler），控制台/文件输出由 QueueListener 线程完成。
+    """
+    global _log_listener
+    log_format = 'LMWork:%(asctime)s - %(levelname)s - %(message)s'
+    formatter = logging.Formatter(log_format)
     handlers = [logging.StreamHandler()]  # 始终输出到控制台
     
     # 如果启用文件日志，添加文件处理器
@@ -50,7 +100,6 @@ def get_logging_config():
             os.makedirs(log_dir, exist_ok=True)
         
         # 创建文件处理器，带有轮转功能
-        from logging.handlers import RotatingFileHandler
         file_handler = RotatingFileHandler(
             LOG_FILE_PATH, 
             maxBytes=10*1024*1024,  # 10MB
@@ -61,11 +110,23 @@ def get_logging_config():
         
         # 打印日志文件位置信息（仅在第一次时打印）
         print(f"日志同时输出到文件: {os.path.abspath(LOG_FILE_PATH)}")
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _stop_log_listener()
+    log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
+    queue_handler = QueueHandler(log_queue)
+    # QueueHandler 会先格式化一次消息，这里只保留 message，避免前缀重复
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
     
     return {
         'level': logging.INFO,
-        'format': 'LMWork:%(asctime)s - %(levelname)s - %(message)s',
-        'handlers': handlers
+        'format': log_format,
+        'handlers': [queue_handler]
     }
 
 # 明确"要匿名"的正向信号（命中任一则偏向 needpriv=true）
@@ -219,6 +280,22 @@ MAX_RETRIES = 3
 RETRY_DELAY = 2  # 秒
 API_TIMEOUT = 30  # 秒
 
+# LLM 延迟预算与对冲请求配置
+# 各调用类型的总延迟预算（秒），可在 oqqwall.config 中以 llm_budget_<类型> 覆盖
+LLM_CALL_BUDGETS = {
+    'grouping': 90,   # 主分组调用，输出较长
+    'safety': 25,     # 文本安全检查
+    'privacy': 25,    # 匿名需求兜底判断
+}
+LLM_HEDGE_DEFAULT_DELAY = 8   # 历史样本不足时的对冲延迟（秒）
+LLM_HEDGE_MIN_DELAY = 2       # 对冲延迟下限（秒）
+LLM_HEDGE_MIN_SAMPLES = 5     # 使用百分位前所需的最少样本数
+LLM_LATENCY_SAMPLES = 50      # 每种调用类型保留的延迟样本数
+LLM_LATENCY_FILE = './cache/llm_latency.json'
+LLM_MAX_ATTEMPTS = 3          # 主请求 + 对冲 + 预算内的一次重试
+LLM_STREAM_GRACE = 10         # 预算用尽时，最近这么多秒内仍有新分片则继续等待
+LLM_BUDGET_MAX_FACTOR = 2     # 持续输出时最多延长到预算的倍数
+
 # 数据库和文件路径配置
 DB_PATH = './cache/OQQWall.db'
 OUTPUT_FILE_PATH_ERROR = "./cache/LM_error.json"
@@ -295,7 +372,7 @@ def rule_needpriv_vote(grouped_messages: list) -> tuple[Optional[bool], dict]:
                     "pattern": pat, 
                     "rank": idx
                 })
-                logging.debug(f"命中反向匿名信号 (rank {idx}): {pat} in '{text[:50]}...'")
+                logging.debug("命中反向匿名信号 (rank %s): %s in '%s...'", idx, pat, text[:50])
                 return False, evidence
         
         # 再检查正向信号
@@ -306,7 +383,7 @@ def rule_needpriv_vote(grouped_messages: list) -> tuple[Optional[bool], dict]:
                     "pattern": pat, 
                     "rank": idx
                 })
-                logging.debug(f"命中正向匿名信号 (rank {idx}): {pat} in '{text[:50]}...'")
+                logging.debug("命中正向匿名信号 (rank %s): %s in '%s...'", idx, pat, text[:50])
                 return True, evidence
     
     # 2) 弱规则：图片隐私线索（仅加权，不直接定案）
@@ -324,11 +401,11 @@ def rule_needpriv_vote(grouped_messages: list) -> tuple[Optional[bool], dict]:
                                     "pattern": pat
                                 })
                                 weak_bias += 1
-                                logging.debug(f"图片隐私信号: {pat} in '{desc[:50]}...'")
+                                logging.debug("图片隐私信号: %s in '%s...'", pat, desc[:50])
     
     # 记录弱偏向
     if weak_bias > 0:
-        logging.debug(f"发现 {weak_bias} 个图片隐私线索，倾向匿名但需LLM确认")
+        logging.debug("发现 %s 个图片隐私线索，倾向匿名但需LLM确认", weak_bias)
         return None, evidence  # 表示倾向匿名，但仍需 LLM 兜底
     
     # 无任何命中 => 交由 LLM 兜底
@@ -430,7 +507,7 @@ def llm_text_safety_check(text_content: str, config: dict) -> dict:
     prompt = TEXT_SAFETY_PROMPT_TEMPLATE.format(text_content=text_content)
     
     try:
-        response = fetch_response_simple(prompt, config)
+        response = fetch_response_simple(prompt, config, call_type='safety')
         if not response:
             logging.warning("文本安全检查未获得响应，默认为安全")
             return {"safe": True, "reason": "API无响应，默认安全", "severity": "low"}
@@ -458,15 +535,15 @@ def llm_text_safety_check(text_content: str, config: dict) -> dict:
             "severity": severity
         }
         
-        logging.info(f"文本安全检查结果: safe={safe}, reason='{reason[:100]}', severity={severity}")
+        logging.info("文本安全检查结果: safe=%s, reason='%s', severity=%s", safe, reason[:100], severity)
         return final_result
         
     except json.JSONDecodeError as e:
-        logging.error(f"文本安全检查JSON解析失败: {e}")
-        logging.error(f"原始响应: {response}")
+        logging.error("文本安全检查JSON解析失败: %s", e)
+        logging.error("原始响应: %s", response)
         return {"safe": True, "reason": "解析错误，默认安全", "severity": "low"}
     except Exception as e:
-        logging.error(f"文本安全检查异常: {e}")
+        logging.error("文本安全检查异常: %s", e)
         return {"safe": True, "reason": "检查异常，默认安全", "severity": "low"}
 
 
@@ -659,7 +736,7 @@ def llm_needpriv_fallback(text_content: str, config: dict) -> dict:
     prompt = LLM_PRIVACY_PROMPT_TEMPLATE.format(payload=text_content)
 
     try:
-        response = fetch_response_simple(prompt, config)
+        response = fetch_response_simple(prompt, config, call_type='privacy')
         if not response:
             return {"needpriv": "false", "reason": "no-response", "confidence": 0.4}
         
@@ -678,14 +755,14 @@ def llm_needpriv_fallback(text_content: str, config: dict) -> dict:
         if not isinstance(reason, str):
             result["reason"] = "llm-judgment"
         
-        logging.debug(f"LLM兜底判断: needpriv={result['needpriv']}, confidence={result['confidence']}, reason='{reason[:100]}'")
+        logging.debug("LLM兜底判断: needpriv=%s, confidence=%s, reason='%s'", result['needpriv'], result['confidence'], reason[:100])
         return result
         
     except json.JSONDecodeError as e:
-        logging.error(f"LLM兜底判断JSON解析失败: {e}")
+        logging.error("LLM兜底判断JSON解析失败: %s", e)
         return {"needpriv": "false", "reason": "parse-error", "confidence": 0.4}
     except Exception as e:
-        logging.error(f"LLM兜底判断异常: {e}")
+        logging.error("LLM兜底判断异常: %s", e)
         return {"needpriv": "false", "reason": "error", "confidence": 0.3}
 
 
@@ -696,7 +773,7 @@ ssl._create_default_https_context = ssl._create_unverified_context
 # 信号处理
 def signal_handler(signum, frame):
     """处理中断信号，确保优雅退出"""
-    logging.warning(f"收到信号 {signum}，正在优雅退出...")
+    logging.warning("收到信号 %s，正在优雅退出...", signum)
     sys.exit(0)
 
 signal.signal(signal.SIGINT, signal_handler)
@@ -714,10 +791,10 @@ def retry_on_exception(max_retries=MAX_RETRIES, delay=RETRY_DELAY, exceptions=(E
                 except exceptions as e:
                     last_exception = e
                     if attempt < max_retries:
-                        logging.warning(f"函数 {func.__name__} 第 {attempt + 1} 次尝试失败: {e}")
+                        logging.warning("函数 %s 第 %s 次尝试失败: %s", func.__name__, attempt + 1, e)
                         time.sleep(delay * (2 ** attempt))  # 指数退避
                     else:
-                        logging.error(f"函数 {func.__name__} 在 {max_retries + 1} 次尝试后仍然失败: {e}")
+                        logging.error("函数 %s 在 %s 次尝试后仍然失败: %s", func.__name__, max_retries + 1, e)
                         raise last_exception
             return None
         return wrapper
@@ -733,14 +810,14 @@ def safe_db_connection():
         conn.execute("PRAGMA journal_mode = WAL")
         yield conn
     except sqlite3.Error as e:
-        logging.error(f"数据库连接错误: {e}")
+        logging.error("数据库连接错误: %s", e)
         raise
     finally:
         if conn:
             try:
                 conn.close()
             except Exception as e:
-                logging.warning(f"关闭数据库连接时出错: {e}")
+                logging.warning("关闭数据库连接时出错: %s", e)
 
 @retry_on_exception(max_retries=2, exceptions=(FileNotFoundError, IOError))
 def read_config(file_path):
@@ -760,26 +837,26 @@ def read_config(file_path):
                         key, value = line.split('=', 1)
                         config[key.strip()] = value.strip().strip('"')
                     else:
-                        logging.warning(f"配置文件第 {line_num} 行格式错误: {line}")
+                        logging.warning("配置文件第 %s 行格式错误: %s", line_num, line)
                 except ValueError as e:
-                    logging.warning(f"配置文件第 {line_num} 行解析错误: {line}, 错误: {e}")
+                    logging.warning("配置文件第 %s 行解析错误: %s, 错误: %s", line_num, line, e)
         
         # 验证必要的配置项，并设置默认值
         if 'text_model' not in config:
             config['text_model'] = DEFAULT_TEXT_MODEL
-            logging.info(f"使用默认文本模型: {DEFAULT_TEXT_MODEL}")
+            logging.info("使用默认文本模型: %s", DEFAULT_TEXT_MODEL)
         if 'vision_model' not in config:
             config['vision_model'] = DEFAULT_VISION_MODEL
-            logging.info(f"使用默认视觉模型: {DEFAULT_VISION_MODEL}")
+            logging.info("使用默认视觉模型: %s", DEFAULT_VISION_MODEL)
         
         required_keys = ['apikey']
         missing_keys = [key for key in required_keys if key not in config]
         if missing_keys:
-            logging.error(f"配置文件缺少必要项: {missing_keys}")
+            logging.error("配置文件缺少必要项: %s", missing_keys)
         
         return config
     except Exception as e:
-        logging.error(f"读取配置文件失败: {e}")
+        logging.error("读取配置文件失败: %s", e)
         raise
 
 
@@ -793,6 +870,11 @@ def insert_missing_commas(json_like_string):
     return corrected_json
 
 
+def dump_afterlm(data):
+    """AfterLM 统一使用紧凑 JSON 存储（jq / json.loads 读取不受影响）"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
 def clean_json_output(output_content):
     # 清理和修正模型输出的JSON字符串
     try:
@@ -840,7 +922,9 @@ def _save_with_format(img: Image.Image, path: str, fmt_hint: str = None, quality
     - JPEG：使用质量/渐进式/子采样
     - WEBP：使用有损质量参数
     其他：按 PNG 处理
+    先写临时文件再替换：图片可能是从 NapCat 目录硬链接来的，原地写会改坏源文件
     """
+    tmp_path = path + ".tmp"
     ext = os.path.splitext(path)[1].lower()
     fmt = (fmt_hint or "").upper()
     if not fmt:
@@ -867,31 +951,33 @@ def _save_with_format(img: Image.Image, path: str, fmt_hint: str = None, quality
             progressive=True,
             subsampling="4:2:0",
         )
-        img.save(path, format="JPEG", **params)
+        img.save(tmp_path, format="JPEG", **params)
 
     elif fmt == "WEBP":
         # 有损 webp，若你不想有损可把 quality 去掉并设 lossless=True
         params = dict(quality=quality if quality is not None else 80, method=6)
-        img.save(path, format="WEBP", **params)
+        img.save(tmp_path, format="WEBP", **params)
 
     else:
         # PNG（无损）。注意：quality 对 PNG 无效
         # compress_level: 0(快,大)~9(慢,小)
-        img.save(path, format="PNG", optimize=True, compress_level=9)
+        img.save(tmp_path, format="PNG", optimize=True, compress_level=9)
+
+    os.replace(tmp_path, path)
 
 
 @retry_on_exception(max_retries=2, exceptions=(OSError, IOError))
 def compress_image(path, max_pixels, size_limit):
     """先尝试把 >8bit 图降到 8bit，再看体积是否达标；不达标再降分辨率到满足 size_limit（也会遵守 max_pixels）。"""
-    logging.info(f"开始处理图片: {path}")
+    logging.info("开始处理图片: %s", path)
     
     # 验证输入参数
     if not os.path.exists(path):
-        logging.error(f"图片文件不存在: {path}")
+        logging.error("图片文件不存在: %s", path)
         return
     
     if max_pixels <= 0 or size_limit <= 0:
-        logging.error(f"无效的参数: max_pixels={max_pixels}, size_limit={size_limit}")
+        logging.error("无效的参数: max_pixels=%s, size_limit=%s", max_pixels, size_limit)
         return
     
     try:
@@ -899,7 +985,7 @@ def compress_image(path, max_pixels, size_limit):
             fmt_hint = (img.format or "").upper()
             width, height = img.size
             pixels = width * height
-            logging.debug(f"图片尺寸: {width}x{height}, 总像素: {pixels}, 模式: {img.mode}, 格式: {fmt_hint or 'N/A'}")
+            logging.debug("图片尺寸: %sx%s, 总像素: %s, 模式: %s, 格式: %s", width, height, pixels, img.mode, fmt_hint or 'N/A')
 
             # === Step 1: 降位深到 8bit（若需要） ===
             if _is_high_bitdepth(img):
@@ -913,7 +999,7 @@ def compress_image(path, max_pixels, size_limit):
                     img = img.convert("RGB" if len(img.getbands()) >= 3 else "L")
                 _save_with_format(img, path, fmt_hint)
                 new_size = os.path.getsize(path)
-                logging.debug(f"位深降到 8bit 后大小: {new_size/1024/1024:.2f}MB")
+                logging.debug("位深降到 8bit 后大小: %.2fMB", new_size/1024/1024)
 
             # 读取最新文件/尺寸状态
             with Image.open(path) as img2:
@@ -931,18 +1017,18 @@ def compress_image(path, max_pixels, size_limit):
             if pixels > max_pixels:
                 ratio = (max_pixels / float(pixels)) ** 0.5
                 new_w, new_h = max(1, int(width * ratio)), max(1, int(height * ratio))
-                logging.debug(f"像素超过上限，调整至: {new_w}x{new_h}")
+                logging.debug("像素超过上限，调整至: %sx%s", new_w, new_h)
                 with Image.open(path) as img2:
                     img2 = img2.resize((new_w, new_h), Image.Resampling.LANCZOS)
                     _save_with_format(img2, path, fmt_hint, quality=85)
                 file_size = os.path.getsize(path)
                 width, height = new_w, new_h
                 pixels = width * height
-                logging.debug(f"像素降至上限后大小: {file_size/1024/1024:.2f}MB")
+                logging.debug("像素降至上限后大小: %.2fMB", file_size/1024/1024)
 
             # === Step 2b: 若仍超 size_limit，再按需降低分辨率（并结合格式化参数） ===
             if file_size > size_limit:
-                logging.debug(f"图片大小({file_size/1024/1024:.2f}MB)超过限制({size_limit/1024/1024:.2f}MB)，开始降分辨率/有损压缩…")
+                logging.debug("图片大小(%.2fMB)超过限制(%.2fMB)，开始降分辨率/有损压缩…", file_size/1024/1024, size_limit/1024/1024)
 
                 # 为了减少循环次数，按理论比例一次性给出初始缩放因子（再细调）
                 # （体积大约与像素数近似线性，先按 sqrt 比例缩）
@@ -959,14 +1045,14 @@ def compress_image(path, max_pixels, size_limit):
                             for q in (80, 75, 70, 65, 60, 55, 50, 45, 40, 35, 30):
                                 _save_with_format(img2, path, fmt_hint, quality=q)
                                 file_size = os.path.getsize(path)
-                                logging.info(f"压缩质量: {q}, 当前大小: {file_size/1024/1024:.2f}MB")
+                                logging.info("压缩质量: %s, 当前大小: %.2fMB", q, file_size/1024/1024)
                                 if file_size <= size_limit:
                                     break
                     else:
                         # PNG 路线（无损）：先按最大压缩保存
                         _save_with_format(img2, path, "PNG")
                         file_size = os.path.getsize(path)
-                        logging.debug(f"PNG 最大压缩后大小: {file_size/1024/1024:.2f}MB")
+                        logging.debug("PNG 最大压缩后大小: %.2fMB", file_size/1024/1024)
 
                         # 若仍然很大（截图/大色彩图常见），尝试调色板 256 色（仍是 PNG，但更小）
                         if file_size > size_limit:
@@ -974,7 +1060,7 @@ def compress_image(path, max_pixels, size_limit):
                             pal = img2.convert("P", palette=Image.ADAPTIVE, colors=256)
                             _save_with_format(pal, path, "PNG")
                             file_size = os.path.getsize(path)
-                            logging.debug(f"PNG 调色板后大小: {file_size/1024/1024:.2f}MB")
+                            logging.debug("PNG 调色板后大小: %.2fMB", file_size/1024/1024)
 
                         # 若还是超限，继续等比缩小，直到达标或边长到阈值
                         while file_size > size_limit and min(img2.size) > 512:
@@ -987,16 +1073,16 @@ def compress_image(path, max_pixels, size_limit):
                                 pal = img2.convert("P", palette=Image.ADAPTIVE, colors=256)
                                 _save_with_format(pal, path, "PNG")
                             file_size = os.path.getsize(path)
-                            logging.debug(f"继续降分辨率到 {nw}x{nh}，当前大小: {file_size/1024/1024:.2f}MB")
+                            logging.debug("继续降分辨率到 %sx%s，当前大小: %.2fMB", nw, nh, file_size/1024/1024)
 
         logging.info("图片压缩流程完成。")
     except UnidentifiedImageError:
-        logging.warning(f"跳过无法识别的图片文件: {path}")
+        logging.warning("跳过无法识别的图片文件: %s", path)
     except (OSError, IOError) as e:
-        logging.error(f"图片文件操作错误 {path}: {e}")
+        logging.error("图片文件操作错误 %s: %s", path, e)
         raise
     except Exception as e:
-        logging.error(f"处理图片 {path} 时发生意外错误: {e}", exc_info=True)
+        logging.error("处理图片 %s 时发生意外错误: %s", path, e, exc_info=True)
         raise
 
 
@@ -1004,11 +1090,11 @@ def compress_image(path, max_pixels, size_limit):
 @retry_on_exception(max_retries=2, exceptions=(Exception,))
 def process_image_safety_and_description(path, model, api_key):
     """使用DashScope同时进行图片安全检查和描述生成。"""
-    logging.info(f"处理图片安全检查和描述生成: {path}")
+    logging.info("处理图片安全检查和描述生成: %s", path)
     
     # 验证输入参数
     if not os.path.exists(path):
-        logging.error(f"图片文件不存在: {path}")
+        logging.error("图片文件不存在: %s", path)
         return True, ""  # 默认安全，无描述
     
     if not api_key or not model:
@@ -1024,10 +1110,10 @@ def process_image_safety_and_description(path, model, api_key):
     }]
     
     # Debug输出：显示发送给模型的输入
-    logging.debug(f"发送给视觉模型的输入:")
-    logging.debug(f"  模型: {model}")
-    logging.debug(f"  图片路径: {os.path.abspath(path)}")
-    logging.debug(f"  消息内容: {json.dumps(messages, ensure_ascii=False, indent=2)}")
+    logging.debug("发送给视觉模型的输入:")
+    logging.debug("  模型: %s", model)
+    logging.debug("  图片路径: %s", os.path.abspath(path))
+    logging.debug("  消息内容: %s", LazyJSON(messages, ensure_ascii=False, indent=2))
     
     try:
         response = MultiModalConversation.call(
@@ -1038,7 +1124,7 @@ def process_image_safety_and_description(path, model, api_key):
         )
         
         # Debug输出：显示API响应状态
-        logging.debug(f"视觉模型API响应状态码: {response.status_code}")
+        logging.debug("视觉模型API响应状态码: %s", response.status_code)
         
         if response.status_code == HTTPStatus.OK:
             content = response.output.choices[0].message.content
@@ -1046,8 +1132,8 @@ def process_image_safety_and_description(path, model, api_key):
                 content = " ".join(map(str, content))
             
             # Debug输出：显示模型返回的完整内容
-            logging.debug(f"视觉模型返回的完整内容:")
-            logging.debug(f"  {content}")
+            logging.debug("视觉模型返回的完整内容:")
+            logging.debug("  %s", content)
             
             # 解析响应内容
             is_safe = True
@@ -1056,7 +1142,7 @@ def process_image_safety_and_description(path, model, api_key):
             # 提取安全性信息
             if 'unsafe' in content.lower():
                 is_safe = False
-                logging.warning(f"图片被标记为不安全: {path}")
+                logging.warning("图片被标记为不安全: %s", path)
             
             # 提取描述信息
             description_start = content.find('描述：')
@@ -1070,48 +1156,48 @@ def process_image_safety_and_description(path, model, api_key):
                         description = line.strip()
                         break
             
-            logging.info(f"图片处理结果 - 安全: {is_safe}, 描述长度: {len(description)} 字符")
+            logging.info("图片处理结果 - 安全: %s, 描述长度: %s 字符", is_safe, len(description))
             return is_safe, description.strip()
             
         elif response.status_code == 400:
             # API返回400错误，通常表示图片内容过于敏感，被API拒绝处理
-            logging.warning(f"图片被API拒绝处理(400错误)，可能包含极度敏感内容: {path}")
-            logging.debug(f"API错误详情: {getattr(response, 'message', '未知错误')}")
+            logging.warning("图片被API拒绝处理(400错误)，可能包含极度敏感内容: %s", path)
+            logging.debug("API错误详情: %s", getattr(response, 'message', '未知错误'))
             return False, ""  # 标记为不安全，无描述
         elif response.status_code == 401:
-            logging.error(f"API密钥无效(401错误): {path}")
+            logging.error("API密钥无效(401错误): %s", path)
             return True, ""  # 默认安全，无描述
         elif response.status_code == 403:
-            logging.error(f"API权限不足或被封禁(403错误): {path}")
+            logging.error("API权限不足或被封禁(403错误): %s", path)
             return True, ""  # 默认安全，无描述
         elif response.status_code == 429:
-            logging.warning(f"API请求频率限制(429错误): {path}")
+            logging.warning("API请求频率限制(429错误): %s", path)
             return True, ""  # 默认安全，无描述
         elif response.status_code >= 500:
-            logging.error(f"API服务器错误({response.status_code}): {path}")
+            logging.error("API服务器错误(%s): %s", response.status_code, path)
             return True, ""  # 默认安全，无描述
         else:
-            logging.warning(f"图片处理返回未知状态码: {response.status_code}, 图片: {path}")
+            logging.warning("图片处理返回未知状态码: %s, 图片: %s", response.status_code, path)
             return True, ""  # 默认安全，无描述
             
     except Exception as e:
         error_msg = str(e).lower()
         if '400' in error_msg or 'bad request' in error_msg:
             # 捕获到400相关异常
-            logging.warning(f"捕获到400错误异常，图片可能包含极度敏感内容: {path}")
-            logging.debug(f"400错误异常详情: {str(e)}")
+            logging.warning("捕获到400错误异常，图片可能包含极度敏感内容: %s", path)
+            logging.debug("400错误异常详情: %s", str(e))
             return False, ""  # 标记为不安全，无描述
         elif 'ssl' in error_msg:
-            logging.warning(f"图片处理SSL错误: {path}, 错误: {str(e)}")
+            logging.warning("图片处理SSL错误: %s, 错误: %s", path, str(e))
             return True, ""  # 默认安全，无描述
         elif 'timeout' in error_msg or 'timed out' in error_msg:
-            logging.warning(f"图片处理超时: {path}")
+            logging.warning("图片处理超时: %s", path)
             return True, ""  # 默认安全，无描述
         elif 'connection' in error_msg or 'network' in error_msg:
-            logging.error(f"网络连接错误: {str(e)}")
+            logging.error("网络连接错误: %s", str(e))
             return True, ""  # 默认安全，无描述
         else:
-            logging.error(f"图片处理发生未知错误: {str(e)}, 错误类型: {type(e)}", exc_info=True)
+            logging.error("图片处理发生未知错误: %s, 错误类型: %s", str(e), type(e), exc_info=True)
             return True, ""  # 默认安全，无描述
 
 
@@ -1144,7 +1230,7 @@ def process_single_image_task(image_info):
         is_additional = image_info.get('is_additional', False)
         
         thread_id = threading.current_thread().ident
-        logging.info(f"[线程{thread_id}] 开始处理图片: {file_name}")
+        logging.info("[线程%s] 开始处理图片: %s", thread_id, file_name)
         
         # 步骤1: 压缩图片
         compress_image(image_path, max_pixels, size_limit)
@@ -1164,7 +1250,7 @@ def process_single_image_task(image_info):
             'error': None
         }
         
-        logging.info(f"[线程{thread_id}] 完成处理图片: {file_name}, 安全: {is_safe}, 描述长度: {len(description)}")
+        logging.info("[线程%s] 完成处理图片: %s, 安全: %s, 描述长度: %s", thread_id, file_name, is_safe, len(description))
         return result
         
     except Exception as e:
@@ -1182,27 +1268,63 @@ def process_single_image_task(image_info):
             'is_api_400': '400' in error_msg or 'bad request' in error_msg
         }
         
-        logging.error(f"[线程{result['thread_id']}] 处理图片 {result['file_name']} 时出错: {e}")
+        logging.error("[线程%s] 处理图片 %s 时出错: %s", result['thread_id'], result['file_name'], e)
         return result
 
 
+def load_afterlm_or_rawmsg(tag):
+    """读取tag对应的消息数据：优先 preprocess.AfterLM，为空时回退到 sender.rawmsg"""
+    with safe_db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            row = cur.execute('SELECT AfterLM FROM preprocess WHERE tag=?', (tag,)).fetchone()
+            if row and row[0] is not None:
+                logging.debug("从AfterLM字段获取消息数据")
+                return json.loads(row[0])
+
+            logging.debug("AfterLM字段为空，尝试从sender表获取原始消息数据")
+            sender_row = cur.execute('''
+                SELECT s.rawmsg 
+                FROM sender s 
+                JOIN preprocess p ON s.senderid = p.senderid AND s.receiver = p.receiver 
+                WHERE p.tag = ?
+            ''', (tag,)).fetchone()
+            if not sender_row or sender_row[0] is None:
+                logging.warning("未找到标签 %s 的原始消息数据", tag)
+                return None
+
+            logging.debug("从sender.rawmsg字段获取原始消息数据")
+            # 构造data结构以保持一致性
+            return {"messages": json.loads(sender_row[0])}
+        except json.JSONDecodeError as e:
+            logging.error("解析JSON数据失败: %s", e)
+            raise
+        except sqlite3.Error as e:
+            logging.error("数据库操作失败: %s", e)
+            raise
+
+
 @retry_on_exception(max_retries=3, exceptions=(sqlite3.Error, json.JSONDecodeError))
 def process_images_comprehensive(tag, config, input_data=None):
-    """对指定tag的所有图片进行压缩、安全检查、描述生成，并更新JSON数据。"""
+    """
+    对指定tag的所有图片进行压缩、安全检查、描述生成。
+    描述直接写入传入数据（msg['describe'] / data['additional_images']），不经数据库中转；
+    返回 {'safe', 'description_count', 'sensitive_files'}，无需处理时返回 None。
+    """
     if not tag or not config:
         logging.error("缺少必要参数: tag 或 config")
         return
     
     folder = os.path.join('cache/picture', str(tag))
-    logging.info(f"处理tag {tag}的图片综合处理（压缩、安全检查、描述生成）")
+    logging.info("处理tag %s的图片综合处理（压缩、安全检查、描述生成）", tag)
     
     if not os.path.isdir(folder):
-        logging.info(f"目录 {folder} 不存在，跳过图片处理")
+        logging.info("目录 %s 不存在，跳过图片处理", folder)
         return
     
     files = os.listdir(folder)
     if not files:
-        logging.info(f"目录 {folder} 为空，跳过图片处理")
+        logging.info("目录 %s 为空，跳过图片处理", folder)
         return
     
     # 验证配置参数
@@ -1215,379 +1337,350 @@ def process_images_comprehensive(tag, config, input_data=None):
         max_pixels = int(config.get('vision_pixel_limit', DEFAULT_MAX_PIXELS))
         size_limit = float(config.get('vision_size_limit_mb', DEFAULT_SIZE_LIMIT_MB)) * 1024 * 1024
     except (ValueError, TypeError) as e:
-        logging.error(f"配置参数解析错误: {e}")
+        logging.error("配置参数解析错误: %s", e)
         return
     
     model = config.get('vision_model', DEFAULT_VISION_MODEL)
     dashscope.api_key = api_key
 
-    # 读取当前数据库中的JSON数据
-    with safe_db_connection() as conn:
-        cur = conn.cursor()
-        try:
-            # 优先使用传入的input_data
-            if input_data is not None:
-                data = input_data
-                messages = data.get('messages', [])
-                logging.debug("使用传入的input_data")
-            else:
-                # 首先尝试从preprocess表的AfterLM字段获取数据
-                row = cur.execute('SELECT AfterLM FROM preprocess WHERE tag=?', (tag,)).fetchone()
-                if row and row[0] is not None:
-                    data = json.loads(row[0])
-                    messages = data.get('messages', [])
-                    logging.debug("从AfterLM字段获取消息数据")
-                else:
-                    # 如果AfterLM字段为空，从sender表的rawmsg字段获取原始数据
-                    logging.debug("AfterLM字段为空，尝试从sender表获取原始消息数据")
-                    sender_row = cur.execute('''
-                        SELECT s.rawmsg 
-                        FROM sender s 
-                        JOIN preprocess p ON s.senderid = p.senderid AND s.receiver = p.receiver 
-                        WHERE p.tag = ?
-                    ''', (tag,)).fetchone()
+    # 读取待处理的消息数据：主流程直接传入 input_data，仅独立调用时才查询数据库
+    if input_data is not None:
+        data = input_data
+        logging.debug("使用传入的input_data")
+    else:
+        data = load_afterlm_or_rawmsg(tag)
+        if data is None:
+            return None
+    messages = data.get('messages', [])
+
+    # 为了图片处理，我们需要访问完整的data字段，所以使用原始数据
+    # 而不是经过make_lm_sanitized_and_original处理的数据
+    
+    # 统计信息
+    processed_count = 0
+    error_count = 0
+    description_count = 0
+    api_400_count = 0
+    sensitive_files = []
+    safe = True
+    
+    # 遍历所有消息，找到图片类型的消息
+    image_count = 0
+    processed_files = set()  # 记录已处理的文件
+    
+    # 首先收集所有需要处理的常规图片任务
+    regular_image_tasks = []
+    for item in messages:
+        if 'message' in item and isinstance(item['message'], list):
+            for msg in item['message']:
+                if msg.get('type') == 'image':
+                    # 检查sub_type，只处理sub_type为0的图片
+                    sub_type = msg.get('data', {}).get('sub_type', 0)
+                    if sub_type != 0:
+                        logging.debug("跳过处理sub_type=%s的图片，只处理sub_type=0的图片", sub_type)
+                        continue
                     
-                    if not sender_row or sender_row[0] is None:
-                        logging.warning(f"未找到标签 {tag} 的原始消息数据")
-                        return
+                    image_count += 1
+                    # 查找对应的图片文件
+                    file_name = None
                     
-                    raw_messages = json.loads(sender_row[0])
-                    # 构造data结构以保持一致性
-                    data = {"messages": raw_messages}
-                    messages = raw_messages
-                    logging.debug("从sender.rawmsg字段获取原始消息数据")
-            
-            # 为了图片处理，我们需要访问完整的data字段，所以使用原始数据
-            # 而不是经过make_lm_sanitized_and_original处理的数据
-            
-            # 统计信息
-            processed_count = 0
-            error_count = 0
-            description_count = 0
-            api_400_count = 0
-            sensitive_files = []
-            safe = True
-            
-            # 遍历所有消息，找到图片类型的消息
-            image_count = 0
-            processed_files = set()  # 记录已处理的文件
-            
-            # 首先收集所有需要处理的常规图片任务
-            regular_image_tasks = []
-            for item in messages:
-                if 'message' in item and isinstance(item['message'], list):
-                    for msg in item['message']:
-                        if msg.get('type') == 'image':
-                            # 检查sub_type，只处理sub_type为0的图片
-                            sub_type = msg.get('data', {}).get('sub_type', 0)
-                            if sub_type != 0:
-                                logging.debug(f"跳过处理sub_type={sub_type}的图片，只处理sub_type=0的图片")
-                                continue
-                            
-                            image_count += 1
-                            # 查找对应的图片文件
-                            file_name = None
-                            
-                            # 方法1: 尝试从data字段获取文件名
-                            if 'data' in msg and 'url' in msg['data']:
-                                # 优先使用URL字段，因为它包含实际的文件路径
-                                url = msg['data']['url']
-                                logging.debug(f"从data.url获取URL: {url}")
-                                if url.startswith('file://'):
-                                    file_name = os.path.basename(url[7:])  # 去掉file://前缀
-                                    logging.debug(f"从URL提取文件名: {file_name}")
-                            elif 'data' in msg and 'file' in msg['data']:
-                                file_name = os.path.basename(msg['data']['file'])
-                                logging.debug(f"从data.file获取文件名: {file_name}")
-                            elif 'file' in msg:
-                                file_name = os.path.basename(msg['file'])
-                                logging.debug(f"从msg.file获取文件名: {file_name}")
-                            
-                            # 方法2: 如果找不到文件名，尝试按tag-index.png格式匹配
-                            if not file_name:
-                                # 查找匹配的图片文件
-                                for f in files:
-                                    if f.startswith(f"{tag}-{image_count}.") and f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
-                                        file_name = f
-                                        break
-                            
-                            # 方法3: 如果仍然找不到，尝试匹配任何图片文件
-                            if not file_name and len(files) == 1:
-                                # 如果只有一个文件，直接使用它
-                                file_name = files[0]
-                                logging.info(f"只有一个图片文件，直接使用: {file_name}")
-                            elif not file_name:
-                                # 如果有多个文件，尝试按顺序匹配
-                                for f in files:
-                                    if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
-                                        file_name = f
-                                        logging.info(f"按顺序匹配到图片文件: {file_name}")
-                                        break
-                            
-                            if file_name and file_name in files:
-                                processed_files.add(file_name)
-                                image_path = os.path.join(folder, file_name)
-                                
-                                # 添加到任务列表
-                                task_info = {
-                                    'image_path': image_path,
-                                    'file_name': file_name,
-                                    'model': model,
-                                    'api_key': api_key,
-                                    'max_pixels': max_pixels,
-                                    'size_limit': size_limit,
-                                    'msg': msg,
-                                    'is_additional': False
-                                }
-                                regular_image_tasks.append(task_info)
-                            else:
-                                logging.warning(f"未找到图片文件，image_count={image_count}, 可用文件: {files}")
-                                logging.debug(f"图片消息结构: {json.dumps(msg, ensure_ascii=False)}")
+                    # 方法1: 尝试从data字段获取文件名
+                    if 'data' in msg and 'url' in msg['data']:
+                        # 优先使用URL字段，因为它包含实际的文件路径
+                        url = msg['data']['url']
+                        logging.debug("从data.url获取URL: %s", url)
+                        if url.startswith('file://'):
+                            file_name = os.path.basename(url[7:])  # 去掉file://前缀
+                            logging.debug("从URL提取文件名: %s", file_name)
+                    elif 'data' in msg and 'file' in msg['data']:
+                        file_name = os.path.basename(msg['data']['file'])
+                        logging.debug("从data.file获取文件名: %s", file_name)
+                    elif 'file' in msg:
+                        file_name = os.path.basename(msg['file'])
+                        logging.debug("从msg.file获取文件名: %s", file_name)
+                    
+                    # 方法2: 如果找不到文件名，尝试按tag-index.png格式匹配
+                    if not file_name:
+                        # 查找匹配的图片文件
+                        for f in files:
+                            if f.startswith(f"{tag}-{image_count}.") and f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
+                                file_name = f
+                                break
+                    
+                    # 方法3: 如果仍然找不到，尝试匹配任何图片文件
+                    if not file_name and len(files) == 1:
+                        # 如果只有一个文件，直接使用它
+                        file_name = files[0]
+                        logging.info("只有一个图片文件，直接使用: %s", file_name)
+                    elif not file_name:
+                        # 如果有多个文件，尝试按顺序匹配
+                        for f in files:
+                            if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
+                                file_name = f
+                                logging.info("按顺序匹配到图片文件: %s", file_name)
+                                break
+                    
+                    if file_name and file_name in files:
+                        processed_files.add(file_name)
+                        image_path = os.path.join(folder, file_name)
+                        
+                        # 添加到任务列表
+                        task_info = {
+                            'image_path': image_path,
+                            'file_name': file_name,
+                            'model': model,
+                            'api_key': api_key,
+                            'max_pixels': max_pixels,
+                            'size_limit': size_limit,
+                            'msg': msg,
+                            'is_additional': False
+                        }
+                        regular_image_tasks.append(task_info)
+                    else:
+                        logging.warning("未找到图片文件，image_count=%s, 可用文件: %s", image_count, files)
+                        logging.debug("图片消息结构: %s", LazyJSON(msg, ensure_ascii=False))
+    
+    # 并行处理常规图片任务
+    if regular_image_tasks:
+        logging.info("开始并行处理 %s 个常规图片消息", len(regular_image_tasks))
+        max_workers = min(len(regular_image_tasks), 3)  # 限制最大并发数
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 提交所有任务
+            future_to_task = {executor.submit(process_single_image_task, task): task for task in regular_image_tasks}
             
-            # 并行处理常规图片任务
-            if regular_image_tasks:
-                logging.info(f"开始并行处理 {len(regular_image_tasks)} 个常规图片消息")
-                max_workers = min(len(regular_image_tasks), 3)  # 限制最大并发数
-                
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    # 提交所有任务
-                    future_to_task = {executor.submit(process_single_image_task, task): task for task in regular_image_tasks}
+            # 收集结果
+            for future in as_completed(future_to_task):
+                task = future_to_task[future]
+                try:
+                    result = future.result()
+                    file_name = result['file_name']
+                    msg = result['msg']
                     
-                    # 收集结果
-                    for future in as_completed(future_to_task):
-                        task = future_to_task[future]
-                        try:
-                            result = future.result()
-                            file_name = result['file_name']
-                            msg = result['msg']
-                            
-                            if result['success']:
-                                # 处理成功
-                                if not result['is_safe']:
-                                    logging.warning(f"图片 {file_name} 被标记为不安全")
-                                    safe = False
-                                    sensitive_files.append(file_name)
-                                
-                                if result['description']:
-                                    # 将描述添加到消息的顶层，这样大模型可以看到
-                                    msg['describe'] = result['description']
-                                    description_count += 1
-                                    logging.debug(f"[线程{result['thread_id']}] 成功为图片 {file_name} 添加描述")
-                                else:
-                                    logging.warning(f"图片 {file_name} 描述生成失败")
-                                    error_count += 1
-                                
-                                processed_count += 1
-                                
-                            else:
-                                # 处理失败
-                                if result.get('is_api_400', False):
-                                    logging.error(f"图片 {file_name} 触发API 400错误，可能包含极度敏感内容: {result['error']}")
-                                    safe = False
-                                    sensitive_files.append(file_name)
-                                    api_400_count += 1
-                                else:
-                                    logging.error(f"处理图片 {file_name} 时出错: {result['error']}")
-                                    error_count += 1
-                                
-                        except Exception as e:
-                            logging.error(f"获取常规图片任务结果时出错: {task['file_name']}, 错误: {e}")
+                    if result['success']:
+                        # 处理成功
+                        if not result['is_safe']:
+                            logging.warning("图片 %s 被标记为不安全", file_name)
+                            safe = False
+                            sensitive_files.append(file_name)
+                        
+                        if result['description']:
+                            # 将描述添加到消息的顶层，这样大模型可以看到
+                            msg['describe'] = result['description']
+                            description_count += 1
+                            logging.debug("[线程%s] 成功为图片 %s 添加描述", result['thread_id'], file_name)
+                        else:
+                            logging.warning("图片 %s 描述生成失败", file_name)
                             error_count += 1
-                
-                logging.info(f"常规图片并行处理完成，总计 {len(regular_image_tasks)} 个文件")
-            
-            # 处理剩余的图片文件（没有对应消息记录的，比如forward聊天记录中的图片）
-            remaining_files = [f for f in files if f not in processed_files and f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'))]
+                        
+                        processed_count += 1
+                        
+                    else:
+                        # 处理失败
+                        if result.get('is_api_400', False):
+                            logging.error("图片 %s 触发API 400错误，可能包含极度敏感内容: %s", file_name, result['error'])
+                            safe = False
+                            sensitive_files.append(file_name)
+                            api_400_count += 1
+                        else:
+                            logging.error("处理图片 %s 时出错: %s", file_name, result['error'])
+                            error_count += 1
+                        
+                except Exception as e:
+                    logging.error("获取常规图片任务结果时出错: %s, 错误: %s", task['file_name'], e)
+                    error_count += 1
+        
+        logging.info("常规图片并行处理完成，总计 %s 个文件", len(regular_image_tasks))
+    
+    # 处理剩余的图片文件（没有对应消息记录的，比如forward聊天记录中的图片）
+    remaining_files = [f for f in files if f not in processed_files and f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'))]
+    
+    # 收集forward聊天记录中sub_type=0的图片文件名 - 需要递归处理嵌套forward
+    def collect_subtype_0_images(item_list, depth=0):
+        subtype_0_files = set()
+        logging.debug("递归深度 %s: 处理 %s 个项目", depth, len(item_list))
+        
+        for i, item in enumerate(item_list):
+            logging.debug("递归深度 %s: 处理项目 %s, 类型: %s, 键: %s", depth, i, type(item), list(item.keys()) if isinstance(item, dict) else 'N/A')
             
-            # 收集forward聊天记录中sub_type=0的图片文件名 - 需要递归处理嵌套forward
-            def collect_subtype_0_images(item_list, depth=0):
-                subtype_0_files = set()
-                logging.debug(f"递归深度 {depth}: 处理 {len(item_list)} 个项目")
-                
-                for i, item in enumerate(item_list):
-                    logging.debug(f"递归深度 {depth}: 处理项目 {i}, 类型: {type(item)}, 键: {list(item.keys()) if isinstance(item, dict) else 'N/A'}")
-                    
-                    # 如果item有message字段，处理其中的消息
-                    if 'message' in item and isinstance(item['message'], list):
-                        logging.debug(f"递归深度 {depth}: 项目 {i} 有 {len(item['message'])} 个消息")
-                        for j, msg in enumerate(item['message']):
-                            msg_type = msg.get('type')
-                            logging.debug(f"递归深度 {depth}: 消息 {j} 类型: {msg_type}")
-                            if msg_type == 'forward' and 'data' in msg:
-                                logging.debug(f"递归深度 {depth}: 处理forward消息")
-                                data_keys = list(msg['data'].keys())
-                                logging.debug(f"递归深度 {depth}: forward data键: {data_keys}")
-                                # 处理forward消息的content或messages字段
-                                if 'content' in msg['data'] and isinstance(msg['data']['content'], list):
-                                    logging.debug(f"递归深度 {depth}: 找到forward消息content，{len(msg['data']['content'])} 个内容项")
-                                    sub_files = collect_subtype_0_images(msg['data']['content'], depth + 1)
-                                    subtype_0_files.update(sub_files)
-                                elif 'messages' in msg['data'] and isinstance(msg['data']['messages'], list):
-                                    logging.debug(f"递归深度 {depth}: 找到forward消息messages，{len(msg['data']['messages'])} 个消息项")
-                                    sub_files = collect_subtype_0_images(msg['data']['messages'], depth + 1)
-                                    subtype_0_files.update(sub_files)
-                                else:
-                                    logging.debug(f"递归深度 {depth}: forward消息没有有效的content或messages字段")
-                            elif msg_type == 'image':
-                                logging.debug(f"递归深度 {depth}: 处理image消息")
-                                sub_type = msg.get('data', {}).get('sub_type')
-                                logging.debug(f"递归深度 {depth}: 找到image消息，sub_type={sub_type}")
-                                if sub_type == 0:
-                                    logging.debug(f"递归深度 {depth}: 找到sub_type=0图片消息")
-                                    # 直接使用URL中的文件名进行精确匹配
-                                    url = msg.get('data', {}).get('url', '')
-                                    if url.startswith('file://'):
-                                        cache_file_name = os.path.basename(url[7:])  # 去掉file://前缀
-                                        logging.debug(f"从URL提取文件名: {cache_file_name}, remaining_files包含: {cache_file_name in remaining_files}")
-                                        if cache_file_name in remaining_files:
-                                            subtype_0_files.add(cache_file_name)
-                                            logging.debug(f"找到sub_type=0的图片: {cache_file_name}")
-                                        else:
-                                            logging.debug(f"sub_type=0图片文件不存在: {cache_file_name}")
-                                    else:
-                                        logging.debug(f"URL格式不正确: {url}")
+            # 如果item有message字段，处理其中的消息
+            if 'message' in item and isinstance(item['message'], list):
+                logging.debug("递归深度 %s: 项目 %s 有 %s 个消息", depth, i, len(item['message']))
+                for j, msg in enumerate(item['message']):
+                    msg_type = msg.get('type')
+                    logging.debug("递归深度 %s: 消息 %s 类型: %s", depth, j, msg_type)
+                    if msg_type == 'forward' and 'data' in msg:
+                        logging.debug("递归深度 %s: 处理forward消息", depth)
+                        data_keys = list(msg['data'].keys())
+                        logging.debug("递归深度 %s: forward data键: %s", depth, data_keys)
+                        # 处理forward消息的content或messages字段
+                        if 'content' in msg['data'] and isinstance(msg['data']['content'], list):
+                            logging.debug("递归深度 %s: 找到forward消息content，%s 个内容项", depth, len(msg['data']['content']))
+                            sub_files = collect_subtype_0_images(msg['data']['content'], depth + 1)
+                            subtype_0_files.update(sub_files)
+                        elif 'messages' in msg['data'] and isinstance(msg['data']['messages'], list):
+                            logging.debug("递归深度 %s: 找到forward消息messages，%s 个消息项", depth, len(msg['data']['messages']))
+                            sub_files = collect_subtype_0_images(msg['data']['messages'], depth + 1)
+                            subtype_0_files.update(sub_files)
+                        else:
+                            logging.debug("递归深度 %s: forward消息没有有效的content或messages字段", depth)
+                    elif msg_type == 'image':
+                        logging.debug("递归深度 %s: 处理image消息", depth)
+                        sub_type = msg.get('data', {}).get('sub_type')
+                        logging.debug("递归深度 %s: 找到image消息，sub_type=%s", depth, sub_type)
+                        if sub_type == 0:
+                            logging.debug("递归深度 %s: 找到sub_type=0图片消息", depth)
+                            # 直接使用URL中的文件名进行精确匹配
+                            url = msg.get('data', {}).get('url', '')
+                            if url.startswith('file://'):
+                                cache_file_name = os.path.basename(url[7:])  # 去掉file://前缀
+                                logging.debug("从URL提取文件名: %s, remaining_files包含: %s", cache_file_name, cache_file_name in remaining_files)
+                                if cache_file_name in remaining_files:
+                                    subtype_0_files.add(cache_file_name)
+                                    logging.debug("找到sub_type=0的图片: %s", cache_file_name)
                                 else:
-                                    logging.debug(f"递归深度 {depth}: 跳过sub_type={sub_type}的图片")
-                            else:
-                                logging.debug(f"递归深度 {depth}: 跳过消息类型: {msg_type}")
-                    
-                    # 如果item是原始forward messages格式（包含所有元数据的消息项）
-                    elif 'message' in item and isinstance(item['message'], list):
-                        # 这个条件重复了，移除
-                        pass
-                    
-                    # 如果item本身就是消息格式（content数组中的直接消息项）
-                    elif item.get('type') == 'image' and item.get('data', {}).get('sub_type') == 0:
-                        logging.debug(f"递归深度 {depth}: 项目 {i} 是sub_type=0图片")
-                        url = item.get('data', {}).get('url', '')
-                        if url.startswith('file://'):
-                            cache_file_name = os.path.basename(url[7:])  # 去掉file://前缀
-                            if cache_file_name in remaining_files:
-                                subtype_0_files.add(cache_file_name)
-                                logging.debug(f"找到sub_type=0的图片: {cache_file_name}")
+                                    logging.debug("sub_type=0图片文件不存在: %s", cache_file_name)
                             else:
-                                logging.debug(f"sub_type=0图片文件不存在: {cache_file_name}")
-                
-                logging.debug(f"递归深度 {depth}: 找到 {len(subtype_0_files)} 个sub_type=0图片: {subtype_0_files}")
-                return subtype_0_files
-            
-            subtype_0_files = collect_subtype_0_images(messages)
+                                logging.debug("URL格式不正确: %s", url)
+                        else:
+                            logging.debug("递归深度 %s: 跳过sub_type=%s的图片", depth, sub_type)
+                    else:
+                        logging.debug("递归深度 %s: 跳过消息类型: %s", depth, msg_type)
             
-            # 只处理sub_type=0的图片文件
-            files_to_process = [f for f in remaining_files if f in subtype_0_files]
+            # 如果item是原始forward messages格式（包含所有元数据的消息项）
+            elif 'message' in item and isinstance(item['message'], list):
+                # 这个条件重复了，移除
+                pass
             
-            if remaining_files:
-                logging.info(f"发现 {len(remaining_files)} 个没有对应消息记录的图片文件")
-                logging.info(f"其中 {len(files_to_process)} 个是sub_type=0的图片，需要进行安全检查: {files_to_process}")
-                logging.info(f"跳过 {len(remaining_files) - len(files_to_process)} 个非sub_type=0的图片")
+            # 如果item本身就是消息格式（content数组中的直接消息项）
+            elif item.get('type') == 'image' and item.get('data', {}).get('sub_type') == 0:
+                logging.debug("递归深度 %s: 项目 %s 是sub_type=0图片", depth, i)
+                url = item.get('data', {}).get('url', '')
+                if url.startswith('file://'):
+                    cache_file_name = os.path.basename(url[7:])  # 去掉file://前缀
+                    if cache_file_name in remaining_files:
+                        subtype_0_files.add(cache_file_name)
+                        logging.debug("找到sub_type=0的图片: %s", cache_file_name)
+                    else:
+                        logging.debug("sub_type=0图片文件不存在: %s", cache_file_name)
+        
+        logging.debug("递归深度 %s: 找到 %s 个sub_type=0图片: %s", depth, len(subtype_0_files), subtype_0_files)
+        return subtype_0_files
+    
+    subtype_0_files = collect_subtype_0_images(messages)
+    
+    # 只处理sub_type=0的图片文件
+    files_to_process = [f for f in remaining_files if f in subtype_0_files]
+    
+    if remaining_files:
+        logging.info("发现 %s 个没有对应消息记录的图片文件", len(remaining_files))
+        logging.info("其中 %s 个是sub_type=0的图片，需要进行安全检查: %s", len(files_to_process), files_to_process)
+        logging.info("跳过 %s 个非sub_type=0的图片", len(remaining_files) - len(files_to_process))
+    
+    if files_to_process:
+        # 并行处理剩余图片文件
+        logging.info("开始并行处理 %s 个图片文件", len(files_to_process))
+        
+        # 准备并行任务
+        image_tasks = []
+        for file_name in files_to_process:
+            image_path = os.path.join(folder, file_name)
+            task_info = {
+                'image_path': image_path,
+                'file_name': file_name,
+                'model': model,
+                'api_key': api_key,
+                'max_pixels': max_pixels,
+                'size_limit': size_limit,
+                'msg': None,
+                'is_additional': True
+            }
+            image_tasks.append(task_info)
+        
+        # 使用线程池并行处理
+        max_workers = min(len(files_to_process), 3)  # 限制最大并发数为3，避免API频率限制
+        logging.info("使用 %s 个线程并行处理图片", max_workers)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 提交所有任务
+            future_to_task = {executor.submit(process_single_image_task, task): task for task in image_tasks}
             
-            if files_to_process:
-                # 并行处理剩余图片文件
-                logging.info(f"开始并行处理 {len(files_to_process)} 个图片文件")
-                
-                # 准备并行任务
-                image_tasks = []
-                for file_name in files_to_process:
-                    image_path = os.path.join(folder, file_name)
-                    task_info = {
-                        'image_path': image_path,
-                        'file_name': file_name,
-                        'model': model,
-                        'api_key': api_key,
-                        'max_pixels': max_pixels,
-                        'size_limit': size_limit,
-                        'msg': None,
-                        'is_additional': True
-                    }
-                    image_tasks.append(task_info)
-                
-                # 使用线程池并行处理
-                max_workers = min(len(files_to_process), 3)  # 限制最大并发数为3，避免API频率限制
-                logging.info(f"使用 {max_workers} 个线程并行处理图片")
-                
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    # 提交所有任务
-                    future_to_task = {executor.submit(process_single_image_task, task): task for task in image_tasks}
+            # 收集结果
+            for future in as_completed(future_to_task):
+                task = future_to_task[future]
+                try:
+                    result = future.result()
+                    file_name = result['file_name']
                     
-                    # 收集结果
-                    for future in as_completed(future_to_task):
-                        task = future_to_task[future]
-                        try:
-                            result = future.result()
-                            file_name = result['file_name']
+                    if result['success']:
+                        # 处理成功
+                        if not result['is_safe']:
+                            logging.warning("图片 %s 被标记为不安全", file_name)
+                            safe = False
+                            sensitive_files.append(file_name)
+                        
+                        if result['description']:
+                            logging.info("[线程%s] 为图片 %s 生成了描述: %s...", result['thread_id'], file_name, result['description'][:100])
+                            description_count += 1
                             
-                            if result['success']:
-                                # 处理成功
-                                if not result['is_safe']:
-                                    logging.warning(f"图片 {file_name} 被标记为不安全")
-                                    safe = False
-                                    sensitive_files.append(file_name)
-                                
-                                if result['description']:
-                                    logging.info(f"[线程{result['thread_id']}] 为图片 {file_name} 生成了描述: {result['description'][:100]}...")
-                                    description_count += 1
-                                    
-                                    # 添加到additional_images
-                                    if 'additional_images' not in data:
-                                        data['additional_images'] = []
-                                    data['additional_images'].append({
-                                        'file': file_name,
-                                        'description': result['description'],
-                                        'source': 'forward_content'
-                                    })
-                                
-                                processed_count += 1
-                                
-                            else:
-                                # 处理失败
-                                if result.get('is_api_400', False):
-                                    logging.error(f"图片 {file_name} 触发API 400错误，可能包含极度敏感内容: {result['error']}")
-                                    safe = False
-                                    sensitive_files.append(file_name)
-                                    api_400_count += 1
-                                else:
-                                    logging.error(f"处理图片 {file_name} 时出错: {result['error']}")
-                                    error_count += 1
-                                
-                        except Exception as e:
-                            logging.error(f"获取并行任务结果时出错: {task['file_name']}, 错误: {e}")
+                            # 添加到additional_images
+                            if 'additional_images' not in data:
+                                data['additional_images'] = []
+                            data['additional_images'].append({
+                                'file': file_name,
+                                'description': result['description'],
+                                'source': 'forward_content'
+                            })
+                        
+                        processed_count += 1
+                        
+                    else:
+                        # 处理失败
+                        if result.get('is_api_400', False):
+                            logging.error("图片 %s 触发API 400错误，可能包含极度敏感内容: %s", file_name, result['error'])
+                            safe = False
+                            sensitive_files.append(file_name)
+                            api_400_count += 1
+                        else:
+                            logging.error("处理图片 %s 时出错: %s", file_name, result['error'])
                             error_count += 1
-                
-                logging.info(f"并行图片处理完成，总计 {len(files_to_process)} 个文件")
-            
-            # 更新数据库
-            if description_count > 0 or not safe:
-                # 更新safemsg字段
-                if not safe:
-                    data['safemsg'] = 'false'
-                
-                updated_data = json.dumps(data, ensure_ascii=False, indent=4)
-                cur.execute('UPDATE preprocess SET AfterLM=? WHERE tag=?', (updated_data, tag))
-                conn.commit()
-                logging.info(f"成功更新数据库，添加了 {description_count} 个图片描述，安全状态: {'不安全' if not safe else '安全'}")
-            
-            # 详细的统计信息
-            logging.info(f"图片综合处理完成:")
-            logging.info(f"  - 总图片文件数: {len(files)}")
-            logging.info(f"  - 处理的图片消息: {processed_count} 个")
-            logging.info(f"  - 成功生成描述: {description_count} 个")
-            logging.info(f"  - 处理错误: {error_count} 个")
-            logging.info(f"  - API 400错误: {api_400_count} 个")
-            logging.info(f"  - 敏感文件: {len(sensitive_files)} 个")
-            if sensitive_files:
-                logging.warning(f"  - 敏感文件列表: {sensitive_files}")
-            logging.info(f"  - 最终安全结果: {'安全' if safe else '不安全'}")
-            
-            # 如果有API 400错误，记录特殊标记
-            if api_400_count > 0:
-                logging.warning(f"标签 {tag} 包含 {api_400_count} 个可能极度敏感的文件，已被标记为不安全")
-            
-        except json.JSONDecodeError as e:
-            logging.error(f"解析JSON数据失败: {e}")
-            raise
-        except sqlite3.Error as e:
-            logging.error(f"数据库操作失败: {e}")
-            raise
+                        
+                except Exception as e:
+                    logging.error("获取并行任务结果时出错: %s, 错误: %s", task['file_name'], e)
+                    error_count += 1
+        
+        logging.info("并行图片处理完成，总计 %s 个文件", len(files_to_process))
+    
+    # 结果只保留在内存中（msg['describe'] / data['additional_images']），由主流程一次性写库
+    if not safe:
+        data['safemsg'] = 'false'
+    if input_data is None and (description_count > 0 or not safe):
+        # 独立调用（无主流程接手）时才回写数据库
+        save_to_sqlite(dump_afterlm(data), tag)
+    logging.info("图片处理完成，添加了 %s 个图片描述，安全状态: %s", description_count, '不安全' if not safe else '安全')
+
+    # 详细的统计信息
+    logging.info("图片综合处理完成:")
+    logging.info("  - 总图片文件数: %s", len(files))
+    logging.info("  - 处理的图片消息: %s 个", processed_count)
+    logging.info("  - 成功生成描述: %s 个", description_count)
+    logging.info("  - 处理错误: %s 个", error_count)
+    logging.info("  - API 400错误: %s 个", api_400_count)
+    logging.info("  - 敏感文件: %s 个", len(sensitive_files))
+    if sensitive_files:
+        logging.warning("  - 敏感文件列表: %s", sensitive_files)
+    logging.info("  - 最终安全结果: %s", '安全' if safe else '不安全')
+    
+    # 如果有API 400错误，记录特殊标记
+    if api_400_count > 0:
+        logging.warning("标签 %s 包含 %s 个可能极度敏感的文件，已被标记为不安全", tag, api_400_count)
+    
+    return {
+        'safe': safe,
+        'description_count': description_count,
+        'sensitive_files': sensitive_files,
+    }
+
 
 ############################################
 #      Flexible per-type redact & restore  #
@@ -1746,7 +1839,7 @@ def clean_forward_content(content_list):
             cleaned_content.append(cleaned_item)
         elif cleaned_item and "message" in cleaned_item:
             # 如果message字段存在但为空，记录警告
-            logging.warning(f"发现空的message字段: {cleaned_item}")
+            logging.warning("发现空的message字段: %s", cleaned_item)
     
     return cleaned_content
 
@@ -1760,7 +1853,7 @@ def make_lm_sanitized_and_original(data_root):
     """
     origin_messages = copy.deepcopy(data_root.get("messages", []))
     lm_messages = copy.deepcopy(origin_messages)
-    logging.debug(f"make_lm_sanitized_and_original: 原始消息数量: {len(origin_messages)}")
+    logging.debug("make_lm_sanitized_and_original: 原始消息数量: %s", len(origin_messages))
 
     # 事件级字段（对LM删除 remove_event + hide_from_LM_only）
     for item in lm_messages:
@@ -1782,7 +1875,7 @@ def make_lm_sanitized_and_original(data_root):
 
                 # 对json类型消息进行特殊处理：提取title字段
                 if mtype == "json":
-                    logging.debug(f"处理json类型消息: {json.dumps(msg, ensure_ascii=False)[:200]}...")
+                    logging.debug("处理json类型消息: %s...", LazyJSON(msg, ensure_ascii=False, limit=200))
                     if "data" in msg:
                         try:
                             json_data = msg["data"].get("data", "")
@@ -1801,14 +1894,14 @@ def make_lm_sanitized_and_original(data_root):
                                     # 替换原有的data字段为title字段
                                     msg["title"] = title
                                     msg.pop("data", None)
-                                    logging.debug(f"提取json消息title: {title}")
+                                    logging.debug("提取json消息title: %s", title)
                                 else:
                                     # 如果没有从meta中提取到title，尝试使用prompt字段
                                     prompt = msg["data"].get("prompt", "")
                                     if prompt:
                                         msg["title"] = prompt
                                         msg.pop("data", None)
-                                        logging.debug(f"提取json消息prompt: {prompt}")
+                                        logging.debug("提取json消息prompt: %s", prompt)
                                     else:
                                         msg["title"] = "[分享内容]"
                                         msg.pop("data", None)
@@ -1823,7 +1916,7 @@ def make_lm_sanitized_and_original(data_root):
                                     msg["title"] = "[分享内容]"
                                     msg.pop("data", None)
                         except (json.JSONDecodeError, KeyError, TypeError) as e:
-                            logging.warning(f"解析json消息失败: {e}")
+                            logging.warning("解析json消息失败: %s", e)
                             # 如果解析失败，尝试使用prompt字段作为备选
                             prompt = msg["data"].get("prompt", "")
                             if prompt:
@@ -1833,7 +1926,7 @@ def make_lm_sanitized_and_original(data_root):
                                 msg["title"] = "[分享内容]"
                                 msg.pop("data", None)
                     else:
-                        logging.warning(f"json消息没有data字段: {json.dumps(msg, ensure_ascii=False)}")
+                        logging.warning("json消息没有data字段: %s", LazyJSON(msg, ensure_ascii=False))
 
                 # msg 顶层删除
                 _remove_many(msg, rules.get('remove_msg', []))
@@ -1843,7 +1936,7 @@ def make_lm_sanitized_and_original(data_root):
                 if isinstance(msg.get("data"), dict):
                     _remove_many(msg, [f"data.{k}" for k in rules.get('remove_in_data', [])])
 
-    logging.debug(f"make_lm_sanitized_and_original: 处理后消息数量: lm_messages={len(lm_messages)}, origin_messages={len(origin_messages)}")
+    logging.debug("make_lm_sanitized_and_original: 处理后消息数量: lm_messages=%s, origin_messages=%s", len(lm_messages), len(origin_messages))
     return lm_messages, origin_messages
 
 
@@ -1881,151 +1974,384 @@ def finalize_item_for_output(item_origin):
     return out_item
 
 
-@retry_on_exception(max_retries=2, exceptions=(Exception,))
-def fetch_response_simple(prompt, config):
-    """简单的单轮调用大模型获取响应"""
-    if not prompt or not config:
-        logging.error("缺少必要参数: prompt 或 config")
-        return ""
-    
-    messages = [{'role': 'system', 'content': '你是一个校园墙投稿管理员'},
-                {'role': 'user', 'content': prompt}]
+class StreamingJSONDetector:
+    """
+    增量检测流式文本中第一个完整的顶层 JSON 对象。
+    跟踪花括号深度与字符串/转义状态，忽略对象之前的 ```json 围栏或前导文字。
+    """
 
-    # Debug输出：显示发送给文本模型的输入
-    logging.debug(f"发送给文本模型的输入:")
-    logging.debug(f"  模型: {config.get('text_model', DEFAULT_TEXT_MODEL)}")
-    logging.debug(f"  消息数量: {len(messages)}")
-    logging.debug(f"  系统消息: {messages[0]['content']}")
-    logging.debug(f"  用户消息长度: {len(messages[1]['content'])} 字符")
-    logging.debug(f"  用户消息完整内容: {messages[1]['content']}")
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+
+    def feed(self, chunk):
+        """
+        喂入一段文本；若该段内顶层对象闭合，返回闭合 '}' 之后的下标，否则返回 -1
+        """
+        if self.complete:
+            return 0
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if not self.started:
+                if ch == '{':
+                    self.started = True
+                    self.depth = 1
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                self.depth += 1
+            elif ch == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    return i + 1
+        return -1
 
+
+# 同一进程内并行的判断阶段（needpriv / safety）共用延迟文件，读-改-写需串行
+_llm_latency_lock = threading.Lock()
+
+
+def load_llm_latency_stats():
+    """读取各调用类型的历史延迟样本"""
     try:
-        seed = 1354
-        logging.info(f"调用大模型API - Using seed: {seed}")
-
-        # 使用流式输出方式调用生成模型
-        responses = Generation.call(
-            model=config.get('text_model', DEFAULT_TEXT_MODEL),
-            messages=messages,
-            seed=seed,
-            result_format='message',
-            stream=True,
-            incremental_output=True,
-            max_tokens=8192,
-            temperature=0.50,
-            repetition_penalty=1.0,
-            timeout=API_TIMEOUT
-        )
+        with open(LLM_LATENCY_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def record_llm_latency(call_type, seconds):
+    """追加一次调用延迟样本（仅保留最近 LLM_LATENCY_SAMPLES 个），写入失败不影响主流程"""
+    try:
+        with _llm_latency_lock:
+            stats = load_llm_latency_stats()
+            samples = stats.get(call_type) or []
+            samples.append(round(float(seconds), 3))
+            stats[call_type] = samples[-LLM_LATENCY_SAMPLES:]
+            os.makedirs(os.path.dirname(LLM_LATENCY_FILE), exist_ok=True)
+            tmp_path = f"{LLM_LATENCY_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, LLM_LATENCY_FILE)
+    except Exception as e:
+        logging.debug("记录LLM延迟样本失败: %s", e)
 
-        # 处理流式响应（兼容多种事件/字段形态）
-        output_content = ""
-        raw_snippets = []
-        for response in responses:
-            if response is None:
-                continue
-            chunk = ""
-            out = None
-            # 1) 尝试读取标准化的 output_text；个别 SDK 版本可能抛异常，这里单独兜底
-            try:
-                text_attr = getattr(response, 'output_text')
-            except Exception as e:
-                text_attr = None
-                logging.debug(f"output_text 不可用: {e}")
-            if isinstance(text_attr, str) and text_attr:
-                chunk = text_attr
 
-            # 2) 若无 chunk，尝试通过 output / to_dict 提取
-            if not chunk:
+def get_llm_call_budget(call_type, config):
+    """获取调用类型的延迟预算（秒），oqqwall.config 中 llm_budget_<类型> 可覆盖默认值"""
+    default = LLM_CALL_BUDGETS.get(call_type, API_TIMEOUT)
+    try:
+        return float(config.get(f'llm_budget_{call_type}', default))
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def compute_hedge_delay(call_type, config, budget):
+    """
+    根据历史延迟的百分位计算对冲请求的触发延迟；返回 None 表示不对冲。
+    样本不足时使用 LLM_HEDGE_DEFAULT_DELAY。
+    """
+    try:
+        percentile = float(config.get('llm_hedge_percentile', 90))
+    except (TypeError, ValueError):
+        percentile = 90.0
+    if percentile <= 0:
+        return None
+    samples = sorted(load_llm_latency_stats().get(call_type) or [])
+    if len(samples) >= LLM_HEDGE_MIN_SAMPLES:
+        idx = min(len(samples) - 1, int(len(samples) * min(percentile, 100.0) / 100.0))
+        delay = samples[idx]
+    else:
+        delay = LLM_HEDGE_DEFAULT_DELAY
+    return max(LLM_HEDGE_MIN_DELAY, min(delay, budget / 2))
+
+
+class LLMStreamError(Exception):
+    """流式响应中途返回了非 200 状态（429/5xx 等），已收到的部分输出不可用"""
+
+
+def stream_text_generation(messages, model, cancel_event=None, timeout=API_TIMEOUT, on_chunk=None):
+    """
+    单次流式调用文本模型，返回 (输出文本, 原始事件快照列表)。
+    检测到完整的顶层 JSON 对象或 cancel_event 被置位时提前关闭流；
+    收到错误状态时抛出 LLMStreamError。每收到一个分片调用一次 on_chunk()。
+    """
+    seed = 1354
+    logging.info("调用大模型API - model: %s, seed: %s", model, seed)
+
+    # 使用流式输出方式调用生成模型
+    responses = Generation.call(
+        model=model,
+        messages=messages,
+        seed=seed,
+        result_format='message',
+        stream=True,
+        incremental_output=True,
+        max_tokens=8192,
+        temperature=0.50,
+        repetition_penalty=1.0,
+        timeout=timeout
+    )
+
+    # 处理流式响应（兼容多种事件/字段形态）
+    # 分片累积到列表，避免 += 拼接的二次方开销；
+    # 原始事件快照仅在 DEBUG 下完整采集，非 DEBUG 时只保留尚无输出前的少量事件
+    output_parts = []
+    raw_snippets = []
+    capture_raw = logging.getLogger().isEnabledFor(logging.DEBUG)
+    detector = StreamingJSONDetector()
+    early_done = False
+    for response in responses:
+        if cancel_event is not None and cancel_event.is_set():
+            early_done = True
+            break
+        if response is None:
+            continue
+        status_code = getattr(response, 'status_code', HTTPStatus.OK)
+        if status_code != HTTPStatus.OK:
+            # 429/5xx 等错误事件：已收到的部分输出被截断，整次调用视为失败
+            code = getattr(response, 'code', '')
+            message = getattr(response, 'message', '')
+            close = getattr(responses, 'close', None)
+            if callable(close):
                 try:
-                    out = getattr(response, 'output', None)
+                    close()
+                except Exception as e:
+                    logging.debug("关闭流式响应失败: %s", e)
+            raise LLMStreamError(f"模型 {model} 返回错误状态 {status_code}: {code} {message}")
+        chunk = ""
+        out = None
+        # 1) 尝试读取标准化的 output_text；个别 SDK 版本可能抛异常，这里单独兜底
+        try:
+            text_attr = getattr(response, 'output_text')
+        except Exception as e:
+            text_attr = None
+            logging.debug("output_text 不可用: %s", e)
+        if isinstance(text_attr, str) and text_attr:
+            chunk = text_attr
+
+        # 2) 若无 chunk，尝试通过 output / to_dict 提取
+        if not chunk:
+            try:
+                out = getattr(response, 'output', None)
+            except Exception:
+                out = None
+            if out is None:
+                try:
+                    to_dict = getattr(response, 'to_dict', None)
+                    if callable(to_dict):
+                        d = to_dict()
+                        out = d.get('output') if isinstance(d, dict) else None
                 except Exception:
                     out = None
-                if out is None:
-                    try:
-                        to_dict = getattr(response, 'to_dict', None)
-                        if callable(to_dict):
-                            d = to_dict()
-                            out = d.get('output') if isinstance(d, dict) else None
-                    except Exception:
-                        out = None
 
-                # 处理 output -> choices -> message.content
-                if isinstance(out, dict):
+            # 处理 output -> choices -> message.content
+            if isinstance(out, dict):
+                if capture_raw or (not output_parts and len(raw_snippets) < 8):
                     try:
                         raw_snippets.append(json.dumps(out, ensure_ascii=False)[:500])
                     except Exception:
                         pass
-                    choices = out.get('choices') or []
-                    if choices:
-                        msg = choices[0].get('message') or {}
-                        content = msg.get('content')
-                        if isinstance(content, list):
-                            buf = []
-                            for part in content:
-                                if isinstance(part, str):
-                                    buf.append(part)
-                                elif isinstance(part, dict):
-                                    t = part.get('text')
-                                    if isinstance(t, str):
-                                        buf.append(t)
-                            chunk = ''.join(buf)
-                        elif isinstance(content, str):
-                            chunk = content
-                else:
-                    # 退化为字符串
+                choices = out.get('choices') or []
+                if choices:
+                    msg = choices[0].get('message') or {}
+                    content = msg.get('content')
+                    if isinstance(content, list):
+                        buf = []
+                        for part in content:
+                            if isinstance(part, str):
+                                buf.append(part)
+                            elif isinstance(part, dict):
+                                t = part.get('text')
+                                if isinstance(t, str):
+                                    buf.append(t)
+                        chunk = ''.join(buf)
+                    elif isinstance(content, str):
+                        chunk = content
+            else:
+                # 退化为字符串
+                if capture_raw or (not output_parts and len(raw_snippets) < 8):
                     try:
                         raw_snippets.append(str(response)[:500])
                     except Exception:
                         pass
 
-            if chunk:
-                output_content += chunk
-                sys.stdout.flush()
+        if chunk:
+            if on_chunk is not None:
+                on_chunk()
+            end = detector.feed(chunk)
+            if end >= 0:
+                # 顶层 JSON 对象已完整，截断其后的围栏/多余文字并提前结束
+                output_parts.append(chunk[:end])
+                early_done = True
+                break
+            output_parts.append(chunk)
+
+    if early_done:
+        close = getattr(responses, 'close', None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                logging.debug("关闭流式响应失败: %s", e)
 
-        # 将原始事件快照存入全局，供调用方在需要时打印
-        global LAST_LLM_RAW_EVENTS
-        try:
-            LAST_LLM_RAW_EVENTS = "\n---\n".join(raw_snippets)[:4000]
-        except Exception:
-            LAST_LLM_RAW_EVENTS = ""
+    return "".join(output_parts), raw_snippets
 
-        # Debug输出：显示接收到的内容
-        logging.debug(f"接收到的内容长度: {len(output_content)} 字符")
-        logging.debug(f"接收到的内容: {output_content}")
-        logging.info("模型响应完成")
 
-        if not output_content:
-            logging.error("流式返回为空，原始事件快照(截断)：\n" + (LAST_LLM_RAW_EVENTS or "<empty>"))
-        return output_content
+def fetch_response_simple(prompt, config, call_type='grouping'):
+    """
+    简单的单轮调用大模型获取响应。
+    每种调用类型有独立的延迟预算；主请求超过历史延迟百分位仍未返回（或已失败）时，
+    再发一个对冲请求（可指向 text_model_fallback），先返回有效结果者胜出。
+    两者都失败时在预算内再重试一次；预算用尽但流仍在持续输出时继续等待，
+    最多到预算的 LLM_BUDGET_MAX_FACTOR 倍。
+    """
+    if not prompt or not config:
+        logging.error("缺少必要参数: prompt 或 config")
+        return ""
+    
+    messages = [{'role': 'system', 'content': '你是一个校园墙投稿管理员'},
+                {'role': 'user', 'content': prompt}]
 
-    except Exception as e:
-        error_msg = str(e).lower()
-        if 'ssl' in error_msg or 'connection' in error_msg or 'timeout' in error_msg:
-            logging.error(f"网络错误: {e}")
+    primary_model = config.get('text_model', DEFAULT_TEXT_MODEL)
+    fallback_model = config.get('text_model_fallback') or primary_model
+
+    # Debug输出：显示发送给文本模型的输入
+    logging.debug("发送给文本模型的输入:")
+    logging.debug("  模型: %s (对冲: %s)", primary_model, fallback_model)
+    logging.debug("  消息数量: %d", len(messages))
+    logging.debug("  系统消息: %s", messages[0]['content'])
+    logging.debug("  用户消息长度: %d 字符", len(messages[1]['content']))
+    logging.debug("  用户消息完整内容: %s", messages[1]['content'])
+
+    budget = get_llm_call_budget(call_type, config)
+    hedge_delay = compute_hedge_delay(call_type, config, budget)
+    start = time.monotonic()
+    deadline = start + budget
+    hard_deadline = start + budget * LLM_BUDGET_MAX_FACTOR
+    hedge_at = start + hedge_delay if hedge_delay is not None else float('inf')
+    logging.info("LLM调用[%s] 预算 %.1fs，对冲延迟 %s", call_type, budget,
+                 f"{hedge_delay:.1f}s" if hedge_delay is not None else "禁用")
+
+    results = queue.Queue()
+    cancel_event = threading.Event()
+    last_chunk = [0.0]
+
+    def on_chunk():
+        last_chunk[0] = time.monotonic()
+
+    def attempt(label, model):
+        t0 = time.monotonic()
+        timeout = max(1, int(min(API_TIMEOUT, hard_deadline - t0) + 0.999))
+        try:
+            text, snippets = stream_text_generation(messages, model, cancel_event, timeout, on_chunk)
+            results.put((label, model, text, snippets, None, time.monotonic() - t0))
+        except Exception as e:
+            results.put((label, model, "", [], e, time.monotonic() - t0))
+
+    def launch(label, model):
+        # 守护线程：落败的请求不会阻塞进程退出
+        threading.Thread(target=attempt, args=(label, model), daemon=True).start()
+
+    launch('primary', primary_model)
+    launched, finished, hedged = 1, 0, False
+    winner = None
+    last_error = None
+    last_snippets = []
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            # 仍在输出的长流（如分组）不因预算到点而作废
+            if now < hard_deadline and now - last_chunk[0] < LLM_STREAM_GRACE:
+                deadline = min(hard_deadline, last_chunk[0] + LLM_STREAM_GRACE)
+                logging.info("LLM调用[%s] 超出预算但仍在输出，延长至 %.1fs", call_type, deadline - start)
+            else:
+                break
+        wait = deadline - now if hedged else max(0.0, min(deadline, hedge_at) - now)
+        try:
+            label, model, text, snippets, err, elapsed = results.get(timeout=wait)
+        except queue.Empty:
+            if not hedged and time.monotonic() >= hedge_at:
+                logging.warning("主请求超过 %.1fs 未返回，发出对冲请求 -> %s", hedge_delay, fallback_model)
+                launch('hedge', fallback_model)
+                launched, hedged = launched + 1, True
+            continue
+        finished += 1
+        last_snippets = snippets or last_snippets
+        if err is None and text:
+            winner = (label, model, text, snippets, elapsed)
+            break
+        if err is not None:
+            last_error = err
+            logging.warning("LLM请求(%s, %s) 失败: %s", label, model, err)
         else:
-            logging.error(f"API调用错误: {e}")
-        raise
+            logging.warning("LLM请求(%s, %s) 返回为空", label, model)
+        if not hedged:
+            # 主请求已失败，立即用对冲请求代替重试
+            launch('hedge', fallback_model)
+            launched, hedged = launched + 1, True
+            continue
+        if finished >= launched:
+            if launched < LLM_MAX_ATTEMPTS and deadline - time.monotonic() > RETRY_DELAY:
+                time.sleep(RETRY_DELAY)
+                logging.warning("LLM请求均失败，重试 -> %s", primary_model)
+                launch('retry', primary_model)
+                launched += 1
+                continue
+            break
+    cancel_event.set()
 
+    # 将原始事件快照存入全局，供调用方在需要时打印
+    global LAST_LLM_RAW_EVENTS
+    try:
+        LAST_LLM_RAW_EVENTS = "\n---\n".join(winner[3] if winner else last_snippets)[:4000]
+    except Exception:
+        LAST_LLM_RAW_EVENTS = ""
+
+    if winner is None:
+        if time.monotonic() >= deadline:
+            logging.error("LLM调用[%s] 超出延迟预算 %.1fs", call_type, deadline - start)
+        if last_error is not None:
+            error_msg = str(last_error).lower()
+            if 'ssl' in error_msg or 'connection' in error_msg or 'timeout' in error_msg:
+                logging.error("网络错误: %s", last_error)
+            else:
+                logging.error("API调用错误: %s", last_error)
+            raise last_error
+        logging.error("流式返回为空，原始事件快照(截断)：\n" + (LAST_LLM_RAW_EVENTS or "<empty>"))
+        return ""
 
-@retry_on_exception(max_retries=2, exceptions=(Exception,))
-def judge_privacy_and_safety(grouped_messages, config):
-    """
-    对分好组的消息进行隐私和安全判断
-    使用"规则优先 + LLM 兜底 + 冲突仲裁"策略
+    label, model, output_content, _, elapsed = winner
+    # 延迟样本只记录主模型；对冲胜出时主请求的已耗时作为下界样本
+    record_llm_latency(call_type, elapsed if label == 'primary' else time.monotonic() - start)
+
+    # Debug输出：显示接收到的内容
+    logging.debug("接收到的内容长度: %d 字符", len(output_content))
+    logging.debug("接收到的内容: %s", output_content)
+    logging.info("模型响应完成（%s, %s, %.2fs）", label, model, elapsed)
+    return output_content
+
+
+def judge_needpriv(grouped_messages, config):
+    """needpriv 判断：本地规则优先，不确定时 LLM 兜底，图片隐私信号加权。
+
+    返回 (needpriv, 判定依据, 规则证据)。
     """
-    if not grouped_messages:
-        logging.error(f"缺少必要参数: grouped_messages 为空或None, 类型: {type(grouped_messages)}, 长度: {len(grouped_messages) if isinstance(grouped_messages, (list, dict)) else 'N/A'}")
-        return "false", "true"  # 默认值：不需要匿名，安全
-    
-    if not config:
-        logging.error(f"缺少必要参数: config 为空或None, 类型: {type(config)}")
-        return "false", "true"  # 默认值：不需要匿名，安全
-    
-    logging.info("开始进行隐私和安全判断...")
-    
-    # === 第一步：本地规则优先判断 needpriv ===
     rule_result, evidence = rule_needpriv_vote(grouped_messages)
-    
+
     needpriv_reason = ""
     if rule_result is True:
         needpriv = "true"
@@ -2033,55 +2359,83 @@ def judge_privacy_and_safety(grouped_messages, config):
         if evidence.get("positive"):
             hit = evidence["positive"][0]  # 取最近的命中
             needpriv_reason += f" | hit: '{hit['pattern']}' in '{hit['text'][:50]}...'"
-        logging.info(f"规则判定：需要匿名 - {needpriv_reason}")
-        
+        logging.info("规则判定：需要匿名 - %s", needpriv_reason)
+
     elif rule_result is False:
         needpriv = "false"
         needpriv_reason = "local-rule: negative signal"
         if evidence.get("negative"):
             hit = evidence["negative"][0]  # 取最近的命中
             needpriv_reason += f" | hit: '{hit['pattern']}' in '{hit['text'][:50]}...'"
-        logging.info(f"规则判定：不需要匿名 - {needpriv_reason}")
-        
+        logging.info("规则判定：不需要匿名 - %s", needpriv_reason)
+
     else:
         # === 不确定或仅弱倾向 -> 调用 LLM 兜底 ===
         logging.info("规则未能明确判定，调用LLM兜底...")
         all_text_content = extract_all_text_content(grouped_messages)
         llm_result = llm_needpriv_fallback(all_text_content, config)
-        
+
         needpriv = llm_result.get("needpriv", "false")
         needpriv_reason = f"llm-fallback: {llm_result.get('reason', '')}, conf={llm_result.get('confidence', 0)}"
-        
+
         # === 图片隐私弱信号加权 ===
         if evidence.get("image_hits") and llm_result.get("confidence", 0) < 0.6:
             needpriv = "true"
             needpriv_reason += f" | boosted-by-image-privacy-signal (hits: {len(evidence['image_hits'])})"
-            logging.info(f"LLM低置信度({llm_result.get('confidence', 0)})，由图片隐私信号提升为匿名")
-        
-        logging.info(f"LLM兜底判定：needpriv={needpriv} - {needpriv_reason}")
-    
-    # === 第二步：安全性判断（safemsg）===
-    # 使用LLM进行文本安全检查
+            logging.info("LLM低置信度(%s)，由图片隐私信号提升为匿名", llm_result.get('confidence', 0))
+
+        logging.info("LLM兜底判定：needpriv=%s - %s", needpriv, needpriv_reason)
+
+    return needpriv, needpriv_reason, evidence
+
+
+def judge_safemsg(grouped_messages, config):
+    """safemsg 判断：LLM 文本安全检查，无文本时默认安全。返回 (safemsg, 判定依据)。"""
     safemsg = "true"  # 默认安全
     safemsg_reason = "default-safe"
-    
+
     # 提取所有文本内容
     all_text_content = extract_all_text_content(grouped_messages)
-    
+
     if all_text_content:
         logging.info("开始LLM文本安全检查...")
         safety_result = llm_text_safety_check(all_text_content, config)
-        
+
         if not safety_result.get("safe", True):
             safemsg = "false"
             safemsg_reason = f"LLM判定不安全: {safety_result.get('reason', '')}, 严重程度: {safety_result.get('severity', 'unknown')}"
-            logging.warning(f"LLM判定文本内容不安全: {safety_result}")
+            logging.warning("LLM判定文本内容不安全: %s", safety_result)
         else:
             safemsg_reason = f"LLM判定安全: {safety_result.get('reason', '')}"
-            logging.info(f"LLM判定文本内容安全: {safety_result.get('reason', '')}")
+            logging.info("LLM判定文本内容安全: %s", safety_result.get('reason', ''))
     else:
         safemsg_reason = "无文本内容，默认安全"
         logging.debug("无文本内容可检查，保持默认安全状态")
+
+    return safemsg, safemsg_reason
+
+
+@retry_on_exception(max_retries=2, exceptions=(Exception,))
+def judge_privacy_and_safety(grouped_messages, config):
+    """
+    对分好组的消息进行隐私和安全判断
+    使用"规则优先 + LLM 兜底 + 冲突仲裁"策略
+    """
+    if not grouped_messages:
+        logging.error("缺少必要参数: grouped_messages 为空或None, 类型: %s, 长度: %s", type(grouped_messages), len(grouped_messages) if isinstance(grouped_messages, (list, dict)) else 'N/A')
+        return "false", "true"  # 默认值：不需要匿名，安全
+    
+    if not config:
+        logging.error("缺少必要参数: config 为空或None, 类型: %s", type(config))
+        return "false", "true"  # 默认值：不需要匿名，安全
+    
+    logging.info("开始进行隐私和安全判断...")
+    
+    # === 第一步：本地规则优先判断 needpriv ===
+    needpriv, needpriv_reason, evidence = judge_needpriv(grouped_messages, config)
+    
+    # === 第二步：安全性判断（safemsg）===
+    safemsg, safemsg_reason = judge_safemsg(grouped_messages, config)
     
     # 记录判定依据（可选：用于调试和审计）
     judgment_log = {
@@ -2096,8 +2450,8 @@ def judge_privacy_and_safety(grouped_messages, config):
         }
     }
     
-    logging.debug(f"判定详情: {json.dumps(judgment_log, ensure_ascii=False, indent=2)}")
-    logging.info(f"最终判定结果: needpriv={needpriv}, safemsg={safemsg}")
+    logging.debug("判定详情: %s", LazyJSON(judgment_log, ensure_ascii=False, indent=2))
+    logging.info("最终判定结果: needpriv=%s, safemsg=%s", needpriv, safemsg)
     
     return needpriv, safemsg
 
@@ -2115,13 +2469,207 @@ def save_to_sqlite(output_data, tag):
             sql_update_query = '''UPDATE preprocess SET AfterLM = ? WHERE tag = ?'''
             cursor.execute(sql_update_query, (output_data, tag))
             conn.commit()
-            logging.info(f"数据成功保存到SQLite，标签: {tag}")
+            logging.info("数据成功保存到SQLite，标签: %s", tag)
             return True
         except sqlite3.Error as e:
-            logging.error(f"SQLite错误: {e}")
+            logging.error("SQLite错误: %s", e)
             raise
 
 
+def compact_afterlm_rows(db_path=DB_PATH):
+    """
+    迁移：将历史上以 indent=4 写入的 AfterLM 改写为紧凑 JSON。
+    已紧凑或无法解析的行保持不变，可重复执行。返回改写的行数。
+    """
+    compacted = 0
+    conn = sqlite3.connect(db_path, timeout=20.0)
+    try:
+        rows = conn.execute(
+            "SELECT rowid, AfterLM FROM preprocess WHERE AfterLM LIKE '%' || char(10) || '%'"
+        ).fetchall()
+        for rowid, afterlm in rows:
+            try:
+                compact = dump_afterlm(json.loads(afterlm))
+            except (TypeError, ValueError):
+                continue
+            if compact != afterlm:
+                conn.execute("UPDATE preprocess SET AfterLM=? WHERE rowid=?", (compact, rowid))
+                compacted += 1
+        conn.commit()
+    finally:
+        conn.close()
+    return compacted
+
+
+class GroupingError(Exception):
+    """分组阶段失败（无有效响应或响应不是合法 JSON）。"""
+
+
+def merge_image_descriptions(data):
+    """把 forward 内图片的描述（data['additional_images']）按文件名回填到消息中，返回回填来源数。
+
+    顶层图片的 describe 已由图片阶段直接写入 data，无需经数据库往返。
+    """
+    additional_descriptions = {}
+    for img_info in data.get("additional_images", []):
+        if "file" in img_info and "description" in img_info:
+            additional_descriptions[img_info["file"]] = img_info["description"]
+
+    def merge_descriptions_recursive(messages, depth=0):
+        """递归合并图片描述到forward消息中"""
+        for item in messages:
+            if "message" in item and isinstance(item["message"], list):
+                for msg in item["message"]:
+                    if msg.get("type") == "image":
+                        if "describe" in msg:
+                            continue
+                        # 匹配additional_images中的描述（通过URL文件名）
+                        url = msg.get("data", {}).get("url", "")
+                        if url.startswith("file://"):
+                            file_name = os.path.basename(url[7:])
+                            if file_name in additional_descriptions:
+                                msg["describe"] = additional_descriptions[file_name]
+                                logging.debug("为forward中的图片 %s 添加了描述", file_name)
+                    elif msg.get("type") == "forward" and "data" in msg:
+                        # 递归处理forward消息内部的图片
+                        if "messages" in msg["data"]:
+                            merge_descriptions_recursive(msg["data"]["messages"], depth + 1)
+                        elif "content" in msg["data"]:
+                            merge_descriptions_recursive(msg["data"]["content"], depth + 1)
+
+    if additional_descriptions:
+        merge_descriptions_recursive(data.get("messages", []))
+        logging.info("合并了图片处理结果到原始数据")
+    return len(additional_descriptions)
+
+
+def group_messages(tag, data, config):
+    """分组阶段：调用大模型挑出属于本次投稿的消息，以原始消息为基准恢复并按规则裁剪。
+
+    返回 (分组结果, origin_messages)；失败时抛出 GroupingError。
+    """
+    # 调试：检查原始数据中的forward消息
+    original_forward_count = 0
+    for item in data.get("messages", []):
+        if "message" in item and isinstance(item["message"], list):
+            for msg in item["message"]:
+                if msg.get("type") == "forward":
+                    original_forward_count += 1
+                    logging.debug("原始数据中发现forward消息: %s", LazyJSON(msg, ensure_ascii=False))
+
+    logging.info("原始数据中包含 %s 个forward消息", original_forward_count)
+
+    lm_messages, origin_messages = make_lm_sanitized_and_original(data)
+    logging.debug("make_lm_sanitized_and_original 返回: lm_messages 长度=%s, origin_messages 长度=%s", len(lm_messages), len(origin_messages))
+
+    # 调试：检查forward消息是否被保留
+    forward_count = 0
+    for item in lm_messages:
+        if "message" in item and isinstance(item["message"], list):
+            for msg in item["message"]:
+                if msg.get("type") == "forward":
+                    forward_count += 1
+                    logging.debug("处理后的forward消息: %s", LazyJSON(msg, ensure_ascii=False))
+
+    logging.info("处理后的消息中包含 %s 个forward消息", forward_count)
+
+    # 使用新的简化格式
+    simplified_input = simplify_for_llm(lm_messages)
+
+    input_content = json.dumps(simplified_input, ensure_ascii=False, separators=(',', ':'))
+    timenow = time.time()
+
+    logging.info("输入内容长度: %s 字符", len(input_content))
+
+    # 构造prompt，详细说明分组和输出要求
+    prompt = MAIN_GROUPING_PROMPT_TEMPLATE.format(
+        timenow=timenow,
+        input_content=input_content
+    )
+
+    # 使用简单的单轮调用获取模型响应
+    logging.info("第二步：开始调用大模型API进行分组...")
+    with trace_span(tag, 'lm_grouping') as span_info:
+        span_info['bytes'] = len(input_content.encode('utf-8'))
+        final_response = fetch_response_simple(prompt, config, call_type='grouping')
+        if not final_response:
+            span_info['exit_code'] = 1
+
+    if not final_response:
+        # 打印模型原始输出快照，便于定位问题
+        logging.error("未获得有效的模型响应，原始事件(截断)：\n" + (LAST_LLM_RAW_EVENTS or "<empty>"))
+        raise GroupingError("未获得有效的模型响应")
+
+    final_response = clean_json_output(final_response)
+    logging.info("模型响应长度: %s 字符", len(final_response))
+
+    # 解析最终的JSON响应
+    try:
+        # 去除markdown格式并加载JSON内容
+        cleaned_response = final_response.strip('```json\n').strip('\n```')
+        logging.debug("清理后的响应内容: %s...", cleaned_response[:500])
+        final_response_json = json.loads(cleaned_response)
+    except json.JSONDecodeError as e:
+        logging.error("JSON解析错误: %s", e)
+        logging.error("返回内容: %s", final_response)
+
+        # 保存错误内容到文件
+        try:
+            with open(OUTPUT_FILE_PATH_ERROR, 'w', encoding='utf-8') as errorfile:
+                errorfile.write(final_response)
+            logging.info("错误的JSON已保存到: %s", OUTPUT_FILE_PATH_ERROR)
+        except Exception as save_error:
+            logging.error("保存错误文件失败: %s", save_error)
+        raise GroupingError(f"JSON解析错误: {e}") from e
+    logging.debug("解析后的JSON结构: %s", LazyJSON(final_response_json, ensure_ascii=False, indent=2))
+
+    # 以原始消息为基准恢复 + 按规则裁剪（保留 hide_from_LM_only）
+    logging.debug("origin_messages 长度: %s", len(origin_messages))
+    if origin_messages:
+        logging.debug("origin_messages 第一个元素: %s...", LazyJSON(origin_messages[0], ensure_ascii=False, limit=200))
+    logging.debug("final_response_json.get('messages', []) 长度: %s", len(final_response_json.get('messages', [])))
+    logging.debug("final_response_json.get('messages', []) 内容: %s", final_response_json.get('messages', []))
+
+    origin_lookup = {msg["message_id"]: msg for msg in origin_messages}
+    logging.debug("origin_lookup 键数量: %s", len(origin_lookup))
+    if origin_lookup:
+        logging.debug("origin_lookup 的键: %s", list(origin_lookup.keys())[:5])
+
+    final_list = []
+    for mid in final_response_json.get("messages", []):
+        # 转换消息ID为整数类型，以匹配origin_lookup的键
+        try:
+            mid_int = int(mid) if isinstance(mid, str) else mid
+            if mid_int in origin_lookup:
+                final_list.append(finalize_item_for_output(origin_lookup[mid_int]))
+            else:
+                logging.warning("未找到消息ID: %s (转换后: %s)", mid, mid_int)
+        except (ValueError, TypeError) as e:
+            logging.warning("无法转换消息ID %s 为整数: %s", mid, e)
+
+    logging.debug("final_list 长度: %s", len(final_list))
+    final_response_json["messages"] = final_list
+    return final_response_json, origin_messages
+
+
+def messages_for_judgment(final_response_json, origin_messages):
+    """needpriv/safemsg 判断所用的消息：分组结果为空时退回全部原始消息。"""
+    final_list = final_response_json.get("messages") or []
+    if final_list:
+        logging.debug("final_list 第一个元素: %s...", LazyJSON(final_list[0], ensure_ascii=False, limit=200))
+    if not final_list and origin_messages:
+        logging.warning("final_list 为空，使用 origin_messages 进行判断")
+        return origin_messages
+    return final_list
+
+
+def store_afterlm(final_response_json, needpriv, safemsg, tag):
+    """写入判断结果并保存 AfterLM（本次处理唯一一次写入）。"""
+    final_response_json["needpriv"] = needpriv
+    final_response_json["safemsg"] = safemsg
+    return save_to_sqlite(dump_afterlm(final_response_json), tag)
+
+
 def main():
     # 配置日志输出
     logging.basicConfig(**get_logging_config())
@@ -2133,7 +2681,7 @@ def main():
             sys.exit(1)
         
         tag = sys.argv[1]
-        logging.info(f"开始处理标签: {tag}")
+        logging.info("开始处理标签: %s", tag)
         
         # 读取配置
         config = read_config('oqqwall.config')
@@ -2149,7 +2697,7 @@ def main():
             data = json.load(sys.stdin)
             logging.debug(data)
         except json.JSONDecodeError as e:
-            logging.error(f"输入JSON解析错误: {e}")
+            logging.error("输入JSON解析错误: %s", e)
             sys.exit(1)
         
         
@@ -2162,233 +2710,42 @@ def main():
             data = {"messages": data}
             logging.debug("检测到输入数据是列表格式，已转换为字典格式")
         
-        process_images_comprehensive(tag, config, data)
+        with trace_span(tag, 'lm_images') as span_info:
+            image_result = process_images_comprehensive(tag, config, data)
+            if image_result:
+                span_info['note'] = f"{image_result['description_count']} described"
         
-        # === 第二步：重新读取处理后的数据（只在有图片处理的情况下） ===
-        # 检查是否有图片消息需要合并处理结果（包括forward消息中的图片）
-        def has_images_in_data(messages):
-            """递归检查消息中是否包含图片（包括forward消息内部的图片）"""
-            for item in messages:
-                if "message" in item and isinstance(item["message"], list):
-                    for msg in item["message"]:
-                        if msg.get("type") == "image":
-                            return True
-                        elif msg.get("type") == "forward" and "data" in msg:
-                            # 检查forward消息内部的图片
-                            if "messages" in msg["data"] and isinstance(msg["data"]["messages"], list):
-                                if has_images_in_data(msg["data"]["messages"]):
-                                    return True
-                            elif "content" in msg["data"] and isinstance(msg["data"]["content"], list):
-                                if has_images_in_data(msg["data"]["content"]):
-                                    return True
-            return False
-        
-        has_image_messages = has_images_in_data(data.get("messages", []))
-        
-        if has_image_messages:
-            with safe_db_connection() as conn:
-                cur = conn.cursor()
-                try:
-                    row = cur.execute('SELECT AfterLM FROM preprocess WHERE tag=?', (tag,)).fetchone()
-                    if row and row[0] is not None:
-                        # 只有在有图片消息时才重新加载数据库中的数据
-                        processed_data = json.loads(row[0])
-                        
-                        # 合并图片处理结果（describe字段）到原始数据
-                        image_descriptions = {}
-                        
-                        # 收集顶层图片消息的描述
-                        for item in processed_data.get("messages", []):
-                            if "message" in item and isinstance(item["message"], list):
-                                for msg in item["message"]:
-                                    if msg.get("type") == "image" and "describe" in msg:
-                                        # 使用消息ID+类型作为key来匹配
-                                        key = f"{item.get('message_id')}_{msg.get('type')}"
-                                        image_descriptions[key] = msg["describe"]
-                        
-                        # 收集additional_images中的描述（来自forward消息中的图片）
-                        additional_images = processed_data.get("additional_images", [])
-                        additional_descriptions = {}
-                        for img_info in additional_images:
-                            if "file" in img_info and "description" in img_info:
-                                # 使用文件名作为key
-                                file_name = img_info["file"]
-                                additional_descriptions[file_name] = img_info["description"]
-                        
-                        # 将描述信息合并到原始数据中
-                        def merge_descriptions_recursive(messages, depth=0):
-                            """递归合并图片描述到forward消息中"""
-                            for item in messages:
-                                if "message" in item and isinstance(item["message"], list):
-                                    for msg in item["message"]:
-                                        if msg.get("type") == "image":
-                                            # 首先尝试匹配顶层图片
-                                            key = f"{item.get('message_id')}_{msg.get('type')}"
-                                            if key in image_descriptions:
-                                                msg["describe"] = image_descriptions[key]
-                                            else:
-                                                # 尝试匹配additional_images中的描述（通过URL文件名）
-                                                url = msg.get("data", {}).get("url", "")
-                                                if url.startswith("file://"):
-                                                    file_name = os.path.basename(url[7:])
-                                                    if file_name in additional_descriptions:
-                                                        msg["describe"] = additional_descriptions[file_name]
-                                                        logging.debug(f"为forward中的图片 {file_name} 添加了描述")
-                                        elif msg.get("type") == "forward" and "data" in msg:
-                                            # 递归处理forward消息内部的图片
-                                            if "messages" in msg["data"]:
-                                                merge_descriptions_recursive(msg["data"]["messages"], depth + 1)
-                                            elif "content" in msg["data"]:
-                                                merge_descriptions_recursive(msg["data"]["content"], depth + 1)
-                        
-                        merge_descriptions_recursive(data.get("messages", []))
-                        
-                        logging.info("合并了图片处理结果到原始数据")
-                    else:
-                        logging.warning(f"未找到标签 {tag} 的记录或AfterLM字段为空，使用原始数据")
-                except json.JSONDecodeError as e:
-                    logging.error(f"重新加载数据时JSON解析错误: {e}")
-                    # 继续使用原始数据
-        else:
+        # === 第二步：合并图片处理结果 ===
+        if not merge_image_descriptions(data) and image_result is None:
             logging.info("没有图片消息，直接使用原始输入数据")
         
-        # === 第三步：基于 per_type_rules 的精细化删改 ===
-        
-        # 调试：检查原始数据中的forward消息
-        original_forward_count = 0
-        for item in data.get("messages", []):
-            if "message" in item and isinstance(item["message"], list):
-                for msg in item["message"]:
-                    if msg.get("type") == "forward":
-                        original_forward_count += 1
-                        logging.debug(f"原始数据中发现forward消息: {json.dumps(msg, ensure_ascii=False)}")
-        
-        logging.info(f"原始数据中包含 {original_forward_count} 个forward消息")
-        
-        lm_messages, origin_messages = make_lm_sanitized_and_original(data)
-        logging.debug(f"make_lm_sanitized_and_original 返回: lm_messages 长度={len(lm_messages)}, origin_messages 长度={len(origin_messages)}")
-
-        # 调试：检查forward消息是否被保留
-        forward_count = 0
-        for item in lm_messages:
-            if "message" in item and isinstance(item["message"], list):
-                for msg in item["message"]:
-                    if msg.get("type") == "forward":
-                        forward_count += 1
-                        logging.debug(f"处理后的forward消息: {json.dumps(msg, ensure_ascii=False)}")
-        
-        logging.info(f"处理后的消息中包含 {forward_count} 个forward消息")
-
-        # 使用新的简化格式
-        simplified_input = simplify_for_llm(lm_messages)
-        
-        input_content = json.dumps(simplified_input, ensure_ascii=False, separators=(',', ':'))
-        timenow = time.time()
-
-        logging.info(f"输入内容长度: {len(input_content)} 字符")
-        
-        # 构造prompt，详细说明分组和输出要求
-        prompt = MAIN_GROUPING_PROMPT_TEMPLATE.format(
-            timenow=timenow,
-            input_content=input_content
-        )
-
-        # 使用简单的单轮调用获取模型响应
-        logging.info("第二步：开始调用大模型API进行分组...")
-        final_response = fetch_response_simple(prompt, config)
-        
-        if not final_response:
-            # 打印模型原始输出快照，便于定位问题
-            logging.error("未获得有效的模型响应，原始事件(截断)：\n" + (LAST_LLM_RAW_EVENTS or "<empty>"))
-            sys.exit(1)
-        
-        final_response = clean_json_output(final_response)
-        logging.info(f"模型响应长度: {len(final_response)} 字符")
-        
-        # 解析并保存最终的JSON响应
+        # === 第三步：分组（基于 per_type_rules 的精细化删改） ===
         try:
-            # 去除markdown格式并加载JSON内容
-            cleaned_response = final_response.strip('```json\n').strip('\n```')
-            logging.debug(f"清理后的响应内容: {cleaned_response[:500]}...")
-            final_response_json = json.loads(cleaned_response)
-            logging.debug(f"解析后的JSON结构: {json.dumps(final_response_json, ensure_ascii=False, indent=2)}")
-            
-            # 以原始消息为基准恢复 + 按规则裁剪（保留 hide_from_LM_only）
-            logging.debug(f"origin_messages 长度: {len(origin_messages)}")
-            if origin_messages:
-                logging.debug(f"origin_messages 第一个元素: {json.dumps(origin_messages[0], ensure_ascii=False)[:200]}...")
-            logging.debug(f"final_response_json.get('messages', []) 长度: {len(final_response_json.get('messages', []))}")
-            logging.debug(f"final_response_json.get('messages', []) 内容: {final_response_json.get('messages', [])}")
-            
-            origin_lookup = {msg["message_id"]: msg for msg in origin_messages}
-            logging.debug(f"origin_lookup 键数量: {len(origin_lookup)}")
-            if origin_lookup:
-                logging.debug(f"origin_lookup 的键: {list(origin_lookup.keys())[:5]}")
-            
-            final_list = []
-            for mid in final_response_json.get("messages", []):
-                # 转换消息ID为整数类型，以匹配origin_lookup的键
-                try:
-                    mid_int = int(mid) if isinstance(mid, str) else mid
-                    if mid_int in origin_lookup:
-                        final_list.append(finalize_item_for_output(origin_lookup[mid_int]))
-                    else:
-                        logging.warning(f"未找到消息ID: {mid} (转换后: {mid_int})")
-                except (ValueError, TypeError) as e:
-                    logging.warning(f"无法转换消息ID {mid} 为整数: {e}")
-            
-            logging.debug(f"final_list 长度: {len(final_list)}")
-            final_response_json["messages"] = final_list
-            
-            # === 第三步：对分好组的消息再次调用模型判断 needpriv 和 safemsg ===
-            logging.info("第三步：开始调用大模型判断 needpriv 和 safemsg...")
-            logging.debug(f"调用 judge_privacy_and_safety 前，final_list 长度: {len(final_list)}")
-            logging.debug(f"调用 judge_privacy_and_safety 前，config 类型: {type(config)}")
-            if final_list:
-                logging.debug(f"final_list 第一个元素: {json.dumps(final_list[0], ensure_ascii=False)[:200]}...")
-            
-            # 如果 final_list 为空，尝试使用原始消息
-            messages_for_judgment = final_list
-            if not final_list and origin_messages:
-                logging.warning("final_list 为空，使用 origin_messages 进行判断")
-                messages_for_judgment = origin_messages
-            
-            needpriv, safemsg = judge_privacy_and_safety(messages_for_judgment, config)
-            
-            # 将判断结果添加到最终输出中
-            final_response_json["needpriv"] = needpriv
-            final_response_json["safemsg"] = safemsg
-
-            output_data = json.dumps(final_response_json, ensure_ascii=False, indent=4)
-            
-            # 保存到数据库
-            if save_to_sqlite(output_data, tag):
-                logging.info("数据保存成功")
-            else:
-                logging.error("数据保存失败")
-                sys.exit(1)
+            final_response_json, origin_messages = group_messages(tag, data, config)
+        except GroupingError:
+            sys.exit(1)
 
-            logging.info("处理完成")
+        # === 第四步：对分好组的消息再次调用模型判断 needpriv 和 safemsg ===
+        logging.info("第三步：开始调用大模型判断 needpriv 和 safemsg...")
+        judged = messages_for_judgment(final_response_json, origin_messages)
+        with trace_span(tag, 'lm_judge') as span_info:
+            needpriv, safemsg = judge_privacy_and_safety(judged, config)
+            span_info['note'] = f"needpriv={needpriv} safemsg={safemsg}"
 
-        except json.JSONDecodeError as e:
-            logging.error(f"JSON解析错误: {e}")
-            logging.error(f"返回内容: {final_response}")
-            
-            # 保存错误内容到文件
-            try:
-                with open(OUTPUT_FILE_PATH_ERROR, 'w', encoding='utf-8') as errorfile:
-                    errorfile.write(final_response)
-                logging.info(f"错误的JSON已保存到: {OUTPUT_FILE_PATH_ERROR}")
-            except Exception as save_error:
-                logging.error(f"保存错误文件失败: {save_error}")
-            
+        # 保存到数据库（本次处理唯一一次写入 AfterLM）
+        if store_afterlm(final_response_json, needpriv, safemsg, tag):
+            logging.info("数据保存成功")
+        else:
+            logging.error("数据保存失败")
             sys.exit(1)
+
+        logging.info("处理完成")
             
     except KeyboardInterrupt:
         logging.info("用户中断操作")
         sys.exit(0)
     except Exception as e:
-        logging.error(f"程序执行过程中发生未预期的错误: {e}")
+        logging.error("程序执行过程中发生未预期的错误: %s", e)
         logging.error(traceback.format_exc())
         sys.exit(1)
 
@@ -2559,6 +2916,12 @@ if __name__ == '__main__':
         print(f"文本提取测试: {'通过' if extraction_result else '失败'}")
         print(f"全部测试: {'✅ 全部通过' if privacy_result and extraction_result else '❌ 存在失败'}")
         
+    elif len(sys.argv) > 1 and sys.argv[1] == "--compact-afterlm":
+        # 迁移：压缩历史 AfterLM 行（main.sh 启动时调用）
+        logging.basicConfig(level=logging.INFO, format='LMWork:%(asctime)s - %(levelname)s - %(message)s')
+        db_path = sys.argv[2] if len(sys.argv) > 2 else DB_PATH
+        count = compact_afterlm_rows(db_path)
+        logging.info("AfterLM 紧凑化完成，改写 %s 行", count)
     elif len(sys.argv) > 1 and sys.argv[1] == "--test-text":
         # 仅运行文本提取测试
         logging.basicConfig(**get_logging_config())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""投稿视频处理：先探测、能 remux 就不转码，必须转码时放到后台队列。
+
+- ``ffprobe`` 判断编码：视频已是 H.264、音频为 AAC/MP3（或无音轨）时，
+  直接 ``-c copy -movflags +faststart`` 重新封装，通常不到一秒；
+- 其余情况先抽一帧作为封面（poster），把转码任务写入 cache/video_transcode/queue/，
+  由单个后台 worker 串行执行（``-preset veryfast``），调用方不等待；
+- 转码结果按源文件内容的 sha256 缓存在 cache/video_transcode/<hash>.mp4，
+  同一视频在重试、刷新或其他投稿中直接复用；
+- 转码进行中目标文件旁有 ``<目标>.pending`` 标记；转码失败时原文件保留原名，
+  目标旁写入 ``<目标>.failed``（内容为原文件路径），不会把未转码的文件冒充为 ``-h264.mp4``，
+  渲染器与重新处理时经 ``failed_source`` 改用原文件；
+- 发往 QZone 的只有 cache/prepost 中的图片（渲染页面与用户原图），视频只在渲染页面中以封面出现，
+  因此发送不需要等待转码完成。
+
+命令行：
+    python3 getmsgserv/LM_work/video_transcode.py --worker   # 处理队列（通常由 enqueue 自动拉起）
+"""
+
+import argparse
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from typing import Optional, Tuple
+
+CACHE_DIR = './cache/video_transcode'
+PENDING_SUFFIX = '.pending'
+FAILED_SUFFIX = '.failed'
+TRANSCODE_PRESET = 'veryfast'
+REMUX_VIDEO_CODECS = ('h264',)
+REMUX_AUDIO_CODECS = ('aac', 'mp3')
+CACHE_MAX_AGE_DAYS = 7
+
+
+def probe_codecs(path: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """返回 (视频编码, 音频编码)；ffprobe 不可用或解析失败返回 None。"""
+    try:
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,codec_name', '-of', 'json', path],
+            capture_output=True, text=True, timeout=30,
+        )
+        streams = json.loads(out.stdout or '{}').get('streams') or []
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+    if out.returncode != 0:
+        return None
+    video = next((s.get('codec_name') for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s.get('codec_name') for s in streams if s.get('codec_type') == 'audio'), None)
+    return video, audio
+
+
+def can_remux(codecs: Optional[Tuple[Optional[str], Optional[str]]]) -> bool:
+    if not codecs:
+        return False
+    video, audio = codecs
+    return video in REMUX_VIDEO_CODECS and (audio is None or audio in REMUX_AUDIO_CODECS)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _run_ffmpeg(args) -> bool:
+    try:
+        return subprocess.run(['ffmpeg', '-y', *args], stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+
+def remux(src: str, dest: str) -> bool:
+    tmp = dest + '.tmp.mp4'
+    if _run_ffmpeg(['-i', src, '-c', 'copy', '-movflags', '+faststart', tmp]) and os.path.isfile(tmp):
+        os.replace(tmp, dest)
+        return True
+    _unlink(tmp)
+    return False
+
+
+def transcode(src: str, dest: str, preset: str = TRANSCODE_PRESET) -> bool:
+    tmp = dest + '.tmp.mp4'
+    ok = _run_ffmpeg(['-i', src, '-c:v', 'libx264', '-preset', preset, '-crf', '23',
+                      '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', tmp])
+    if ok and os.path.isfile(tmp):
+        os.replace(tmp, dest)
+        return True
+    _unlink(tmp)
+    return False
+
+
+def extract_poster(src: str, poster: str) -> bool:
+    return _run_ffmpeg(['-i', src, '-frames:v', '1', '-q:v', '3', poster]) and os.path.isfile(poster)
+
+
+def _chmod_shared(path: str):
+    # 与原脚本一致：缓存目录中的媒体文件对其他进程（web_review 等）可写
+    try:
+        os.chmod(path, 0o666)
+    except OSError:
+        pass
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _place(cached: str, dest: str) -> bool:
+    """把缓存结果放到目标位置：优先硬链接，失败则复制。"""
+    tmp = dest + '.tmp'
+    _unlink(tmp)
+    try:
+        os.link(cached, tmp)
+    except OSError:
+        try:
+            shutil.copyfile(cached, tmp)
+        except OSError:
+            return False
+    os.replace(tmp, dest)
+    return True
+
+
+def prepare_video(src: str, dest: str, poster: str, cache_dir: str = CACHE_DIR) -> Tuple[str, Optional[str]]:
+    """处理单个视频，返回 (最终视频路径, 封面路径或 None)。
+
+    remux 与缓存命中同步完成；需要转码时抽帧后入队，返回的 dest 在转码完成前尚不存在
+    （旁边有 .pending 标记）。
+    """
+    if can_remux(probe_codecs(src)) and remux(src, dest):
+        _unlink(src)
+        _chmod_shared(dest)
+        return dest, None
+
+    try:
+        digest = file_sha256(src)
+    except OSError:
+        return src, None
+    cached = os.path.join(cache_dir, f'{digest}.mp4')
+    if os.path.isfile(cached) and _place(cached, dest):
+        _unlink(src)
+        _chmod_shared(dest)
+        return dest, None
+
+    has_poster = extract_poster(src, poster)
+    enqueue(src, dest, digest, cache_dir)
+    return dest, poster if has_poster else None
+
+
+def enqueue(src: str, dest: str, digest: str, cache_dir: str = CACHE_DIR):
+    queue_dir = os.path.join(cache_dir, 'queue')
+    os.makedirs(queue_dir, exist_ok=True)
+    with open(dest + PENDING_SUFFIX, 'w', encoding='utf-8') as f:
+        f.write(digest)
+    job = {'src': os.path.abspath(src), 'dest': os.path.abspath(dest), 'digest': digest, 'queued_at': time.time()}
+    path = os.path.join(queue_dir, f'{time.time():.6f}-{uuid.uuid4().hex[:8]}.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(path + '.tmp', path)
+    spawn_worker(cache_dir)
+
+
+def spawn_worker(cache_dir: str = CACHE_DIR):
+    """后台拉起 worker；已有 worker 在跑时新进程拿不到锁会立即退出。"""
+    try:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--worker', '--cache-dir', os.path.abspath(cache_dir)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        pass
+
+
+def run_job(job: dict, cache_dir: str) -> bool:
+    src, dest, digest = job['src'], job['dest'], job['digest']
+    cached = os.path.join(cache_dir, f'{digest}.mp4')
+    ok = os.path.isfile(cached) or (os.path.isfile(src) and transcode(src, cached))
+    if ok:
+        ok = _place(cached, dest)
+    if ok:
+        _unlink(src)
+        _chmod_shared(dest)
+    elif os.path.isfile(src):
+        # 转码失败：原文件保留原名，记录下来供重新处理时引用
+        with open(dest + FAILED_SUFFIX, 'w', encoding='utf-8') as f:
+            f.write(src)
+        _chmod_shared(src)
+    _unlink(dest + PENDING_SUFFIX)
+    return ok
+
+
+def failed_source(dest: str) -> Optional[str]:
+    """转码失败时返回保留下来的原文件路径，否则返回 None。"""
+    try:
+        with open(dest + FAILED_SUFFIX, 'r', encoding='utf-8') as f:
+            src = f.read().strip()
+    except OSError:
+        return None
+    return src if src and os.path.isfile(src) else None
+
+
+def prune_cache(cache_dir: str, max_age_days: float = CACHE_MAX_AGE_DAYS):
+    cutoff = time.time() - max_age_days * 86400
+    for path in glob.glob(os.path.join(cache_dir, '*.mp4')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def run_worker(cache_dir: str = CACHE_DIR) -> int:
+    """串行处理队列直到为空；同一时间只有一个 worker。返回处理的任务数。"""
+    queue_dir = os.path.join(cache_dir, 'queue')
+    os.makedirs(queue_dir, exist_ok=True)
+    done = 0
+    while True:
+        with open(os.path.join(cache_dir, 'worker.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return done
+            prune_cache(cache_dir)
+            while True:
+                jobs = sorted(glob.glob(os.path.join(queue_dir, '*.json')))
+                if not jobs:
+                    break
+                for path in jobs:
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            job = json.load(f)
+                        run_job(job, cache_dir)
+                    except (OSError, ValueError, KeyError):
+                        pass
+                    _unlink(path)
+                    done += 1
+        # 释放锁后再看一眼，避免与刚入队、却因拿不到锁而退出的 worker 擦肩而过
+        if not glob.glob(os.path.join(queue_dir, '*.json')):
+            return done
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='视频后台转码队列')
+    parser.add_argument('--worker', action='store_true', help='处理转码队列直到为空')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+    if args.worker:
+        run_worker(args.cache_dir)
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
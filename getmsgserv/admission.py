@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""私聊投稿准入控制：入库前拦截黑名单发件人，并按发件人限制消息速率与大小。
+
+serv.py 在写入任何数据之前调用：
+
+- 查内存中的 ``blocklist`` 副本。``blocklist`` 上的触发器在每次增删改时递增 ``blocklist_version``，
+  serv.py 最多每秒读一次该版本号，变化时才重新加载整张表。
+  command.sh、processsend.sh 用 sqlite3 改表也能及时生效；
+- 每个发件人两个令牌桶：消息条数（``admission_msg_per_min`` / ``admission_msg_burst``）
+  与字节数（``admission_kb_per_min``，可突发两分钟的量）。任一超限即丢弃该消息，0 为不限。
+  QQ 的多图投稿每张图是一条私聊消息，默认值按一次发几十张图留有余量；
+  发件人开始被限流时 ``notice_due`` 返回 True（每人每 ``NOTICE_INTERVAL_SEC`` 至多一次），由 serv.py 私聊告知；
+- 统计放行/拦截次数与拦截最多的发件人，定期写入 ``cache/admission_stats.json``。
+
+命令行：
+    python3 getmsgserv/admission.py stats      # 打印最近一次统计
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+
+DB_PATH = './cache/OQQWall.db'
+STATS_PATH = './cache/admission_stats.json'
+DEFAULT_MSG_PER_MIN = 60
+DEFAULT_MSG_BURST = 60
+DEFAULT_KB_PER_MIN = 1024
+BLOCKLIST_REFRESH_SEC = 1.0
+STATS_INTERVAL_SEC = 300
+NOTICE_INTERVAL_SEC = 600
+MAX_TRACKED_SENDERS = 10000
+TOP_SENDERS = 10
+
+ADMITTED = 'admitted'
+BLOCKED = 'blocked'
+RATE_LIMITED = 'rate_limited'
+SIZE_LIMITED = 'size_limited'
+
+VERSION_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS blocklist_version (
+  id      INTEGER PRIMARY KEY CHECK (id = 1),
+  version INT NOT NULL
+);'''
+_TRIGGER_SQL = '''CREATE TRIGGER IF NOT EXISTS blocklist_version_{event} AFTER {event} ON blocklist
+BEGIN
+  UPDATE blocklist_version SET version = version + 1 WHERE id = 1;
+END;'''
+
+
+def ensure_schema(conn: sqlite3.Connection) -> bool:
+    """创建版本表与触发器（blocklist 表由 main.sh 创建，不存在时返回 False）。"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='blocklist'").fetchone()
+    if not exists:
+        return False
+    conn.execute(VERSION_TABLE_SQL)
+    conn.execute('INSERT OR IGNORE INTO blocklist_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(_TRIGGER_SQL.format(event=event))
+    return True
+
+
+class TokenBucket:
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate  # 每秒补充
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.tokens
+
+    def full(self, now: float) -> bool:
+        return self.refill(now) >= self.capacity
+
+
+class Admission:
+    def __init__(self, db_path: str = DB_PATH, msg_per_min: float = DEFAULT_MSG_PER_MIN,
+                 msg_burst: float = DEFAULT_MSG_BURST, kb_per_min: float = DEFAULT_KB_PER_MIN,
+                 clock: Callable[[], float] = time.monotonic, refresh_interval: float = BLOCKLIST_REFRESH_SEC):
+        self.db_path = db_path
+        self.msg_rate = max(0.0, msg_per_min) / 60.0
+        self.msg_burst = max(1.0, msg_burst)
+        self.byte_rate = max(0.0, kb_per_min) * 1024 / 60.0
+        self.byte_burst = self.byte_rate * 120
+        self.clock = clock
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.blocked: FrozenSet[Tuple[str, str]] = frozenset()
+        self.blocklist_version: Optional[int] = None
+        self._checked_at: Optional[float] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self.buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self.counts: Counter = Counter()
+        self.rejected_by_sender: Counter = Counter()
+        self._noticed: Dict[str, float] = {}
+        self.started = time.time()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, str], db_path: str = DB_PATH) -> 'Admission':
+        def number(key, default):
+            try:
+                return float(str(config.get(key, '')).strip() or default)
+            except ValueError:
+                return default
+
+        return cls(db_path, number('admission_msg_per_min', DEFAULT_MSG_PER_MIN),
+                   number('admission_msg_burst', DEFAULT_MSG_BURST),
+                   number('admission_kb_per_min', DEFAULT_KB_PER_MIN))
+
+    # ---- 黑名单 ----
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._conn.execute('PRAGMA busy_timeout=5000;')
+        return self._conn
+
+    def reload(self):
+        with self.lock:
+            self._refresh_blocklist(force=True)
+
+    def _refresh_blocklist(self, force: bool = False):
+        """版本号变化（或 force）时重新加载黑名单；数据库暂不可用时沿用旧副本。调用方需持有锁。"""
+        now = self.clock()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT version FROM blocklist_version WHERE id = 1').fetchone()
+            version = row[0] if row else None
+            if not force and version is not None and version == self.blocklist_version:
+                return
+            rows = conn.execute('SELECT senderid, ACgroup FROM blocklist').fetchall()
+        except sqlite3.Error:
+            return
+        self.blocked = frozenset((str(s), str(g)) for s, g in rows)
+        self.blocklist_version = version
+
+    def is_blocked(self, senderid: str, acgroup: str) -> bool:
+        with self.lock:
+            self._refresh_blocklist()
+            return (senderid, acgroup) in self.blocked
+
+    # ---- 限流 ----
+    def _buckets(self, senderid: str, now: float):
+        pair = self.buckets.get(senderid)
+        if pair is None:
+            if len(self.buckets) >= MAX_TRACKED_SENDERS:
+                self._evict(now)
+            pair = (TokenBucket(self.msg_burst, self.msg_rate, now) if self.msg_rate else None,
+                    TokenBucket(self.byte_burst, self.byte_rate, now) if self.byte_rate else None)
+            self.buckets[senderid] = pair
+        return pair
+
+    def _evict(self, now: float):
+        """丢弃已回满的桶（与新建的桶等价）。"""
+        for senderid, pair in list(self.buckets.items()):
+            if all(b is None or b.full(now) for b in pair):
+                del self.buckets[senderid]
+
+    def check(self, senderid: str, acgroup: str, nbytes: int) -> str:
+        """返回 ADMITTED / BLOCKED / RATE_LIMITED / SIZE_LIMITED；放行时扣除令牌。"""
+        with self.lock:
+            self._refresh_blocklist()
+            if (senderid, acgroup) in self.blocked:
+                verdict = BLOCKED
+            else:
+                now = self.clock()
+                msg_bucket, byte_bucket = self._buckets(senderid, now)
+                if byte_bucket and (nbytes > byte_bucket.capacity or byte_bucket.refill(now) < nbytes):
+                    verdict = SIZE_LIMITED
+                elif msg_bucket and msg_bucket.refill(now) < 1:
+                    verdict = RATE_LIMITED
+                else:
+                    verdict = ADMITTED
+                    if msg_bucket:
+                        msg_bucket.tokens -= 1
+                    if byte_bucket:
+                        byte_bucket.tokens -= nbytes
+            self.counts[verdict] += 1
+            if verdict != ADMITTED:
+                self.rejected_by_sender[senderid] += 1
+                if len(self.rejected_by_sender) > MAX_TRACKED_SENDERS:
+                    self.rejected_by_sender = Counter(dict(self.rejected_by_sender.most_common(TOP_SENDERS)))
+            return verdict
+
+    def notice_due(self, senderid: str) -> bool:
+        """被限流的发件人是否该收到提醒：每人每 NOTICE_INTERVAL_SEC 至多一次。"""
+        with self.lock:
+            now = self.clock()
+            last = self._noticed.get(senderid)
+            if last is not None and now - last < NOTICE_INTERVAL_SEC:
+                return False
+            if len(self._noticed) >= MAX_TRACKED_SENDERS:
+                self._noticed = {s: t for s, t in self._noticed.items() if now - t < NOTICE_INTERVAL_SEC}
+            self._noticed[senderid] = now
+            return True
+
+    # ---- 统计 ----
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'since': int(self.started),
+                'updated': int(time.time()),
+                'counts': {k: self.counts.get(k, 0) for k in (ADMITTED, BLOCKED, RATE_LIMITED, SIZE_LIMITED)},
+                'blocklist_size': len(self.blocked),
+                'blocklist_version': self.blocklist_version,
+                'tracked_senders': len(self.buckets),
+                'top_rejected': self.rejected_by_sender.most_common(TOP_SENDERS),
+            }
+
+    def write_stats(self, path: str = STATS_PATH) -> dict:
+        snapshot = self.stats()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return snapshot
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description='私聊投稿准入控制')
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('stats', help='打印 serv.py 最近一次写入的统计')
+    p.add_argument('--path', default=STATS_PATH)
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.path, 'r', encoding='utf-8') as f:
+            print(json.dumps(json.load(f), ensure_ascii=False, indent=2))
+    except (OSError, ValueError) as exc:
+        print(f"无法读取 {args.path}: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
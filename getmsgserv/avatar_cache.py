@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""投稿者头像本地缓存。
+
+渲染时不联网取 qlogo 头像，改用本地文件：
+
+- 头像缓存在 ``cache/avatars/<uid>.jpg``，已缩小到页面上的实际像素（50px CSS × 360dpi 栅格化 ≈ 188px）；
+- serv.py 收到新投稿时后台预热（``warm_async``），文件超过 TTL（默认 7 天）才重新下载；
+- 渲染器调用 ``avatar_url``：有缓存（即使已过期）就用本地 file:// URL，
+  没有时同步下载一次（短超时），仍失败则用匿名头像。
+
+命令行：
+    python3 getmsgserv/avatar_cache.py warm <uid>...   # 下载/刷新
+    python3 getmsgserv/avatar_cache.py url <uid>       # 输出渲染用 URL
+"""
+
+import argparse
+import io
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import requests
+
+AVATAR_DIR = './cache/avatars'
+REMOTE_URL = 'https://qlogo2.store.qq.com/qzone/{uid}/{uid}/640'
+ANONYMOUS_AVATAR = 'getmsgserv/HTMLwork/source/Anonymous_avatar.png'
+AVATAR_PX = 188
+TTL_SEC = 7 * 86400
+FETCH_TIMEOUT = 5
+RENDER_FETCH_TIMEOUT = 3
+
+_inflight = set()
+_inflight_lock = threading.Lock()
+
+
+def _valid_uid(uid) -> bool:
+    return str(uid).isdigit()
+
+
+def avatar_path(uid, cache_dir: str = AVATAR_DIR) -> str:
+    return os.path.join(cache_dir, f'{uid}.jpg')
+
+
+def is_fresh(uid, cache_dir: str = AVATAR_DIR, ttl: float = TTL_SEC) -> bool:
+    try:
+        return time.time() - os.path.getmtime(avatar_path(uid, cache_dir)) < ttl
+    except OSError:
+        return False
+
+
+def downscale(data: bytes, size: int = AVATAR_PX) -> bytes:
+    """缩到 size×size（方形头像，页面上裁成圆形），输出 JPEG。"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            bg = Image.new('RGB', img.size, (255, 255, 255))
+            bg.paste(img, mask=img.split()[-1])
+            img = bg
+        else:
+            img = img.convert('RGB')
+        img = ImageOps.fit(img, (size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=90, optimize=True)
+        return out.getvalue()
+
+
+def fetch(uid, cache_dir: str = AVATAR_DIR, timeout: float = FETCH_TIMEOUT,
+          session: Optional[requests.Session] = None) -> bool:
+    """下载并缩小头像，原子写入缓存；失败返回 False（保留原有缓存）。"""
+    if not _valid_uid(uid):
+        return False
+    try:
+        resp = (session or requests).get(REMOTE_URL.format(uid=uid), timeout=timeout)
+        resp.raise_for_status()
+        data = downscale(resp.content)
+    except Exception:
+        return False
+    os.makedirs(cache_dir, exist_ok=True)
+    path = avatar_path(uid, cache_dir)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+
+def warm(uid, cache_dir: str = AVATAR_DIR, ttl: float = TTL_SEC) -> bool:
+    """缓存不存在或已过期时下载；返回缓存是否可用。"""
+    if is_fresh(uid, cache_dir, ttl):
+        return True
+    return fetch(uid, cache_dir) or os.path.isfile(avatar_path(uid, cache_dir))
+
+
+def warm_async(uid, cache_dir: str = AVATAR_DIR, ttl: float = TTL_SEC):
+    """后台预热（serv.py 收到新投稿时调用），同一 uid 同时只下载一次。"""
+    if not _valid_uid(uid) or is_fresh(uid, cache_dir, ttl):
+        return None
+    key = (cache_dir, str(uid))
+    with _inflight_lock:
+        if key in _inflight:
+            return None
+        _inflight.add(key)
+
+    def run():
+        try:
+            warm(uid, cache_dir, ttl)
+        finally:
+            with _inflight_lock:
+                _inflight.discard(key)
+
+    thread = threading.Thread(target=run, name=f'avatar-{uid}', daemon=True)
+    thread.start()
+    return thread
+
+
+def avatar_url(uid, root: Optional[str] = None, cache_dir: Optional[str] = None,
+               timeout: float = RENDER_FETCH_TIMEOUT) -> str:
+    """渲染用头像 URL：本地缓存 > 同步下载 > 匿名头像，始终是 file:// URL。"""
+    root = os.path.abspath(root or os.getcwd())
+    cache_dir = cache_dir or os.path.normpath(os.path.join(root, AVATAR_DIR))
+    path = avatar_path(uid, cache_dir)
+    if os.path.isfile(path) or fetch(uid, cache_dir, timeout):
+        return f'file://{os.path.abspath(path)}'
+    return f'file://{os.path.join(root, ANONYMOUS_AVATAR)}'
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='投稿者头像本地缓存')
+    parser.add_argument('--cache-dir', default=AVATAR_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('warm', help='下载或刷新过期头像')
+    p.add_argument('uids', nargs='+')
+    p.add_argument('--ttl', type=float, default=TTL_SEC)
+    p = sub.add_parser('url', help='输出渲染用头像 URL')
+    p.add_argument('uid')
+    args = parser.parse_args(argv)
+
+    if args.action == 'warm':
+        failed = [uid for uid in args.uids if not warm(uid, args.cache_dir, args.ttl)]
+        for uid in failed:
+            print(f'avatar {uid}: fetch failed', file=sys.stderr)
+        return 1 if failed else 0
+    print(avatar_url(args.uid, cache_dir=args.cache_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
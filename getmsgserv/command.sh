@@ -238,6 +238,8 @@ $group_pending"
             # 没有要保留的，全部删除
             rm -rf ./cache/prepost/*
         fi
+        media_gc
+        cache_prune
         # 查找正在运行的 preprocess.sh 的 tag
         running_tags=()
         while read -r pid cmdline; do
@@ -283,6 +285,7 @@ $group_pending"
                 if [ ! -z "$tag" ]; then
                     echo "tag=$tag"
                     rm -rf "./cache/prepost/$tag"
+                    media_release "$tag"
                 fi
             done <<< "$all_tags"
             # 删除 sendstorge 中的所有数据
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""投稿静默期调度：投稿人停止发送一段时间后再开始处理。
+
+- 轮询 sender 表中该 (senderid, receiver) 的 ``modtime``，每来一条新消息计时重新开始，
+  静默满 ``process_quiet_sec`` 秒即开始处理；
+- 总等待不超过 ``process_waittime``；
+- 最后一条消息是结束语（``process_end_signals``，如“发完了”）时立即开始处理。
+
+命令行（输出触发原因，如 ``quiet 30s`` / ``end-signal`` / ``max-wait 120s``）：
+    python3 getmsgserv/debounce.py wait <senderid> <receiver> [--quiet 30] [--max 120]
+"""
+
+import argparse
+import calendar
+import json
+import re
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DB_PATH = './cache/OQQWall.db'
+CONFIG_PATH = 'oqqwall.config'
+DEFAULT_QUIET_SEC = 30
+DEFAULT_MAX_WAIT = 120
+DEFAULT_END_SIGNALS = ('发完了', '发完啦', '发完', '就这些', '完毕', '结束')
+POLL_INTERVAL = 1.0
+_PUNCT_RE = re.compile(r'[\s。.，,！!～~…、；;：:\-—]+')
+
+
+def read_config(path: str = CONFIG_PATH) -> Dict[str, str]:
+    config: Dict[str, str] = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                config[key.strip()] = value.strip().strip('"')
+    except OSError:
+        pass
+    return config
+
+
+def parse_signals(value: Optional[str]) -> Tuple[str, ...]:
+    if not value:
+        return DEFAULT_END_SIGNALS
+    return tuple(s for s in (normalize(part) for part in re.split(r'[,，|]', value)) if s)
+
+
+def normalize(text: str) -> str:
+    return _PUNCT_RE.sub('', text or '')
+
+
+def last_message_text(rawmsg: Optional[str]) -> str:
+    """rawmsg 中最后一条消息的纯文本（含非文本段时返回空串，图片不算结束语）。"""
+    try:
+        messages = json.loads(rawmsg or '[]')
+    except ValueError:
+        return ''
+    if not isinstance(messages, list) or not messages or not isinstance(messages[-1], dict):
+        return ''
+    segments = messages[-1].get('message') or []
+    if isinstance(segments, str):
+        return segments
+    parts: List[str] = []
+    for seg in segments:
+        if not isinstance(seg, dict) or seg.get('type') != 'text':
+            return ''
+        parts.append(str((seg.get('data') or {}).get('text') or ''))
+    return ''.join(parts)
+
+
+def parse_modtime(value: Optional[str]) -> Optional[float]:
+    """sender.modtime（SQLite CURRENT_TIMESTAMP，UTC）转为时间戳。"""
+    if not value:
+        return None
+    try:
+        return float(calendar.timegm(time.strptime(value[:19], '%Y-%m-%d %H:%M:%S')))
+    except ValueError:
+        return None
+
+
+def decide(now: float, started: float, last_activity: float, last_text: str, quiet: float,
+           max_wait: float, signals: Iterable[str]) -> Optional[str]:
+    """返回触发原因；仍需等待时返回 None。"""
+    if normalize(last_text) in signals:
+        return 'end-signal'
+    if now - started >= max_wait:
+        return f'max-wait {int(now - started)}s'
+    if now - max(started, last_activity) >= quiet:
+        return f'quiet {int(now - started)}s'
+    return None
+
+
+def fetch_activity(senderid: str, receiver: str, db_path: str = DB_PATH) -> Tuple[Optional[str], Optional[str]]:
+    """(modtime, rawmsg)；发件人记录已被删除（如投稿被撤回）时均为 None。"""
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        row = conn.execute('SELECT modtime, rawmsg FROM sender WHERE senderid=? AND receiver=?',
+                           (senderid, receiver)).fetchone()
+    finally:
+        conn.close()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def wait(senderid: str, receiver: str, quiet: float = DEFAULT_QUIET_SEC, max_wait: float = DEFAULT_MAX_WAIT,
+         signals: Iterable[str] = DEFAULT_END_SIGNALS,
+         fetch: Optional[Callable[[], Tuple[Optional[str], Optional[str]]]] = None,
+         clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep) -> str:
+    """阻塞到静默期结束、收到结束语或达到等待上限，返回触发原因。"""
+    fetch = fetch or (lambda: fetch_activity(senderid, receiver))
+    signals = tuple(signals)
+    started = clock()
+    last_activity = started
+    seen_modtime: Optional[str] = None
+    last_text = ''
+    while True:
+        try:
+            modtime, rawmsg = fetch()
+        except sqlite3.Error:
+            modtime, rawmsg = None, None
+        if modtime is not None and modtime != seen_modtime:
+            # 新消息：计时从现在重新开始（modtime 只精确到秒，以本地观察到变化的时刻为准）
+            if seen_modtime is not None:
+                last_activity = clock()
+            else:
+                stamp = parse_modtime(modtime)
+                last_activity = max(started, stamp) if stamp else started
+            seen_modtime = modtime
+            last_text = last_message_text(rawmsg)
+        now = clock()
+        reason = decide(now, started, last_activity, last_text, quiet, max_wait, signals)
+        if reason:
+            return reason
+        remaining = min(max_wait - (now - started), quiet - (now - max(started, last_activity)))
+        sleep(max(0.05, min(POLL_INTERVAL, remaining)))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    config = read_config()
+    parser = argparse.ArgumentParser(description='投稿静默期调度')
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('wait', help='等待投稿人发完')
+    p.add_argument('senderid')
+    p.add_argument('receiver')
+    p.add_argument('--quiet', type=float, default=float(config.get('process_quiet_sec') or DEFAULT_QUIET_SEC))
+    p.add_argument('--max', type=float, default=float(config.get('process_waittime') or DEFAULT_MAX_WAIT))
+    p.add_argument('--signals', default=config.get('process_end_signals'), help='逗号分隔的结束语')
+    p.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args(argv)
+
+    quiet = min(args.quiet, args.max)
+    print(wait(args.senderid, args.receiver, quiet, args.max, parse_signals(args.signals),
+               fetch=lambda: fetch_activity(args.senderid, args.receiver, args.db)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
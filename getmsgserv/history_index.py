@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""私聊消息历史索引：message_id -> (时间, 预览文本)。
+
+progress-lite-json.sh 渲染 reply（引用）时需要被引用消息的时间和预览。
+serv.py 在收到私聊消息时写入 ``cache/OQQWall.db`` 的 ``msg_history`` 表，
+渲染时只按本次投稿引用到的 id 查询。
+
+- 预览规则与 progress-lite-json.sh 中 jq 的 ``preview`` 保持一致（按段拼接、压缩空白、截取前 80 字）；
+- 表为空时（例如刚升级）首次查询会从 priv_post.jsonl 末尾回填一次；
+- 超过 ``HISTORY_MAX_AGE_DAYS`` 的记录由 serv.py 启动时及运行中每小时清理一次，cache_prune 也会清理。
+
+命令行：
+    python3 getmsgserv/history_index.py lookup < rawmsg.json   # 输出 {id: {time, preview}}
+    python3 getmsgserv/history_index.py rebuild                # 从 priv_post.jsonl 重建
+    python3 getmsgserv/history_index.py prune [--days 30]      # 清理过期记录
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+DB_PATH = './cache/OQQWall.db'
+HISTORY_FILE = './getmsgserv/all/priv_post.jsonl'
+LEGACY_HISTORY_FILE = './getmsgserv/all/priv_post.json'
+HIST_TAIL_LINES = 20000
+HISTORY_MAX_AGE_DAYS = 30
+PRUNE_INTERVAL_SEC = 3600
+PREVIEW_LEN = 80
+
+# 与 main.sh 中 table_defs[msg_history] 保持一致
+HISTORY_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS msg_history (
+  message_id TEXT PRIMARY KEY,
+  time       INT,
+  preview    TEXT
+);'''
+
+_PLACEHOLDERS = {
+    'face': '[表情]',
+    'image': '[图片]',
+    'json': '[卡片]',
+    'file': '[文件]',
+    'poke': '[戳一戳]',
+}
+_WS = re.compile(r'\s+')
+
+
+def preview_text(message: Any) -> str:
+    segments = message.get('message') if isinstance(message, dict) else None
+    parts = []
+    for seg in segments or []:
+        if not isinstance(seg, dict):
+            continue
+        if seg.get('type') == 'text':
+            text = (seg.get('data') or {}).get('text')
+            parts.append(text if isinstance(text, str) else '')
+        else:
+            parts.append(_PLACEHOLDERS.get(seg.get('type'), ''))
+    return _WS.sub(' ', ''.join(parts))[:PREVIEW_LEN]
+
+
+def ensure_table(conn: sqlite3.Connection):
+    conn.execute(HISTORY_TABLE_SQL)
+
+
+def record_message(conn: sqlite3.Connection, message: dict) -> bool:
+    """写入/覆盖一条消息；不开启也不提交事务，由调用方决定（serv.py 在入库事务内调用）。"""
+    message_id = message.get('message_id') if isinstance(message, dict) else None
+    if message_id in (None, ''):
+        return False
+    conn.execute(
+        'INSERT OR REPLACE INTO msg_history (message_id, time, preview) VALUES (?, ?, ?)',
+        (str(message_id), message.get('time'), preview_text(message)),
+    )
+    return True
+
+
+def reply_ids(messages: Any) -> List[str]:
+    """找出投稿中所有 reply 段引用的 message_id。"""
+    ids = []
+    stack = [messages]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            data = cur.get('data')
+            if cur.get('type') == 'reply' and isinstance(data, dict) and data.get('id') not in (None, ''):
+                ids.append(str(data['id']))
+            stack.extend(cur.values())
+        elif isinstance(cur, list):
+            stack.extend(cur)
+    return sorted(set(ids))
+
+
+def lookup(ids: Iterable[str], db_path: str = DB_PATH) -> Dict[str, dict]:
+    ids = [str(i) for i in ids]
+    if not ids or not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        ensure_table(conn)
+        result = {}
+        # SQLite 默认参数上限 999，分批查询
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(
+                f'SELECT message_id, time, preview FROM msg_history WHERE message_id IN ({",".join("?" * len(chunk))})',
+                chunk).fetchall()
+            for message_id, ts, preview in rows:
+                result[message_id] = {'time': ts, 'preview': preview or ''}
+        return result
+    finally:
+        conn.close()
+
+
+def _read_history_tail(path: str, tail_lines: int) -> List[dict]:
+    """兼容 JSON Lines 与旧版数组格式，读取末尾 tail_lines 条。"""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as fp:
+            head = fp.read(64).lstrip()
+            fp.seek(0)
+            if head.startswith('['):
+                try:
+                    data = json.load(fp)
+                except ValueError:
+                    return []
+                return [m for m in data[-tail_lines:] if isinstance(m, dict)] if isinstance(data, list) else []
+            result = []
+            for line in deque(fp, maxlen=tail_lines):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(item, dict):
+                    result.append(item)
+            return result
+    except OSError:
+        return []
+
+
+def rebuild(db_path: str = DB_PATH, history_file: Optional[str] = None,
+            tail_lines: int = HIST_TAIL_LINES) -> int:
+    """从 priv_post.jsonl 末尾回填索引，返回写入条数。"""
+    if history_file is None:
+        history_file = HISTORY_FILE
+        if not os.path.exists(history_file) and os.path.exists(LEGACY_HISTORY_FILE):
+            history_file = LEGACY_HISTORY_FILE
+    messages = _read_history_tail(history_file, tail_lines)
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        ensure_table(conn)
+        count = sum(1 for m in messages if record_message(conn, m))
+        conn.commit()
+        return count
+    finally:
+        conn.close()
+
+
+def is_empty(db_path: str = DB_PATH) -> bool:
+    if not os.path.exists(db_path):
+        return True
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        ensure_table(conn)
+        return conn.execute('SELECT 1 FROM msg_history LIMIT 1').fetchone() is None
+    finally:
+        conn.close()
+
+
+def prune(conn: sqlite3.Connection, max_age_days: float = HISTORY_MAX_AGE_DAYS) -> int:
+    cutoff = int(time.time() - max_age_days * 86400)
+    return conn.execute('DELETE FROM msg_history WHERE time < ?', (cutoff,)).rowcount
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='私聊消息历史索引')
+    parser.add_argument('action', choices=['lookup', 'rebuild', 'prune'])
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--history', help='priv_post.jsonl 路径（回填/重建用）')
+    parser.add_argument('--days', type=float, default=HISTORY_MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    if args.action == 'prune':
+        conn = sqlite3.connect(args.db, timeout=10)
+        try:
+            conn.execute('PRAGMA busy_timeout=5000;')
+            ensure_table(conn)
+            with conn:
+                print(prune(conn, args.days))
+        finally:
+            conn.close()
+        return 0
+
+    if args.action == 'rebuild':
+        print(rebuild(args.db, args.history))
+        return 0
+
+    try:
+        messages = json.load(sys.stdin)
+    except ValueError:
+        messages = []
+    ids = reply_ids(messages)
+    if ids and is_empty(args.db):
+        rebuild(args.db, args.history)
+    json.dump(lookup(ids, args.db), sys.stdout, ensure_ascii=False)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""投稿媒体内容寻址存储（CAS）。
+
+同一张图片会出现在 cache/picture/<tag>/、cache/prepost/<tag>/、刷新后的新 tag 等多个位置，
+这些位置共享一份数据：
+
+- 文件内容按 sha256 存一份：``cache/media_store/blobs/<前两位>/<sha256>``；
+- 各 tag 的路径仍然存在（脚本、web_review、sendcontrol 照常按路径读取），
+  但只是指向 blob 的硬链接（跨文件系统时退回复制）；
+- ``cache/media_store/manifests/<tag>.json`` 记录该 tag 引用了哪些 blob（路径 -> sha256），
+  即引用计数；
+- tag 发送、删除、拒绝后调用 ``release`` 删除清单，不再被任何清单引用的 blob 随即回收。
+  ``gc`` 还会剔除已不存在的路径，用于目录被整体清空的情况。
+
+删除 blob 只是去掉存储里的一个硬链接，仍存在的 tag 路径不受影响。
+
+命令行：
+    python3 getmsgserv/media_store.py ingest <tag> <文件或目录>...   # 收录并去重
+    python3 getmsgserv/media_store.py link <tag> <源文件或 file:// URL> <目标>
+    python3 getmsgserv/media_store.py release <tag>...
+    python3 getmsgserv/media_store.py gc
+    python3 getmsgserv/media_store.py stats
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Set
+
+STORE_DIR = './cache/media_store'
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _same_file(a: str, b: str) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _link_replace(src: str, dest: str) -> bool:
+    """原子地让 dest 成为 src 的硬链接（dest 已存在时替换）。"""
+    tmp = f'{dest}.{os.getpid()}.lnk'
+    try:
+        os.link(src, tmp)
+        os.replace(tmp, dest)
+        return True
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+
+class MediaStore:
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.manifest_dir = os.path.join(root, 'manifests')
+
+    # ---- 基础 ---------------------------------------------------------------
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def manifest_path(self, tag) -> str:
+        return os.path.join(self.manifest_dir, f'{tag}.json')
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, 'store.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read_manifest(self, tag) -> Dict[str, str]:
+        try:
+            with open(self.manifest_path(tag), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, tag, entries: Dict[str, str]):
+        path = self.manifest_path(tag)
+        if not entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.manifest_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp, path)
+
+    def _manifest_tags(self) -> List[str]:
+        try:
+            return [name[:-5] for name in os.listdir(self.manifest_dir) if name.endswith('.json')]
+        except OSError:
+            return []
+
+    # ---- 收录 ---------------------------------------------------------------
+    def _adopt(self, path: str) -> Optional[str]:
+        """把文件收入存储并返回 sha256；已有同内容 blob 时把 path 换成指向它的硬链接。"""
+        digest = file_sha256(path)
+        blob = self.blob_path(digest)
+        if os.path.isfile(blob):
+            if not _same_file(blob, path):
+                _link_replace(blob, path)
+            return digest
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if not _link_replace(path, blob):
+            # 跨文件系统：存储里放一份副本，tag 路径保持原样
+            tmp = f'{blob}.{os.getpid()}.tmp'
+            try:
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, blob)
+            except OSError:
+                return None
+        return digest
+
+    def ingest(self, tag, paths: Iterable[str]) -> Dict[str, str]:
+        """收录 tag 的若干文件（去重），返回 {绝对路径: sha256}。"""
+        added: Dict[str, str] = {}
+        for path in paths:
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            try:
+                digest = self._adopt(path)
+            except OSError:
+                digest = None
+            if digest:
+                added[os.path.abspath(path)] = digest
+        if added:
+            with self._locked():
+                entries = self._read_manifest(tag)
+                entries.update(added)
+                self._write_manifest(tag, entries)
+        return added
+
+    def ingest_dir(self, tag, folder: str) -> Dict[str, str]:
+        try:
+            names = sorted(os.listdir(folder))
+        except OSError:
+            return {}
+        # 跳过临时文件与转码中的占位
+        return self.ingest(tag, [os.path.join(folder, n) for n in names
+                                 if not n.endswith(('.tmp', '.part', '.pending'))])
+
+    def link(self, tag, src: str, dest: str) -> bool:
+        """把 src 的内容放到 dest（经由存储硬链接），并记入 tag 的清单。"""
+        if src.startswith('file://'):
+            src = src[7:]
+        if not os.path.isfile(src):
+            return False
+        try:
+            digest = self._adopt(src)
+        except OSError:
+            return False
+        if not digest:
+            return False
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        if not _link_replace(blob, dest):
+            try:
+                shutil.copyfile(blob, dest)
+            except OSError:
+                return False
+        with self._locked():
+            entries = self._read_manifest(tag)
+            entries[os.path.abspath(dest)] = digest
+            self._write_manifest(tag, entries)
+        return True
+
+    # ---- 回收 ---------------------------------------------------------------
+    def _referenced(self) -> Set[str]:
+        refs: Set[str] = set()
+        for tag in self._manifest_tags():
+            refs.update(self._read_manifest(tag).values())
+        return refs
+
+    def _drop_blobs(self, digests: Iterable[str], referenced: Set[str]) -> int:
+        removed = 0
+        for digest in set(digests) - referenced:
+            try:
+                os.unlink(self.blob_path(digest))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def release(self, tags: Iterable) -> int:
+        """tag 生命周期结束：删除清单并回收只被它们引用的 blob，返回回收数。"""
+        with self._locked():
+            candidates: Set[str] = set()
+            for tag in tags:
+                candidates.update(self._read_manifest(tag).values())
+                self._write_manifest(tag, {})
+            if not candidates:
+                return 0
+            return self._drop_blobs(candidates, self._referenced())
+
+    def gc(self) -> int:
+        """剔除清单中已不存在的路径，并回收所有未被引用的 blob。"""
+        with self._locked():
+            for tag in self._manifest_tags():
+                entries = self._read_manifest(tag)
+                alive = {p: d for p, d in entries.items() if os.path.exists(p)}
+                if alive != entries:
+                    self._write_manifest(tag, alive)
+            existing = []
+            for dirpath, _, names in os.walk(self.blob_dir):
+                existing.extend(n for n in names if len(n) == 64)
+            return self._drop_blobs(existing, self._referenced())
+
+    def stats(self) -> dict:
+        blobs = 0
+        blob_bytes = 0
+        for dirpath, _, names in os.walk(self.blob_dir):
+            for name in names:
+                try:
+                    blob_bytes += os.path.getsize(os.path.join(dirpath, name))
+                    blobs += 1
+                except OSError:
+                    pass
+        refs = 0
+        logical = 0
+        for tag in self._manifest_tags():
+            for digest in self._read_manifest(tag).values():
+                refs += 1
+                try:
+                    logical += os.path.getsize(self.blob_path(digest))
+                except OSError:
+                    pass
+        return {'blobs': blobs, 'bytes': blob_bytes, 'manifests': len(self._manifest_tags()),
+                'references': refs, 'logical_bytes': logical}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='投稿媒体内容寻址存储')
+    parser.add_argument('--store', default=STORE_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('ingest', help='收录文件或目录并去重')
+    p.add_argument('tag')
+    p.add_argument('paths', nargs='+')
+    p = sub.add_parser('link', help='经由存储把源文件硬链接到目标位置')
+    p.add_argument('tag')
+    p.add_argument('src')
+    p.add_argument('dest')
+    p = sub.add_parser('release', help='tag 结束：删除清单并回收 blob')
+    p.add_argument('tags', nargs='+')
+    sub.add_parser('gc', help='剔除失效引用并回收未引用 blob')
+    sub.add_parser('stats', help='输出存储统计（JSON）')
+    args = parser.parse_args(argv)
+
+    store = MediaStore(args.store)
+    if args.action == 'ingest':
+        count = 0
+        for path in args.paths:
+            added = store.ingest_dir(args.tag, path) if os.path.isdir(path) else store.ingest(args.tag, [path])
+            count += len(added)
+        print(count)
+        return 0
+    if args.action == 'link':
+        return 0 if store.link(args.tag, args.src, args.dest) else 1
+    if args.action == 'release':
+        print(store.release(args.tags))
+        return 0
+    if args.action == 'gc':
+        print(store.gc())
+        return 0
+    print(json.dumps(store.stats(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""外发图片编码：按账户组的尺寸与大小预算压缩 cache/prepost/<tag>/ 中的图片。
+
+preprocess.sh 的最后一步：
+
+- 每个账户组可设置 ``outbound_image_short_side``（短边像素上限，长截图不因长边被缩小）、
+  ``outbound_image_max_kb``（单张字节预算）与 ``outbound_image_format``（jpeg / webp），0 为不限；
+  账户组未设置时不限，图片原样发送；
+- 已满足限制的图片原样保留（不做有损重编码）；否则缩放到短边上限，
+  以渐进式 JPEG（或 WebP）二分查找预算内的最高质量，最低质量仍超出时再按比例缩小；
+- 多张图片用线程池并行编码（Pillow 编解码时释放 GIL）；动图保持原样；
+- 结果先写临时文件再 ``os.replace`` 替换，不原地改写：prepost 中的文件可能是
+  render_cache 或 media_store 的硬链接；
+- ``cache/outbound/<tag>.json`` 记录每张图的原始与发送大小、尺寸和处理方式。
+
+命令行：
+    python3 getmsgserv/outbound_encoder.py encode <tag> <目录> [--group <账户组>]
+    python3 getmsgserv/outbound_encoder.py prune [--days 30]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+MANIFEST_DIR = './cache/outbound'
+GROUP_CONFIG = 'AcountGroupcfg.json'
+# 账户组未设置时不限（0），未主动启用的组不做有损重编码
+DEFAULT_SHORT_SIDE = 0
+DEFAULT_MAX_KB = 0
+DEFAULT_FORMAT = 'jpeg'
+MAX_QUALITY = 90
+MIN_QUALITY = 50
+MAX_SHRINK_ROUNDS = 4
+MANIFEST_MAX_AGE_DAYS = 30
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def group_settings(group: Optional[str], config_path: str = GROUP_CONFIG) -> dict:
+    """读取账户组的外发图片设置，缺省或非法时使用默认值。"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            obj = (json.load(f) or {}).get(group or '') or {}
+    except (OSError, ValueError, AttributeError):
+        obj = {}
+
+    def as_int(key, default):
+        try:
+            return max(0, int(str(obj.get(key, default)).strip() or default))
+        except ValueError:
+            return default
+
+    fmt = str(obj.get('outbound_image_format') or DEFAULT_FORMAT).strip().lower()
+    return {
+        'short_side': as_int('outbound_image_short_side', DEFAULT_SHORT_SIDE),
+        'max_kb': as_int('outbound_image_max_kb', DEFAULT_MAX_KB),
+        'format': 'webp' if fmt == 'webp' else 'jpeg',
+    }
+
+
+def _flatten(img):
+    from PIL import Image
+
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        bg = Image.new('RGB', img.size, (255, 255, 255))
+        bg.paste(img, mask=img.split()[-1])
+        return bg
+    return img.convert('RGB')
+
+
+def _save(img, fmt: str, quality: int) -> bytes:
+    out = io.BytesIO()
+    if fmt == 'webp':
+        img.save(out, 'WEBP', quality=quality, method=4)
+    else:
+        img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _fit_quality(img, fmt: str, max_bytes: int) -> Tuple[bytes, int]:
+    """预算内的最高质量（二分查找）；最低质量仍超出时返回最低质量的结果。"""
+    data = _save(img, fmt, MAX_QUALITY)
+    if not max_bytes or len(data) <= max_bytes:
+        return data, MAX_QUALITY
+    lo, hi = MIN_QUALITY, MAX_QUALITY - 1
+    best: Optional[Tuple[bytes, int]] = None
+    while lo <= hi:
+        q = (lo + hi) // 2
+        data = _save(img, fmt, q)
+        if len(data) <= max_bytes:
+            best = (data, q)
+            lo = q + 1
+        else:
+            hi = q - 1
+    return best or (_save(img, fmt, MIN_QUALITY), MIN_QUALITY)
+
+
+def encode_image(data: bytes, short_side: int = DEFAULT_SHORT_SIDE, max_kb: int = DEFAULT_MAX_KB,
+                 fmt: str = DEFAULT_FORMAT) -> Tuple[Optional[bytes], dict]:
+    """返回 (新图片数据, 信息)；无需处理时新数据为 None。"""
+    from PIL import Image, ImageOps
+
+    max_bytes = max_kb * 1024
+    with Image.open(io.BytesIO(data)) as img:
+        size = img.size
+        info = {'size': list(size), 'format': (img.format or '').lower()}
+        if getattr(img, 'is_animated', False):
+            return None, {**info, 'action': 'kept-animated'}
+        too_big = short_side and min(size) > short_side
+        if not too_big and (not max_bytes or len(data) <= max_bytes):
+            return None, {**info, 'action': 'kept'}
+        img = _flatten(ImageOps.exif_transpose(img))
+    if too_big:
+        scale = short_side / min(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                         Image.Resampling.LANCZOS)
+    out, quality = _fit_quality(img, fmt, max_bytes)
+    for _ in range(MAX_SHRINK_ROUNDS):
+        if not max_bytes or len(out) <= max_bytes:
+            break
+        # 最低质量仍超预算：按面积比例缩小后重试
+        scale = max(0.5, min(0.9, (max_bytes / len(out)) ** 0.5))
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                         Image.Resampling.LANCZOS)
+        out, quality = _fit_quality(img, fmt, max_bytes)
+    if not too_big and len(out) >= len(data):
+        return None, {**info, 'action': 'kept'}
+    return out, {**info, 'action': 'encoded', 'sent_size': list(img.size), 'quality': quality,
+                 'sent_format': fmt}
+
+
+def _target_name(name: str, fmt: str) -> str:
+    stem, ext = os.path.splitext(name)
+    if fmt == 'webp':
+        return f'{stem}.webp'
+    return name if ext.lower() in ('.jpg', '.jpeg') else f'{stem}.jpg'
+
+
+def encode_file(path: str, settings: dict) -> dict:
+    """处理单个文件：写临时文件后替换（不改写可能被硬链接共享的原 inode）。"""
+    name = os.path.basename(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    entry = {'name': name, 'original_bytes': len(data), 'sent_name': name, 'sent_bytes': len(data)}
+    try:
+        out, info = encode_image(data, settings['short_side'], settings['max_kb'], settings['format'])
+    except Exception as exc:
+        return {**entry, 'action': 'error', 'error': str(exc)}
+    entry.update(info)
+    if out is None:
+        return entry
+    target = os.path.join(os.path.dirname(path), _target_name(name, settings['format']))
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(out)
+    os.replace(tmp, target)
+    if target != path:
+        os.unlink(path)
+    entry.update(sent_name=os.path.basename(target), sent_bytes=len(out))
+    return entry
+
+
+def list_images(folder: str) -> List[str]:
+    try:
+        names = sorted(os.listdir(folder))
+    except OSError:
+        return []
+    return [os.path.join(folder, n) for n in names
+            if n.lower().endswith(IMAGE_EXTS) and os.path.isfile(os.path.join(folder, n))]
+
+
+def encode_folder(tag, folder: str, settings: dict, manifest_dir: Optional[str] = MANIFEST_DIR,
+                  workers: Optional[int] = None) -> dict:
+    """并行处理目录中的全部图片，写入清单并返回。"""
+    paths = list_images(folder)
+    started = time.monotonic()
+    workers = max(1, min(len(paths) or 1, workers or os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files = list(pool.map(lambda p: encode_file(p, settings), paths))
+    manifest = {
+        'tag': str(tag),
+        'created': int(time.time()),
+        'settings': settings,
+        'files': files,
+        'original_bytes': sum(f['original_bytes'] for f in files),
+        'sent_bytes': sum(f['sent_bytes'] for f in files),
+        'ms': int((time.monotonic() - started) * 1000),
+    }
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+        path = os.path.join(manifest_dir, f'{tag}.json')
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    return manifest
+
+
+def prune(manifest_dir: str = MANIFEST_DIR, max_age_days: float = MANIFEST_MAX_AGE_DAYS) -> int:
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    try:
+        names = os.listdir(manifest_dir)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(manifest_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='外发图片编码')
+    parser.add_argument('--manifest-dir', default=MANIFEST_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('encode', help='按账户组设置处理目录中的图片')
+    p.add_argument('tag')
+    p.add_argument('folder')
+    p.add_argument('--group', help='账户组名（读取 AcountGroupcfg.json）')
+    p.add_argument('--workers', type=int)
+    p = sub.add_parser('prune', help='清理旧清单')
+    p.add_argument('--days', type=float, default=MANIFEST_MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    if args.action == 'prune':
+        print(prune(args.manifest_dir, args.days))
+        return 0
+    manifest = encode_folder(args.tag, args.folder, group_settings(args.group), args.manifest_dir, args.workers)
+    errors = [f for f in manifest['files'] if f.get('action') == 'error']
+    for f in errors:
+        print(f"outbound {f['name']}: {f['error']}", file=sys.stderr)
+    encoded = sum(1 for f in manifest['files'] if f.get('action') == 'encoded')
+    print(f"{len(manifest['files'])} {encoded} {manifest['original_bytes']} {manifest['sent_bytes']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""投稿 LLM 处理编排：分阶段执行、逐阶段检查点与重试。
+
+preprocess.sh 调用，把 ``progress-lite-json.sh | sendtoLM.py`` 拆成独立阶段：
+
+    fetch（拉取/展开消息）→ media（图片/视频获取）→ images（图片安全检查与描述）
+    → grouping（分组）→ needpriv / safety（并行）→ store（写入 AfterLM）
+
+- 每个阶段的输出以 JSON 检查点写入 ``cache/pipeline/<tag>/<阶段>.json``，并记录输入摘要
+  （fetch 以 sender 表中的原始消息为输入，其余阶段以上游输出为输入）；输入不变时直接复用；
+- 阶段失败只重试该阶段（指数退避），上游检查点不受影响；重试用尽后保留检查点，
+  下次处理同一 tag（如刷新）从失败的阶段继续；全部成功后删除检查点；
+- 依赖已满足的阶段并行执行（needpriv 与 safety 互不依赖）；
+- 每个阶段写入一条 trace span（``pipeline_<阶段>``）。
+
+渲染与审核通知仍由 preprocess.sh 完成；渲染已有 render_cache 作为检查点。
+
+命令行（退出码 0 成功；3 为某阶段重试用尽；其他为编排器自身异常，preprocess.sh 回退到旧流程）：
+    python3 getmsgserv/pipeline.py run <tag> --port <napcat 端口>
+    python3 getmsgserv/pipeline.py prune [--days 7]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+
+CHECKPOINT_DIR = './cache/pipeline'
+DB_PATH = './cache/OQQWall.db'
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 2.0
+CHECKPOINT_MAX_AGE_DAYS = 7
+EXIT_STEP_FAILED = 3
+
+
+class StepFailed(Exception):
+    """某阶段重试用尽。"""
+
+    def __init__(self, step: str, attempts: int, error: BaseException):
+        super().__init__(f"{step} 失败（{attempts} 次）: {error}")
+        self.step = step
+        self.attempts = attempts
+        self.error = error
+
+
+class Step:
+    """一个阶段：``func(inputs)`` 接收 {上游阶段名: 输出}，返回可 JSON 序列化的输出。"""
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.retries = retries
+        self.backoff = backoff
+
+
+def digest(*parts: Any) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class Pipeline:
+    def __init__(self, tag, steps: List[Step], checkpoint_dir: Optional[str] = CHECKPOINT_DIR,
+                 sleep: Callable[[float], None] = time.sleep, max_workers: int = 4,
+                 trace: Optional[Callable[..., None]] = None, log: Optional[Callable[[str], None]] = None):
+        names = [s.name for s in steps]
+        for step in steps:
+            missing = [d for d in step.deps if d not in names]
+            if missing:
+                raise ValueError(f"阶段 {step.name} 依赖未知阶段: {missing}")
+        self.tag = str(tag)
+        self.steps = {s.name: s for s in steps}
+        self.order = names
+        self.dir = os.path.join(checkpoint_dir, self.tag) if checkpoint_dir else None
+        self.sleep = sleep
+        self.max_workers = max_workers
+        self.trace = trace
+        self.log = log or (lambda msg: print(f"pipeline {self.tag}: {msg}", file=sys.stderr))
+
+    # ---- 检查点 ----
+    def _checkpoint_path(self, name: str) -> Optional[str]:
+        return os.path.join(self.dir, f'{name}.json') if self.dir else None
+
+    def load_checkpoint(self, name: str, input_digest: str) -> Optional[dict]:
+        path = self._checkpoint_path(name)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(record, dict) or record.get('input') != input_digest or 'output' not in record:
+            return None
+        return record
+
+    def save_checkpoint(self, name: str, input_digest: str, output: Any, attempts: int):
+        path = self._checkpoint_path(name)
+        if not path:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'input': input_digest, 'attempts': attempts, 'created': int(time.time()),
+                       'output': output}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def clear(self):
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    # ---- 执行 ----
+    def _run_step(self, step: Step, inputs: Dict[str, Any], input_digest: str) -> Any:
+        record = self.load_checkpoint(step.name, input_digest)
+        if record is not None:
+            self.log(f"{step.name}: 复用检查点")
+            if self.trace:
+                now = time.time()
+                self.trace(self.tag, f'pipeline_{step.name}', now, now, 0, None, 'checkpoint')
+            return record['output']
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.time()
+            try:
+                output = step.func(inputs)
+                # 先序列化一次：输出无法写入检查点也算该阶段失败
+                json.dumps(output, ensure_ascii=False)
+            except Exception as exc:
+                if self.trace:
+                    self.trace(self.tag, f'pipeline_{step.name}', start, time.time(), 1, None,
+                               f'attempt {attempt}: {type(exc).__name__}')
+                if attempt > step.retries:
+                    raise StepFailed(step.name, attempt, exc) from exc
+                delay = step.backoff * (2 ** (attempt - 1))
+                self.log(f"{step.name}: 第 {attempt} 次失败（{exc}），{delay:g}s 后重试")
+                self.sleep(delay)
+                continue
+            if self.trace:
+                self.trace(self.tag, f'pipeline_{step.name}', start, time.time(), 0, None, f'attempt {attempt}')
+            self.save_checkpoint(step.name, input_digest, output, attempt)
+            return output
+
+    def run(self, key: Any = '') -> Dict[str, Any]:
+        """按依赖执行全部阶段，返回 {阶段名: 输出}；失败时抛出 StepFailed 并保留检查点。"""
+        outputs: Dict[str, Any] = {}
+        pending = list(self.order)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            failure: Optional[StepFailed] = None
+            while pending or running:
+                if failure is None:
+                    for name in [n for n in pending if all(d in outputs for d in self.steps[n].deps)]:
+                        step = self.steps[name]
+                        inputs = {d: outputs[d] for d in step.deps}
+                        input_digest = digest(name, key, inputs)
+                        running[pool.submit(self._run_step, step, inputs, input_digest)] = name
+                        pending.remove(name)
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except StepFailed as exc:
+                        failure = failure or exc
+            if failure is not None:
+                raise failure
+        self.clear()
+        return outputs
+
+
+def prune(checkpoint_dir: str = CHECKPOINT_DIR, max_age_days: float = CHECKPOINT_MAX_AGE_DAYS) -> int:
+    """删除长期未续跑的检查点目录。"""
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    try:
+        names = os.listdir(checkpoint_dir)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(checkpoint_dir, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# ---- 投稿处理的各阶段 ----
+
+def sender_key(tag, db_path: str = DB_PATH) -> str:
+    """fetch 阶段的输入：投稿人当前的原始消息。消息有更新时不复用旧的检查点。"""
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        row = conn.execute(
+            'SELECT s.rawmsg FROM preprocess p JOIN sender s ON s.senderid = p.senderid AND s.receiver = p.receiver '
+            'WHERE p.tag = ?', (str(tag),)).fetchone()
+    finally:
+        conn.close()
+    return digest(row[0] if row else None)
+
+
+def _run_json(cmd: List[str], stdin: Optional[str] = None, env: Optional[dict] = None) -> Any:
+    proc = subprocess.run(cmd, input=stdin, capture_output=True, text=True, env=env)
+    if proc.stderr:
+        sys.stderr.write(proc.stderr)
+    if proc.returncode != 0 or not proc.stdout.strip():
+        raise RuntimeError(f"{os.path.basename(cmd[1])} 退出码 {proc.returncode}")
+    return json.loads(proc.stdout)
+
+
+def build_steps(tag, port, lm, config: dict) -> List[Step]:
+    """lm 为已加载的 sendtoLM 模块。"""
+    tag = str(tag)
+    container = os.environ.get('NAPCAT_CONTAINER', 'napcat')
+
+    def fetch(_):
+        env = dict(os.environ, OQQWALL_COLLECT_SKIP_MEDIA='1')
+        return _run_json(['bash', 'getmsgserv/LM_work/progress-lite-json.sh', tag, str(port)], env=env)
+
+    def media(inputs):
+        data = inputs['fetch']
+        stdin = json.dumps(data.get('messages', []), ensure_ascii=False)
+        try:
+            messages = _run_json(
+                [sys.executable, 'getmsgserv/LM_work/media_fetch.py', '--tag', tag,
+                 '--folder', os.path.join('cache', 'picture', tag), '--pwd', os.getcwd(), '--container', container],
+                stdin=stdin)
+        except (RuntimeError, ValueError) as exc:
+            # 与旧流程一致：media_fetch.py 失败时回退到 progress-lite-json.sh 中的逐个复制
+            print(f"media_fetch.py 执行失败（{exc}），回退到逐个复制", file=sys.stderr)
+            env = dict(os.environ, OQQWALL_LEGACY_MEDIA='1')
+            messages = _run_json(['bash', 'getmsgserv/LM_work/progress-lite-json.sh', tag, str(port)],
+                                 stdin=stdin, env=env)
+        return {**data, 'messages': messages}
+
+    def images(inputs):
+        data = json.loads(json.dumps(inputs['media']))
+        lm.process_images_comprehensive(tag, config, data)
+        lm.merge_image_descriptions(data)
+        return data
+
+    def grouping(inputs):
+        result, origin = lm.group_messages(tag, inputs['images'], config)
+        return {'result': result, 'judge': lm.messages_for_judgment(result, origin)}
+
+    def needpriv(inputs):
+        judged = inputs['grouping']['judge']
+        if not judged:
+            return {'needpriv': 'false', 'reason': 'empty'}
+        value, reason, _ = lm.judge_needpriv(judged, config)
+        return {'needpriv': value, 'reason': reason}
+
+    def safety(inputs):
+        judged = inputs['grouping']['judge']
+        if not judged:
+            return {'safemsg': 'true', 'reason': 'empty'}
+        value, reason = lm.judge_safemsg(judged, config)
+        return {'safemsg': value, 'reason': reason}
+
+    def store(inputs):
+        result = json.loads(json.dumps(inputs['grouping']['result']))
+        if not lm.store_afterlm(result, inputs['needpriv']['needpriv'], inputs['safety']['safemsg'], tag):
+            raise RuntimeError('AfterLM 保存失败')
+        return {'needpriv': result['needpriv'], 'safemsg': result['safemsg'],
+                'messages': len(result.get('messages') or [])}
+
+    return [
+        Step('fetch', fetch),
+        Step('media', media, ['fetch']),
+        Step('images', images, ['media']),
+        Step('grouping', grouping, ['images']),
+        Step('needpriv', needpriv, ['grouping']),
+        Step('safety', safety, ['grouping']),
+        Step('store', store, ['grouping', 'needpriv', 'safety']),
+    ]
+
+
+def run(tag, port, checkpoint_dir: str = CHECKPOINT_DIR) -> int:
+    sys.path.append(os.path.join(HERE, 'LM_work'))
+    import logging
+
+    import sendtoLM as lm
+    from pipeline_trace import record_span
+
+    logging.basicConfig(**lm.get_logging_config())
+    config = lm.read_config('oqqwall.config')
+    if not config.get('apikey'):
+        logging.error("配置中缺少API密钥")
+        return EXIT_STEP_FAILED
+    lm.dashscope.api_key = config.get('apikey')
+
+    def trace(tag_, stage, start, end, exit_code, nbytes, note):
+        record_span(tag_, stage, start, end, exit_code=exit_code, nbytes=nbytes, note=note)
+
+    pipeline = Pipeline(tag, build_steps(tag, port, lm, config), checkpoint_dir, trace=trace,
+                        log=logging.info)
+    try:
+        outputs = pipeline.run(key=sender_key(tag))
+    except StepFailed as exc:
+        logging.error("处理失败，检查点已保留: %s", exc)
+        return EXIT_STEP_FAILED
+    logging.info("处理完成: %s", outputs['store'])
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='投稿 LLM 处理编排')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('run', help='处理一个投稿（从已有检查点继续）')
+    p.add_argument('tag')
+    p.add_argument('--port', required=True, help='NapCat HTTP 端口')
+    p = sub.add_parser('prune', help='清理旧检查点')
+    p.add_argument('--days', type=float, default=CHECKPOINT_MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    if args.action == 'prune':
+        print(prune(args.checkpoint_dir, args.days))
+        return 0
+    return run(args.tag, args.port, args.checkpoint_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""投稿处理链路追踪（trace）。
+
+一次投稿从 serv.py 入库开始，依次经过 preprocess.sh、progress-lite-json.sh、
+sendtoLM.py、gotohtml.sh、Chrome、ImageMagick、processsend.sh、sendcontrol.sh。
+各阶段分属不同进程，这里用同一个 trace_id 把它们串起来：
+
+- trace_id 由 tag 派生（``<tag>-<毫秒时间戳>``），通过环境变量 ``OQQ_TRACE_ID`` 向子进程传递；
+- 每个阶段结束时向 ``cache/OQQWall.db`` 的 ``trace_span`` 表写入一行
+  （开始/结束时间、耗时、退出码、产出字节数、备注）；
+- bash 侧使用 Global_toolkit.sh 中的 ``trace_now`` / ``trace_span``，Python 侧使用本模块的 ``span()``；
+- 按 (tag, start_ts) 建索引，查询某个 tag 的时间线不扫全表；超过 ``TRACE_MAX_AGE_DAYS`` 的 span
+  由 ``prune`` 删除（main.sh 每 6 小时经 cache_prune 调用）。
+
+写入失败只会被忽略，不影响主流程。
+
+命令行：
+    python3 getmsgserv/pipeline_trace.py <tag>            # 打印时间线
+    python3 getmsgserv/pipeline_trace.py <tag> --json     # 输出 JSON
+    python3 getmsgserv/pipeline_trace.py record <tag> <stage> <start> [end] [exit_code] [bytes] [note]
+    python3 getmsgserv/pipeline_trace.py prune [--days 30]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+DB_PATH = './cache/OQQWall.db'
+TRACE_ENV = 'OQQ_TRACE_ID'
+TRACE_MAX_AGE_DAYS = 30
+
+# 与 main.sh 中 table_defs[trace_span] 保持一致
+TRACE_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS trace_span (
+  trace_id   TEXT,
+  tag        TEXT,
+  stage      TEXT,
+  pid        INT,
+  start_ts   REAL,
+  end_ts     REAL,
+  duration   REAL,
+  exit_code  INT,
+  bytes      INT,
+  note       TEXT
+);'''
+TRACE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_trace_span_tag ON trace_span (tag, start_ts);'
+
+
+def new_trace_id(tag) -> str:
+    return f"{tag}-{int(time.time() * 1000)}"
+
+
+def current_trace_id(tag) -> str:
+    """优先沿用环境变量中属于该 tag 的 trace_id，否则新建一个并写回环境变量供子进程继承。"""
+    trace_id = os.environ.get(TRACE_ENV)
+    if not trace_id or not trace_id.startswith(f"{tag}-"):
+        trace_id = new_trace_id(tag)
+        os.environ[TRACE_ENV] = trace_id
+    return trace_id
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.execute(TRACE_TABLE_SQL)
+    conn.execute(TRACE_INDEX_SQL)
+    return conn
+
+
+def record_span(tag, stage: str, start_ts: float, end_ts: Optional[float] = None,
+                exit_code: int = 0, nbytes: Optional[int] = None, note: str = '',
+                trace_id: Optional[str] = None, db_path: str = DB_PATH) -> bool:
+    """写入一条 span；任何异常都吞掉并返回 False。"""
+    if end_ts is None:
+        end_ts = time.time()
+    try:
+        conn = _connect(db_path)
+        try:
+            conn.execute(
+                'INSERT INTO trace_span (trace_id, tag, stage, pid, start_ts, end_ts, duration, exit_code, bytes, note) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (trace_id or current_trace_id(tag), str(tag), stage, os.getpid(),
+                 start_ts, end_ts, max(0.0, end_ts - start_ts), int(exit_code),
+                 nbytes, note or None),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return True
+    except Exception:
+        return False
+
+
+@contextmanager
+def span(tag, stage: str, db_path: str = DB_PATH):
+    """记录 with 块的耗时；块内可设置 info['bytes'] / info['note'] / info['exit_code']。"""
+    info: Dict[str, object] = {}
+    start_ts = time.time()
+    try:
+        yield info
+    except BaseException as exc:
+        info.setdefault('exit_code', 1)
+        info.setdefault('note', type(exc).__name__)
+        raise
+    finally:
+        record_span(tag, stage, start_ts, time.time(),
+                    exit_code=info.get('exit_code', 0), nbytes=info.get('bytes'),
+                    note=info.get('note', ''), db_path=db_path)
+
+
+def fetch_spans(tag, db_path: str = DB_PATH, trace_id: Optional[str] = None) -> List[dict]:
+    """读取某个 tag 的全部 span；默认只取最近一次 trace。"""
+    if not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='trace_span'").fetchone()
+        if not exists:
+            return []
+        if trace_id is None:
+            row = conn.execute(
+                'SELECT trace_id FROM trace_span WHERE tag = ? ORDER BY start_ts DESC LIMIT 1',
+                (str(tag),)).fetchone()
+            if not row:
+                return []
+            trace_id = row['trace_id']
+        rows = conn.execute(
+            'SELECT * FROM trace_span WHERE tag = ? AND trace_id = ? ORDER BY start_ts, end_ts',
+            (str(tag), trace_id)).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+
+def list_traces(tag, db_path: str = DB_PATH) -> List[str]:
+    if not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        rows = conn.execute(
+            'SELECT trace_id, MIN(start_ts) AS s FROM trace_span WHERE tag = ? GROUP BY trace_id ORDER BY s',
+            (str(tag),)).fetchall()
+        return [r[0] for r in rows]
+    except sqlite3.Error:
+        return []
+    finally:
+        conn.close()
+
+
+def prune(db_path: str = DB_PATH, max_age_days: float = TRACE_MAX_AGE_DAYS) -> int:
+    """删除开始时间早于 max_age_days 天前的 span，返回删除行数。"""
+    if not os.path.exists(db_path):
+        return 0
+    conn = _connect(db_path)
+    try:
+        with conn:
+            return conn.execute('DELETE FROM trace_span WHERE start_ts < ?',
+                                (time.time() - max_age_days * 86400,)).rowcount
+    finally:
+        conn.close()
+
+
+def build_timeline(spans: List[dict]) -> dict:
+    """把 span 列表整理成相对时间线，供 CLI 与 web_review 共用。"""
+    if not spans:
+        return {'trace_id': None, 'start_ts': None, 'total': 0.0, 'spans': []}
+    origin = min(s['start_ts'] for s in spans)
+    end = max(s['end_ts'] for s in spans)
+    items = []
+    for s in spans:
+        items.append({
+            'stage': s['stage'],
+            'pid': s['pid'],
+            'offset': round(s['start_ts'] - origin, 3),
+            'duration': round(s['duration'], 3),
+            'exit_code': s['exit_code'],
+            'bytes': s['bytes'],
+            'note': s['note'],
+        })
+    return {'trace_id': spans[0]['trace_id'], 'start_ts': origin,
+            'total': round(end - origin, 3), 'spans': items}
+
+
+def format_timeline(timeline: dict, width: int = 40) -> str:
+    if not timeline['spans']:
+        return '没有找到追踪记录'
+    total = timeline['total'] or 1e-9
+    start = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeline['start_ts']))
+    lines = [f"trace {timeline['trace_id']}  开始于 {start}  总耗时 {timeline['total']:.3f}s"]
+    for item in timeline['spans']:
+        left = min(width - 1, int(item['offset'] / total * width))
+        size = max(1, min(width - left, int(item['duration'] / total * width)))
+        bar = ' ' * left + '#' * size
+        extra = []
+        if item['exit_code']:
+            extra.append(f"exit={item['exit_code']}")
+        if item['bytes'] is not None:
+            extra.append(f"{item['bytes']}B")
+        if item['note']:
+            extra.append(item['note'])
+        lines.append(f"{item['stage']:<14}{item['offset']:>9.3f}{item['duration']:>9.3f}s |{bar:<{width}}| {' '.join(extra)}")
+    return '\n'.join(lines)
+
+
+def _record_cli(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='pipeline_trace.py record')
+    parser.add_argument('tag')
+    parser.add_argument('stage')
+    parser.add_argument('start', type=float)
+    parser.add_argument('end', type=float, nargs='?')
+    parser.add_argument('exit_code', type=int, nargs='?', default=0)
+    parser.add_argument('bytes', type=int, nargs='?')
+    parser.add_argument('note', nargs='?', default='')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args(argv)
+    record_span(args.tag, args.stage, args.start, args.end, args.exit_code, args.bytes, args.note, db_path=args.db)
+    return 0
+
+
+def _prune_cli(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='pipeline_trace.py prune')
+    parser.add_argument('--days', type=float, default=TRACE_MAX_AGE_DAYS)
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args(argv)
+    print(prune(args.db, args.days))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == 'record':
+        return _record_cli(argv[1:])
+    if argv and argv[0] == 'prune':
+        return _prune_cli(argv[1:])
+    parser = argparse.ArgumentParser(description='查看投稿处理时间线')
+    parser.add_argument('tag')
+    parser.add_argument('--trace', help='指定 trace_id，默认最近一次')
+    parser.add_argument('--all', action='store_true', help='列出该 tag 的所有 trace_id')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args(argv)
+    if args.all:
+        for trace_id in list_traces(args.tag, args.db):
+            print(trace_id)
+        return 0
+    timeline = build_timeline(fetch_spans(args.tag, args.db, args.trace))
+    if args.json:
+        print(json.dumps(timeline, ensure_ascii=False))
+    else:
+        print(format_timeline(timeline))
+    return 0 if timeline['spans'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
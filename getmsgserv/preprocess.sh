@@ -9,6 +9,15 @@ log_and_continue() {
 }
 tag=$1
 flag=$2
+trace_init "$tag"
+trace_preprocess_start=$(trace_now)
+on_exit() {
+  local rc=$?
+  # 中途退出时也清理本次渲染的临时目录
+  [[ -n "${render_dir:-}" ]] && rm -rf -- "$render_dir"
+  trace_span "$tag" preprocess "$trace_preprocess_start" "$rc"
+}
+trap on_exit EXIT
 receiver=$(sqlite3 'cache/OQQWall.db' "SELECT receiver FROM preprocess WHERE tag = '$tag';")
 senderid=$(sqlite3 'cache/OQQWall.db' "SELECT senderid FROM preprocess WHERE tag = '$tag';")
 waittime=$(grep 'process_waittime' oqqwall.config | cut -d'=' -f2 | tr -d '"')
@@ -59,7 +68,14 @@ else
   done
 fi
 echo waitingforsender...
-sleep $waittime
+trace_start=$(trace_now)
+# 静默期调度：投稿人静默 process_quiet_sec 秒、发出结束语或等满 process_waittime 后开始处理
+wait_reason="${waittime}s"
+if [[ "$waittime" =~ ^[0-9]+$ && "$waittime" -gt 0 ]]; then
+  wait_reason=$(python3 getmsgserv/debounce.py wait "$senderid" "$receiver" --max "$waittime") \
+    || { sleep "$waittime"; wait_reason="${waittime}s"; }
+fi
+trace_span "$tag" wait "$trace_start" 0 "" "$wait_reason"
 last_modtime=$(sqlite3 'cache/OQQWall.db' "SELECT modtime FROM sender WHERE senderid = '$senderid';")
 if [[ $flag == randeronly ]]; then
   echo "跳过更新processtime（randeronly 模式）"
@@ -72,14 +88,28 @@ else
   echo process-message-to-jpg...
   ###processinfo###
   # Step 1: Process tag and send to LM
+  # 分阶段编排（getmsgserv/pipeline.py）：每个阶段单独检查点、单独重试；
+  # 退出码 3 为某阶段重试用尽，其他非零退出码说明编排器本身不可用，回退到整体重试
   attempt=0
   max_lm_attempts=3
   success=false
-  while [[ $attempt -lt $max_lm_attempts ]]; do
+  trace_start=$(trace_now)
+  python3 getmsgserv/pipeline.py run "$tag" --port "$port"
+  pipeline_rc=$?
+  trace_span "$tag" lm "$trace_start" "$pipeline_rc" "" "pipeline"
+  if [[ $pipeline_rc -eq 0 ]]; then
+    success=true
+  elif [[ $pipeline_rc -eq 3 ]]; then
+    attempt=$max_lm_attempts
+  fi
+  while [[ "$success" == false && $attempt -lt $max_lm_attempts ]]; do
+    trace_start=$(trace_now)
     if getmsgserv/LM_work/progress-lite-json.sh "$tag" "$port"| python3 getmsgserv/LM_work/sendtoLM.py "$tag"; then
+      trace_span "$tag" lm "$trace_start" 0 "" "attempt $((attempt + 1))"
       success=true
       break
     else
+      trace_span "$tag" lm "$trace_start" 1 "" "attempt $((attempt + 1))"
       ((attempt++))
       echo "Attempt $attempt failed, retrying..."
     fi
@@ -90,78 +120,166 @@ else
 fi
 
 echo '开始处理json到html'
-# Step 2: Lock the cache files and process HTML to PDF
-{
-  flock -x 200  # Acquire exclusive oock
-  getmsgserv/HTMLwork/gotohtml.sh $tag > /dev/shm/OQQWall/oqqwallhtmlcache.html
-
-#确保html写完了
-wait_stable() { local f="$1" last=0; while :; do
-  sz=$(stat -c%s "$f" 2>/dev/null || echo 0)
-  [[ $sz -gt 0 && $sz -eq $last ]] && break
-  last=$sz; sleep 0.1
-done; }
-wait_stable /dev/shm/OQQWall/oqqwallhtmlcache.html
-
-echo '开始处理html到pdf'
-# Step 3: Process the output into JPG
-# ---- 1. 选择可执行文件 ---------------------------------------------------
-# 依次查找可用的浏览器可执行文件
-for candidate in  google-chrome-stable chrome chromium-browser chromium; do
-    if command -v "$candidate" >/dev/null 2>&1; then
-        CHROME_BIN=$(command -v "$candidate")
-        break
-    fi
-done
-
-# 如果都没找到就退出
-if [[ -z "${CHROME_BIN:-}"  ]]; then
-    echo "Error: no suitable Chromium/Chrome binary found in PATH." >&2
+# Step 2: 取得渲染槽位，在本 tag 独立的临时目录中处理 HTML -> PDF -> JPG
+# 槽位数 render_concurrency；0 或未配置时取渲染服务的浏览器数 render_pool_size，
+# 未启用渲染服务（render_pool_size=0）时取 CPU 核数。各渲染互不共享文件，可并行
+render_slots=$(grep -m1 '^render_concurrency=' oqqwall.config | cut -d'=' -f2 | tr -d '"')
+if ! [[ "$render_slots" =~ ^[1-9][0-9]*$ ]]; then
+  render_slots=$(grep -m1 '^render_pool_size=' oqqwall.config | cut -d'=' -f2 | tr -d '"')
+  [[ "$render_slots" =~ ^[1-9][0-9]*$ ]] || render_slots=$(nproc 2>/dev/null || echo 1)
+fi
+acquire_render_slot() {
+  local i
+  mkdir -p /dev/shm/OQQWall
+  while :; do
+    for ((i=0; i<render_slots; i++)); do
+      exec {render_slot_fd}>"/dev/shm/OQQWall/render-slot-$i.lock"
+      if flock -n "$render_slot_fd"; then
+        return 0
+      fi
+      exec {render_slot_fd}>&-
+    done
+    sleep 0.2
+  done
+}
+release_render_slot() {
+  [[ -n "${render_slot_fd:-}" ]] && exec {render_slot_fd}>&-
+  render_slot_fd=""
+  rm -rf -- "$render_dir"
+}
+# 同一 tag 可能同时被刷新，目录带上 PID 区分
+render_dir="/dev/shm/OQQWall/render/${tag}.$$"
+HTML_FILE="$render_dir/post.html"
+PDF_OUT="$render_dir/post.pdf"
+HTML_IN="file://$HTML_FILE"
+folder=./cache/prepost/${tag}
+json_data=$(sqlite3 'cache/OQQWall.db' "SELECT AfterLM FROM preprocess WHERE tag = '$tag';")
+if [[ -z "$json_data" ]]; then
+    log_and_continue "No data found for tag $tag"
     exit 1
 fi
 
-# ---- 2. 参数 --------------------------------------------------------
-PDF_OUT=/dev/shm/OQQWall/oqqwallpdfcache.pdf
-HTML_IN=file:///dev/shm/OQQWall/oqqwallhtmlcache.html
+# 渲染缓存（getmsgserv/HTMLwork/render_cache.py）：内容、发件人、组配置与模板都没变时直接复用上次的页面
+trace_start=$(trace_now)
+render_key=$(python3 getmsgserv/HTMLwork/render_cache.py key "$tag" 2>/dev/null || true)
+render_cached=false
+if [[ -n "$render_key" ]] && pages=$(python3 getmsgserv/HTMLwork/render_cache.py restore "$render_key" "$tag" "$folder" 2>/dev/null); then
+  render_cached=true
+  trace_span "$tag" render_cache "$trace_start" 0 "$(du -sb "$folder" 2>/dev/null | cut -f1)" "hit, ${pages} pages"
+  echo "渲染缓存命中，复用 ${pages} 页"
+fi
+{
+if [[ "$render_cached" != true ]]; then
+  trace_start=$(trace_now)
+  acquire_render_slot
+  trace_span "$tag" render_lock "$trace_start" 0 "" "slots=$render_slots"
+  mkdir -p "$render_dir"
+  trace_start=$(trace_now)
+  getmsgserv/HTMLwork/gotohtml.sh $tag > "$HTML_FILE"
 
-COMMON_ARGS=(
-    --headless
-    --run-all-compositor-stages-before-draw
-    --no-pdf-header-footer
-    --virtual-time-budget=1000
-    --pdf-page-orientation=portrait
-    --no-margins
-    --enable-background-graphics
-    --print-background=true
-    --allow-file-access-from-files 
-        --print-to-pdf="$PDF_OUT"
-    )
+  #确保html写完了
+  wait_stable() { local f="$1" last=0; while :; do
+    sz=$(stat -c%s "$f" 2>/dev/null || echo 0)
+    [[ $sz -gt 0 && $sz -eq $last ]] && break
+    last=$sz; sleep 0.1
+  done; }
+  wait_stable "$HTML_FILE"
+  trace_span "$tag" html "$trace_start" 0 "$(trace_file_bytes "$HTML_FILE")"
 
-# 根据配置决定是否添加 --no-sandbox 参数
-if [[ "$force_chromium_no_sandbox" == "true" ]]; then
-    COMMON_ARGS+=(--no-sandbox)
-    echo "Chromium 将使用 --no-sandbox 模式运行"
-fi
+  # PDF 一次性栅格化：优先 Ghostscript 多线程单遍输出，否则单次 convert（只解析一次 PDF）
+  rasterize_pdf() {
+      local pdf=$1 out=$2 prefix=$3 f n
+      if command -v gs >/dev/null 2>&1; then
+          gs -q -dNOPAUSE -dBATCH -dSAFER -sDEVICE=jpeg -dJPEGQ=90 -r360 \
+              -dTextAlphaBits=4 -dGraphicsAlphaBits=4 -dNumRenderingThreads="$(nproc 2>/dev/null || echo 1)" \
+              -sOutputFile="$render_dir/page-%02d.jpeg" "$pdf" || return 1
+          # gs 页码从 1 开始，改为原有的 00 起始
+          for f in "$render_dir"/page-*.jpeg; do
+              [[ -f "$f" ]] || continue
+              n=${f##*/page-}
+              n=${n%.jpeg}
+              mv -- "$f" "$out/${prefix}$(printf '%02d' $((10#$n - 1))).jpeg"
+          done
+      else
+          convert -density 360 -quality 90 "$pdf" "$out/${prefix}%02d.jpeg"
+      fi
+  }
 
-# ---- 3. 执行 --------------------------------------------------------------
-"$CHROME_BIN" "${COMMON_ARGS[@]}" "$HTML_IN"
+  echo '开始渲染页面'
+  # Step 3: HTML -> JPG
+  # 优先由常驻渲染服务（getmsgserv/HTMLwork/render_service.py）按消息边界分段直接截图，跳过 PDF；
+  # 不可用时回退为 PDF（渲染服务或冷启动 Chrome）+ 一次性栅格化
+  tiles_dir="$render_dir/tiles"
+  render_mode=fallback
+  trace_start=$(trace_now)
+  if [[ -S "${RENDER_UDS_PATH:-./render_uds.sock}" ]] \
+      && python3 getmsgserv/HTMLwork/render_service.py render "$HTML_IN" "$tiles_dir" --format tiles --prefix "${tag}-" >/dev/null; then
+      rm -rf $folder
+      mkdir -p "$folder"
+      mv -- "$tiles_dir"/* "$folder"/
+      render_mode=tiles
+      pages=$(find "$folder" -maxdepth 1 -type f | wc -l)
+      trace_span "$tag" rasterize "$trace_start" 0 "$(du -sb "$folder" 2>/dev/null | cut -f1)" "${pages} pages, render_service tiles"
+  else
+      # 渲染服务输出 PDF，或冷启动 Chrome
+      trace_start=$(trace_now)
+      if [[ -S "${RENDER_UDS_PATH:-./render_uds.sock}" ]] \
+          && python3 getmsgserv/HTMLwork/render_service.py render "$HTML_IN" "$PDF_OUT" >/dev/null; then
+          trace_span "$tag" chrome "$trace_start" 0 "$(trace_file_bytes "$PDF_OUT")" "render_service"
+      else
+          # ---- 1. 选择可执行文件 ---------------------------------------------------
+          # 依次查找可用的浏览器可执行文件
+          for candidate in  google-chrome-stable chrome chromium-browser chromium; do
+              if command -v "$candidate" >/dev/null 2>&1; then
+                  CHROME_BIN=$(command -v "$candidate")
+                  break
+              fi
+          done
 
+          # 如果都没找到就退出
+          if [[ -z "${CHROME_BIN:-}"  ]]; then
+              echo "Error: no suitable Chromium/Chrome binary found in PATH." >&2
+              exit 1
+          fi
 
-folder=./cache/prepost/${tag}
-json_data=$(sqlite3 'cache/OQQWall.db' "SELECT AfterLM FROM preprocess WHERE tag = '$tag';")
-if [[ -z "$json_data" ]]; then
-    log_and_continue "No data found for tag $tag"
-    exit 1
+          # ---- 2. 参数 --------------------------------------------------------
+          COMMON_ARGS=(
+              --headless
+              --run-all-compositor-stages-before-draw
+              --no-pdf-header-footer
+              --virtual-time-budget=1000
+              --pdf-page-orientation=portrait
+              --no-margins
+              --enable-background-graphics
+              --print-background=true
+              --allow-file-access-from-files 
+                  --print-to-pdf="$PDF_OUT"
+              )
+
+          # 根据配置决定是否添加 --no-sandbox 参数
+          if [[ "$force_chromium_no_sandbox" == "true" ]]; then
+              COMMON_ARGS+=(--no-sandbox)
+              echo "Chromium 将使用 --no-sandbox 模式运行"
+          fi
+
+          # ---- 3. 执行 --------------------------------------------------------------
+          trace_start=$(trace_now)
+          "$CHROME_BIN" "${COMMON_ARGS[@]}" "$HTML_IN"
+          trace_span "$tag" chrome "$trace_start" "$?" "$(trace_file_bytes "$PDF_OUT")"
+      fi
+
+      rm -rf $folder
+      mkdir -p "$folder"
+      trace_start=$(trace_now)
+      rasterize_pdf "$PDF_OUT" "$folder" "${tag}-"
+      pages=$(find "$folder" -maxdepth 1 -type f | wc -l)
+      trace_span "$tag" rasterize "$trace_start" 0 "$(du -sb "$folder" 2>/dev/null | cut -f1)" "${pages} pages"
+  fi
+  # 回退路径（PDF + 栅格化）的切分方式不同，不入缓存
+  if [[ -n "$render_key" && "$render_mode" == tiles ]]; then
+    python3 getmsgserv/HTMLwork/render_cache.py store "$render_key" "$folder" "$HTML_FILE" --prefix "${tag}-" >/dev/null 2>&1 || true
+  fi
 fi
-rm -rf $folder
-mkdir -p "$folder"
-# 使用identify获取PDF页数
-pages=$(identify -format "%n\n" /dev/shm/OQQWall/oqqwallpdfcache.pdf | head -n 1)
-# 循环处理每一页
-for ((i=0; i<$pages; i++)); do
-    formatted_index=$(printf "%02d" $i)
-    convert -density 360 -quality 90 /dev/shm/OQQWall/oqqwallpdfcache.pdf[$i] $folder/${tag}-${formatted_index}.jpeg
-done
 existing_files=$(ls "$folder" | wc -l)
 next_file_index=$existing_files
 # 当 individual_image_in_posts 为 true 时，拷贝用户原始投稿图片；否则仅保留渲染图片
@@ -170,8 +288,10 @@ if [[ "$individual_image_in_posts" == "true" ]]; then
       # 格式化文件索引
       formatted_index=$(printf "%02d" $next_file_index)
 
-      # 下载文件并保存
-      curl -o "$folder/$tag-${formatted_index}.jpg" "$url"
+      # 本地文件经由 media_store 硬链接（不复制数据），非本地 URL 才下载
+      if ! python3 ./getmsgserv/media_store.py link "$tag" "$url" "$folder/$tag-${formatted_index}.jpg" >/dev/null 2>&1; then
+          curl -o "$folder/$tag-${formatted_index}.jpg" "$url"
+      fi
 
       # 增加文件索引
       next_file_index=$((next_file_index + 1))
@@ -179,7 +299,14 @@ if [[ "$individual_image_in_posts" == "true" ]]; then
 else
   echo "组策略 individual_image_in_posts=false：仅拷贝渲染图片，跳过原始图片拷贝"
 fi
-} 200>/dev/shm/OQQWall/oqqwall.lock  
+# 外发图片按组策略（短边/大小预算/格式）压缩，清单写入 cache/outbound/<tag>.json
+trace_start=$(trace_now)
+if outbound=$(python3 getmsgserv/outbound_encoder.py encode "$tag" "$folder" --group "$groupname"); then
+  read -r ob_files ob_encoded ob_orig ob_sent <<< "$outbound"
+  trace_span "$tag" encode "$trace_start" 0 "$ob_sent" "${ob_encoded}/${ob_files} encoded, ${ob_orig} -> ${ob_sent} bytes"
+fi
+}
+release_render_slot
 
 # Lock the directory with a lock file
 # 保留文件后缀，便于浏览器与前端按 MIME 正确识别与展示
@@ -235,4 +362,6 @@ for file_path in $(find "$folder_path" -maxdepth 1 -type f | sort); do
     MSGcache+="[CQ:image,file=file://$file_path]"
 done
 echo $MSGcache
+trace_start=$(trace_now)
 sendmsggroup "$MSGcache"
+trace_span "$tag" send_review "$trace_start"
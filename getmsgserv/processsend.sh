@@ -29,12 +29,14 @@ postqzone(){
     json_data=$(jq -n --arg tag "$object" --arg numb "$numfinal" --arg initsendstatue "$initsendstatus" \
         '{tag:$tag, numb: $numb, initsendstatue: $initsendstatue}')
     echo "$json_data"
-    local sc_sock
+    local sc_sock trace_start
+    trace_start=$(trace_now)
     sc_sock="${SENDCONTROL_UDS_PATH:-./sendcontrol_uds.sock}"
     # 发送并等待回包
     # 发送并等待回包；捕获退出码以便诊断连接失败
     post_statue=$(printf '%s' "$json_data" | socat -t 60 -T 120 - UNIX-CONNECT:"$sc_sock" 2>/dev/null)
     sc_rc=$?
+    trace_span "$object" sendcontrol_handoff "$trace_start" "$sc_rc" "" "$post_statue"
     echo 已收到回报: $post_statue
     if [[ $sc_rc -ne 0 || -z "$post_statue" ]]; then
         log_and_continue "无法连接 sendcontrol UDS 或未收到响应 (sock=$sc_sock, rc=$sc_rc)"
@@ -99,6 +101,10 @@ echo processsend收到审核指令:$1
 object=$(echo $1 | awk '{print $1}')
 command=$(echo $1 | awk '{print $2}')
 flag=$(echo $1 | awk '{print $3}')
+# 链路追踪：审核指令接在该投稿已有的时间线之后
+trace_resume "$object"
+trace_review_start=$(trace_now)
+trap 'trace_span "$object" "review:$command" "$trace_review_start" "$?"' EXIT
 
 # 检查快捷回复指令是否与审核指令冲突
 check_quick_reply_conflict() {
@@ -215,6 +221,7 @@ case $command in
         rm -rf ./cache/prepost/$object
         timeout 10s sqlite3 "./cache/OQQWall.db" ".param set :id $senderid" "DELETE FROM sender WHERE senderid = :id;"
         rm -rf cache/prepost/$object
+        media_release "$object"
         numfinal=$(cat ./cache/numb/"$groupname"_numfinal.txt)
         numfinal=$((numfinal + 1))
         echo $numfinal > ./cache/numb/"$groupname"_numfinal.txt
@@ -228,6 +235,7 @@ case $command in
     删)
         postcmd="del"
         rm -rf ./cache/prepost/$object
+        media_release "$object"
         timeout 10s sqlite3 "./cache/OQQWall.db" ".param set :id $senderid" "DELETE FROM sender WHERE senderid = :id;"
         ;;
     拒)
@@ -235,6 +243,7 @@ case $command in
         rm -rf ./cache/prepost/$object
         timeout 10s sqlite3 "./cache/OQQWall.db" ".param set :id $senderid" "DELETE FROM sender WHERE senderid = :id;"
         rm -rf cache/prepost/$object
+        media_release "$object"
         sendmsgpriv $senderid '你的稿件被拒绝,请尝试修改后重新投稿'
         echo 结束发件流程,拒
         ;;
@@ -251,11 +260,12 @@ VALUES ('$senderid', '$groupname', '$receiver', '$reason');
 EOF
         sendmsggroup_ctx 已拉黑$senderid
         rm -rf cache/prepost/$object
+        media_release "$object"
         ;;
     匿)
         sendmsggroup 尝试切换匿名状态...
         json_content=$(timeout 10s sqlite3 "./cache/OQQWall.db" "SELECT AfterLM FROM preprocess WHERE tag='$object';")
-        if ! modified_json=$(echo "$json_content" | jq '.needpriv = (if (.needpriv == "true" or .needpriv == true) then "false" else "true" end)'); then
+        if ! modified_json=$(echo "$json_content" | jq -c '.needpriv = (if (.needpriv == "true" or .needpriv == true) then "false" else "true" end)'); then
             log_and_continue "匿名切换失败: 无法解析 AfterLM JSON (tag=$object)"
             sendmsggroup_ctx "匿名切换失败，投稿数据解析异常"
             sendmsggroup "内部编号$object, 请发送指令"
@@ -283,7 +293,7 @@ EOF
         # 先尝试标准化（含 forward 展开、file->image、下载资源等）
         processed_json=$(getmsgserv/LM_work/progress-lite-json.sh "$object" "$port" 2>/dev/null || true)
         if [[ -n "$processed_json" ]]; then
-            if updated=$(jq -n --arg base "${exist_json}" --argjson proc "$processed_json" '
+            if updated=$(jq -cn --arg base "${exist_json}" --argjson proc "$processed_json" '
                 (try ($base|fromjson) catch {})
                 + {messages: ($proc.messages // [])}
                 + {notregular: ($proc.notregular // "false")}
@@ -313,7 +323,7 @@ EOF
             sendmsggroup_ctx "未找到原始消息，无法全选"
             sendmsggroup "内部编号$object, 请发送指令"
         else
-            if updated=$(jq -n --arg base "${exist_json}" --argjson msgs "$raw_json" '((try ($base|fromjson) catch {}) + {messages:$msgs})'); then
+            if updated=$(jq -cn --arg base "${exist_json}" --argjson msgs "$raw_json" '((try ($base|fromjson) catch {}) + {messages:$msgs})'); then
                 escaped_updated=$(printf "%s" "$updated" | sed "s/'/''/g")
                 if timeout 10s sqlite3 'cache/OQQWall.db' "UPDATE preprocess SET AfterLM='$escaped_updated' WHERE tag = '$object';"; then
                     getmsgserv/preprocess.sh $object randeronly
@@ -330,35 +340,21 @@ EOF
         fi
         ;;
     扩列审查|扩列|查|查成分)
+        # 二维码在本地识别（getmsgserv/qr_scan.py：并行、按图片哈希缓存），与下面的资料查询同时进行
+        scan_file=$(mktemp)
+        python3 getmsgserv/qr_scan.py scan "./cache/picture/$object" > "$scan_file" &
+        scan_pid=$!
         response=$(curl -s -H "$NAPCAT_AUTH_HEADER" "http://127.0.0.1:$port/get_stranger_info?user_id=$senderid")
         # 使用 jq 提取 qqLevel
         qqLevel=$(echo "$response" | jq '.data.qqLevel')
         qzoneopenstatus=$(check_qzone_open "$senderid")
-        #草料二维码
-        src_dir="./cache/picture/$object"
-        API_URL="https://api.2dcode.biz/v1/read-qr-code"
 
-        scan_result=""
-        for img in "$src_dir"/*.{jpg,jpeg,png}; do
-
-        # 上传文件并解析返回 JSON
-        resp=$(curl -s -F "file=@${img}" "$API_URL")
-        # 有些接口返回数组，有些返回字符串；统一兼容
-        content=$(echo "$resp" | jq -r '
-            .d
-            
-            ta.contents? //
-            empty | (if type=="array" then join("\n") else . end)')
-
-        # 若成功识别
-        if [[ -n $content ]]; then
-            # 扫描多张并全部汇总：
-            scan_result+="$img: $content"$'\n'
+        if wait "$scan_pid"; then
+            scan_result=$(<"$scan_file")
+        else
+            scan_result="本地二维码识别失败（需要 zxing-cpp 或 pyzbar）"
         fi
-        done
-
-        # 去掉最后一个换行
-        scan_result=${scan_result%$'\n'}
+        rm -f "$scan_file"
         [[ -z $scan_result ]] && scan_result="没有找到二维码"
         sendmsggroup "用户的QQ等级为: $qqLevel
 对方空间对主账号$qzoneopenstatus
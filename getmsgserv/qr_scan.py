@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""扩列审查的二维码识别：在本地解码投稿图片中的二维码/条码。
+
+processsend.sh 的「扩列审查」调用，识别 cache/picture/<tag>/ 中的全部图片，不上传到外部服务：
+
+- 本地解码：优先 zxing-cpp（``pip install zxing-cpp``，自带原生库），其次 pyzbar（需系统 libzbar）；
+- 多张图片用线程池并行识别（解码在原生库中进行，释放 GIL）；
+- 结果按图片内容的 sha256 缓存在 ``cache/qr_scan/``，同一张图（重复审查、转发的同一张码）不再解码；
+- 长截图、大图先把长边缩到 ``MAX_DECODE_SIDE``；未识别到时再逐级缩小重试
+  （大图中的二维码模块过细、或有摩尔纹时，缩小后反而更容易识别）。
+
+输出：每张识别到内容的图片一行 ``<图片路径>: <内容>``，同一张图的多个码以换行连接；
+没有识别到任何内容时不输出。
+
+命令行：
+    python3 getmsgserv/qr_scan.py scan <目录>
+    python3 getmsgserv/qr_scan.py prune [--days 30]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+CACHE_DIR = './cache/qr_scan'
+CACHE_VERSION = 1
+MAX_AGE_DAYS = 30
+MAX_DECODE_SIDE = 2400
+MIN_DECODE_SIDE = 480
+DOWNSCALE_STEP = 0.6
+# 与 shell 的 "$src_dir"/*.{jpg,jpeg,png} 相同：先按扩展名、再按文件名排序
+IMAGE_EXTS = ('jpg', 'jpeg', 'png', 'webp', 'bmp', 'gif')
+
+
+class DecoderUnavailable(RuntimeError):
+    pass
+
+
+def _zxing_decoder():
+    import zxingcpp
+
+    def decode(img) -> List[str]:
+        return [r.text for r in zxingcpp.read_barcodes(img) if r.text]
+    return decode
+
+
+def _zbar_decoder():
+    from pyzbar import pyzbar
+
+    def decode(img) -> List[str]:
+        return [r.data.decode('utf-8', 'replace') for r in pyzbar.decode(img) if r.data]
+    return decode
+
+
+def load_decoder() -> Callable:
+    """decode(PIL.Image) -> [文本]；本地解码库均不可用时抛出 DecoderUnavailable。"""
+    for factory in (_zxing_decoder, _zbar_decoder):
+        try:
+            return factory()
+        except ImportError:
+            continue
+    raise DecoderUnavailable('未安装 zxing-cpp 或 pyzbar')
+
+
+def decode_image(data: bytes, decode: Callable) -> List[str]:
+    """先在长边不超过 MAX_DECODE_SIDE 的灰度图上识别，未识别到时逐级缩小重试。"""
+    import io
+
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img).convert('L')
+    scale = min(1.0, MAX_DECODE_SIDE / max(img.size))
+    while True:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        frame = img if size == img.size else img.resize(size, Image.Resampling.LANCZOS)
+        texts = decode(frame)
+        if texts:
+            return list(dict.fromkeys(texts))
+        scale *= DOWNSCALE_STEP
+        if max(img.size) * scale < MIN_DECODE_SIDE:
+            return []
+
+
+class QRScanner:
+    def __init__(self, cache_dir: Optional[str] = CACHE_DIR, decode: Optional[Callable] = None,
+                 workers: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self._decode = decode
+        self.workers = workers
+        self.stats = {'images': 0, 'cached': 0, 'decoded': 0, 'errors': 0}
+
+    @property
+    def decode(self) -> Callable:
+        if self._decode is None:
+            self._decode = load_decoder()
+        return self._decode
+
+    def _cache_path(self, digest: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.json')
+
+    def scan_file(self, path: str) -> List[str]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        cache_path = self._cache_path(digest)
+        if cache_path:
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                if record.get('version') == CACHE_VERSION:
+                    self.stats['cached'] += 1
+                    return list(record.get('texts') or [])
+            except (OSError, ValueError, AttributeError):
+                pass
+        texts = decode_image(data, self.decode)
+        self.stats['decoded'] += 1
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp = f'{cache_path}.{os.getpid()}.{id(data)}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'texts': texts}, f, ensure_ascii=False)
+            os.replace(tmp, cache_path)
+        return texts
+
+    def _scan_one(self, path: str) -> List[str]:
+        try:
+            return self.scan_file(path)
+        except DecoderUnavailable:
+            raise
+        except Exception as exc:
+            # 单张图片损坏或格式不支持时跳过，不影响其他图片
+            self.stats['errors'] += 1
+            print(f"qr_scan {path}: {exc}", file=sys.stderr)
+            return []
+
+    def scan_paths(self, paths: List[str]) -> List[tuple]:
+        """并行识别，按输入顺序返回 [(路径, [文本])]。"""
+        self.stats['images'] += len(paths)
+        if not paths:
+            return []
+        if self._decode is None:
+            self._decode = load_decoder()  # 解码库缺失时在分派前报错
+        workers = max(1, min(len(paths), self.workers or os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(zip(paths, pool.map(self._scan_one, paths)))
+
+
+def list_images(folder: str) -> List[str]:
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    paths = []
+    for ext in IMAGE_EXTS:
+        paths += [os.path.join(folder, n) for n in sorted(names)
+                  if n.rsplit('.', 1)[-1] == ext and os.path.isfile(os.path.join(folder, n))]
+    return paths
+
+
+def format_results(results: List[tuple]) -> str:
+    return '\n'.join(f"{path}: {chr(10).join(texts)}" for path, texts in results if texts)
+
+
+def prune(cache_dir: str = CACHE_DIR, max_age_days: float = MAX_AGE_DAYS) -> int:
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='本地二维码识别')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('scan', help='识别目录中全部图片的二维码')
+    p.add_argument('folder')
+    p.add_argument('--workers', type=int)
+    p = sub.add_parser('prune', help='清理旧缓存')
+    p.add_argument('--days', type=float, default=MAX_AGE_DAYS)
+    args = parser.parse_args(argv)
+
+    if args.action == 'prune':
+        print(prune(args.cache_dir, args.days))
+        return 0
+    scanner = QRScanner(args.cache_dir, workers=args.workers)
+    try:
+        results = scanner.scan_paths(list_images(args.folder))
+    except DecoderUnavailable as exc:
+        print(f"qr_scan: {exc}", file=sys.stderr)
+        return 2
+    output = format_results(results)
+    if output:
+        print(output)
+    print(f"qr_scan: {json.dumps(scanner.stats)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
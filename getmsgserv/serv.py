@@ -1,4 +1,5 @@
 
+import atexit
 import hashlib
 import hmac
 import logging
@@ -8,16 +9,23 @@ from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import subprocess
 import json
 import os
+import queue
 import re
 import sqlite3
 import time
-from threading import Lock
+import urllib.request
+from threading import Lock, Thread
 from contextlib import contextmanager
 import fcntl
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from collections import deque
 from urllib.parse import urlparse, parse_qs
 
+from pipeline_trace import TRACE_ENV, new_trace_id, record_span
+import history_index
+import avatar_cache
+import admission
+
 # 创建自定义的日志格式化器
 class CustomFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
@@ -46,8 +54,13 @@ console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(formatter)
 console_handler.setLevel(log_level)
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+# 请求线程只把日志记录放入队列，格式化落盘/输出由监听线程完成，避免文件 I/O 阻塞请求处理
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger.addHandler(QueueHandler(log_queue))
 
 # 定义存储路径
 RAWPOST_DIR = './getmsgserv/rawpost'
@@ -140,7 +153,14 @@ def init_db():
         cursor.execute('PRAGMA journal_mode=WAL;')
         cursor.execute('PRAGMA synchronous=NORMAL;')
         cursor.execute('PRAGMA busy_timeout=5000;')
+        history_index.ensure_table(conn)
+        pruned = history_index.prune(conn)
+        if not admission.ensure_schema(conn):
+            logger.warning('blocklist table missing; admission control reloads it every second')
         conn.commit()
+    if pruned:
+        logger.info('Pruned %s expired msg_history rows', pruned)
+    admission_control.reload()
 
 
 @contextmanager
@@ -174,6 +194,45 @@ if not NAPCAT_ACCESS_TOKEN:
     raise RuntimeError('napcat_access_token 未配置，请更新 oqqwall.config。')
 EXPECTED_AUTH_HEADER = f'Bearer {NAPCAT_ACCESS_TOKEN}'
 
+# ---- msg_history 定期清理：serv.py 常驻数周，不能只在启动时清理 ----
+_history_prune_lock = Lock()
+_history_pruned_at = time.monotonic()
+
+
+def prune_history_if_due(conn, interval=history_index.PRUNE_INTERVAL_SEC):
+    global _history_pruned_at
+    with _history_prune_lock:
+        if time.monotonic() - _history_pruned_at < interval:
+            return
+        _history_pruned_at = time.monotonic()
+    pruned = history_index.prune(conn)
+    if pruned:
+        logger.info('Pruned %s expired msg_history rows', pruned)
+
+
+# ---- 准入控制：黑名单与按发件人限流（详见 getmsgserv/admission.py）----
+admission_control = admission.Admission.from_config(config)
+_admission_stats_lock = Lock()
+_admission_stats_at = time.monotonic()
+
+
+def report_admission_stats(interval=admission.STATS_INTERVAL_SEC):
+    """定期把准入统计写入 cache/admission_stats.json 并记一行日志。"""
+    global _admission_stats_at
+    with _admission_stats_lock:
+        if time.monotonic() - _admission_stats_at < interval:
+            return
+        _admission_stats_at = time.monotonic()
+    try:
+        snapshot = admission_control.write_stats()
+    except OSError as exc:
+        logger.warning('Failed to write admission stats: %s', exc)
+        return
+    counts = snapshot['counts']
+    logger.info('准入统计: 放行 %s, 黑名单 %s, 限速 %s, 超量 %s',
+                counts[admission.ADMITTED], counts[admission.BLOCKED],
+                counts[admission.RATE_LIMITED], counts[admission.SIZE_LIMITED])
+
 
 def _digits(value, max_len=20):
     return isinstance(value, str) and value.isdigit() and 0 < len(value) <= max_len
@@ -324,6 +383,45 @@ def _reload_account_group_cfg(force=False):
 
 _reload_account_group_cfg(force=True)
 
+
+def _http_port_for(self_id):
+    """self_id 所在账户组中该账号的 NapCat HTTP 端口。"""
+    self_id = _normalize_qq_id(self_id)
+    group_info = account_group_cfg.get(self_id_to_acgroup.get(self_id, ''), {})
+    if not isinstance(group_info, dict):
+        return None
+    if _normalize_qq_id(group_info.get('mainqqid')) == self_id:
+        return group_info.get('mainqq_http_port')
+    minor_ids = [_normalize_qq_id(q) for q in group_info.get('minorqqid', []) or []]
+    minor_ports = group_info.get('minorqq_http_port', []) or []
+    if self_id in minor_ids and minor_ids.index(self_id) < len(minor_ports):
+        return minor_ports[minor_ids.index(self_id)]
+    return None
+
+
+THROTTLE_NOTICE = '消息发送过快，部分消息未被接收。请稍等一分钟，再把未收到的内容重新发送一次。'
+
+
+def notify_throttled(user_id, self_id, verdict):
+    """发件人开始被限流时私聊提醒（后台线程，不阻塞回复 NapCat）。"""
+    port = _http_port_for(self_id)
+    logger.warning('Sender %s is being throttled (%s); notifying via port %s', user_id, verdict, port)
+    if not port:
+        return
+
+    def send():
+        body = json.dumps({'user_id': user_id, 'message': THROTTLE_NOTICE}, ensure_ascii=False).encode('utf-8')
+        req = urllib.request.Request(f'http://127.0.0.1:{port}/send_private_msg', data=body, method='POST',
+                                     headers={'Content-Type': 'application/json',
+                                              'Authorization': EXPECTED_AUTH_HEADER})
+        try:
+            urllib.request.urlopen(req, timeout=10).close()
+        except OSError as exc:
+            logger.warning('Failed to send throttle notice to %s: %s', user_id, exc)
+
+    Thread(target=send, daemon=True).start()
+
+
 class RequestHandler(BaseHTTPRequestHandler):
     protocol_version = 'HTTP/1.1'
 
@@ -336,9 +434,9 @@ class RequestHandler(BaseHTTPRequestHandler):
         try:
             super().handle()
         except ConnectionResetError as e:
-            logger.error(f"连接错误 {str(e)}")
+            logger.error("连接错误 %s", str(e))
         except Exception as e:
-            logger.error(f"处理请求时发生错误: {str(e)}")
+            logger.error("处理请求时发生错误: %s", str(e))
 
     def send_json_response(self, status_code, data):
         payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
@@ -426,7 +524,7 @@ class RequestHandler(BaseHTTPRequestHandler):
             user_id = data.get('user_id')
             self_id = data.get('self_id')
             acgroup = self_id_to_acgroup.get(str(self_id), 'Unknown')
-            logger.info(f"来自{user_id}到{self_id},组{acgroup}")
+            logger.info("来自%s到%s,组%s", user_id, self_id, acgroup)
 
             # 忽略自动回复消息和好友请求消息
             if data.get('message_type') == 'private' and 'raw_message' in data:
@@ -457,6 +555,17 @@ class RequestHandler(BaseHTTPRequestHandler):
                     self.send_json_response(200, {"status": "ok", "message": "Suppressed duplicate private message"})
                     return
 
+            # === 私聊投稿准入：黑名单与按发件人限流，在任何写入之前 ===
+            if data.get('message_type') == 'private' and data.get('post_type') != 'message_sent':
+                verdict = admission_control.check(str(user_id), acgroup, len(post_data))
+                report_admission_stats()
+                if verdict != admission.ADMITTED:
+                    logger.info("Private message from %s dropped by admission control: %s", user_id, verdict)
+                    if verdict != admission.BLOCKED and admission_control.notice_due(str(user_id)):
+                        notify_throttled(user_id, self_id, verdict)
+                    self.send_json_response(200, {"status": "ok", "message": f"Dropped by admission control: {verdict}"})
+                    return
+
             # 处理不同类型的通知
             if data.get('notice_type') == 'friend_recall':
                 self.handle_friend_recall(data)
@@ -469,7 +578,7 @@ class RequestHandler(BaseHTTPRequestHandler):
         except ConnectionResetError as e:
             logger.error('连接错误 %s', e)
         except Exception as e:
-            logger.error(f"处理POST请求时发生错误: {str(e)}")
+            logger.error("处理POST请求时发生错误: %s", str(e))
             self.send_json_response(500, {"error": f"Internal Server Error: {str(e)}"})
 
     def read_chunked(self):
@@ -539,7 +648,7 @@ class RequestHandler(BaseHTTPRequestHandler):
                     else:
                         logger.info('No existing messages found for this user and receiver.')
             except Exception as e:
-                logger.error(f'Error deleting message from database: {e}')
+                logger.error("Error deleting message from database: %s", e)
 
     def handle_friend_request(self, data):
         """自动同意好友请求，并将该请求的 comment 记录为几分钟的抑制关键词。"""
@@ -554,12 +663,12 @@ class RequestHandler(BaseHTTPRequestHandler):
 
         # 2 分钟内重复的同一 user_id 好友申请只处理一次
         if not should_process_friend_request(user_id, FRIEND_REQ_WINDOW_SEC):
-            logger.info(f"Duplicate friend request from {user_id} within some minutes; ignored.")
+            logger.info("Duplicate friend request from %s within some minutes; ignored.", user_id)
             return
 
         if user_id and comment:
             add_suppression(user_id, comment, duration_sec=PRIVATE_SUPPRESSION_WINDOW_SEC)
-            logger.info(f"Added suppression for user {user_id} with comment='{comment}' for some minutes.")
+            logger.info("Added suppression for user %s with comment='%s' for some minutes.", user_id, comment)
         else:
             logger.warning("Friend request missing user_id or comment; suppression not added.")
 
@@ -653,6 +762,7 @@ class RequestHandler(BaseHTTPRequestHandler):
         timestamp = data.get('time')
 
         if message_type == 'private' and post_type != 'message_sent' and user_id and timestamp is not None:
+            ingest_start = time.time()
             simplified_data = {
                 "message_id": data.get("message_id"),
                 "message": data.get("message"),
@@ -695,6 +805,15 @@ class RequestHandler(BaseHTTPRequestHandler):
                         message_list = deduped[-500:]
                         updated_rawmsg = json.dumps(message_list, ensure_ascii=False)
 
+                        # 引用预览索引与 rawmsg 同一事务写入，渲染时按 id 直接查询
+                        # （连接为自动提交模式，需显式开启事务，由下方 conn.commit() 提交）
+                        cursor.execute('BEGIN')
+                        try:
+                            history_index.record_message(conn, simplified_data)
+                            prune_history_if_due(conn)
+                        except sqlite3.Error as exc:
+                            logger.warning('Failed to index message %s: %s', simplified_data.get('message_id'), exc)
+
                         if row:
                             cursor.execute('''
                                 UPDATE sender 
@@ -716,16 +835,22 @@ class RequestHandler(BaseHTTPRequestHandler):
                             ''', (new_tag, user_id, nickname, self_id, ACgroup))
 
                             conn.commit()
+                            # 渲染前后台预热投稿者头像（已缓存且未过期时不下载）
+                            avatar_cache.warm_async(user_id)
+                            # 新投稿：生成 trace_id，经环境变量传给 preprocess.sh 及其子进程
+                            trace_id = new_trace_id(new_tag)
+                            record_span(new_tag, 'ingest', ingest_start, trace_id=trace_id)
                             preprocess_script_path = './getmsgserv/preprocess.sh'
                             try:
-                                subprocess.run([preprocess_script_path, str(new_tag)], check=True)
+                                subprocess.run([preprocess_script_path, str(new_tag)], check=True,
+                                               env=dict(os.environ, **{TRACE_ENV: trace_id}))
                             except subprocess.CalledProcessError as e:
-                                logger.error(f"Preprocess script execution failed: {e}")
+                                logger.error("Preprocess script execution failed: %s", e)
 
                         conn.commit()
                     except Exception as e:
                         conn.rollback()
-                        logger.error(f'Database error: {e}')
+                        logger.error("Database error: %s", e)
                         raise
 
                 try:
@@ -734,7 +859,7 @@ class RequestHandler(BaseHTTPRequestHandler):
                     logger.error('Error recording to %s: %s', PRIV_POST_FILE, exc)
 
             except Exception as e:
-                logger.error(f'Error recording private message to database: {e}')
+                logger.error("Error recording private message to database: %s", e)
 
 def run(server_class=ThreadingHTTPServer, handler_class=RequestHandler):
     init_db()
@@ -750,7 +875,7 @@ def run(server_class=ThreadingHTTPServer, handler_class=RequestHandler):
     httpd = server_class(server_address, handler_class)
     httpd.daemon_threads = True
     httpd.allow_reuse_address = True
-    logger.info(f'Starting HTTP server on port {port}...')
+    logger.info("Starting HTTP server on port %s...", port)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
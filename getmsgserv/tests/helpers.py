@@ -0,0 +1,26 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+GETMSGSERV_DIR = REPO_ROOT / "getmsgserv"
+
+
+def load_script_module(name, relative_path):
+    """Import a standalone script (not a package member) by file path."""
+    if name in sys.modules:
+        return sys.modules[name]
+    path = REPO_ROOT / relative_path
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_sendtolm():
+    return load_script_module("sendtoLM", "getmsgserv/LM_work/sendtoLM.py")
+
+
+def load_mock_dashscope():
+    return load_script_module("mock_dashscope", "tests/mock_dashscope.py")
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from .helpers import load_script_module
+
+
+def load_admission():
+    return load_script_module("admission", "getmsgserv/admission.py")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdmissionTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_admission()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = os.path.join(self.tmp.name, "OQQWall.db")
+        with sqlite3.connect(self.db) as conn:
+            conn.execute("CREATE TABLE blocklist (senderid TEXT, ACgroup TEXT, receiver TEXT, reason TEXT, "
+                         "PRIMARY KEY (senderid, ACgroup))")
+            self.assertTrue(self.mod.ensure_schema(conn))
+        self.clock = FakeClock()
+
+    def make(self, **kwargs):
+        adm = self.mod.Admission(self.db, clock=self.clock, **kwargs)
+        self.addCleanup(lambda: adm._conn and adm._conn.close())
+        return adm
+
+    def block(self, senderid, group, blocked=True):
+        conn = sqlite3.connect(self.db)
+        if blocked:
+            conn.execute("INSERT INTO blocklist (senderid, ACgroup) VALUES (?, ?)", (senderid, group))
+        else:
+            conn.execute("DELETE FROM blocklist WHERE senderid=? AND ACgroup=?", (senderid, group))
+        conn.commit()
+        conn.close()
+
+    def test_blocklist_changes_are_picked_up_after_refresh_interval(self):
+        adm = self.make(refresh_interval=1.0)
+        self.assertEqual(adm.check("10", "A", 100), self.mod.ADMITTED)
+        self.block("10", "A")
+        # within the refresh interval the cached copy is used
+        self.assertFalse(adm.is_blocked("10", "A"))
+        self.clock.now += 1.5
+        self.assertEqual(adm.check("10", "A", 100), self.mod.BLOCKED)
+        self.assertEqual(adm.check("10", "B", 100), self.mod.ADMITTED)
+        self.block("10", "A", blocked=False)
+        self.clock.now += 1.5
+        self.assertFalse(adm.is_blocked("10", "A"))
+
+    def test_message_rate_bucket_refills_over_time(self):
+        adm = self.make(msg_per_min=6, msg_burst=3, kb_per_min=0)
+        verdicts = [adm.check("1", "A", 10) for _ in range(4)]
+        self.assertEqual(verdicts, [self.mod.ADMITTED] * 3 + [self.mod.RATE_LIMITED])
+        # other senders have their own bucket
+        self.assertEqual(adm.check("2", "A", 10), self.mod.ADMITTED)
+        self.clock.now += 10  # 6 per minute -> one token every 10 s
+        self.assertEqual(adm.check("1", "A", 10), self.mod.ADMITTED)
+        self.assertEqual(adm.check("1", "A", 10), self.mod.RATE_LIMITED)
+
+    def test_defaults_admit_a_multi_image_post_and_notify_once(self):
+        adm = self.make()
+        # QQ delivers every picture as its own private message
+        verdicts = [adm.check("1", "A", 1500) for _ in range(40)]
+        self.assertEqual(set(verdicts), {self.mod.ADMITTED})
+        self.assertTrue(adm.notice_due("1"))
+        self.assertFalse(adm.notice_due("1"))
+        self.assertTrue(adm.notice_due("2"))
+        self.clock.now += self.mod.NOTICE_INTERVAL_SEC
+        self.assertTrue(adm.notice_due("1"))
+
+    def test_byte_budget_and_stats(self):
+        adm = self.make(msg_per_min=0, kb_per_min=1)  # burst = 2 KB
+        self.assertEqual(adm.check("1", "A", 4096), self.mod.SIZE_LIMITED)
+        self.assertEqual(adm.check("1", "A", 1500), self.mod.ADMITTED)
+        self.assertEqual(adm.check("1", "A", 1500), self.mod.SIZE_LIMITED)
+        stats_path = os.path.join(self.tmp.name, "stats.json")
+        stats = adm.write_stats(stats_path)
+        self.assertEqual(stats["counts"], {"admitted": 1, "blocked": 0, "rate_limited": 0, "size_limited": 2})
+        self.assertEqual(stats["top_rejected"], [("1", 2)])
+        self.assertTrue(os.path.isfile(stats_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from .helpers import load_script_module
+
+
+def load_avatar_cache():
+    return load_script_module("avatar_cache", "getmsgserv/avatar_cache.py")
+
+
+def png_bytes(size=(640, 640)):
+    out = io.BytesIO()
+    Image.new("RGBA", size, (10, 120, 200, 255)).save(out, "PNG")
+    return out.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, content, status=200):
+        self.content = content
+        self.status_code = status
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class AvatarCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_avatar_cache()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.cache = os.path.join(self.root, "cache", "avatars")
+
+    def test_fetch_downscales_to_rendered_size(self):
+        with mock.patch.object(self.mod.requests, "get", return_value=FakeResponse(png_bytes())) as get:
+            self.assertTrue(self.mod.fetch("12345", self.cache))
+        self.assertEqual(get.call_args[0][0], "https://qlogo2.store.qq.com/qzone/12345/12345/640")
+        with Image.open(self.mod.avatar_path("12345", self.cache)) as img:
+            self.assertEqual((img.format, img.size), ("JPEG", (self.mod.AVATAR_PX, self.mod.AVATAR_PX)))
+
+    def test_warm_refreshes_only_after_ttl(self):
+        with mock.patch.object(self.mod.requests, "get", return_value=FakeResponse(png_bytes())) as get:
+            self.assertTrue(self.mod.warm("12345", self.cache))
+            self.assertTrue(self.mod.warm("12345", self.cache))
+            self.assertEqual(get.call_count, 1)
+            old = time.time() - self.mod.TTL_SEC - 60
+            os.utime(self.mod.avatar_path("12345", self.cache), (old, old))
+            self.mod.warm("12345", self.cache)
+            self.assertEqual(get.call_count, 2)
+        # 刷新失败时保留过期缓存
+        os.utime(self.mod.avatar_path("12345", self.cache), (old, old))
+        with mock.patch.object(self.mod.requests, "get", side_effect=OSError("offline")):
+            self.assertTrue(self.mod.warm("12345", self.cache))
+
+    def test_avatar_url_prefers_cache_and_falls_back_to_anonymous(self):
+        with mock.patch.object(self.mod.requests, "get", return_value=FakeResponse(b"", status=404)):
+            self.assertEqual(self.mod.avatar_url("12345", self.root),
+                             f"file://{self.root}/getmsgserv/HTMLwork/source/Anonymous_avatar.png")
+        with mock.patch.object(self.mod.requests, "get", return_value=FakeResponse(png_bytes((100, 60)))):
+            url = self.mod.avatar_url("12345", self.root)
+        self.assertEqual(url, f"file://{self.cache}/12345.jpg")
+        with mock.patch.object(self.mod.requests, "get", side_effect=AssertionError("no network")):
+            self.assertEqual(self.mod.avatar_url("12345", self.root), url)
+
+
+if __name__ == "__main__":
+    unittest.main()
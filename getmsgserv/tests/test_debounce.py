@@ -0,0 +1,73 @@
+import json
+import unittest
+
+from .helpers import load_script_module
+
+
+def load_debounce():
+    return load_script_module("debounce", "getmsgserv/debounce.py")
+
+
+def rawmsg(*texts):
+    return json.dumps([{"message_id": i, "message": [{"type": "text", "data": {"text": t}}]}
+                       for i, t in enumerate(texts)], ensure_ascii=False)
+
+
+class FakeSender:
+    """按虚拟时间返回 sender 记录：events 为 [(到达时刻, 文本), ...]。"""
+
+    def __init__(self, events):
+        self.events = events
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def fetch(self):
+        arrived = [text for at, text in self.events if at <= self.now]
+        if not arrived:
+            return None, None
+        return f"modtime-{len(arrived)}", rawmsg(*arrived)
+
+
+class DebounceTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_debounce()
+
+    def run_wait(self, events, quiet=10, max_wait=60):
+        sender = FakeSender(events)
+        reason = self.mod.wait("1", "2", quiet, max_wait, self.mod.DEFAULT_END_SIGNALS,
+                               fetch=sender.fetch, clock=sender.clock, sleep=sender.sleep)
+        return reason, sender.now
+
+    def test_single_message_fires_after_quiet_period(self):
+        reason, waited = self.run_wait([(0, "一条投稿")])
+        self.assertTrue(reason.startswith("quiet"), reason)
+        self.assertAlmostEqual(waited, 10, delta=1)
+
+    def test_new_messages_reset_timer_until_max_wait(self):
+        reason, waited = self.run_wait([(0, "a"), (8, "b"), (16, "c")])
+        self.assertAlmostEqual(waited, 26, delta=1.5)
+        reason, waited = self.run_wait([(t, "x") for t in range(0, 100, 5)])
+        self.assertTrue(reason.startswith("max-wait"), reason)
+        self.assertAlmostEqual(waited, 60, delta=1)
+
+    def test_end_signal_fires_early(self):
+        reason, waited = self.run_wait([(0, "投稿内容"), (3, "发完了！")])
+        self.assertEqual(reason, "end-signal")
+        self.assertLess(waited, 5)
+        # 结束语出现在长文本中、或带图片时不算
+        self.assertEqual(self.mod.last_message_text(json.dumps([{"message": [
+            {"type": "text", "data": {"text": "发完了"}}, {"type": "image", "data": {}}]}])), "")
+        self.assertIsNone(self.mod.decide(1, 0, 0, "今天的事我发完了再说", 10, 60, self.mod.DEFAULT_END_SIGNALS))
+
+    def test_signals_from_config(self):
+        self.assertEqual(self.mod.parse_signals("好了， 就这样|完"), ("好了", "就这样", "完"))
+        self.assertEqual(self.mod.parse_signals(""), self.mod.DEFAULT_END_SIGNALS)
+
+
+if __name__ == "__main__":
+    unittest.main()
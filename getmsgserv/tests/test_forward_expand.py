@@ -0,0 +1,128 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .helpers import load_script_module
+
+
+def load_forward_expand():
+    return load_script_module("forward_expand", "getmsgserv/LM_work/forward_expand.py")
+
+
+FORWARDS = {
+    "100": {"messages": [
+        {"message_id": 1, "message": [{"type": "text", "data": {"text": "外层"}}]},
+        {"message_id": 2, "message": [{"type": "forward", "data": {"id": "200"}}]},
+    ]},
+    "101": {"messages": [{"message_id": 3, "message": [{"type": "text", "data": {"text": "另一条"}}]}]},
+    "200": {"messages": [{"message_id": 4, "message": [{"type": "text", "data": {"text": "内层"}}]}]},
+}
+
+
+class FakeNapCat:
+    def __init__(self, delay=0.2):
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        lock = threading.Lock()
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fid = parse_qs(urlparse(self.path).query)["message_id"][0]
+                with lock:
+                    owner.calls.append((fid, self.headers.get("Authorization")))
+                    owner.active += 1
+                    owner.peak = max(owner.peak, owner.active)
+                time.sleep(delay)
+                with lock:
+                    owner.active -= 1
+                if fid in FORWARDS:
+                    body = {"status": "ok", "data": FORWARDS[fid]}
+                else:
+                    body = {"status": "failed", "data": None}
+                raw = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api = f"127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def rawmsg():
+    return [
+        {"message_id": 10, "message": [{"type": "forward", "data": {"id": "100"}}]},
+        {"message_id": 11, "message": [{"type": "forward", "data": {"id": "101"}}]},
+        {"message_id": 12, "message": [{"type": "forward", "data": {"id": "999"}}]},
+        # 同一转发既在顶层又嵌在 100 内
+        {"message_id": 13, "message": [{"type": "forward", "data": {"id": "200"}}]},
+    ]
+
+
+class ForwardExpandTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_forward_expand()
+        self.napcat = FakeNapCat()
+        self.addCleanup(self.napcat.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def expander(self, **kwargs):
+        exp = self.mod.ForwardExpander(self.napcat.api, "tok", cache_dir=self.tmpdir.name, **kwargs)
+        self.addCleanup(exp.close)
+        return exp
+
+    def test_expands_nested_forwards_keeping_ids(self):
+        result = self.expander().expand(rawmsg())
+        outer = result[0]["message"][0]["data"]
+        self.assertEqual(outer["id"], "100")
+        inner = outer["messages"][1]["message"][0]["data"]
+        self.assertEqual(inner["id"], "200")
+        self.assertEqual(inner["messages"][0]["message"][0]["data"]["text"], "内层")
+        self.assertEqual(result[1]["message"][0]["data"]["messages"][0]["message_id"], 3)
+        # 拉取失败的 forward 保持原样
+        self.assertEqual(result[2]["message"][0]["data"], {"id": "999"})
+        self.assertEqual(result[3]["message"][0]["data"]["messages"][0]["message_id"], 4)
+        self.assertEqual(sorted(fid for fid, _ in self.napcat.calls), ["100", "101", "200", "999"])
+        self.assertTrue(all(auth == "Bearer tok" for _, auth in self.napcat.calls))
+
+    def test_same_depth_ids_are_fetched_concurrently(self):
+        started = time.monotonic()
+        self.expander(concurrency=4).expand(rawmsg())
+        elapsed = time.monotonic() - started
+        self.assertGreaterEqual(self.napcat.peak, 2)
+        # 四个 id 同层并发，约 0.2s；串行需要 4 × 0.2s
+        self.assertLess(elapsed, 0.6)
+
+    def test_results_are_memoized_across_runs(self):
+        self.expander().expand(rawmsg())
+        first_calls = len(self.napcat.calls)
+        self.expander().expand(rawmsg())
+        # 只有失败的 999 会被再次请求
+        self.assertEqual([fid for fid, _ in self.napcat.calls[first_calls:]], ["999"])
+
+    def test_input_without_forwards_is_returned_unchanged(self):
+        data = [{"message_id": 1, "message": [{"type": "text", "data": {"text": "hi"}}]}]
+        self.assertIs(self.expander().expand(data), data)
+        self.assertEqual(self.napcat.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from .helpers import load_script_module
+
+# progress-lite-json.sh 中 jq 的 preview 定义，索引里的预览必须与之一致
+JQ_PREVIEW = r'''
+def preview($m):
+  (($m.message // [])
+    | map(
+        if .type=="text" then .data.text
+        elif .type=="face" then "[表情]"
+        elif .type=="image" then "[图片]"
+        elif .type=="json" then  "[卡片]"
+        elif .type=="file" then  "[文件]"
+        elif .type=="poke" then  "[戳一戳]"
+        else ""
+        end
+      )
+    | join("")
+    | gsub("\\s+";" ") )[0:80];
+map(preview(.))
+'''
+
+
+def load_history_index():
+    return load_script_module("history_index", "getmsgserv/history_index.py")
+
+
+def msg(message_id, ts, *segments):
+    return {"message_id": message_id, "time": ts, "message": list(segments)}
+
+
+def text(value):
+    return {"type": "text", "data": {"text": value}}
+
+
+class HistoryIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_history_index()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.db_path = os.path.join(self.tmpdir.name, "OQQWall.db")
+
+    def write_history(self, messages, as_array=False):
+        path = os.path.join(self.tmpdir.name, "priv_post.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            if as_array:
+                json.dump(messages, f, ensure_ascii=False)
+            else:
+                for m in messages:
+                    f.write(json.dumps(m, ensure_ascii=False) + "\n")
+        return path
+
+    @unittest.skipUnless(shutil.which("jq"), "jq not installed")
+    def test_preview_matches_jq(self):
+        samples = [
+            msg(1, 0, text("你好\n\n  世界"), {"type": "face", "data": {"id": "1"}}, {"type": "image", "data": {}}),
+            msg(2, 0, {"type": "json", "data": {}}, {"type": "file", "data": {}}, {"type": "poke", "data": {}},
+                {"type": "video", "data": {}}),
+            msg(3, 0, text("长" * 100)),
+            {"message_id": 4},
+        ]
+        out = subprocess.run(["jq", "-c", JQ_PREVIEW], input=json.dumps(samples, ensure_ascii=False),
+                             capture_output=True, text=True, check=True).stdout
+        self.assertEqual([self.mod.preview_text(m) for m in samples], json.loads(out))
+
+    def test_recorded_messages_are_looked_up_by_id(self):
+        conn = sqlite3.connect(self.db_path)
+        self.mod.ensure_table(conn)
+        self.mod.record_message(conn, msg(101, 1700000000, text("第一条")))
+        self.mod.record_message(conn, msg(102, 1700000060, {"type": "image", "data": {}}))
+        self.assertFalse(self.mod.record_message(conn, {"message": []}))
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(self.mod.lookup(["101", "102", "999"], self.db_path), {
+            "101": {"time": 1700000000, "preview": "第一条"},
+            "102": {"time": 1700000060, "preview": "[图片]"},
+        })
+        self.assertEqual(self.mod.lookup([], self.db_path), {})
+
+    def test_reply_ids_include_nested_forwards(self):
+        rawmsg = [
+            msg(1, 0, {"type": "reply", "data": {"id": 55}}, text("x")),
+            msg(2, 0, {"type": "forward", "data": {"messages": [
+                {"message": [{"type": "reply", "data": {"id": "66"}}]},
+            ]}}),
+        ]
+        self.assertEqual(self.mod.reply_ids(rawmsg), ["55", "66"])
+
+    def test_cli_backfills_empty_index_from_history(self):
+        for as_array in (False, True):
+            with self.subTest(as_array=as_array):
+                if os.path.exists(self.db_path):
+                    os.unlink(self.db_path)
+                history = self.write_history([msg(7, 1700000000, text("被引用"))], as_array=as_array)
+                stdin = io.StringIO(json.dumps([msg(8, 1700000100, {"type": "reply", "data": {"id": 7}})]))
+                out = io.StringIO()
+                with mock.patch("sys.stdin", stdin), redirect_stdout(out):
+                    self.mod.main(["lookup", "--db", self.db_path, "--history", history])
+                self.assertEqual(json.loads(out.getvalue()), {"7": {"time": 1700000000, "preview": "被引用"}})
+
+    def test_prune_drops_expired_rows(self):
+        conn = sqlite3.connect(self.db_path)
+        self.mod.ensure_table(conn)
+        self.mod.record_message(conn, msg(1, int(time.time()) - 90 * 86400, text("old")))
+        self.mod.record_message(conn, msg(2, int(time.time()), text("new")))
+        self.assertEqual(self.mod.prune(conn, max_age_days=30), 1)
+        conn.commit()
+        conn.close()
+        self.assertEqual(list(self.mod.lookup(["1", "2"], self.db_path)), ["2"])
+
+    def test_prune_command_used_by_cache_prune(self):
+        conn = sqlite3.connect(self.db_path)
+        self.mod.ensure_table(conn)
+        self.mod.record_message(conn, msg(1, int(time.time()) - 3 * 86400, text("old")))
+        conn.commit()
+        conn.close()
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(self.mod.main(["prune", "--db", self.db_path, "--days", "1"]), 0)
+        self.assertEqual(out.getvalue().strip(), "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import stat
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .helpers import load_script_module
+
+
+def load_media_fetch():
+    return load_script_module("media_fetch", "getmsgserv/LM_work/media_fetch.py")
+
+
+FAKE_DOCKER = """#!/bin/bash
+echo "$*" >> "{log}"
+case "$1" in
+  inspect) echo '[]' ;;
+  exec) shift 6; cd "{root}" && tar -cf - -- "${{@#/}}" ;;
+  *) exit 1 ;;
+esac
+"""
+
+
+class MediaFetchTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_media_fetch()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.folder = os.path.join(self.root, "cache", "picture", "5")
+        self.src_dir = os.path.join(self.root, "src")
+        os.makedirs(self.src_dir)
+
+    def write(self, path, data=b"img"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def fetcher(self, **kwargs):
+        kwargs.setdefault("mounts", [])
+        kwargs.setdefault("store_dir", os.path.join(self.root, "cache", "media_store"))
+        fetcher = self.mod.MediaFetcher("5", self.folder, self.root, **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_host_files_are_linked_numbered_and_rewritten_once(self):
+        a = self.write(os.path.join(self.src_dir, "a.JPG"))
+        b = self.write(os.path.join(self.src_dir, "b"))
+        messages = [
+            {"message": [{"type": "image", "data": {"url": f"file://{a}", "file": "a.JPG"}}]},
+            {"message": [{"type": "forward", "data": {"messages": [
+                {"message": [{"type": "image", "data": {"url": f"file://{b}"}},
+                             {"type": "image", "data": {"url": f"file://{a}", "file": "a.JPG"}}]}]}}]},
+        ]
+        fetcher = self.fetcher()
+        result = fetcher.process(messages)
+        base = f"file://{self.root}/cache/picture/5/"
+        self.assertEqual(result[0]["message"][0]["data"]["url"], base + "5-1.jpg")
+        inner = result[1]["message"][0]["data"]["messages"][0]["message"]
+        self.assertEqual(inner[0]["data"]["url"], base + "5-2.png")
+        self.assertEqual(inner[1]["data"]["url"], base + "5-1.jpg")
+        self.assertEqual(os.stat(a).st_ino, os.stat(os.path.join(self.folder, "5-1.jpg")).st_ino)
+        # a 与 b 内容相同：收录进 media_store 后指向同一份数据
+        self.assertTrue(os.path.samefile(os.path.join(self.folder, "5-1.jpg"), os.path.join(self.folder, "5-2.png")))
+        self.assertEqual(fetcher.stats["stored"], 2)
+        self.assertEqual(fetcher.stats["linked"], 2)
+
+    def test_container_paths_use_bind_mount_then_one_tar_stream(self):
+        mounted = self.write(os.path.join(self.root, "qqdata", "img", "m.png"), b"mounted")
+        fake_root = os.path.join(self.root, "container")
+        for name in ("x.png", "y.png"):
+            self.write(os.path.join(fake_root, "app", "tmp", name), name.encode())
+        log = os.path.join(self.root, "docker.log")
+        docker = os.path.join(self.root, "docker")
+        with open(docker, "w") as f:
+            f.write(FAKE_DOCKER.format(log=log, root=fake_root))
+        os.chmod(docker, os.stat(docker).st_mode | stat.S_IEXEC)
+
+        messages = [{"message": [
+            {"type": "image", "data": {"url": "file:///app/.config/QQ/img/m.png"}},
+            {"type": "image", "data": {"url": "file:///app/tmp/x.png"}},
+            {"type": "image", "data": {"url": "file:///app/tmp/y.png"}},
+        ]}]
+        fetcher = self.fetcher(docker_bin=docker,
+                               mounts=[("/app/.config/QQ", os.path.join(self.root, "qqdata"))])
+        fetcher.process(messages)
+        with open(os.path.join(self.folder, "5-1.png"), "rb") as f:
+            self.assertEqual(f.read(), b"mounted")
+        with open(os.path.join(self.folder, "5-3.png"), "rb") as f:
+            self.assertEqual(f.read(), b"y.png")
+        with open(log) as f:
+            calls = f.read().splitlines()
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(calls[0].startswith("exec napcat tar"))
+        self.assertEqual(fetcher.stats["docker_batch"], 2)
+        self.assertTrue(os.path.samefile(mounted, os.path.join(self.folder, "5-1.png")))
+
+    def test_http_downloads_run_concurrently_and_existing_files_are_kept(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                barrier.wait()
+                body = self.path.encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        self.write(os.path.join(self.folder, "5-1.png"), b"cached")
+        messages = [{"message": [
+            {"type": "image", "data": {"url": base + "/cached.png"}},
+            {"type": "image", "data": {"url": base + "/a.png?x=1"}},
+            {"type": "image", "data": {"url": base + "/b.gif"}},
+            {"type": "image", "data": {"url": base + "/c.webp"}},
+        ]}]
+        self.fetcher(concurrency=4).process(messages)
+        with open(os.path.join(self.folder, "5-1.png"), "rb") as f:
+            self.assertEqual(f.read(), b"cached")
+        with open(os.path.join(self.folder, "5-2.png"), "rb") as f:
+            self.assertEqual(f.read(), b"/a.png?x=1")
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "5-4.webp")))
+
+    def test_videos_are_numbered_separately_and_queued_with_poster(self):
+        v = self.write(os.path.join(self.src_dir, "v.mov"), b"not really a video")
+        i = self.write(os.path.join(self.src_dir, "i.png"))
+        messages = [{"message": [
+            {"type": "image", "data": {"url": f"file://{i}"}},
+            {"type": "video", "data": {"url": f"file://{v}", "file": "v.mov"}},
+        ]}]
+        vt = self.mod.video_transcode
+        poster_dir = self.folder
+
+        def fake_poster(src, poster):
+            self.write(poster, b"jpeg")
+            return True
+
+        with mock.patch.object(vt, "probe_codecs", return_value=("hevc", "aac")), \
+                mock.patch.object(vt, "extract_poster", side_effect=fake_poster), \
+                mock.patch.object(vt, "spawn_worker") as spawn:
+            fetcher = self.fetcher(video_cache_dir=os.path.join(self.root, "vcache"))
+            result = fetcher.process(messages)
+        spawn.assert_called_once()
+        video = result[0]["message"][1]["data"]
+        self.assertTrue(video["url"].endswith("/5-1-h264.mp4"), video["url"])
+        self.assertTrue(video["poster"].endswith("/5-1-poster.jpg"))
+        self.assertTrue(os.path.exists(os.path.join(poster_dir, "5-1-h264.mp4.pending")))
+        self.assertTrue(result[0]["message"][0]["data"]["url"].endswith("/5-1.png"))
+
+        # 转码仍在进行时重跑（如 LLM 重试）不会重复获取或入队
+        with mock.patch.object(vt, "spawn_worker") as spawn:
+            again = self.fetcher(video_cache_dir=os.path.join(self.root, "vcache")).process(
+                [{"message": [{"type": "video", "data": {"url": f"file://{v}", "file": "v.mov"}}]}])
+        spawn.assert_not_called()
+        self.assertTrue(again[0]["message"][0]["data"]["poster"].endswith("/5-1-poster.jpg"))
+
+if __name__ == "__main__":
+    unittest.main()
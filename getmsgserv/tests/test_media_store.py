@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+from .helpers import load_script_module
+
+
+def load_media_store():
+    return load_script_module("media_store", "getmsgserv/media_store.py")
+
+
+class MediaStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_media_store()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.store = self.mod.MediaStore(os.path.join(self.root, "media_store"))
+
+    def write(self, rel, data):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def blob_count(self):
+        return self.store.stats()["blobs"]
+
+    def test_duplicates_across_tags_share_one_blob(self):
+        a = self.write("picture/1/1-1.jpg", b"popular meme")
+        b = self.write("picture/2/2-1.jpg", b"popular meme")
+        c = self.write("picture/2/2-2.png", b"unique")
+        self.store.ingest_dir("1", os.path.dirname(a))
+        self.store.ingest_dir("2", os.path.dirname(b))
+
+        self.assertEqual(self.blob_count(), 2)
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertFalse(os.path.samefile(a, c))
+        with open(b, "rb") as f:
+            self.assertEqual(f.read(), b"popular meme")
+        stats = self.store.stats()
+        self.assertEqual((stats["references"], stats["manifests"]), (3, 2))
+
+    def test_link_places_per_tag_path_without_copying(self):
+        src = self.write("picture/3/3-1.png", b"pixels")
+        dest = os.path.join(self.root, "prepost", "3", "3-01.jpg")
+        self.assertTrue(self.store.link("3", f"file://{src}", dest))
+        self.assertTrue(os.path.samefile(src, dest))
+        self.assertTrue(os.path.samefile(dest, self.store.blob_path(self.mod.file_sha256(src))))
+        self.assertFalse(self.store.link("3", "https://example.invalid/x.jpg", dest + "2"))
+
+    def test_release_collects_only_unreferenced_blobs(self):
+        shared_1 = self.write("picture/1/1-1.jpg", b"shared")
+        self.write("picture/2/2-1.jpg", b"shared")
+        only_1 = self.write("picture/1/1-2.jpg", b"only tag 1")
+        self.store.ingest_dir("1", os.path.dirname(shared_1))
+        self.store.ingest_dir("2", os.path.join(self.root, "picture", "2"))
+
+        self.assertEqual(self.store.release(["1"]), 1)
+        self.assertFalse(os.path.exists(self.store.manifest_path("1")))
+        self.assertTrue(os.path.isfile(self.store.blob_path(self.mod.file_sha256(shared_1))))
+        # 回收 blob 不影响仍存在的 tag 路径
+        self.assertTrue(os.path.isfile(only_1))
+
+        self.assertEqual(self.store.release(["2"]), 1)
+        self.assertEqual(self.blob_count(), 0)
+
+    def test_gc_drops_references_to_deleted_paths(self):
+        kept = self.write("prepost/4/4-01.jpg", b"kept")
+        gone = self.write("prepost/4/4-02.jpg", b"gone")
+        self.store.ingest("4", [kept, gone])
+        os.unlink(gone)
+        self.assertEqual(self.store.gc(), 1)
+        self.assertEqual(self.blob_count(), 1)
+        self.assertEqual(self.store.stats()["references"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from PIL import Image
+
+from .helpers import load_script_module
+
+
+def load_outbound_encoder():
+    return load_script_module("outbound_encoder", "getmsgserv/outbound_encoder.py")
+
+
+def noisy_image(size, fmt="JPEG", quality=95):
+    rng = random.Random(7)
+    img = Image.frombytes("RGB", size, bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+    out = io.BytesIO()
+    img.save(out, fmt, **({"quality": quality} if fmt == "JPEG" else {}))
+    return out.getvalue()
+
+
+class OutboundEncoderTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_outbound_encoder()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.folder = os.path.join(self.tmp.name, "prepost", "7")
+        os.makedirs(self.folder)
+        self.manifests = os.path.join(self.tmp.name, "outbound")
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_group_settings_defaults_and_overrides(self):
+        cfg = os.path.join(self.tmp.name, "AcountGroupcfg.json")
+        with open(cfg, "w", encoding="utf-8") as f:
+            json.dump({"G": {"outbound_image_short_side": "800", "outbound_image_max_kb": "0",
+                             "outbound_image_format": "WebP"}}, f)
+        self.assertEqual(self.mod.group_settings("G", cfg), {"short_side": 800, "max_kb": 0, "format": "webp"})
+        # groups that never opted in are sent as-is
+        self.assertEqual(self.mod.group_settings("missing", cfg),
+                         {"short_side": 0, "max_kb": 0, "format": "jpeg"})
+        big = io.BytesIO()
+        Image.new("RGB", (2000, 3000), (200, 30, 30)).save(big, "PNG")
+        self.assertEqual(self.mod.encode_image(big.getvalue(), 0, 0), (None, {"size": [2000, 3000], "format": "png",
+                                                                                "action": "kept"}))
+
+    def test_images_within_limits_are_kept_byte_for_byte(self):
+        data = noisy_image((64, 48))
+        path = self.write("7-00.jpeg", data)
+        manifest = self.mod.encode_folder(7, self.folder, {"short_side": 1440, "max_kb": 1024, "format": "jpeg"},
+                                          self.manifests)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(manifest["files"][0]["action"], "kept")
+        self.assertTrue(os.path.isfile(os.path.join(self.manifests, "7.json")))
+
+    def test_oversized_images_are_replaced_not_rewritten_in_place(self):
+        shared = os.path.join(self.tmp.name, "blob.jpg")
+        with open(shared, "wb") as f:
+            f.write(noisy_image((400, 300)))
+        linked = os.path.join(self.folder, "7-01.jpg")
+        os.link(shared, linked)
+        self.write("7-02.png", noisy_image((300, 200), "PNG"))
+        settings = {"short_side": 150, "max_kb": 40, "format": "jpeg"}
+
+        manifest = self.mod.encode_folder(7, self.folder, settings, self.manifests, workers=2)
+
+        self.assertEqual(sorted(os.listdir(self.folder)), ["7-01.jpg", "7-02.jpg"])
+        self.assertFalse(os.path.samefile(shared, linked))
+        self.assertEqual(os.path.getsize(shared), manifest["files"][0]["original_bytes"])
+        for entry in manifest["files"]:
+            self.assertEqual(entry["action"], "encoded")
+            self.assertLessEqual(entry["sent_bytes"], 40 * 1024)
+            with Image.open(os.path.join(self.folder, entry["sent_name"])) as img:
+                self.assertEqual(img.format, "JPEG")
+                self.assertLessEqual(min(img.size), 150)
+                self.assertEqual(list(img.size), entry["sent_size"])
+        self.assertLess(manifest["sent_bytes"], manifest["original_bytes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from .helpers import load_script_module
+
+
+def load_pipeline():
+    return load_script_module("pipeline", "getmsgserv/pipeline.py")
+
+
+class Flaky:
+    """Step function that fails the first `failures` calls, counting every call."""
+
+    def __init__(self, output, failures=0):
+        self.output = output
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, inputs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError(f"boom {self.calls}")
+        return self.output(inputs) if callable(self.output) else self.output
+
+
+class PipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_pipeline()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.sleeps = []
+
+    def make(self, steps):
+        return self.mod.Pipeline(7, steps, self.tmp.name, sleep=self.sleeps.append, log=lambda msg: None)
+
+    def test_only_the_failed_step_is_retried_with_backoff(self):
+        fetch = Flaky({"messages": [1, 2]})
+        group = Flaky(lambda inputs: {"n": len(inputs["fetch"]["messages"])}, failures=2)
+        outputs = self.make([
+            self.mod.Step("fetch", fetch),
+            self.mod.Step("grouping", group, ["fetch"], retries=2, backoff=1.5),
+        ]).run()
+        self.assertEqual(outputs["grouping"], {"n": 2})
+        self.assertEqual((fetch.calls, group.calls), (1, 3))
+        self.assertEqual(self.sleeps, [1.5, 3.0])
+        # 全部成功后删除检查点
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "7")))
+
+    def test_failed_run_resumes_from_checkpoints(self):
+        fetch = Flaky({"messages": ["a"]})
+        group = Flaky({"ok": True}, failures=5)
+        steps = [self.mod.Step("fetch", fetch), self.mod.Step("grouping", group, ["fetch"], retries=1)]
+        with self.assertRaises(self.mod.StepFailed) as ctx:
+            self.make(steps).run(key="raw-1")
+        self.assertEqual((ctx.exception.step, ctx.exception.attempts), ("grouping", 2))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp.name, "7", "fetch.json")))
+
+        group.failures = 0
+        outputs = self.make(steps).run(key="raw-1")
+        self.assertEqual(outputs["grouping"], {"ok": True})
+        self.assertEqual(fetch.calls, 1)
+
+    def test_changed_input_invalidates_checkpoint(self):
+        fetch = Flaky({"messages": ["a"]})
+        group = Flaky({}, failures=10)
+        steps = [self.mod.Step("fetch", fetch), self.mod.Step("grouping", group, ["fetch"], retries=0)]
+        with self.assertRaises(self.mod.StepFailed):
+            self.make(steps).run(key="raw-1")
+        group.failures = 0
+        self.make(steps).run(key="raw-2")
+        self.assertEqual(fetch.calls, 2)
+
+    def test_independent_steps_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def judge(name):
+            def func(inputs):
+                barrier.wait()  # 两个判断阶段必须同时在运行才能通过
+                return {name: inputs["grouping"]}
+            return func
+
+        outputs = self.make([
+            self.mod.Step("grouping", Flaky("g")),
+            self.mod.Step("needpriv", judge("needpriv"), ["grouping"], retries=0),
+            self.mod.Step("safety", judge("safety"), ["grouping"], retries=0),
+            self.mod.Step("store", lambda inputs: sorted(inputs), ["needpriv", "safety"]),
+        ]).run()
+        self.assertEqual(outputs["store"], ["needpriv", "safety"])
+
+    def test_media_step_falls_back_to_per_file_copy(self):
+        calls = []
+
+        def fake_run_json(cmd, stdin=None, env=None):
+            calls.append((os.path.basename(cmd[1]), (env or {}).get("OQQWALL_LEGACY_MEDIA")))
+            if cmd[1].endswith("media_fetch.py"):
+                raise RuntimeError("media_fetch.py 退出码 1")
+            return ["copied"]
+
+        self.mod._run_json = fake_run_json
+        media = next(s for s in self.mod.build_steps(7, 3000, None, {}) if s.name == "media")
+        output = media.func({"fetch": {"notregular": "false", "messages": ["raw"]}})
+        self.assertEqual(output, {"notregular": "false", "messages": ["copied"]})
+        self.assertEqual(calls, [("media_fetch.py", None), ("progress-lite-json.sh", "1")])
+
+
+if __name__ == "__main__":
+    unittest.main()
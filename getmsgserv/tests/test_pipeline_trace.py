@@ -0,0 +1,86 @@
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from .helpers import load_script_module
+
+
+def load_pipeline_trace():
+    return load_script_module("pipeline_trace", "getmsgserv/pipeline_trace.py")
+
+
+class PipelineTraceTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_pipeline_trace()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.db_path = os.path.join(self.tmpdir.name, "OQQWall.db")
+
+    def test_spans_share_trace_id_and_form_timeline(self):
+        with mock.patch.dict(os.environ, {"OQQ_TRACE_ID": "7-1000"}):
+            self.mod.record_span(7, "wait", 100.0, 101.5, db_path=self.db_path)
+            with self.mod.span(7, "lm_grouping", db_path=self.db_path) as info:
+                info["bytes"] = 42
+        # 另一次（更早的）处理不应混入最近一次时间线
+        self.mod.record_span(7, "wait", 10.0, 11.0, trace_id="7-1", db_path=self.db_path)
+
+        spans = self.mod.fetch_spans(7, self.db_path)
+        self.assertEqual([s["stage"] for s in spans], ["wait", "lm_grouping"])
+        self.assertEqual({s["trace_id"] for s in spans}, {"7-1000"})
+        timeline = self.mod.build_timeline(spans)
+        self.assertEqual(timeline["spans"][0]["offset"], 0.0)
+        self.assertEqual(timeline["spans"][0]["duration"], 1.5)
+        self.assertEqual(timeline["spans"][1]["bytes"], 42)
+        self.assertEqual(self.mod.list_traces(7, self.db_path), ["7-1", "7-1000"])
+
+    def test_span_records_failure_and_reraises(self):
+        with mock.patch.dict(os.environ, {"OQQ_TRACE_ID": "8-1"}):
+            with self.assertRaises(SystemExit):
+                with self.mod.span(8, "lm_judge", db_path=self.db_path):
+                    raise SystemExit(1)
+        span = self.mod.fetch_spans(8, self.db_path)[0]
+        self.assertEqual(span["exit_code"], 1)
+        self.assertEqual(span["note"], "SystemExit")
+
+    def test_foreign_trace_id_is_not_inherited(self):
+        with mock.patch.dict(os.environ, {"OQQ_TRACE_ID": "3-500"}):
+            self.assertEqual(self.mod.current_trace_id(3), "3-500")
+            self.assertTrue(self.mod.current_trace_id(4).startswith("4-"))
+
+    def test_record_never_raises_on_unwritable_db(self):
+        bad_path = os.path.join(self.tmpdir.name, "missing", "OQQWall.db")
+        self.assertFalse(self.mod.record_span(1, "wait", 1.0, 2.0, db_path=bad_path))
+        self.assertEqual(self.mod.fetch_spans(1, bad_path), [])
+
+    def test_prune_drops_old_spans_and_tag_lookups_use_index(self):
+        now = time.time()
+        self.mod.record_span(5, "wait", now - 40 * 86400, now - 40 * 86400 + 1, trace_id="5-1", db_path=self.db_path)
+        self.mod.record_span(5, "wait", now - 60, now, trace_id="5-2", db_path=self.db_path)
+        with redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(self.mod.main(["prune", "--db", self.db_path]), 0)
+        self.assertEqual(out.getvalue().strip(), "1")
+        self.assertEqual(self.mod.list_traces(5, self.db_path), ["5-2"])
+        conn = sqlite3.connect(self.db_path)
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT trace_id FROM trace_span WHERE tag = ? "
+                            "ORDER BY start_ts DESC LIMIT 1", ("5",)).fetchall()
+        conn.close()
+        self.assertIn("idx_trace_span_tag", " ".join(str(row[-1]) for row in plan))
+
+    def test_cli_record_and_print(self):
+        with mock.patch.dict(os.environ, {"OQQ_TRACE_ID": "9-1"}):
+            self.mod.main(["record", "9", "chrome", "5.0", "6.25", "0", "2048", "--db", self.db_path])
+        out = io.StringIO()
+        with redirect_stdout(out):
+            rc = self.mod.main(["9", "--db", self.db_path])
+        self.assertEqual(rc, 0)
+        self.assertIn("chrome", out.getvalue())
+        self.assertIn("2048B", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from .helpers import load_script_module
+
+
+def load_qr_cache():
+    return load_script_module("qr_cache", "getmsgserv/HTMLwork/qr_cache.py")
+
+
+class QRCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_qr_cache()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.encoded = []
+        self.cache = self.mod.QRCache(os.path.join(self.tmp.name, "qr_cache"), encoder=self.fake_encode)
+
+    def fake_encode(self, url):
+        self.encoded.append(url)
+        return f"png:{url}".encode()
+
+    def out(self, *parts):
+        return os.path.join(self.tmp.name, "qrcode", *parts)
+
+    def test_same_url_is_encoded_once_across_tags(self):
+        url = "https://b23.tv/abc"
+        self.cache.make(url, self.out("1", "qr_11.png"))
+        self.cache.make(url, self.out("2", "qr_21.png"))
+        self.cache.make(url, self.out("1", "qr_11.png"))
+        self.cache.make("https://example.com/other", self.out("2", "qr_22.png"))
+
+        self.assertEqual(self.encoded, [url, "https://example.com/other"])
+        self.assertEqual(self.cache.stats, {"hits": 2, "encoded": 2})
+        self.assertTrue(os.path.samefile(self.out("1", "qr_11.png"), self.out("2", "qr_21.png")))
+        with open(self.out("2", "qr_22.png"), "rb") as f:
+            self.assertEqual(f.read(), b"png:https://example.com/other")
+
+    def test_prune_drops_entries_unused_for_too_long(self):
+        old = self.cache.get("https://old.example.com")
+        kept = self.cache.get("https://new.example.com")
+        stale = time.time() - 40 * 86400
+        os.utime(old, (stale, stale))
+        self.assertEqual(self.cache.prune(max_age_days=30), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(kept))
+
+    @unittest.skipUnless(importlib.util.find_spec("qrcode") or shutil.which("qrencode"),
+                         "neither qrcode nor qrencode installed")
+    def test_encode_png_writes_png(self):
+        self.assertTrue(self.mod.encode_png("https://example.com").startswith(b"\x89PNG"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+from .helpers import load_script_module
+
+try:
+    import zxingcpp
+except ImportError:
+    zxingcpp = None
+
+
+def load_qr_scan():
+    return load_script_module("qr_scan", "getmsgserv/qr_scan.py")
+
+
+class FakeDecoder:
+    """Finds a 'code' only when the image's long side is at most `readable_side`."""
+
+    def __init__(self, readable_side=None, text="https://qm.qq.com/q/abc"):
+        self.readable_side = readable_side
+        self.text = text
+        self.sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, img):
+        with self.lock:
+            self.sizes.append(img.size)
+        if self.readable_side and max(img.size) <= self.readable_side:
+            return [self.text, self.text]
+        return []
+
+
+class QRScanTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_qr_scan()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.folder = os.path.join(self.tmp.name, "picture", "9")
+        os.makedirs(self.folder)
+        self.cache = os.path.join(self.tmp.name, "qr_scan")
+
+    def save(self, name, size, color=255):
+        path = os.path.join(self.folder, name)
+        Image.new("L", size, color).save(path)
+        return path
+
+    def test_large_screenshots_are_downscaled_until_readable(self):
+        self.save("9-1.png", (1200, 6000))
+        decoder = FakeDecoder(readable_side=1000)
+        results = self.mod.QRScanner(self.cache, decode=decoder).scan_paths(self.mod.list_images(self.folder))
+        self.assertEqual(results[0][1], ["https://qm.qq.com/q/abc"])
+        self.assertEqual(max(decoder.sizes[0]), self.mod.MAX_DECODE_SIDE)
+        self.assertGreater(len(decoder.sizes), 2)
+        # nothing readable: give up once the long side drops below the minimum
+        decoder = FakeDecoder()
+        with open(os.path.join(self.folder, "9-1.png"), "rb") as f:
+            self.assertEqual(self.mod.decode_image(f.read(), decoder), [])
+        self.assertGreaterEqual(max(decoder.sizes[-1]), self.mod.MIN_DECODE_SIDE)
+
+    def test_results_are_cached_by_content_and_formatted_like_before(self):
+        self.save("9-2.jpg", (300, 300))
+        self.save("9-1.png", (300, 300), color=0)
+        self.save("9-3.jpeg", (300, 300), color=128)
+        decoder = FakeDecoder(readable_side=300)
+        paths = self.mod.list_images(self.folder)
+        self.assertEqual([os.path.basename(p) for p in paths], ["9-2.jpg", "9-3.jpeg", "9-1.png"])
+        scanner = self.mod.QRScanner(self.cache, decode=decoder, workers=3)
+        output = self.mod.format_results(scanner.scan_paths(paths))
+        self.assertEqual(output.splitlines()[0], f"{paths[0]}: https://qm.qq.com/q/abc")
+        self.assertEqual(len(output.splitlines()), 3)
+
+        again = self.mod.QRScanner(self.cache, decode=FakeDecoder())
+        self.assertEqual(self.mod.format_results(again.scan_paths(paths)), output)
+        self.assertEqual(again.stats["cached"], 3)
+        self.assertEqual(self.mod.format_results([(paths[0], [])]), "")
+
+    def test_unreadable_file_does_not_abort_the_scan(self):
+        with open(os.path.join(self.folder, "9-1.jpg"), "wb") as f:
+            f.write(b"not an image")
+        self.save("9-2.jpg", (200, 200))
+        scanner = self.mod.QRScanner(None, decode=FakeDecoder(readable_side=500))
+        results = dict(scanner.scan_paths(self.mod.list_images(self.folder)))
+        self.assertEqual(results[os.path.join(self.folder, "9-1.jpg")], [])
+        self.assertEqual(scanner.stats["errors"], 1)
+
+    @unittest.skipIf(zxingcpp is None, "zxing-cpp not installed")
+    def test_decodes_real_qr_code_in_long_screenshot(self):
+        code = zxingcpp.create_barcode("https://qm.qq.com/q/real", zxingcpp.BarcodeFormat.QRCode)
+        view = memoryview(zxingcpp.write_barcode_to_image(code, scale=4))
+        qr = Image.frombytes("L", (view.shape[1], view.shape[0]), view.tobytes())
+        page = Image.new("L", (1440, 7000), 255)
+        page.paste(qr.resize((qr.width * 6, qr.height * 6), Image.NEAREST), (200, 3000))
+        page.save(os.path.join(self.folder, "9-1.jpg"), quality=85)
+        results = self.mod.QRScanner(self.cache).scan_paths(self.mod.list_images(self.folder))
+        self.assertEqual(results[0][1], ["https://qm.qq.com/q/real"])
+
+
+if __name__ == "__main__":
+    unittest.main()
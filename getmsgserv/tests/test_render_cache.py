@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from .helpers import REPO_ROOT, load_script_module
+
+FIXTURE_DIR = REPO_ROOT / "getmsgserv" / "tests" / "fixtures" / "render_post"
+
+
+def load_render_cache():
+    return load_script_module("render_cache", "getmsgserv/HTMLwork/render_cache.py")
+
+
+class RenderCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_render_cache()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, "cache"))
+        shutil.copy(FIXTURE_DIR / "AcountGroupcfg.json", self.root)
+        with open(FIXTURE_DIR / "basic.json", encoding="utf-8") as f:
+            self.fx = json.load(f)
+        self.db = os.path.join(self.root, "cache", "OQQWall.db")
+        conn = sqlite3.connect(self.db)
+        conn.execute("CREATE TABLE preprocess (tag INTEGER, senderid TEXT, nickname TEXT, receiver TEXT, "
+                     "ACgroup TEXT, AfterLM TEXT, comment TEXT, numnfinal INTEGER)")
+        conn.execute("INSERT INTO preprocess (tag, senderid, nickname, ACgroup, AfterLM) VALUES (?, ?, ?, ?, ?)",
+                     (self.fx["tag"], self.fx["senderid"], self.fx["nickname"], self.fx["ACgroup"],
+                      json.dumps(self.fx["AfterLM"], ensure_ascii=False)))
+        conn.commit()
+        conn.close()
+        self.cache = self.mod.RenderCache(os.path.join(self.root, "cache", "render_cache"))
+
+    def key(self):
+        return self.mod.compute_key(self.fx["tag"], self.root)
+
+    def write_pages(self, folder, prefix, count):
+        os.makedirs(folder, exist_ok=True)
+        for i in range(count):
+            with open(os.path.join(folder, f"{prefix}{i:02d}.jpeg"), "wb") as f:
+                f.write(b"page%d" % i)
+
+    def test_key_tracks_content_and_group_config(self):
+        key = self.key()
+        self.assertIsNotNone(key)
+        self.assertEqual(self.key(), key)
+
+        after_lm = dict(self.fx["AfterLM"], needpriv="true")
+        conn = sqlite3.connect(self.db)
+        conn.execute("UPDATE preprocess SET AfterLM=? WHERE tag=?", (json.dumps(after_lm), self.fx["tag"]))
+        conn.commit()
+        conn.close()
+        changed = self.key()
+        self.assertNotEqual(changed, key)
+
+        cfg_path = os.path.join(self.root, "AcountGroupcfg.json")
+        with open(cfg_path, encoding="utf-8") as f:
+            cfg = json.load(f)
+        cfg[self.fx["ACgroup"]]["watermark_text"] = "another"
+        with open(cfg_path, "w", encoding="utf-8") as f:
+            json.dump(cfg, f)
+        previous, changed = changed, self.key()
+        self.assertNotEqual(changed, previous)
+
+        with open(os.path.join(self.root, "oqqwall.config"), "w", encoding="utf-8") as f:
+            f.write('render_slice_max_kb="1024"\n')
+        self.assertNotEqual(self.key(), changed)
+
+        self.assertIsNone(self.mod.compute_key(999, self.root))
+
+    def test_store_then_restore_hardlinks_pages(self):
+        key = self.key()
+        prefix = f"{self.fx['tag']}-"
+        src = os.path.join(self.root, "render")
+        self.write_pages(src, prefix, 3)
+        html = os.path.join(src, f"{self.fx['tag']}.html")
+        with open(html, "w", encoding="utf-8") as f:
+            f.write("<html></html>")
+        self.assertEqual(self.cache.store(key, src, html, prefix), 3)
+
+        dest = os.path.join(self.root, "cache", "prepost", str(self.fx["tag"]))
+        os.makedirs(dest)
+        with open(os.path.join(dest, "stale.jpeg"), "wb") as f:
+            f.write(b"x")
+        self.assertEqual(self.cache.restore(key, prefix, dest), 3)
+        self.assertEqual(sorted(os.listdir(dest)), [f"{prefix}{i:02d}.jpeg" for i in range(3)])
+        self.assertTrue(os.path.samefile(os.path.join(dest, f"{prefix}01.jpeg"),
+                                         os.path.join(self.cache.entry_dir(key), "01.jpeg")))
+        self.assertEqual(self.cache.restore("0" * 64, prefix, dest), 0)
+        self.assertEqual(len(os.listdir(dest)), 3)
+
+    def test_cached_html_and_prune(self):
+        key = self.key()
+        self.assertIsNone(self.mod.cached_html(self.fx["tag"], self.root))
+        src = os.path.join(self.root, "render")
+        self.write_pages(src, "", 1)
+        html = os.path.join(src, "post.html")
+        with open(html, "w", encoding="utf-8") as f:
+            f.write("<p>cached</p>")
+        self.cache.store(key, src, html, "")
+        self.assertEqual(self.mod.cached_html(self.fx["tag"], self.root), "<p>cached</p>")
+
+        self.assertEqual(self.cache.prune(), 0)
+        old = time.time() - 30 * 86400
+        os.utime(self.cache.entry_dir(key), (old, old))
+        self.assertEqual(self.cache.prune(), 1)
+        self.assertEqual(self.cache.pages(key), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
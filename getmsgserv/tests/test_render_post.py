@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+
+from .helpers import REPO_ROOT, load_script_module
+
+FIXTURE_DIR = REPO_ROOT / "getmsgserv" / "tests" / "fixtures" / "render_post"
+FIXTURES = ("basic", "cards", "anonymous")
+
+
+def load_render_post():
+    return load_script_module("render_post", "getmsgserv/HTMLwork/render_post.py")
+
+
+def load_fixture(name):
+    with open(FIXTURE_DIR / f"{name}.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RenderPostTests(unittest.TestCase):
+    """golden 文件由原 gotohtml.sh（jq 实现）生成，根目录路径替换为 @ROOT@。"""
+
+    def setUp(self):
+        self.mod = load_render_post()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, "cache"))
+        shutil.copy(FIXTURE_DIR / "AcountGroupcfg.json", self.root)
+        conn = sqlite3.connect(os.path.join(self.root, "cache", "OQQWall.db"))
+        conn.execute("CREATE TABLE preprocess (tag INTEGER, senderid TEXT, nickname TEXT, receiver TEXT, "
+                     "ACgroup TEXT, AfterLM TEXT, comment TEXT, numnfinal INTEGER)")
+        for name in FIXTURES:
+            fx = load_fixture(name)
+            conn.execute("INSERT INTO preprocess (tag, senderid, nickname, ACgroup, AfterLM) VALUES (?, ?, ?, ?, ?)",
+                         (fx["tag"], fx["senderid"], fx["nickname"], fx["ACgroup"],
+                          json.dumps(fx["AfterLM"], ensure_ascii=False)))
+        conn.commit()
+        conn.close()
+        self.qrs = []
+
+    def fake_qr(self, url, path):
+        self.qrs.append((url, os.path.basename(path)))
+
+    @staticmethod
+    def remote_avatar(uid):
+        # golden 文件生成时还没有头像缓存
+        return f"https://qlogo2.store.qq.com/qzone/{uid}/{uid}/640"
+
+    def golden(self, name):
+        with open(FIXTURE_DIR / f"{name}.html", encoding="utf-8") as f:
+            return f.read().replace("@ROOT@", self.root)
+
+    def test_output_matches_golden_files(self):
+        for name in FIXTURES:
+            with self.subTest(name):
+                html = self.mod.render_tag(load_fixture(name)["tag"], self.root, make_qr=self.fake_qr,
+                                           avatar=self.remote_avatar)
+                self.assertEqual(html, self.golden(name))
+
+    def test_qr_codes_follow_card_message_ids(self):
+        self.mod.render_tag(102, self.root, make_qr=self.fake_qr, avatar=self.remote_avatar)
+        self.assertEqual(self.qrs, [
+            ("https://mp.qzone.qq.com/u/24681357", "qr_301.png"),
+            ("https://b23.tv/abc", "qr_302.png"),
+            ("https://news.example.com/a?b=1&c=2", "qr_303.png"),
+            ("https://y.qq.com/x", "qr_304.png"),
+            ("https://m.example.com/x", "qr_3051.png"),
+            ("https://n.example.com/y", "qr_305.png"),
+        ])
+
+    def test_failed_transcode_falls_back_to_original_video(self):
+        src = os.path.join(self.root, "7-1.mov")
+        dest = os.path.join(self.root, "7-1-h264.mp4")
+        with open(src, "wb") as f:
+            f.write(b"original")
+        seg = {"type": "video", "data": {"url": f"file://{dest}"}}
+        renderer = self.mod.PostRenderer(self.root, self.tmp.name)
+        self.assertIn(f'src="file://{dest}"', renderer.segment(seg, 1))
+        with open(dest + ".failed", "w", encoding="utf-8") as f:
+            f.write(src)
+        self.assertIn(f'src="file://{src}"', renderer.segment(seg, 1))
+
+    def test_missing_tag_raises(self):
+        with self.assertRaises(LookupError):
+            self.mod.render_tag(999, self.root, make_qr=self.fake_qr, avatar=self.remote_avatar)
+
+    @unittest.skipUnless(all(shutil.which(t) for t in ("jq", "sqlite3", "qrencode")),
+                         "jq/sqlite3/qrencode not installed")
+    def test_matches_legacy_script(self):
+        script = REPO_ROOT / "getmsgserv" / "HTMLwork" / "gotohtml.sh"
+        env = dict(os.environ, OQQWALL_HTML_LEGACY="1")
+        for name in FIXTURES:
+            with self.subTest(name):
+                tag = load_fixture(name)["tag"]
+                legacy = subprocess.run(["bash", str(script), str(tag)], cwd=self.root, env=env,
+                                        capture_output=True, text=True, check=True).stdout
+                html = self.mod.render_tag(tag, self.root, make_qr=self.fake_qr, avatar=self.remote_avatar)
+                self.assertEqual(html, legacy)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import base64
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+
+from .helpers import load_script_module
+
+
+def load_render_service():
+    return load_script_module("render_service", "getmsgserv/HTMLwork/render_service.py")
+
+
+class FakeWorker:
+    """代替真实浏览器：记录启动/关闭次数，把 HTML 原样写到输出文件。"""
+
+    def __init__(self, fail_on=()):
+        self.renders = 0
+        self.starts = 0
+        self.closes = 0
+        self.running = False
+        self.fail_on = set(fail_on)
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.starts += 1
+            self.renders = 0
+
+    def close(self):
+        if self.running:
+            self.closes += 1
+        self.running = False
+
+    def render(self, html, out, fmt="pdf", timeout=30, options=None):
+        self.start()
+        if html in self.fail_on:
+            raise RuntimeError("boom")
+        self.renders += 1
+        if fmt == "tiles":
+            os.makedirs(out, exist_ok=True)
+            files = []
+            for i in range(2):
+                files.append(os.path.join(out, f"{options.get('prefix', '')}{i:02d}.jpeg"))
+                with open(files[-1], "w", encoding="utf-8") as f:
+                    f.write(str(options))
+            return {"files": files, "bytes": 2}
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(f"{fmt}:{html}")
+        return {"out": out, "bytes": os.path.getsize(out)}
+
+
+class RenderServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_render_service()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def out(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_pool_recycles_browser_after_n_renders(self):
+        worker = FakeWorker()
+        pool = self.mod.BrowserPool(lambda: worker, size=1, recycle_after=2)
+        for i in range(5):
+            pool.render(f"page{i}.html", self.out(f"{i}.pdf"))
+        self.assertEqual(worker.starts, 3)
+        self.assertEqual(pool.stats["recycled"], 2)
+        self.assertEqual(pool.stats["renders"], 5)
+
+    def test_failed_render_discards_browser(self):
+        worker = FakeWorker(fail_on={"bad.html"})
+        pool = self.mod.BrowserPool(lambda: worker, size=1, recycle_after=50)
+        with self.assertRaises(RuntimeError):
+            pool.render("bad.html", self.out("bad.pdf"))
+        self.assertFalse(worker.running)
+        pool.render("good.html", self.out("good.pdf"))
+        self.assertEqual((worker.starts, pool.stats["failures"]), (2, 1))
+
+    def test_busy_pool_fails_before_client_timeout(self):
+        pool = self.mod.BrowserPool(FakeWorker, size=1)
+        pool._idle.get()  # the only browser is rendering another tag
+        self.mod.POOL_WAIT = 0.2
+        started = time.monotonic()
+        with self.assertRaises(self.mod.RenderError):
+            pool.render("x.html", self.out("x.pdf"), timeout=30)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_unix_socket_round_trip(self):
+        pool = self.mod.BrowserPool(FakeWorker, size=2)
+        sock = self.out("render.sock")
+        server = self.mod.RenderServer(pool, sock, output_roots=[self.tmp.name])
+        server.start()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(server.stop)
+
+        self.assertEqual(self.mod.request({"cmd": "ping"}, sock), {"ok": True})
+        resp = self.mod.render("/tmp/x.html", self.out("x.pdf"), sock_path=sock)
+        self.assertTrue(resp["ok"], resp)
+        with open(self.out("x.pdf"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "pdf:/tmp/x.html")
+        self.assertFalse(self.mod.request({"html": "a.html"}, sock)["ok"])
+        outside = os.path.join(self.tmp.name, "..", "escaped.pdf")
+        self.assertFalse(self.mod.render("/tmp/x.html", outside, sock_path=sock)["ok"])
+        self.assertFalse(os.path.exists(outside))
+        tiles = self.mod.render("/tmp/x.html", self.out("tiles"), "tiles", sock_path=sock, prefix="7-", dpi=180)
+        self.assertEqual([os.path.basename(f) for f in tiles["files"]], ["7-00.jpeg", "7-01.jpeg"])
+        with open(tiles["files"][0], encoding="utf-8") as f:
+            self.assertEqual(f.read(), str({"prefix": "7-", "dpi": 180}))
+        stats = self.mod.request({"cmd": "stats"}, sock)
+        self.assertEqual((stats["pool_size"], stats["renders"]), (2, 2))
+
+    def test_slices_only_cut_between_blocks(self):
+        blocks = [[0, 100], [110, 400], [410, 700], [700, 720], [730, 1500], [1510, 1600]]
+        slices = self.mod.plan_slices(blocks, 1600, 800)
+        self.assertEqual(slices, [[0, 725], [725, 1505], [1505, 1600]])
+        for top, bottom in slices[:-1]:
+            self.assertFalse(any(t < bottom < b for t, b in blocks))
+        # 单块高于上限时只能硬切
+        self.assertEqual(self.mod.plan_slices([[0, 50], [60, 2000]], 2000, 800),
+                         [[0, 55], [55, 855], [855, 1655], [1655, 2000]])
+        self.assertEqual(self.mod.plan_slices([], 300, 800), [[0, 300]])
+
+    def test_tiles_split_oversized_slice_at_middle_block(self):
+        class FakeConn:
+            def send(self, method, params=None, session_id=None, timeout=None):
+                if method == "Runtime.evaluate":
+                    return {"result": {"value": {"total": 1000, "blocks": [[0, 200], [210, 480], [490, 1000]]}}}
+                clip = params["clip"]
+                # 每 CSS 像素 1KB
+                data = bytes(int(clip["height"]) * 1024)
+                return {"data": base64.b64encode(data).decode()}
+
+        @contextmanager
+        def fake_page(html, timeout, metrics=None, media=None):
+            self.assertEqual(metrics["height"], 1536)
+            yield FakeConn(), "s"
+
+        worker = self.mod.BrowserWorker("chrome", tile_defaults={"max_kb": 600})
+        worker._page = fake_page
+        result = worker.render("x.html", self.out("tiles"), "tiles", options={"prefix": "9-"})
+        self.assertEqual([os.path.basename(f) for f in result["files"]], ["9-00.jpeg", "9-01.jpeg"])
+        self.assertEqual([os.path.getsize(f) // 1024 for f in result["files"]], [485, 515])
+
+    @unittest.skipUnless(shutil.which("node"), "node not installed")
+    def test_short_post_is_measured_from_content_not_viewport(self):
+        # Minimal DOM: the viewport is max_height (1536) tall and so is the
+        # document's scrollHeight; only .container reflects the content height.
+        def layout(container_height):
+            dom = """
+                const el = (top, bottom, children = []) => ({
+                  children, scrollHeight: bottom - top,
+                  getBoundingClientRect: () => ({top, bottom, height: bottom - top}),
+                });
+                const header = el(0, 60), msg = el(70, %d);
+                const container = el(0, %d, [header, {children: [msg]}]);
+                globalThis.window = {scrollY: 0};
+                globalThis.document = {
+                  documentElement: {scrollHeight: 1536}, body: {scrollHeight: 1536},
+                  querySelector: (sel) => sel === '.container' ? container : null,
+                  querySelectorAll: () => [header, msg],
+                };
+            """ % (container_height, container_height)
+            expression = self.mod.LAYOUT_BLOCKS_JS % (1536, 384)
+            script = dom + "console.log(JSON.stringify(" + expression + "));"
+            out = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True)
+            return json.loads(out.stdout)
+
+        short = layout(200)
+        self.assertEqual(short["total"], 384)  # 4in minimum, not the 1536px viewport
+        self.assertEqual(short["blocks"], [[0, 60], [70, 200]])
+        self.assertEqual(layout(900)["total"], 900)
+
+    def test_file_paths_become_file_urls(self):
+        self.assertEqual(self.mod.to_url("file:///dev/shm/a.html"), "file:///dev/shm/a.html")
+        self.assertEqual(self.mod.to_url("/dev/shm/a.html"), "file:///dev/shm/a.html")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from .helpers import load_mock_dashscope, load_sendtolm
+
+
+class AfterLMStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_sendtolm()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.db_path = os.path.join(self.tmpdir.name, "OQQWall.db")
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE preprocess (tag INT, senderid TEXT, nickname TEXT, receiver TEXT, "
+                     "ACgroup TEXT, AfterLM TEXT, comment TEXT, numnfinal INT)")
+        conn.commit()
+        conn.close()
+
+    def insert(self, tag, afterlm):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO preprocess (tag, AfterLM) VALUES (?, ?)", (tag, afterlm))
+        conn.commit()
+        conn.close()
+
+    def fetch(self, tag):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT AfterLM FROM preprocess WHERE tag=?", (tag,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_compact_migration_rewrites_only_pretty_rows(self):
+        payload = {"needpriv": "false", "messages": [{"message_id": 1, "text": "第一行\n第二行"}]}
+        self.insert(1, json.dumps(payload, ensure_ascii=False, indent=4))
+        self.insert(2, self.mod.dump_afterlm(payload))
+        self.insert(3, "not json\n at all")
+        self.insert(4, None)
+
+        self.assertEqual(self.mod.compact_afterlm_rows(self.db_path), 1)
+        self.assertEqual(self.fetch(1), self.mod.dump_afterlm(payload))
+        self.assertEqual(json.loads(self.fetch(1)), payload)
+        self.assertEqual(self.fetch(3), "not json\n at all")
+        self.assertIsNone(self.fetch(4))
+        self.assertEqual(self.mod.compact_afterlm_rows(self.db_path), 0)
+
+    def test_image_stage_keeps_descriptions_in_memory(self):
+        server = load_mock_dashscope().MockDashScopeServer().start()
+        self.addCleanup(server.stop)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs("cache/picture/7")
+        from PIL import Image
+        Image.new("RGB", (32, 32), "red").save("cache/picture/7/7-0.png")
+        self.insert(7, None)
+        data = {"messages": [{"message_id": 70, "message": [
+            {"type": "image", "data": {"sub_type": 0, "url": "file://" + os.path.abspath("cache/picture/7/7-0.png")}},
+        ]}]}
+
+        with mock.patch.object(self.mod, "DB_PATH", self.db_path), \
+                mock.patch.object(self.mod.dashscope, "base_http_api_url", server.base_http_api_url):
+            result = self.mod.process_images_comprehensive("7", {"apikey": "sk-test"}, data)
+
+        self.assertTrue(result["safe"])
+        self.assertEqual(result["description_count"], 1)
+        self.assertIn("describe", data["messages"][0]["message"][0])
+        self.assertIsNone(self.fetch(7))
+
+
+if __name__ == "__main__":
+    unittest.main()
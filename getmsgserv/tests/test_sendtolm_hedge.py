@@ -0,0 +1,110 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from .helpers import load_mock_dashscope, load_sendtolm
+
+
+class HedgedFetchTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_sendtolm()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.latency_file = os.path.join(self.tmpdir.name, "llm_latency.json")
+        self.server = None
+        patches = [
+            mock.patch.object(self.mod, "LLM_LATENCY_FILE", self.latency_file),
+            mock.patch.object(self.mod, "LLM_HEDGE_DEFAULT_DELAY", 0.3),
+            mock.patch.object(self.mod, "LLM_HEDGE_MIN_DELAY", 0.1),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        if self.server:
+            self.server.stop()
+        self.tmpdir.cleanup()
+
+    def start_server(self, **kwargs):
+        self.server = load_mock_dashscope().MockDashScopeServer(**kwargs).start()
+        p = mock.patch.object(self.mod.dashscope, "base_http_api_url", self.server.base_http_api_url)
+        p.start()
+        self.addCleanup(p.stop)
+        self.mod.dashscope.api_key = "sk-test"
+
+    def test_hedge_to_fallback_model_wins_when_primary_is_slow(self):
+        self.start_server(
+            replies={"slow": '{"who": "primary"}', "fast": '{"who": "fallback"}'},
+            latencies={"slow": 3.0},
+        )
+        config = {"text_model": "slow", "text_model_fallback": "fast", "llm_budget_safety": "10"}
+        started = time.monotonic()
+        result = self.mod.fetch_response_simple("prompt", config, call_type="safety")
+        self.assertEqual(result, '{"who": "fallback"}')
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertEqual(self.server.models_requested(), ["slow", "fast"])
+
+    def test_fast_primary_does_not_hedge_and_records_latency(self):
+        self.start_server(replies={"*": '{"ok": true}'})
+        config = {"text_model": "m", "text_model_fallback": "fb"}
+        result = self.mod.fetch_response_simple("prompt", config, call_type="privacy")
+        self.assertEqual(result, '{"ok": true}')
+        self.assertEqual(self.server.models_requested(), ["m"])
+        self.assertEqual(len(self.mod.load_llm_latency_stats()["privacy"]), 1)
+
+    def test_throttled_primary_falls_back_immediately(self):
+        self.start_server(replies={"*": '{"ok": true}'}, error_script=["429"])
+        config = {"text_model": "m", "text_model_fallback": "fb", "llm_hedge_percentile": "0"}
+        result = self.mod.fetch_response_simple("prompt", config, call_type="safety")
+        self.assertEqual(result, '{"ok": true}')
+        self.assertEqual(self.server.models_requested(), ["m", "fb"])
+
+    def test_retries_once_within_budget_after_primary_and_hedge_fail(self):
+        self.start_server(replies={"*": '{"ok": true}'}, error_script=["503", "429"])
+        config = {"text_model": "m", "text_model_fallback": "fb", "llm_budget_safety": "10"}
+        with mock.patch.object(self.mod, "RETRY_DELAY", 0.1):
+            result = self.mod.fetch_response_simple("prompt", config, call_type="safety")
+        self.assertEqual(result, '{"ok": true}')
+        self.assertEqual(self.server.models_requested(), ["m", "fb", "m"])
+
+    def test_budget_is_extended_while_stream_is_still_producing(self):
+        reply = '{"messages": "' + "x" * 200 + '"}'
+        self.start_server(replies={"*": reply}, chunk_delay=0.1)  # ~1.4 s of chunks
+        config = {"text_model": "m", "llm_budget_grouping": "0.8", "llm_hedge_percentile": "0"}
+        self.assertEqual(self.mod.fetch_response_simple("prompt", config), reply)
+
+    def test_budget_exhausted_returns_empty(self):
+        self.start_server(latencies={"*": 3.0})
+        config = {"text_model": "m", "llm_budget_grouping": "0.8", "llm_hedge_percentile": "0"}
+        started = time.monotonic()
+        self.assertEqual(self.mod.fetch_response_simple("prompt", config), "")
+        self.assertLess(time.monotonic() - started, 2.0)
+
+    def test_hedge_delay_follows_latency_percentile(self):
+        for seconds in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
+            self.mod.record_llm_latency("grouping", seconds)
+        delay = self.mod.compute_hedge_delay("grouping", {"llm_hedge_percentile": "50"}, 90)
+        self.assertEqual(delay, 6)
+        self.assertIsNone(self.mod.compute_hedge_delay("grouping", {"llm_hedge_percentile": "0"}, 90))
+
+    def test_parallel_stages_keep_every_latency_sample(self):
+        # needpriv and safety record from threads of the same process
+        def record(call_type):
+            for _ in range(20):
+                self.mod.record_llm_latency(call_type, 1)
+
+        threads = [threading.Thread(target=record, args=(t,)) for t in ("privacy", "safety")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = self.mod.load_llm_latency_stats()
+        self.assertEqual((len(stats["privacy"]), len(stats["safety"])), (20, 20))
+        self.assertEqual(os.listdir(self.tmpdir.name), ["llm_latency.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .helpers import load_sendtolm
+
+
+class FakeEvent:
+    def __init__(self, text):
+        self.output = {"choices": [{"message": {"content": text}}]}
+
+
+class FakeErrorEvent:
+    status_code = 503
+    code = "ServiceUnavailable"
+    message = "overloaded"
+
+
+class FakeStream:
+    """A generator-like stream that records how far it was consumed."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed or self.consumed >= len(self.chunks):
+            raise StopIteration
+        chunk = self.chunks[self.consumed]
+        self.consumed += 1
+        return chunk if isinstance(chunk, FakeErrorEvent) else FakeEvent(chunk)
+
+    def close(self):
+        self.closed = True
+
+
+class StreamingJSONDetectorTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_sendtolm()
+
+    def feed_all(self, chunks):
+        detector = self.mod.StreamingJSONDetector()
+        for i, chunk in enumerate(chunks):
+            end = detector.feed(chunk)
+            if end >= 0:
+                return i, end
+        return None
+
+    def test_detects_object_split_across_chunks(self):
+        self.assertEqual(self.feed_all(['```json\n{"a": {', '"b": 1}', '}\n```']), (2, 1))
+
+    def test_ignores_braces_inside_strings(self):
+        chunks = ['{"reason": "含有 } 和 \\" 以及 {", ', '"safe": true}']
+        self.assertEqual(self.feed_all(chunks), (1, len(chunks[1])))
+
+    def test_incomplete_object_is_not_reported(self):
+        self.assertIsNone(self.feed_all(['{"messages": [1, 2', ']']))
+
+
+class FetchResponseSimpleTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_sendtolm()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        p = mock.patch.object(self.mod, "LLM_LATENCY_FILE", os.path.join(tmpdir.name, "llm_latency.json"))
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_returns_early_and_closes_stream(self):
+        stream = FakeStream(['```json\n{"needpriv": ', '"true"}', '\n```', 'trailing', 'more'])
+        with mock.patch.object(self.mod.Generation, "call", return_value=stream):
+            result = self.mod.fetch_response_simple("prompt", {"text_model": "m"})
+        self.assertEqual(result, '```json\n{"needpriv": "true"}')
+        self.assertEqual(stream.consumed, 2)
+        self.assertTrue(stream.closed)
+
+    def test_falls_back_to_full_output_without_json(self):
+        stream = FakeStream(["no ", "json ", "here"])
+        with mock.patch.object(self.mod.Generation, "call", return_value=stream):
+            result = self.mod.fetch_response_simple("prompt", {"text_model": "m"})
+        self.assertEqual(result, "no json here")
+        self.assertFalse(stream.closed)
+
+    def test_error_status_mid_stream_discards_partial_output(self):
+        broken = FakeStream(['{"messages": [1, ', FakeErrorEvent(), '2]}'])
+        good = FakeStream(['{"messages": [1, 2]}'])
+        config = {"text_model": "m", "text_model_fallback": "fb", "llm_hedge_percentile": "0"}
+        with mock.patch.object(self.mod.Generation, "call", side_effect=[broken, good]):
+            result = self.mod.fetch_response_simple("prompt", config)
+        self.assertEqual(result, '{"messages": [1, 2]}')
+        self.assertTrue(broken.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from .helpers import load_script_module
+
+
+def load_video_transcode():
+    return load_script_module("video_transcode", "getmsgserv/LM_work/video_transcode.py")
+
+
+class VideoTranscodeTests(unittest.TestCase):
+    def setUp(self):
+        self.mod = load_video_transcode()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_dir = os.path.join(self.tmp.name, "vcache")
+        os.makedirs(self.cache_dir)
+        self.src = os.path.join(self.tmp.name, "5-1.mov")
+        self.dest = os.path.join(self.tmp.name, "5-1-h264.mp4")
+        self.poster = os.path.join(self.tmp.name, "5-1-poster.jpg")
+        with open(self.src, "wb") as f:
+            f.write(b"source video bytes")
+
+    def test_remux_decision(self):
+        self.assertTrue(self.mod.can_remux(("h264", "aac")))
+        self.assertTrue(self.mod.can_remux(("h264", None)))
+        self.assertFalse(self.mod.can_remux(("hevc", "aac")))
+        self.assertFalse(self.mod.can_remux(("h264", "opus")))
+        self.assertFalse(self.mod.can_remux(None))
+
+    def test_compatible_video_is_remuxed_without_transcoding(self):
+        def fake_remux(src, dest):
+            with open(dest, "wb") as f:
+                f.write(b"remuxed")
+            return True
+
+        with mock.patch.object(self.mod, "probe_codecs", return_value=("h264", "aac")), \
+                mock.patch.object(self.mod, "remux", side_effect=fake_remux), \
+                mock.patch.object(self.mod, "enqueue") as enqueue:
+            final, poster = self.mod.prepare_video(self.src, self.dest, self.poster, self.cache_dir)
+        enqueue.assert_not_called()
+        self.assertEqual((final, poster), (self.dest, None))
+        self.assertFalse(os.path.exists(self.src))
+
+    def test_cached_transcode_is_reused_by_content_hash(self):
+        digest = self.mod.file_sha256(self.src)
+        with open(os.path.join(self.cache_dir, f"{digest}.mp4"), "wb") as f:
+            f.write(b"cached h264")
+        with mock.patch.object(self.mod, "probe_codecs", return_value=("hevc", "aac")), \
+                mock.patch.object(self.mod, "enqueue") as enqueue:
+            final, _ = self.mod.prepare_video(self.src, self.dest, self.poster, self.cache_dir)
+        enqueue.assert_not_called()
+        with open(final, "rb") as f:
+            self.assertEqual(f.read(), b"cached h264")
+
+    def test_queued_transcode_completes_in_worker(self):
+        def fake_transcode(src, dest, preset=None):
+            with open(dest, "wb") as f:
+                f.write(b"transcoded")
+            return True
+
+        with mock.patch.object(self.mod, "probe_codecs", return_value=None), \
+                mock.patch.object(self.mod, "extract_poster", return_value=False), \
+                mock.patch.object(self.mod, "spawn_worker"):
+            final, poster = self.mod.prepare_video(self.src, self.dest, self.poster, self.cache_dir)
+        self.assertIsNone(poster)
+        self.assertFalse(os.path.exists(final))
+        self.assertTrue(os.path.exists(self.dest + self.mod.PENDING_SUFFIX))
+
+        with mock.patch.object(self.mod, "transcode", side_effect=fake_transcode):
+            self.assertEqual(self.mod.run_worker(self.cache_dir), 1)
+        self.assertFalse(os.path.exists(self.dest + self.mod.PENDING_SUFFIX))
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), b"transcoded")
+        self.assertFalse(os.path.exists(self.src))
+
+    def test_failed_transcode_keeps_original_name_and_records_failure(self):
+        with open(self.dest + self.mod.PENDING_SUFFIX, "w") as f:
+            f.write("x")
+        job = {"src": self.src, "dest": self.dest, "digest": "0" * 64}
+        with mock.patch.object(self.mod, "transcode", return_value=False):
+            self.assertFalse(self.mod.run_job(job, self.cache_dir))
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(self.mod.failed_source(self.dest), self.src)
+        with open(self.src, "rb") as f:
+            self.assertEqual(f.read(), b"source video bytes")
+        self.assertFalse(os.path.exists(self.dest + self.mod.PENDING_SUFFIX))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -253,7 +253,7 @@ ensure_system_packages() {
 
   # 通用命令检查列表（命令名）
   # 说明：新增 socat 作为 UDS 依赖（Sendcontrol 与 getmsgserv 通过 UDS 通信需用）
-  #       新增 qrencode 作为 HTML 生成二维码依赖（getmsgserv/HTMLwork/gotohtml.sh 使用）
+  #       新增 qrencode 作为 HTML 生成二维码依赖（gotohtml.sh 的 jq 回退实现与 qr_cache.py 未装 qrcode 包时使用）
   local cmds=(jq sqlite3 python3 curl perl pkill socat qrencode)
 
   # 追加 xvfb-run（仅在内部管理 NapCat 时需要），在调用处按需处理
@@ -803,16 +803,28 @@ init_default_config() {
 http-serv-port=
 apikey=""
 process_waittime=120
+process_quiet_sec=30
+process_end_signals=发完了,发完啦,就这些,完毕
 manage_napcat_internal=true
 renewcookies_use_napcat=true
 max_attempts_qzone_autologin=3
 text_model=qwen-plus-latest
+text_model_fallback=
+llm_hedge_percentile=90
 vision_model=qwen-vl-max-latest
 vision_pixel_limit=12000000
 vision_size_limit_mb=9.5
 at_unprived_sender=true
 friend_request_window_sec=300
+admission_msg_per_min=60
+admission_msg_burst=60
+admission_kb_per_min=1024
 force_chromium_no-sandbox=false
+render_pool_size=2
+render_recycle_after=50
+render_concurrency=0
+render_slice_max_aspect=4
+render_slice_max_kb=2048
 use_web_review=false
 web_review_port=10923
 napcat_access_token=$napcat_token
@@ -928,6 +940,7 @@ force_restart_uds_services() {
   kill_tree_by_pattern "python3 SendQzone/qzone-serv-UDS.py"
   kill_tree_by_pattern "/bin/bash ./Sendcontrol/sendcontrol.sh"
   kill_tree_by_pattern "socat .*sendcontrol_uds.sock"
+  kill_tree_by_pattern "python3 getmsgserv/HTMLwork/render_service.py serve"
 
   # 清理遗留 UDS 文件，避免 bind 失败
   local qz_sock sc_sock
@@ -935,6 +948,7 @@ force_restart_uds_services() {
   sc_sock=${SENDCONTROL_UDS_PATH:-./sendcontrol_uds.sock}
   [[ -S "$qz_sock" ]] && rm -f -- "$qz_sock" || true
   [[ -S "$sc_sock" ]] && rm -f -- "$sc_sock" || true
+  [[ -S "${RENDER_UDS_PATH:-./render_uds.sock}" ]] && rm -f -- "${RENDER_UDS_PATH:-./render_uds.sock}" || true
   ./Sendcontrol/sendcontrol.sh &
   echo "sendcontrol.sh started"
   sleep 2
@@ -945,6 +959,11 @@ force_restart_uds_services() {
     python3 ./SendQzone/qzone-serv-UDS.py &
     echo "qzone-serv-UDS.py started"
   fi
+  # 常驻渲染服务（render_pool_size=0 时不启动，preprocess.sh 冷启动 Chrome）
+  if [[ "$(cfg_get 'render_pool_size')" != "0" ]]; then
+    python3 getmsgserv/HTMLwork/render_service.py serve > ./cache/render_service.log 2>&1 &
+    echo "render_service.py started"
+  fi
 }
 
 require_cmd() {
@@ -994,6 +1013,9 @@ ensure_python_packages() {
     [regex]=regex
     [PIL]=pillow
     [urllib3]=urllib3
+    [websocket]=websocket-client
+    [qrcode]=qrcode
+    [zxingcpp]=zxing-cpp
   )
 
   # 组装需要检查的模块列表
@@ -1218,6 +1240,9 @@ guide_account_group_setup() {
     "max_post_stack": "$max_stack",
     "max_image_number_one_post": "$max_imgs",
     "individual_image_in_posts": $indiv_images,
+    "outbound_image_short_side": "0",
+    "outbound_image_max_kb": "0",
+    "outbound_image_format": "jpeg",
     "friend_add_message": "$friend_json",
     "send_schedule": [],
     "watermark_text": "$watermark_json",
@@ -1443,10 +1468,10 @@ fi
 # 初始化目录和文件
 # 初始化目录
 check_and_create "/dev/shm/OQQWall/" "directory"
+check_and_create "/dev/shm/OQQWall/render/" "directory"
 check_and_create "./cache/numb/" "directory"
 check_and_create "getmsgserv/all/" "directory"
 # 初始化文件
-check_and_create "/dev/shm/OQQWall/oqqwallhtmlcache.html" "file"
 check_and_create "./getmsgserv/all/commugroup.txt" "file"
 if [[ ! -f "getmsgserv/all/priv_post.jsonl" ]]; then
     touch "getmsgserv/all/priv_post.jsonl"
@@ -1471,6 +1496,9 @@ if [[ ! -f "AcountGroupcfg.json" ]]; then
     "max_post_stack": "1",
     "max_image_number_one_post": "20",
     "individual_image_in_posts": true,
+    "outbound_image_short_side": "0",
+    "outbound_image_max_kb": "0",
+    "outbound_image_format": "jpeg",
     "friend_add_message": "",
     "send_schedule": [],
     "watermark_text": "",
@@ -1487,16 +1515,27 @@ check_variable "napcat_access_token" "auto"
 check_variable "http-serv-port" "8082"
 check_variable "apikey"  "sk-"
 check_variable "process_waittime" "120"
+check_variable "process_quiet_sec" "30"
+check_variable "process_end_signals" "发完了,发完啦,就这些,完毕"
 check_variable "manage_napcat_internal" "true"
 check_variable "renewcookies_use_napcat" "true"
 check_variable "max_attempts_qzone_autologin"  "3"
 check_variable "at_unprived_sender" "true"
 check_variable "text_model" "qwen-plus-latest"
 check_variable "vision_model" "qwen-vl-max-latest"
+check_variable "llm_hedge_percentile" "90"
 check_variable "vision_pixel_limit" "12000000"
 check_variable "vision_size_limit_mb" "9.5"
 check_variable "friend_request_window_sec" "300"
+check_variable "admission_msg_per_min" "60"
+check_variable "admission_msg_burst" "60"
+check_variable "admission_kb_per_min" "1024"
 check_variable "force_chromium_no-sandbox" "false"
+check_variable "render_pool_size" "2"
+check_variable "render_recycle_after" "50"
+check_variable "render_concurrency" "0"
+check_variable "render_slice_max_aspect" "4"
+check_variable "render_slice_max_kb" "2048"
 check_variable "use_web_review" "false"
 check_variable "web_review_port" "10923"
 
@@ -1630,6 +1669,26 @@ table_defs[blocklist]='CREATE TABLE blocklist (
   reason   TEXT,
   PRIMARY KEY (senderid, ACgroup)
 );'
+# 链路追踪 span，见 getmsgserv/pipeline_trace.py
+table_defs[trace_span]='CREATE TABLE trace_span (
+  trace_id   TEXT,
+  tag        TEXT,
+  stage      TEXT,
+  pid        INT,
+  start_ts   REAL,
+  end_ts     REAL,
+  duration   REAL,
+  exit_code  INT,
+  bytes      INT,
+  note       TEXT
+);
+CREATE INDEX idx_trace_span_tag ON trace_span (tag, start_ts);'
+# 引用预览历史索引，见 getmsgserv/history_index.py
+table_defs[msg_history]='CREATE TABLE msg_history (
+  message_id TEXT PRIMARY KEY,
+  time       INT,
+  preview    TEXT
+);'
 #--------------------------------------------------------------------
 # 2) 辅助函数：提取结构签名   name|TYPE|pkFlag
 table_sig () {
@@ -1645,12 +1704,14 @@ if [[ ! -f $DB_NAME ]]; then
 ${table_defs[sender]}
 ${table_defs[preprocess]}
 ${table_defs[blocklist]}
+${table_defs[trace_span]}
+${table_defs[msg_history]}
 EOF
   exit
 fi
 #--------------------------------------------------------------------
 # 4) 逐表检查
-for tbl in sender preprocess blocklist; do
+for tbl in sender preprocess blocklist trace_span msg_history; do
 
   # （a）表是否存在
   if ! sqlite3 "$DB_NAME" "SELECT 1 FROM sqlite_master WHERE type='table' AND name='$tbl';" |
@@ -1687,6 +1748,9 @@ SQL
   fi
 done
 
+# 5) 迁移：将历史 AfterLM（indent=4 格式）压缩为紧凑 JSON，可重复执行
+python3 getmsgserv/LM_work/sendtoLM.py --compact-afterlm "$DB_NAME" || echo "AfterLM 紧凑化迁移失败，跳过。"
+
 
 apikey=$(cfg_get 'apikey')
 http_serv_port=$(cfg_get 'http-serv-port')
@@ -1821,6 +1885,9 @@ while read -r group; do
   send_schedule_type=$(jq -r --arg group "$group" '.[$group].send_schedule | type' "$json_file")
   watermark_text=$(jq -r --arg group "$group" '.[$group].watermark_text // empty' "$json_file")
   watermark_text_type=$(jq -r --arg group "$group" '.[$group].watermark_text | type' "$json_file")
+  outbound_image_short_side=$(jq -r --arg group "$group" '.[$group].outbound_image_short_side // empty' "$json_file")
+  outbound_image_max_kb=$(jq -r --arg group "$group" '.[$group].outbound_image_max_kb // empty' "$json_file")
+  outbound_image_format=$(jq -r --arg group "$group" '.[$group].outbound_image_format // empty' "$json_file")
   
   # —— 校验 max_*：存在则必须为纯数字 ——
   if [[ -n "$max_post_stack" && ! "$max_post_stack" =~ ^[0-9]+$ ]]; then
@@ -1829,6 +1896,15 @@ while read -r group; do
   if [[ -n "$max_image_number_one_post" && ! "$max_image_number_one_post" =~ ^[0-9]+$ ]]; then
     errors+=("错误：在 $group 中，max_image_number_one_post 存在但不是纯数字：$max_image_number_one_post")
   fi
+  if [[ -n "$outbound_image_short_side" && ! "$outbound_image_short_side" =~ ^[0-9]+$ ]]; then
+    errors+=("错误：在 $group 中，outbound_image_short_side 存在但不是纯数字：$outbound_image_short_side")
+  fi
+  if [[ -n "$outbound_image_max_kb" && ! "$outbound_image_max_kb" =~ ^[0-9]+$ ]]; then
+    errors+=("错误：在 $group 中，outbound_image_max_kb 存在但不是纯数字：$outbound_image_max_kb")
+  fi
+  if [[ -n "$outbound_image_format" && ! "$outbound_image_format" =~ ^(jpeg|webp)$ ]]; then
+    errors+=("错误：在 $group 中，outbound_image_format 只能是 jpeg 或 webp：$outbound_image_format")
+  fi
 
   # —— 校验 friend_add_message：可空；若存在必须为字符串 ——
   if [[ "$friend_add_message_type" != "null" && "$friend_add_message_type" != "string" ]]; then
@@ -2081,11 +2157,18 @@ done
 
 
 ran_today=""  # 记录当天是否已执行
+cache_pruned_at=0  # 上次清理派生缓存的时间（见 Global_toolkit.sh 的 cache_prune）
 
 while true; do
   # 对齐到下一分钟再判断，避免错过 07:00
   sleep $((60 - $(date +%s) % 60))
 
+  # 每 6 小时按各模块的保留期清理一次渲染/二维码/外发/检查点等缓存，后台执行不阻塞定时任务
+  if (( $(date +%s) - cache_pruned_at >= 21600 )); then
+    cache_prune &
+    cache_pruned_at=$(date +%s)
+  fi
+
   # 到了 07:00 且今天还没执行过 → 执行任务
   if [[ "$(date +%H:%M)" == "07:00" ]]; then
     today=$(date +%F)
@@ -68,17 +68,29 @@ GROUP_CFG = ROOT / "AcountGroupcfg.json"
 CONFIG_TOOLTIPS: dict[str, str] = {
     "http-serv-port": "HTTP 服务端口（默认 8082）",
     "apikey": "调用大模型时使用的 API Key",
-    "process_waittime": "等待图片/处理的超时秒数",
+    "process_waittime": "投稿最长等待秒数（静默期未结束时到此也开始处理）",
+    "process_quiet_sec": "投稿人静默多少秒后开始处理（每条新消息重新计时）",
+    "process_end_signals": "结束语（逗号分隔），最后一条消息是结束语时立即处理",
     "manage_napcat_internal": "是否由本程序管理 NapCat/QQ",
     "renewcookies_use_napcat": "续 Cookies 使用 NapCat 版(true)/非 NapCat 版(false)",
     "max_attempts_qzone_autologin": "QZone 自动登录重试次数",
     "text_model": "文本模型名称（如 qwen-plus-latest）",
+    "text_model_fallback": "对冲请求使用的备用文本模型（留空则与 text_model 相同）",
+    "llm_hedge_percentile": "主请求超过历史延迟该百分位仍未返回时发出对冲请求（0 为禁用）",
     "vision_model": "多模态模型名称",
     "vision_pixel_limit": "图片像素限制，超出会压缩",
     "vision_size_limit_mb": "图片大小限制（MB）",
     "at_unprived_sender": "通过时是否 @ 未公开空间的投稿人",
     "friend_request_window_sec": "好友请求窗口（秒）",
+    "admission_msg_per_min": "每个发件人每分钟最多接收的私聊消息数，超出的消息丢弃并私聊提醒发件人（0 为不限）",
+    "admission_msg_burst": "每个发件人可连续突发的消息条数（多图投稿每张图算一条）",
+    "admission_kb_per_min": "每个发件人每分钟最多接收的消息大小（KB，可突发两分钟的量，0 为不限）",
     "force_chromium_no-sandbox": "Chromium 禁用 sandbox（容器/权限受限环境使用）",
+    "render_pool_size": "常驻渲染服务的浏览器数量（0 为不启用，每次冷启动 Chrome）",
+    "render_recycle_after": "每个浏览器渲染多少次后重启回收",
+    "render_concurrency": "同时进行的渲染数（0 为与 render_pool_size 相同；未启用渲染服务时按 CPU 核数）",
+    "render_slice_max_aspect": "长投稿分段截图时每张图的最大高宽比（按消息边界切分）",
+    "render_slice_max_kb": "每张分段图片的大小预算（KB，超出时在消息边界再切，0 为不限）",
     "use_web_review": "是否启用网页审核面板",
     "web_review_port": "网页审核监听端口",
     "napcat_access_token": "NapCat /get_status 接口 Access Token",
@@ -89,6 +101,8 @@ CONFIG_ORDER: list[str] = [
     # 基础/服务
     "http-serv-port",
     "process_waittime",
+    "process_quiet_sec",
+    "process_end_signals",
     "apikey",
     # NapCat/登录
     "napcat_access_token",
@@ -98,14 +112,25 @@ CONFIG_ORDER: list[str] = [
     # QZone/浏览器
     "max_attempts_qzone_autologin",
     "force_chromium_no-sandbox",
+    # 渲染
+    "render_pool_size",
+    "render_recycle_after",
+    "render_concurrency",
+    "render_slice_max_aspect",
+    "render_slice_max_kb",
     # 机器人行为
     "at_unprived_sender",
     "friend_request_window_sec",
+    "admission_msg_per_min",
+    "admission_msg_burst",
+    "admission_kb_per_min",
     # 审核面板
     "use_web_review",
     "web_review_port",
     # 模型与能力
     "text_model",
+    "text_model_fallback",
+    "llm_hedge_percentile",
     "vision_model",
     "vision_pixel_limit",
     "vision_size_limit_mb",
@@ -844,7 +869,8 @@ class GroupConfigPage(Vertical):
 
     - 顶栏：各组按钮 + “添加组”
     - 可编辑项：mangroupid, mainqqid, mainqq_http_port, watermark_text,
-      friend_add_message, max_post_stack, max_image_number_one_post
+      friend_add_message, max_post_stack, max_image_number_one_post,
+      outbound_image_short_side, outbound_image_max_kb, outbound_image_format
     - 副账号及端口：成对列表，可增删
     - 快捷回复：指令/回复 成对列表，可增删
     - 保存/重新加载
@@ -1033,6 +1059,9 @@ class GroupConfigPage(Vertical):
         # 其余基础项
         row("max_post_stack", "发件调度发件阈值")
         row("max_image_number_one_post", "单条说说图片数量上限")
+        row("outbound_image_short_side", "外发图片短边上限(px，0 不限)", "0")
+        row("outbound_image_max_kb", "外发图片大小预算(KB，0 不限)", "0")
+        row("outbound_image_format", "外发图片格式(jpeg/webp)", "jpeg")
         # 布尔开关：是否在 prepost 目录保留投稿原图（含中文说明，三行文本居中）
         def _as_bool(v: Any) -> bool:
             if isinstance(v, bool):
@@ -1115,6 +1144,7 @@ class GroupConfigPage(Vertical):
                 "mainqqid":"","mainqq_http_port":"",
                 "minorqqid":[],"minorqq_http_port":[],
                 "admins":[],"max_post_stack":"3","max_image_number_one_post":"18",
+                "outbound_image_short_side":"0","outbound_image_max_kb":"0","outbound_image_format":"jpeg",
                 "individual_image_in_posts": True,
                 "friend_add_message":"","watermark_text":"",
                 "quick_replies":{}
@@ -1138,7 +1168,8 @@ class GroupConfigPage(Vertical):
 
         for k in [
             "mangroupid","mainqqid","mainqq_http_port","max_post_stack",
-            "max_image_number_one_post","watermark_text","friend_add_message"
+            "max_image_number_one_post","watermark_text","friend_add_message",
+            "outbound_image_short_side","outbound_image_max_kb","outbound_image_format"
         ]:
             obj[k] = get_val(k)
 
@@ -1342,6 +1373,7 @@ class GroupConfigPage(Vertical):
                 "mainqqid":"","mainqq_http_port":"",
                 "minorqqid":[],"minorqq_http_port":[],
                 "admins":[],"max_post_stack":"3","max_image_number_one_post":"18",
+                "outbound_image_short_side":"0","outbound_image_max_kb":"0","outbound_image_format":"jpeg",
                 "friend_add_message":"","watermark_text":"",
                 "quick_replies":{}
             }
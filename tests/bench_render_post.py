@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Benchmark the post HTML stage: legacy jq gotohtml.sh vs render_post.py.
+
+Run with:
+    python3 tests/bench_render_post.py --runs 20
+
+The runner builds a throw-away workspace (AcountGroupcfg.json,
+cache/OQQWall.db) from the golden fixtures in
+getmsgserv/tests/fixtures/render_post/ and renders every fixture tag
+
+    legacy   OQQWALL_HTML_LEGACY=1 bash gotohtml.sh <tag>   (needs jq, sqlite3)
+    wrapper  bash gotohtml.sh <tag>  (what preprocess.sh runs today)
+    inproc   render_post.render_tag() in this process (no interpreter start-up)
+
+and reports wall-clock per render. The legacy mode needs qrencode for fixtures
+containing cards and skips them when it is missing; the Python modes encode
+QR codes in-process through qr_cache.py, so repeat runs hit its URL cache
+(card fixtures are skipped when neither qrcode nor qrencode is available).
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+FIXTURE_DIR = REPO_ROOT / "getmsgserv" / "tests" / "fixtures" / "render_post"
+GOTOHTML = REPO_ROOT / "getmsgserv" / "HTMLwork" / "gotohtml.sh"
+
+sys.path.insert(0, str(REPO_ROOT / "getmsgserv" / "HTMLwork"))
+import render_post  # noqa: E402
+
+PREPROCESS_SCHEMA = """CREATE TABLE IF NOT EXISTS preprocess (
+    tag INTEGER,
+    senderid TEXT,
+    nickname TEXT,
+    receiver TEXT,
+    ACgroup TEXT,
+    AfterLM TEXT,
+    comment TEXT,
+    numnfinal INTEGER
+)"""
+
+
+def build_workspace(root: Path) -> Dict[int, bool]:
+    """Load the fixtures into a fresh database; return {tag: has_cards}."""
+    (root / "cache").mkdir(parents=True, exist_ok=True)
+    (root / "getmsgserv" / "HTMLwork").mkdir(parents=True, exist_ok=True)
+    # gotohtml.sh calls render_post.py relative to the working directory
+    shutil.copy(GOTOHTML, root / "getmsgserv" / "HTMLwork" / "gotohtml.sh")
+    shutil.copy(REPO_ROOT / "getmsgserv" / "avatar_cache.py", root / "getmsgserv")
+    for name in ("render_post.py", "qr_cache.py"):
+        shutil.copy(REPO_ROOT / "getmsgserv" / "HTMLwork" / name, root / "getmsgserv" / "HTMLwork")
+    shutil.copytree(REPO_ROOT / "getmsgserv" / "HTMLwork" / "source", root / "getmsgserv" / "HTMLwork" / "source")
+    shutil.copy(FIXTURE_DIR / "AcountGroupcfg.json", root)
+    conn = sqlite3.connect(root / "cache" / "OQQWall.db")
+    conn.execute(PREPROCESS_SCHEMA)
+    tags = {}
+    for path in sorted(FIXTURE_DIR.glob("*.json")):
+        fx = json.loads(path.read_text(encoding="utf-8"))
+        if "AfterLM" not in fx:
+            continue
+        conn.execute(
+            "INSERT INTO preprocess (tag, senderid, nickname, ACgroup, AfterLM) VALUES (?, ?, ?, ?, ?)",
+            (fx["tag"], fx["senderid"], fx["nickname"], fx["ACgroup"], json.dumps(fx["AfterLM"], ensure_ascii=False)),
+        )
+        tags[fx["tag"]] = bool(render_post.qr_targets(fx["AfterLM"]))
+        # serv.py warms avatars at ingest, so renders only read the local cache
+        write_avatar(root / "cache" / "avatars" / f"{fx['senderid']}.jpg")
+    conn.commit()
+    conn.close()
+    return tags
+
+
+def write_avatar(path: Path) -> None:
+    from PIL import Image
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (188, 188), (90, 140, 200)).save(path, "JPEG")
+
+
+def time_script(root: Path, tag: int, legacy: bool) -> float:
+    env = dict(os.environ, OQQWALL_HTML_LEGACY="1" if legacy else "0")
+    started = time.monotonic()
+    subprocess.run(["bash", "getmsgserv/HTMLwork/gotohtml.sh", str(tag)], cwd=root, env=env,
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.monotonic() - started
+
+
+def time_inproc(root: Path, tag: int) -> float:
+    started = time.monotonic()
+    render_post.render_tag(tag, str(root))
+    return time.monotonic() - started
+
+
+def summarize(results: Dict[str, List[float]]) -> str:
+    lines = [f"{'mode':<10}{'n':>5}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}"]
+    for mode, values in results.items():
+        if not values:
+            continue
+        values = sorted(values)
+        lines.append(
+            f"{mode:<10}{len(values):>5}{statistics.mean(values) * 1000:>10.1f}"
+            f"{statistics.median(values) * 1000:>10.1f}{values[-1] * 1000:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark gotohtml.sh (jq) against render_post.py")
+    parser.add_argument("--runs", type=int, default=10, help="renders per fixture and mode")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workspace")
+    args = parser.parse_args(argv)
+
+    has_qrencode = shutil.which("qrencode") is not None
+    can_encode = has_qrencode or importlib.util.find_spec("qrcode") is not None
+    can_legacy = all(shutil.which(t) for t in ("jq", "sqlite3"))
+    root = Path(tempfile.mkdtemp(prefix="oqqwall-bench-"))
+    results: Dict[str, List[float]] = {"legacy": [], "wrapper": [], "inproc": []}
+    try:
+        tags = build_workspace(root)
+        for _ in range(args.runs):
+            for tag, has_cards in tags.items():
+                if can_legacy and (has_qrencode or not has_cards):
+                    results["legacy"].append(time_script(root, tag, legacy=True))
+                if can_encode or not has_cards:
+                    results["wrapper"].append(time_script(root, tag, legacy=False))
+                    results["inproc"].append(time_inproc(root, tag))
+    finally:
+        if args.keep:
+            print(f"workspace kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print(summarize(results))
+    if not can_legacy:
+        print("jq/sqlite3 not installed: legacy mode skipped")
+    if results["legacy"] and results["wrapper"]:
+        saved = statistics.mean(results["legacy"]) - statistics.mean(results["wrapper"])
+        print(f"saved per render: {saved * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
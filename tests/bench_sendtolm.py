@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the LLM stage (getmsgserv/LM_work/sendtoLM.py).
+
+Run with:
+    python3 tests/bench_sendtolm.py --tags 20 --images 2 --latency '*=lognormal:-1,0.5'
+
+The runner builds a throw-away workspace (oqqwall.config, cache/OQQWall.db,
+cache/picture/<tag>/), starts tests/mock_dashscope.py in-process, pushes N
+synthetic tags through sendtoLM.py exactly like preprocess.sh does
+(JSON on stdin, tag as argv) and reports per-stage latency taken from the
+sendtoLM log markers:
+
+    images    第一步 -> 第二步  (compress + vision safety/description)
+    grouping  第二步 -> 第三步  (grouping call)
+    judge     第三步 -> 处理完成 (needpriv / safemsg)
+    total     process wall clock
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SENDTOLM = REPO_ROOT / "getmsgserv" / "LM_work" / "sendtoLM.py"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from mock_dashscope import MockDashScopeServer, load_fixtures, parse_mapping  # noqa: E402
+
+LOG_LINE = re.compile(r"LMWork:(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - \w+ - (.*)")
+STAGE_MARKERS = [
+    ("images", "第一步"),
+    ("grouping", "第二步"),
+    ("judge", "第三步"),
+    ("done", "处理完成"),
+]
+
+PREPROCESS_SCHEMA = """CREATE TABLE IF NOT EXISTS preprocess (
+    tag INTEGER,
+    senderid TEXT,
+    nickname TEXT,
+    receiver TEXT,
+    ACgroup TEXT,
+    AfterLM TEXT,
+    comment TEXT,
+    numnfinal INTEGER
+)"""
+
+
+def build_workspace(root: Path, tags: List[int], images: int) -> Dict[int, dict]:
+    """Create config, database and per-tag inputs; return the stdin payloads."""
+    (root / "cache").mkdir(parents=True, exist_ok=True)
+    (root / "oqqwall.config").write_text(
+        "apikey=\"sk-mock\"\ntext_model=qwen-plus-latest\nvision_model=qwen-vl-max-latest\n",
+        encoding="utf-8",
+    )
+    conn = sqlite3.connect(root / "cache" / "OQQWall.db")
+    conn.execute(PREPROCESS_SCHEMA)
+    payloads = {}
+    now = int(time.time())
+    for tag in tags:
+        conn.execute(
+            "INSERT INTO preprocess (tag, senderid, nickname, receiver, ACgroup) VALUES (?, ?, ?, ?, ?)",
+            (tag, "10001", "bench", "20002", "BenchGroup"),
+        )
+        messages = [{
+            "message_id": tag * 100,
+            "time": now - 60,
+            "message": [{"type": "text", "data": {"text": f"投稿 {tag}：今天食堂的饭很好吃，不用匿名"}}],
+        }]
+        if images:
+            pic_dir = root / "cache" / "picture" / str(tag)
+            pic_dir.mkdir(parents=True, exist_ok=True)
+            for idx in range(images):
+                path = pic_dir / f"{tag}-{idx}.png"
+                write_sample_image(path, idx)
+                messages.append({
+                    "message_id": tag * 100 + idx + 1,
+                    "time": now - 50 + idx,
+                    "message": [{"type": "image", "data": {"file": path.name, "url": f"file://{path}"}}],
+                })
+        messages.append({
+            "message_id": tag * 100 + 99,
+            "time": now - 30,
+            "message": [{"type": "text", "data": {"text": "发完了"}}],
+        })
+        payloads[tag] = {"messages": messages}
+    conn.commit()
+    conn.close()
+    return payloads
+
+
+def write_sample_image(path: Path, seed: int) -> None:
+    try:
+        from PIL import Image
+    except ImportError:
+        # 1x1 PNG fallback when Pillow is not available
+        path.write_bytes(bytes.fromhex(
+            "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+            "1f15c4890000000d4944415478da63f8cf00000301010018dd8db40000000049454e44ae426082"
+        ))
+        return
+    Image.new("RGB", (640, 480), ((seed * 70) % 255, 120, 200)).save(path)
+
+
+def parse_stage_times(log_text: str) -> Dict[str, float]:
+    marks: Dict[str, datetime] = {}
+    for line in log_text.splitlines():
+        m = LOG_LINE.search(line)
+        if not m:
+            continue
+        stamp = datetime.strptime(m.group(1), "%Y-%m-%d %H:%M:%S,%f")
+        for stage, marker in STAGE_MARKERS:
+            if stage not in marks and m.group(2).startswith(marker):
+                marks[stage] = stamp
+    durations = {}
+    for (stage, _), (nxt, _) in zip(STAGE_MARKERS, STAGE_MARKERS[1:]):
+        if stage in marks and nxt in marks:
+            durations[stage] = (marks[nxt] - marks[stage]).total_seconds()
+    return durations
+
+
+def run_tag(root: Path, tag: int, payload: dict, base_url: str, timeout: float) -> dict:
+    env = dict(os.environ, DASHSCOPE_HTTP_BASE_URL=base_url)
+    started = time.monotonic()
+    proc = subprocess.run(
+        [sys.executable, str(SENDTOLM), str(tag)],
+        input=json.dumps(payload, ensure_ascii=False),
+        capture_output=True, text=True, cwd=root, env=env, timeout=timeout,
+    )
+    result = parse_stage_times(proc.stderr)
+    result["total"] = time.monotonic() - started
+    result["ok"] = proc.returncode == 0
+    if not result["ok"]:
+        result["error"] = proc.stderr.strip().splitlines()[-1:] or [""]
+    return result
+
+
+def summarize(results: List[dict]) -> str:
+    lines = [f"{'stage':<10}{'n':>5}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}"]
+    for stage in ["images", "grouping", "judge", "total"]:
+        values = sorted(r[stage] for r in results if stage in r)
+        if not values:
+            continue
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        lines.append(
+            f"{stage:<10}{len(values):>5}{statistics.mean(values):>9.3f}"
+            f"{statistics.median(values):>9.3f}{p95:>9.3f}{values[-1]:>9.3f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark sendtoLM.py against the mock DashScope server")
+    parser.add_argument("--tags", type=int, default=10, help="number of submissions to push")
+    parser.add_argument("--images", type=int, default=1, help="images per submission")
+    parser.add_argument("--concurrency", type=int, default=1, help="sendtoLM processes run at once")
+    parser.add_argument("--latency", action="append", metavar="MODEL=SPEC", help="see mock_dashscope.py")
+    parser.add_argument("--error", action="append", metavar="STATUS=RATE", help="see mock_dashscope.py")
+    parser.add_argument("--fixtures", help="fixture file for the mock server")
+    parser.add_argument("--seed", type=int, default=1354)
+    parser.add_argument("--timeout", type=float, default=300, help="per-tag timeout in seconds")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workspace")
+    parser.add_argument("--json", action="store_true", help="print raw per-tag results as JSON")
+    args = parser.parse_args(argv)
+
+    server = MockDashScopeServer(
+        latencies=parse_mapping(args.latency),
+        errors={int(k): float(v) for k, v in parse_mapping(args.error).items()},
+        fixtures=load_fixtures(args.fixtures) if args.fixtures else None,
+        seed=args.seed,
+    ).start()
+    root = Path(tempfile.mkdtemp(prefix="oqqwall-bench-"))
+    try:
+        tags = list(range(1, args.tags + 1))
+        payloads = build_workspace(root, tags, args.images)
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+            futures = [pool.submit(run_tag, root, tag, payloads[tag], server.base_http_api_url, args.timeout)
+                       for tag in tags]
+            results = [f.result() for f in futures]
+    finally:
+        server.stop()
+        if args.keep:
+            print(f"workspace kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    failed = [r for r in results if not r["ok"]]
+    print(summarize(results))
+    endpoints = server.stats()["endpoints"]
+    for name, item in sorted(endpoints.items()):
+        print(f"mock {name}: {item['count']} requests, status {item['status']}")
+    if failed:
+        print(f"{len(failed)} of {len(results)} tags failed, e.g. {failed[0].get('error')}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
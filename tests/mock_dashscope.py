@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""Local stand-in for the DashScope APIs used by sendtoLM.py.
+
+Run with:
+    python3 tests/mock_dashscope.py --port 8090 --latency qwen-plus-latest=uniform:1,3
+
+Then point sendtoLM.py at it:
+    DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8090/api/v1 python3 getmsgserv/LM_work/sendtoLM.py <tag>
+
+Endpoints:
+    POST /api/v1/services/aigc/text-generation/generation
+        DashScope native protocol (``dashscope.Generation.call``),
+        SSE when the request carries ``X-DashScope-SSE: enable``.
+    POST /api/v1/services/aigc/multimodal-generation/generation
+        ``dashscope.MultiModalConversation.call`` (stream or not).
+    GET  /api/v1/uploads?action=getPolicy  +  POST /oss
+        Upload certificate and fake OSS bucket used by the SDK for
+        ``file://`` images.
+    POST /compatible-mode/v1/chat/completions
+        OpenAI-compatible chat completions (``stream`` true/false).
+    GET  /_mock/stats
+        Request counts and served latencies, for benchmarks.
+
+Replies are picked in this order: a matching fixture, a per-model
+``--reply``, then a rule-based answer recognising the sendtoLM prompts
+(grouping / text safety / needpriv / image analysis).
+
+Latency specs (``--latency MODEL=SPEC``, ``*`` matches any model):
+    2.5              fixed seconds
+    uniform:1,3      uniform between 1 and 3 seconds
+    normal:2,0.5     normal(mean, stddev), clamped at 0
+    lognormal:0.5,0.4  lognormal(mu, sigma)
+
+Error injection: ``--error 429=0.1 --error 500=0.05`` fails that share of
+requests with the given status; ``--error-script 429,ok,500`` fails the
+first requests in that exact order.
+
+Fixtures (``--fixtures FILE``, JSON list or JSON lines) are objects with
+optional ``endpoint`` (text/multimodal/compatible), ``model``,
+``contains`` (substring of the prompt) or ``prompt_sha1`` keys and the
+``reply`` / ``status`` / ``latency`` to serve. ``--record FILE`` appends
+every served exchange in the same format, so a session can be replayed.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+API_PREFIX = "/api/v1"
+TEXT_GENERATION_PATH = API_PREFIX + "/services/aigc/text-generation/generation"
+MULTIMODAL_PATH = API_PREFIX + "/services/aigc/multimodal-generation/generation"
+UPLOADS_PATH = API_PREFIX + "/uploads"
+OSS_PATH = "/oss"
+COMPATIBLE_CHAT_PATH = "/compatible-mode/v1/chat/completions"
+STATS_PATH = "/_mock/stats"
+
+DEFAULT_REPLY = '{"safe": true, "needpriv": "false", "reason": "mock", "messages": []}'
+DEFAULT_IMAGE_REPLY = "安全性：safe\n描述：模拟的图片描述。"
+
+ERROR_BODIES = {
+    400: ("InvalidParameter", "mock: invalid parameter"),
+    429: ("Throttling.RateQuota", "mock: requests rate limit exceeded"),
+    500: ("InternalError", "mock: internal error"),
+    502: ("BadGateway", "mock: bad gateway"),
+    503: ("ServiceUnavailable", "mock: service unavailable"),
+}
+
+
+def split_chunks(text: str, size: int = 16) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def parse_latency(spec: Union[str, float, int, None], rng: random.Random) -> Callable[[], float]:
+    """Turn a latency spec into a sampler returning seconds."""
+    if spec is None or spec == "":
+        return lambda: 0.0
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda: value
+    params = [float(x) for x in args.split(",")]
+    if kind == "uniform":
+        low, high = params
+        return lambda: rng.uniform(low, high)
+    if kind == "normal":
+        mean, stddev = params
+        return lambda: max(0.0, rng.gauss(mean, stddev))
+    if kind == "lognormal":
+        mu, sigma = params
+        return lambda: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+def load_fixtures(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def extract_prompt(body: dict) -> str:
+    """Concatenate the text parts of the last user message."""
+    messages = body.get("input", {}).get("messages") or body.get("messages") or []
+    for msg in reversed(messages):
+        if msg.get("role") != "user":
+            continue
+        content = msg.get("content")
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def rule_based_reply(endpoint: str, prompt: str) -> str:
+    """Answer the sendtoLM prompts with plausible, parseable output."""
+    if endpoint == "multimodal":
+        return DEFAULT_IMAGE_REPLY
+    if "最后一组投稿" in prompt:
+        ids: List[str] = []
+        start = prompt.find("{")
+        end = prompt.find("\n\n请根据")
+        if start >= 0 and end > start:
+            try:
+                ids = list(json.loads(prompt[start:end]).keys())
+            except ValueError:
+                ids = []
+        return json.dumps({"isover": "true", "messages": ids}, ensure_ascii=False)
+    if "内容安全审查" in prompt:
+        return '{"safe": true, "reason": "mock", "severity": "low"}'
+    if "needpriv" in prompt:
+        return '{"needpriv": "false", "reason": "mock", "confidence": 0.5}'
+    return DEFAULT_REPLY
+
+
+class MockDashScopeServer:
+    """Threaded stand-in server; usable from tests or from the command line."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 replies: Optional[Dict[str, str]] = None,
+                 latencies: Optional[Dict[str, Union[str, float]]] = None,
+                 chunk_delay: float = 0.0,
+                 errors: Optional[Dict[int, float]] = None,
+                 error_script: Optional[List[Optional[int]]] = None,
+                 fixtures: Optional[List[dict]] = None,
+                 record_path: Optional[str] = None,
+                 seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.replies = dict(replies or {})
+        self.latencies = {k: parse_latency(v, self.rng) for k, v in (latencies or {}).items()}
+        self.chunk_delay = chunk_delay
+        self.errors = {int(k): float(v) for k, v in (errors or {}).items()}
+        self.error_script = list(error_script or [])
+        self.fixtures = list(fixtures or [])
+        self.record_path = record_path
+        self.requests: List[dict] = []
+        self.uploads: List[str] = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.httpd.server_address[0]}:{self.port}"
+
+    @property
+    def base_http_api_url(self) -> str:
+        return self.base_url + API_PREFIX
+
+    def match_fixture(self, endpoint: str, model: str, prompt: str) -> Optional[dict]:
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        for fx in self.fixtures:
+            if fx.get("endpoint", "*") not in ("*", endpoint):
+                continue
+            if fx.get("model") and fx["model"] != model:
+                continue
+            if fx.get("contains") and fx["contains"] not in prompt:
+                continue
+            if fx.get("prompt_sha1") and fx["prompt_sha1"] != digest:
+                continue
+            return fx
+        return None
+
+    def plan(self, endpoint: str, model: str, prompt: str) -> dict:
+        """Decide status, latency and reply for one request."""
+        fx = self.match_fixture(endpoint, model, prompt) or {}
+        with self._lock:
+            status = None
+            if self.error_script:
+                step = self.error_script.pop(0)
+                status = None if step in (None, "ok") else int(step)
+            elif self.errors:
+                roll = self.rng.random()
+                for code, rate in sorted(self.errors.items()):
+                    if roll < rate:
+                        status = code
+                        break
+                    roll -= rate
+            if status is None:
+                status = int(fx.get("status", 200))
+            if "latency" in fx:
+                latency = parse_latency(fx["latency"], self.rng)()
+            else:
+                sampler = self.latencies.get(model) or self.latencies.get("*")
+                latency = sampler() if sampler else 0.0
+        if "reply" in fx:
+            reply = fx["reply"]
+        elif model in self.replies or "*" in self.replies:
+            reply = self.replies.get(model, self.replies.get("*"))
+        else:
+            reply = rule_based_reply(endpoint, prompt)
+        return {"status": status, "latency": latency, "reply": reply,
+                "prompt_sha1": hashlib.sha1(prompt.encode("utf-8")).hexdigest()}
+
+    def record(self, endpoint: str, model: str, prompt: str, plan: dict) -> None:
+        entry = {"endpoint": endpoint, "model": model, "time": time.time(),
+                 "status": plan["status"], "latency": round(plan["latency"], 4),
+                 "prompt_sha1": plan["prompt_sha1"], "reply": plan["reply"]}
+        with self._lock:
+            self.requests.append(entry)
+            if self.record_path:
+                with open(self.record_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def models_requested(self) -> List[str]:
+        with self._lock:
+            return [r["model"] for r in self.requests]
+
+    def stats(self) -> dict:
+        with self._lock:
+            summary: Dict[str, dict] = {}
+            for r in self.requests:
+                item = summary.setdefault(r["endpoint"], {"count": 0, "status": {}, "latencies": []})
+                item["count"] += 1
+                item["status"][str(r["status"])] = item["status"].get(str(r["status"]), 0) + 1
+                item["latencies"].append(r["latency"])
+            return {"endpoints": summary, "uploads": len(self.uploads)}
+
+    def start(self) -> "MockDashScopeServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt, *args):  # keep test output quiet
+                pass
+
+            def _read_body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _read_json(self) -> dict:
+                try:
+                    return json.loads(self._read_body().decode("utf-8") or "{}")
+                except ValueError:
+                    return {}
+
+            def _send_json(self, status: int, payload: dict) -> None:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_error(self, status: int, request_id: str) -> None:
+                code, message = ERROR_BODIES.get(status, ("MockError", f"mock: status {status}"))
+                self._send_json(status, {"request_id": request_id, "code": code, "message": message})
+
+            def _start_sse(self) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream;charset=UTF-8")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+            def _write_event(self, text: str) -> bool:
+                try:
+                    self.wfile.write(text.encode("utf-8"))
+                    self.wfile.flush()
+                    return True
+                except (BrokenPipeError, ConnectionResetError):
+                    return False
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path.rstrip("/") == UPLOADS_PATH:
+                    self._send_json(200, {
+                        "request_id": str(uuid.uuid4()),
+                        "data": {
+                            "policy": "mock-policy",
+                            "signature": "mock-signature",
+                            "upload_dir": "mock/uploads",
+                            "upload_host": server.base_url + OSS_PATH,
+                            "expire_in_seconds": 300,
+                            "max_file_size_mb": 100,
+                            "capacity_limit_mb": 1000,
+                            "oss_access_key_id": "mock-ak",
+                            "x_oss_object_acl": "private",
+                            "x_oss_forbid_overwrite": "true",
+                        },
+                    })
+                elif parsed.path == STATS_PATH:
+                    self._send_json(200, server.stats())
+                else:
+                    self._send_json(404, {"code": "NotFound", "message": self.path})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path == OSS_PATH:
+                    body = self._read_body()
+                    with server._lock:
+                        server.uploads.append(hashlib.sha1(body).hexdigest())
+                    self._send_json(200, {})
+                    return
+                endpoint = {TEXT_GENERATION_PATH: "text", MULTIMODAL_PATH: "multimodal",
+                            COMPATIBLE_CHAT_PATH: "compatible"}.get(path)
+                if endpoint is None:
+                    self._read_body()
+                    self._send_json(404, {"code": "NotFound", "message": self.path})
+                    return
+                body = self._read_json()
+                model = body.get("model", "")
+                prompt = extract_prompt(body)
+                plan = server.plan(endpoint, model, prompt)
+                server.record(endpoint, model, prompt, plan)
+                time.sleep(plan["latency"])
+                request_id = str(uuid.uuid4())
+                if plan["status"] != 200:
+                    self._send_error(plan["status"], request_id)
+                elif endpoint == "compatible":
+                    self._compatible(body, plan["reply"])
+                else:
+                    self._native(endpoint, plan["reply"], request_id)
+
+            def _native(self, endpoint: str, reply: str, request_id: str) -> None:
+                stream = self.headers.get("X-DashScope-SSE", "").lower() == "enable"
+
+                def message(content):
+                    if endpoint == "multimodal":
+                        return {"role": "assistant", "content": [{"text": content}]}
+                    return {"role": "assistant", "content": content}
+
+                if not stream:
+                    self._send_json(200, {
+                        "request_id": request_id,
+                        "output": {"choices": [{"finish_reason": "stop", "message": message(reply)}]},
+                        "usage": {"input_tokens": 1, "output_tokens": len(reply)},
+                    })
+                    return
+                self._start_sse()
+                chunks = split_chunks(reply)
+                for idx, chunk in enumerate(chunks, 1):
+                    finish = "stop" if idx == len(chunks) else "null"
+                    data = {
+                        "request_id": request_id,
+                        "output": {"choices": [{"finish_reason": finish, "message": message(chunk)}]},
+                        "usage": {"input_tokens": 1, "output_tokens": idx},
+                    }
+                    event = f"id:{idx}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+                    if not self._write_event(event):
+                        return
+                    if server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+
+            def _compatible(self, body: dict, reply: str) -> None:
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                model = body.get("model", "")
+                if not body.get("stream"):
+                    self._send_json(200, {
+                        "id": completion_id, "object": "chat.completion", "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": reply}}],
+                    })
+                    return
+                self._start_sse()
+                for chunk in split_chunks(reply):
+                    data = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                            "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}
+                    if not self._write_event(f"data: {json.dumps(data, ensure_ascii=False)}\n\n"):
+                        return
+                    if server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                self._write_event("data: [DONE]\n\n")
+
+        return Handler
+
+
+def parse_mapping(items: Optional[List[str]]) -> Dict[str, str]:
+    mapping = {}
+    for item in items or []:
+        key, _, value = item.partition("=")
+        mapping[key] = value
+    return mapping
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local DashScope stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--reply", action="append", metavar="MODEL=TEXT",
+                        help="fixed reply for a model ('*' matches any model)")
+    parser.add_argument("--latency", action="append", metavar="MODEL=SPEC",
+                        help="latency spec for a model ('*' matches any model)")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="delay between stream chunks")
+    parser.add_argument("--error", action="append", metavar="STATUS=RATE",
+                        help="fail this share of requests with STATUS (e.g. 429=0.1)")
+    parser.add_argument("--error-script", default="",
+                        help="comma separated statuses for the first requests, 'ok' for success")
+    parser.add_argument("--fixtures", help="fixture file (JSON list or JSON lines)")
+    parser.add_argument("--record", help="append served exchanges to this JSON lines file")
+    parser.add_argument("--seed", type=int, help="random seed for latency/error sampling")
+    args = parser.parse_args()
+
+    server = MockDashScopeServer(
+        args.host, args.port,
+        replies=parse_mapping(args.reply),
+        latencies=parse_mapping(args.latency),
+        chunk_delay=args.chunk_delay,
+        errors={int(k): float(v) for k, v in parse_mapping(args.error).items()},
+        error_script=[s.strip() for s in args.error_script.split(",") if s.strip()],
+        fixtures=load_fixtures(args.fixtures) if args.fixtures else None,
+        record_path=args.record,
+        seed=args.seed,
+    )
+    print(f"Mock DashScope listening on {server.base_http_api_url} (Ctrl+C to stop)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping server.")
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
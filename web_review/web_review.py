@@ -57,6 +57,20 @@ DB_PATH = ROOT_DIR / 'cache' / 'OQQWall.db'
 PREPOST_DIR = ROOT_DIR / 'cache' / 'prepost'
 PICTURE_DIR = ROOT_DIR / 'cache' / 'picture'
 
+# 链路追踪（getmsgserv/pipeline_trace.py），用于 /trace 时间线页面
+sys.path.append(str(ROOT_DIR / 'getmsgserv'))
+try:
+    import pipeline_trace
+except ImportError:
+    pipeline_trace = None
+
+# 渲染结果缓存（getmsgserv/HTMLwork/render_cache.py），预览命中时不再重新生成 HTML
+sys.path.append(str(ROOT_DIR / 'getmsgserv' / 'HTMLwork'))
+try:
+    import render_cache
+except ImportError:
+    render_cache = None
+
 # ============================================================================
 # 模板加载
 # ============================================================================
@@ -1378,6 +1392,11 @@ class ReviewServer(http.server.SimpleHTTPRequestHandler):
         if parsed_path.path == '/detail_html':
             self.render_detail_html(parsed_path, user)
             return
+
+        # 处理时间线（页面与 JSON）
+        if parsed_path.path in ('/trace', '/api/trace'):
+            self.render_trace(parsed_path, user, as_json=parsed_path.path == '/api/trace')
+            return
         
         # 默认：渲染审核页面
         self.render_review_page(parsed_path, user)
@@ -2019,24 +2038,26 @@ class ReviewServer(http.server.SimpleHTTPRequestHandler):
         if not row or str(row[0].get('ACgroup')) != str(user['group']):
             self.send_error(403, 'Forbidden')
             return
-        # 运行渲染脚本
+        # 运行渲染脚本：直接读取其标准输出，不经过 /dev/shm，避免与正在进行的正式渲染互相覆盖
+        content = ''
+        if render_cache is not None:
+            try:
+                content = render_cache.cached_html(tag, str(ROOT_DIR)) or ''
+            except Exception as e:
+                print(f"[web-review] 读取渲染缓存失败: {e}")
         try:
-            cmd = [
-                'bash','-lc',
-                f"getmsgserv/HTMLwork/gotohtml.sh {tag} > /dev/shm/OQQWall/oqqwallhtmlcache.html"
-            ]
-            subprocess.run(cmd, cwd=str(ROOT_DIR), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=20)
+            if not content:
+                result = subprocess.run(['bash', '-lc', f"getmsgserv/HTMLwork/gotohtml.sh {tag}"], cwd=str(ROOT_DIR),
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=20)
+                content = result.stdout.decode('utf-8', errors='ignore')
         except Exception as e:
             print(f"[web-review] 渲染预览失败: {e}")
-        # 读取渲染结果
-        html_path = Path('/dev/shm/OQQWall/oqqwallhtmlcache.html')
-        if not html_path.exists():
+        if not content.strip():
             self.send_response(200)
             self.send_header('Content-type', 'text/html; charset=utf-8')
             self.end_headers()
             self.wfile.write("<p style='color:#B3261E'>无法生成渲染预览</p>".encode('utf-8'))
             return
-        content = html_path.read_text(encoding='utf-8', errors='ignore')
         # 内嵌 file:// 图片为 data URI（仅限项目目录内文件）
         def repl_img(m):
             url = m.group(1)
@@ -2098,6 +2119,68 @@ class ReviewServer(http.server.SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(content.encode('utf-8', errors='ignore'))
 
+    def render_trace(self, parsed_path, user, as_json: bool = False):
+        """展示某个投稿在各进程中的处理时间线（trace_span 表）。"""
+        query = urllib.parse.parse_qs(parsed_path.query)
+        tag = (query.get('tag') or [''])[0]
+        if not tag.isdigit():
+            self.send_error(400, 'Bad Request')
+            return
+        row = db_query("SELECT ACgroup FROM preprocess WHERE tag = ?", (tag,))
+        if not row or str(row[0].get('ACgroup')) != str(user['group']):
+            self.send_error(403, 'Forbidden')
+            return
+        if pipeline_trace is None:
+            self.send_error(503, 'Trace module unavailable')
+            return
+        timeline = pipeline_trace.build_timeline(pipeline_trace.fetch_spans(tag, str(DB_PATH)))
+        if as_json:
+            body = json.dumps(timeline, ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        total = timeline['total'] or 1e-9
+        rows_html = []
+        for item in timeline['spans']:
+            left = item['offset'] / total * 100
+            width = max(item['duration'] / total * 100, 0.5)
+            color = '#B3261E' if item['exit_code'] else '#6750A4'
+            detail = []
+            if item['bytes'] is not None:
+                detail.append(f"{item['bytes']} B")
+            if item['note']:
+                detail.append(html.escape(str(item['note'])))
+            if item['exit_code']:
+                detail.append(f"exit={item['exit_code']}")
+            rows_html.append(
+                f"<tr><td>{html.escape(item['stage'])}</td>"
+                f"<td class='num'>{item['offset']:.3f}</td><td class='num'>{item['duration']:.3f}</td>"
+                f"<td class='bar'><div style='margin-left:{left:.2f}%;width:{min(width, 100 - left):.2f}%;background:{color}'></div></td>"
+                f"<td>{' · '.join(detail)}</td></tr>"
+            )
+        if rows_html:
+            started = datetime.fromtimestamp(timeline['start_ts']).strftime('%Y-%m-%d %H:%M:%S')
+            summary = f"trace {html.escape(timeline['trace_id'])}，开始于 {started}，总耗时 {timeline['total']:.3f}s"
+        else:
+            summary = '暂无追踪记录'
+        page = f"""<!doctype html>
+<html lang="zh-CN"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1"><title>处理时间线 #{tag}</title>
+<style>body{{font-family:Arial,Helvetica,sans-serif;padding:16px;max-width:1100px;margin:0 auto}}table{{width:100%;border-collapse:collapse;font-size:14px}}td,th{{padding:6px 8px;border-bottom:1px solid #eee;text-align:left;white-space:nowrap}}td.num{{text-align:right;font-variant-numeric:tabular-nums}}td.bar{{width:45%}}td.bar div{{height:12px;border-radius:6px}}</style>
+</head><body>
+<h1>处理时间线 #{tag}</h1>
+<p><a href="/detail?tag={tag}">← 返回详情</a></p>
+<p>{summary}</p>
+<table><tr><th>阶段</th><th>起点(s)</th><th>耗时(s)</th><th>时间线</th><th>说明</th></tr>
+{''.join(rows_html)}
+</table></body></html>"""
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(page.encode('utf-8'))
+
     # 登录/注销与用户获取
     def _render_login(self, msg_html: str = ""):
         self.send_response(200)